@@ -0,0 +1,321 @@
+"""
+Throughput benchmarks that need neither the live API nor a MySQL server.
+
+    python benchmarks/bench_ingest.py --tracks 3000 --obs 20 --output bench_results.json
+
+Micro-benchmarks time the decode path piece by piece on synthetic responses (see helper_synthetic_data.py). The end-to-end
+benchmark runs run_scraper against a local HTTP server that plays the API (token chaining included) and a fake connection
+that records what would have been sent to MySQL, once per track writer. Pass --mysql to write to the MySQL in .env
+instead (a throwaway table is created and dropped). Results are one JSON document, so runs can be diffed across changes.
+"""
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import timeit
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+from protobuf_mysql_loader.api_provider.project_pb2 import SomeClass
+from protobuf_mysql_loader.helper_api_2_mysql import Observation, mysqlify_track, mysql_record_to_insert_tuple, pack_list_of_values_as_little_endian_bytes, ObDataType, columnize_track, COMPACT_BLOB_CODEC_BY_COLUMN
+from protobuf_mysql_loader.helper_blob_codec import encode_blob, decode_blob
+from protobuf_mysql_loader.helper_api_query import yield_batches_of_docs
+from protobuf_mysql_loader.helper_wire_scanner import iter_track_views, get_field_numbers
+from protobuf_mysql_loader.helper_parallel_decode import ParallelTrackDecoder
+from protobuf_mysql_loader.helper_poll_scheduler import AdaptivePollScheduler, FakeClock
+from protobuf_mysql_loader.helper_scraper_state import UsefulGlobalState
+from protobuf_mysql_loader.helper_http_transport import TransportSettings, configure_api_session
+from protobuf_mysql_loader.helper_synthetic_data import make_synthetic_response
+from protobuf_mysql_loader.db.mysql_bulk_load import TRACK_WRITERS, WRITER_LOAD_DATA
+from protobuf_mysql_loader.db.mysql_checkpoint import CHECKPOINT_TABLE_NAME
+from protobuf_mysql_loader.db.mysql_insert_engine import forget_insert_engines_for
+from protobuf_mysql_loader import a_main
+
+
+def time_runs(name:str, fn:Callable[[], object], num_repeats:int, num_items:int, item_name:str) -> Dict:
+    fn() # warm up caches, lazy imports and the process pool
+    run_seconds = []
+    for _ in range(num_repeats):
+        start_time = timeit.default_timer()
+        fn()
+        run_seconds.append(timeit.default_timer() - start_time)
+    median_s = statistics.median(run_seconds)
+    return {
+        "name": name,
+        "repeats": num_repeats,
+        "items_per_run": num_items,
+        "item": item_name,
+        "min_s": min(run_seconds),
+        "median_s": median_s,
+        "mean_s": statistics.fmean(run_seconds),
+        "items_per_s": num_items / median_s if median_s > 0 else None,
+    }
+
+
+def run_micro_benchmarks(api_message:SomeClass, num_repeats:int, max_workers:int) -> List[Dict]:
+    tracks = list(api_message.udl_observation_responses)
+    obs = [ob for track in tracks for ob in track.udl_observation_data]
+    serialized_response = api_message.SerializeToString()
+    ra_values_per_track = [[ob.ra.value for ob in track.udl_observation_data] for track in tracks]
+    track_columns = [columnize_track(track) for track in tracks]
+    mysql_records = [mysqlify_track(track) for track in tracks]
+    compact_blobs = [(encode_blob(c.timestamps_us, ObDataType.U64.value, COMPACT_BLOB_CODEC_BY_COLUMN["timestamp_us_blob"]), encode_blob(c.sen_pos_xyz_itrf_km, ObDataType.F32.value, COMPACT_BLOB_CODEC_BY_COLUMN["sen_pos_xyz_itrf_km_blob"])) for c in track_columns]
+    results = [
+        time_runs("SomeClass.ParseFromString", lambda: SomeClass().ParseFromString(serialized_response), num_repeats, len(serialized_response), "byte"),
+        time_runs("iter_track_views", lambda: sum(1 for _ in iter_track_views(serialized_response, *get_field_numbers(SomeClass))), num_repeats, len(tracks), "track"),
+        time_runs("Observation.from_proto", lambda: [Observation.from_proto(ob) for ob in obs], num_repeats, len(obs), "ob"),
+        time_runs("mysqlify_track", lambda: [mysqlify_track(track) for track in tracks], num_repeats, len(tracks), "track"),
+        time_runs("mysql_record_to_insert_tuple", lambda: list(map(mysql_record_to_insert_tuple, mysql_records)), num_repeats, len(tracks), "track"),
+        time_runs("pack_list_of_values_as_little_endian_bytes", lambda: [pack_list_of_values_as_little_endian_bytes(values, ObDataType.F64) for values in ra_values_per_track], num_repeats, len(obs), "value"),
+        time_runs("encode_blob[compact timestamps+positions]", lambda: [(encode_blob(c.timestamps_us, ObDataType.U64.value, COMPACT_BLOB_CODEC_BY_COLUMN["timestamp_us_blob"]), encode_blob(c.sen_pos_xyz_itrf_km, ObDataType.F32.value, COMPACT_BLOB_CODEC_BY_COLUMN["sen_pos_xyz_itrf_km_blob"])) for c in track_columns], num_repeats, len(tracks), "track"),
+        time_runs("decode_blob[compact timestamps+positions]", lambda: [(decode_blob(ts_blob, ObDataType.U64.value), decode_blob(pos_blob, ObDataType.F32.value, 3)) for ts_blob, pos_blob in compact_blobs], num_repeats, len(tracks), "track"),
+        time_runs("yield_batches_of_docs", lambda: sum(len(batch) for batch in yield_batches_of_docs(api_message, num_tracks_per_batch=1000)), num_repeats, len(tracks), "track"),
+    ]
+    with ParallelTrackDecoder(max_workers=max_workers, min_tracks_for_parallel_decode=0) as track_decoder:
+        results.append(time_runs(f"ParallelTrackDecoder.decode_tracks[{max_workers} workers]", lambda: track_decoder.decode_tracks(api_message.udl_observation_responses), num_repeats, len(tracks), "track"))
+    return results
+
+
+class FakeApiServer:
+    """
+    Plays the API on 127.0.0.1: the first query (startTime=...) gets response 0, ?token=<token of response i> gets response i+1.
+    Bodies go out gzipped to clients that accept it, compressed up front so the server thread doesn't compete for the CPU.
+    """
+    def __init__(self, serialized_responses:List[bytes], tokens:List[str]):
+        self.serialized_responses = serialized_responses
+        self.gzipped_responses = [gzip.compress(body, compresslevel=6) for body in serialized_responses]
+        self.response_index_by_token = {token: i+1 for i, token in enumerate(tokens)}
+        self.num_bytes_served = 0      # decompressed
+        self.num_wire_bytes_served = 0
+        fake_api_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, like the real API
+            def do_GET(self):
+                token = parse_qs(urlsplit(self.path).query).get("token", [None])[0]
+                response_index = fake_api_server.response_index_by_token.get(token, 0) if token else 0
+                response_index = min(response_index, len(fake_api_server.serialized_responses)-1)
+                body = fake_api_server.serialized_responses[response_index]
+                fake_api_server.num_bytes_served += len(body)
+                is_gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+                if is_gzipped:
+                    body = fake_api_server.gzipped_responses[response_index]
+                fake_api_server.num_wire_bytes_served += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                if is_gzipped:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class RedirectingSession(requests.Session):
+    """ Sends whatever URL the scraper builds to the local stand-in, keeping the path and query. """
+    def __init__(self, base_url:str):
+        super().__init__()
+        self._base_url = base_url
+
+    def request(self, method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        return super().request(method, f"{self._base_url}{parts.path}?{parts.query}", *args, **kwargs)
+
+
+class RecordingCursor:
+    def __init__(self, connection:"RecordingConnection"):
+        self._connection = connection
+        self._result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def execute(self, sql:str, params=None):
+        self._connection.num_statements += 1
+        if "@@max_allowed_packet" in sql:
+            self._result = (64*1024*1024, )
+        elif sql.lstrip().upper().startswith("LOAD DATA"):
+            file_path = sql.split("'")[1]
+            self._connection.num_bytes_sent += os.path.getsize(file_path)
+            with open(file_path, "rb") as f:
+                self._connection.num_rows_pending += sum(1 for _ in f)
+        elif params is not None and sql.lstrip().upper().startswith("INSERT") and CHECKPOINT_TABLE_NAME not in sql:
+            # multi-row insert engine: params is every row's values flattened
+            num_placeholders_per_row = sql.split("VALUES", 1)[1].split(")", 1)[0].count("%s")
+            self._connection.num_rows_pending += len(params) // max(1, num_placeholders_per_row)
+            self._connection.num_bytes_sent += len(sql) + sum(len(p) if isinstance(p, (bytes, str)) else 8 for p in params)
+
+    def executemany(self, sql:str, seq_params):
+        self._connection.num_statements += 1
+        self._connection.num_rows_pending += len(seq_params)
+        self._connection.num_bytes_sent += sum(len(p) if isinstance(p, (bytes, str)) else 8 for params in seq_params for p in params)
+
+    def fetchone(self):
+        return self._result
+
+    def fetchall(self):
+        return [self._result] if self._result is not None else []
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    """ Stands in for a MySQLConnection: accepts everything, counts statements/rows/bytes, keeps no data. """
+    def __init__(self, table_name:str):
+        self.table_name = table_name
+        self.num_statements = 0
+        self.num_rows_pending = 0
+        self.num_rows_committed = 0
+        self.num_bytes_sent = 0
+        self.num_commits = 0
+
+    def cursor(self, **kwargs):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.num_commits += 1
+        self.num_rows_committed += self.num_rows_pending
+        self.num_rows_pending = 0
+
+    def rollback(self):
+        self.num_rows_pending = 0
+
+    def is_connected(self):
+        return True
+
+    def ping(self, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+def run_end_to_end_benchmark(serialized_responses:List[bytes], tokens:List[str], num_tracks_per_response:int, track_writer:str, max_workers:int, stream_api_responses:bool, mysql_connection=None, table_name:str="bench_tracks", compress:bool=True) -> Dict:
+    fake_api_server = FakeApiServer(serialized_responses, tokens)
+    session = configure_api_session(RedirectingSession(fake_api_server.base_url), TransportSettings(compress=compress)) # same transport as get_api_session, minus the client cert
+    useful_global_state = UsefulGlobalState(0, 0, 0, "", "", 0)
+    useful_global_state.json_mirror_enabled = False
+    poll_scheduler = AdaptivePollScheduler(clock=FakeClock()) # decides the waits, but never actually sleeps
+    connection = mysql_connection if mysql_connection is not None else RecordingConnection(table_name)
+    try:
+        start_time = timeit.default_timer()
+        for _ in serialized_responses:
+            a_main.run_scraper(requests_session=session, useful_global_state=useful_global_state, mysql_conn=connection, max_threads=max_workers, max_tracks_added_at_once=10_000, table_name=table_name, min_tracks_for_parallel_decode=500, track_writer=track_writer, stream_api_responses=stream_api_responses, poll_scheduler=poll_scheduler)
+        seconds = timeit.default_timer() - start_time
+    finally:
+        fake_api_server.stop()
+        session.close()
+        forget_insert_engines_for(connection) # engines are cached by id(connection), which the next fake could reuse
+    num_tracks = num_tracks_per_response * len(serialized_responses)
+    result = {
+        "name": f"run_scraper[{track_writer}{',stream' if stream_api_responses else ''}{',identity' if not compress else ''}{',mysql' if mysql_connection is not None else ''}]",
+        "responses": len(serialized_responses),
+        "tracks": num_tracks,
+        "seconds": seconds,
+        "tracks_per_s": num_tracks / seconds,
+        "api_bytes_per_s": fake_api_server.num_bytes_served / seconds,
+        "api_wire_bytes_per_track": fake_api_server.num_wire_bytes_served / num_tracks,
+    }
+    if isinstance(connection, RecordingConnection):
+        result.update({"rows_committed": connection.num_rows_committed, "statements": connection.num_statements, "commits": connection.num_commits, "db_bytes_sent": connection.num_bytes_sent})
+    return result
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv:Optional[List[str]]=None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=3000, help="tracks per synthetic response (the API sends up to ~3k)")
+    parser.add_argument("--obs", type=int, default=20, help="mean obs per track")
+    parser.add_argument("--responses", type=int, default=5, help="responses per end-to-end run")
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per micro-benchmark (the median is reported)")
+    parser.add_argument("--workers", type=int, default=4, help="decode worker processes")
+    parser.add_argument("--writers", nargs="+", default=list(TRACK_WRITERS), choices=TRACK_WRITERS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-end-to-end", action="store_true")
+    parser.add_argument("--mysql", action="store_true", help="write to the MySQL configured in .env instead of the recording fake")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    responses = [make_synthetic_response(args.tracks, args.obs, token=f"bench-token-{i:04d}-{rng.getrandbits(64):016x}", seed=args.seed+i, obs_per_track_jitter=0.5) for i in range(args.responses)]
+    serialized_responses = [response.SerializeToString() for response in responses]
+    tokens = [response.token for response in responses]
+
+    report = {
+        "meta": {
+            "started_at_utc": datetime.now(timezone.utc).isoformat(),
+            "git_commit": get_git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "mean_response_bytes": statistics.fmean(len(b) for b in serialized_responses),
+        },
+        "micro": [],
+        "end_to_end": [],
+    }
+    if not args.skip_micro:
+        report["micro"] = run_micro_benchmarks(responses[0], args.repeats, args.workers)
+    if not args.skip_end_to_end:
+        mysql_connection, table_name = None, "bench_tracks"
+        if args.mysql:
+            from protobuf_mysql_loader.db.mysql_utils import get_mysql_connection_object
+            from protobuf_mysql_loader.db.mysql_creation import create_initial_table, ensure_track_fingerprint_unique_key, ensure_sky_cell_index
+            mysql_connection = get_mysql_connection_object(allow_local_infile=(WRITER_LOAD_DATA in args.writers))
+            table_name = f"bench_tracks_{datetime.now(timezone.utc):%Y%m%d_%H%M%S}"
+            create_initial_table(table_name, mysql_connection)
+            ensure_track_fingerprint_unique_key(table_name, mysql_connection)
+            ensure_sky_cell_index(table_name, mysql_connection)
+        try:
+            for track_writer in args.writers:
+                report["end_to_end"].append(run_end_to_end_benchmark(serialized_responses, tokens, args.tracks, track_writer, args.workers, stream_api_responses=False, mysql_connection=mysql_connection, table_name=table_name))
+            report["end_to_end"].append(run_end_to_end_benchmark(serialized_responses, tokens, args.tracks, args.writers[0], args.workers, stream_api_responses=True, mysql_connection=mysql_connection, table_name=table_name))
+            report["end_to_end"].append(run_end_to_end_benchmark(serialized_responses, tokens, args.tracks, args.writers[0], args.workers, stream_api_responses=False, mysql_connection=mysql_connection, table_name=table_name, compress=False))
+        finally:
+            if mysql_connection is not None:
+                with mysql_connection.cursor() as cur:
+                    cur.execute(f"DROP TABLE IF EXISTS {table_name};")
+                mysql_connection.close()
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
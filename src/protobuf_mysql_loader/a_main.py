@@ -1,16 +1,31 @@
-import time
+import os
+import queue
 import requests
 import timeit
 import datetime
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable, Iterable, Optional
 if TYPE_CHECKING:
     from mysql.connector import MySQLConnection
 
-from protobuf_mysql_loader.db.mysql_utils import get_mysql_connection_object, check_on_mysql_connection
-from protobuf_mysql_loader.db.mysql_creation import add_partitions, create_initial_table, add_tracks_to_db
+from protobuf_mysql_loader.db.mysql_utils import get_mysql_connection_object, check_on_mysql_connection, MySQLConnectionPool, ParallelBatchWriter
+from protobuf_mysql_loader.db.mysql_creation import create_initial_table, add_record_tuples_to_db, ensure_track_fingerprint_unique_key, ensure_sky_cell_index, ensure_track_stats_columns
+from protobuf_mysql_loader.db.mysql_bulk_load import WRITER_EXECUTEMANY, WRITER_LOAD_DATA
+from protobuf_mysql_loader.db.mysql_partition_manager import PartitionManager, GRANULARITY_MONTHLY, RETENTION_ARCHIVE
+from protobuf_mysql_loader.db.mysql_checkpoint import create_checkpoint_table, write_checkpoint, write_checkpoint_without_committing
+from protobuf_mysql_loader.db.mysql_spill_buffer import SpillBuffer, is_spillable_db_error, rollback_quietly
 from protobuf_mysql_loader.helper_scraper_state import UsefulGlobalState
-from protobuf_mysql_loader.helper_api_query import get_api_session, query_api, yield_batches_of_docs
+from protobuf_mysql_loader.helper_api_query import get_api_session, query_api, stream_api_response, parse_api_response_body
+from protobuf_mysql_loader.helper_http_transport import TransportSettings
+from protobuf_mysql_loader.helper_response_capture import CapturedResponse, ResponseRecorder, set_response_recorder
+from protobuf_mysql_loader.helper_parallel_decode import get_parallel_track_decoder, DEFAULT_MIN_TRACKS_FOR_PARALLEL_DECODE, ParallelTrackDecoder
+from protobuf_mysql_loader.helper_pipeline import StageRunner, TokenCheckpointTracker, Checkpoint, END_OF_STREAM
+from protobuf_mysql_loader.helper_dedupe import get_recent_fingerprint_cache
+from protobuf_mysql_loader.helper_poll_scheduler import AdaptivePollScheduler, get_poll_scheduler, ERROR_UNCAUGHT
+from protobuf_mysql_loader.helper_api_2_mysql import TRACKEND_UTC_INSERT_INDEX
+from protobuf_mysql_loader.helper_record_batch import RecordBatch
+from protobuf_mysql_loader.helper_timestamps import us_to_naive_utc_datetime
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry, MetricsReporter
 from protobuf_mysql_loader.helper_logging import get_logger
 
 
@@ -19,52 +34,275 @@ logger = get_logger()
 from dotenv import load_dotenv
 load_dotenv()
 
+# run_scraper is called once per response, but checkpoint ranks have to keep increasing across calls
+_run_scraper_checkpoint_tracker = TokenCheckpointTracker()
 
-def run_scraper(requests_session:requests.Session, useful_global_state:UsefulGlobalState, mysql_conn:"MySQLConnection", max_threads:int, max_tracks_added_at_once:int, table_name:str, low_bound_num_track_threshold:int):
+
+def run_scraper(requests_session:requests.Session, useful_global_state:UsefulGlobalState, mysql_conn:"MySQLConnection", max_threads:int, max_tracks_added_at_once:int, table_name:str, min_tracks_for_parallel_decode:int=DEFAULT_MIN_TRACKS_FOR_PARALLEL_DECODE, track_writer:str=WRITER_EXECUTEMANY, db_writer:Optional[ParallelBatchWriter]=None, use_db_checkpoint:bool=False, idempotent_ingest:bool=False, stream_api_responses:bool=False, poll_scheduler:Optional[AdaptivePollScheduler]=None, spill_buffer:Optional[SpillBuffer]=None):
     start_time = timeit.default_timer()
-    spacex_api_message = query_api(requests_session, useful_global_state)
-    num_tracks_returned_by_this_spacex_api_query = len(spacex_api_message.udl_observation_responses)
+    poll_scheduler = poll_scheduler if poll_scheduler is not None else get_poll_scheduler()
+    # Decoding is CPU-bound, so it's spread over max_threads worker processes (small responses stay in this process).
+    track_decoder = get_parallel_track_decoder(max_workers=max_threads, min_tracks_for_parallel_decode=min_tracks_for_parallel_decode)
+    if stream_api_responses:
+        # Tracks are cut straight out of the wire bytes as they download and decoded while the rest is still arriving
+        streamed_response = stream_api_response(requests_session, useful_global_state, poll_scheduler=poll_scheduler)
+        record_tuples = track_decoder.decode_serialized_track_stream(streamed_response.iter_track_views())
+        num_tracks_returned_by_this_spacex_api_query = len(record_tuples)
+    else:
+        spacex_api_message = query_api(requests_session, useful_global_state, poll_scheduler=poll_scheduler)
+        num_tracks_returned_by_this_spacex_api_query = len(spacex_api_message.udl_observation_responses)
     
     if num_tracks_returned_by_this_spacex_api_query==0: 
-        handle_api_returning_zero_tracks(useful_global_state)
+        handle_api_returning_zero_tracks(useful_global_state, poll_scheduler)
         return None
     else:
         useful_global_state.number_of_queries_in_a_row_where_we_didnt_receive_any_tracks = 0
     
-    logger.info(f"START: Query returned {num_tracks_returned_by_this_spacex_api_query} tracks. The query completed in {(timeit.default_timer()-start_time):.1f}s")
+    logger.info(f"START: Query returned {num_tracks_returned_by_this_spacex_api_query} tracks. The query{' and decode' if stream_api_responses else ''} completed in {(timeit.default_timer()-start_time):.1f}s")
 
     # This query returned a bunch of protobuf tracklet data. Time to parse the data from each track and add to the MySQL database.
-    # NOTE: honestly I don't think we need threading. We can only get 10k tracks max at a time, and we can probably batch them all at once if we really wanted to.
-    for batch_of_docs in yield_batches_of_docs(spacex_api_message, num_tracks_per_batch=max_tracks_added_at_once):
-        add_tracks_to_db(batch_of_docs, mysql_conn, useful_global_state, table_name)
-        useful_global_state.last_successful_time_we_saved_data_to_db_s = datetime.datetime.now().timestamp()
-        useful_global_state.last_token_received_for_data_sucessfully_added_to_db = useful_global_state.last_token_received
+    if stream_api_responses:
+        batches_of_record_tuples = [record_tuples[i:i+max_tracks_added_at_once] for i in range(0, len(record_tuples), max_tracks_added_at_once)]
+    else:
+        batches_of_record_tuples = list(track_decoder.yield_batches_of_record_tuples(spacex_api_message, num_tracks_per_batch=max_tracks_added_at_once))
+    sequence_number = _run_scraper_checkpoint_tracker.allocate_sequence_number()
+    _run_scraper_checkpoint_tracker.register_response(sequence_number, useful_global_state.last_token_received, len(batches_of_record_tuples))
+    write_kwargs = dict(table_name=table_name, track_writer=track_writer, useful_global_state=useful_global_state, checkpoint_tracker=_run_scraper_checkpoint_tracker, sequence_number=sequence_number, use_db_checkpoint=use_db_checkpoint, idempotent_ingest=idempotent_ingest, spill_buffer=spill_buffer)
+    try:
+        if db_writer is not None and not (spill_buffer is not None and spill_buffer.should_spill()):
+            # Batches commit concurrently on separate pooled connections. The token only moves once they've all landed.
+            db_writer.write_all(write_batch_and_checkpoint, [(batch, ) for batch in batches_of_record_tuples], **write_kwargs)
+        else:
+            for batch_of_record_tuples in batches_of_record_tuples:
+                # Also the spill mode path: those batches go to local disk, so there's no point checking out pooled connections
+                write_batch_and_checkpoint(batch_of_record_tuples, mysql_connection=mysql_conn, **write_kwargs)
+    except BaseException:
+        # The next query resumes from the last checkpoint and fetches these tracks again, so don't let this response hold
+        # the checkpoint back for the rest of the process
+        _run_scraper_checkpoint_tracker.abandon(sequence_number)
+        raise
     
     logger.info(f"\tEND: Indexing of obs from {num_tracks_returned_by_this_spacex_api_query} tracks finished. Total time from query to indexing took {(timeit.default_timer()-start_time):.1f}s.")
     
-    if num_tracks_returned_by_this_spacex_api_query<low_bound_num_track_threshold:
-        logger.info(f"Last query we didn't receive many tracks. Sleeping for 10s to prevent log clutter and API throttling...")
-        time.sleep(10) 
+    next_poll_delay_s = poll_scheduler.record_response(num_tracks_returned_by_this_spacex_api_query, ingest_lag_s=newest_track_age_s(batches_of_record_tuples))
+    if next_poll_delay_s > 0:
+        logger.info(f"Waiting {next_poll_delay_s:.1f}s before the next query (~{poll_scheduler.arrival_rate_tracks_per_s or 0:.1f} tracks/s arriving, ingest lag {poll_scheduler.last_ingest_lag_s or 0:.0f}s)")
+        poll_scheduler.wait_for_next_poll()
     
     return None
 
 
-def handle_api_returning_zero_tracks(useful_global_state:UsefulGlobalState) -> None:
-    time_to_sleep_if_we_dont_receive_any_tracks = 30
-    num_times_without_track = useful_global_state.number_of_queries_in_a_row_where_we_didnt_receive_any_tracks
-    if num_times_without_track > 120: # idk wait an hour then fail? 
-        raise Exception("Haven't received any tracks in a while... what's up?")
-    logger.warning(f"Queried for tracks but didn't get any in return... Will retry the query with the same token in {time_to_sleep_if_we_dont_receive_any_tracks} seconds.")
+def newest_track_age_s(batches_of_record_tuples) -> Optional[float]:
+    # How far behind real time the newest data we just wrote is. Feeds the scheduler's freshness target.
+    newest_trackend_utc = max((newest_trackend_utc_of_batch(batch) for batch in batches_of_record_tuples if len(batch)), default=None)
+    if newest_trackend_utc is None:
+        return None
+    return (datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - newest_trackend_utc).total_seconds()
+
+
+def newest_trackend_utc_of_batch(batch_of_record_tuples) -> datetime.datetime:
+    if isinstance(batch_of_record_tuples, RecordBatch):
+        return us_to_naive_utc_datetime(int(batch_of_record_tuples.column("trackend_utc").max()))
+    return max(record[TRACKEND_UTC_INSERT_INDEX] for record in batch_of_record_tuples)
+
+
+def write_batch_and_checkpoint(batch_of_record_tuples, mysql_connection:"MySQLConnection", table_name:str, track_writer:str, useful_global_state:UsefulGlobalState, checkpoint_tracker:TokenCheckpointTracker, sequence_number:int, use_db_checkpoint:bool, idempotent_ingest:bool=False, spill_buffer:Optional[SpillBuffer]=None) -> None:
+    """
+    Inserts one batch of a response. With use_db_checkpoint, if this batch is the last one outstanding for its response (and
+    everything before it), the response's token is written to the checkpoint table in the same transaction as the rows.
+    With idempotent_ingest, tracks we recently committed (i.e. a replayed token) are dropped before they reach MySQL, and
+    INSERT IGNORE against the track_fingerprint unique key catches anything the in-process cache doesn't remember.
+    With a spill_buffer, a batch MySQL can't take right now (connection trouble, or the buffer is in spill mode after a
+    failed or slow write) is fsynced to local disk instead, with its checkpoint behind it, and counts as committed.
+    """
+    fingerprints_to_insert = None
+    if idempotent_ingest:
+        num_tracks_before_dedupe = len(batch_of_record_tuples)
+        batch_of_record_tuples, fingerprints_to_insert = get_recent_fingerprint_cache(table_name=table_name).drop_already_committed(batch_of_record_tuples)
+        if len(batch_of_record_tuples) < num_tracks_before_dedupe:
+            logger.info(f"Dropped {num_tracks_before_dedupe-len(batch_of_record_tuples)} of {num_tracks_before_dedupe} tracks that were already committed (replayed token?)")
+
+    def update_in_memory_token(checkpoint:Checkpoint):
+        useful_global_state.last_token_received_for_data_sucessfully_added_to_db = checkpoint.token
+
+    if spill_buffer is not None and spill_buffer.should_spill():
+        spill_batch_and_checkpoint(batch_of_record_tuples, spill_buffer, checkpoint_tracker, sequence_number, fingerprints_to_insert, update_in_memory_token)
+        return None
+
+    checkpoints_written_in_transaction = []
+    def write_checkpoint_in_same_transaction(mysql_connection):
+        checkpoint = checkpoint_tracker.checkpoint_if_committed(sequence_number)
+        if checkpoint is not None:
+            write_checkpoint_without_committing(mysql_connection, table_name, checkpoint.token, checkpoint.rank)
+            checkpoints_written_in_transaction.append(checkpoint)
+
+    # Still runs for an emptied batch so the checkpoint can move past a fully replayed response
+    try:
+        write_stats = add_record_tuples_to_db(batch_of_record_tuples, mysql_connection, table_name, writer=track_writer, before_commit=write_checkpoint_in_same_transaction if use_db_checkpoint else None, ignore_duplicates=idempotent_ingest)
+    except Exception as e:
+        if spill_buffer is None or not is_spillable_db_error(e):
+            raise
+        logger.error(f"MySQL write failed ({e}). Spilling the batch to disk so fetching can carry on.")
+        rollback_quietly(mysql_connection)
+        spill_buffer.record_db_failure()
+        spill_batch_and_checkpoint(batch_of_record_tuples, spill_buffer, checkpoint_tracker, sequence_number, fingerprints_to_insert, update_in_memory_token)
+        return None
+    if spill_buffer is not None:
+        spill_buffer.record_db_write_seconds(write_stats.seconds)
+    if fingerprints_to_insert is not None:
+        get_recent_fingerprint_cache(table_name=table_name).add_committed(fingerprints_to_insert)
+    useful_global_state.last_successful_time_we_saved_data_to_db_s = datetime.datetime.now().timestamp()
+
+    checkpoint = checkpoint_tracker.mark_batch_committed(sequence_number, on_advance=update_in_memory_token)
+    if use_db_checkpoint and checkpoint is not None and checkpoint not in checkpoints_written_in_transaction:
+        # A concurrent writer committed the other half of this response while we were in our transaction. The data is all
+        # committed now, so a standalone write is safe, and the rank stops it from overwriting anything newer.
+        write_checkpoint(mysql_connection, table_name, checkpoint.token, checkpoint.rank)
+    return None
+
+
+def spill_batch_and_checkpoint(batch_of_record_tuples, spill_buffer:SpillBuffer, checkpoint_tracker:TokenCheckpointTracker, sequence_number:int, fingerprints_to_insert:Optional[list], on_advance:Callable[[Checkpoint], None]) -> None:
+    # Same contract as the MySQL path: the checkpoint this batch completes is fsynced right behind its rows, and the token
+    # only moves after that. The drainer later writes both to MySQL in one transaction.
+    checkpoint = checkpoint_tracker.checkpoint_if_committed(sequence_number)
+    spill_buffer.spill(batch_of_record_tuples, checkpoint) # raises SpillBufferFull rather than grow past its limit
+    if fingerprints_to_insert is not None:
+        get_recent_fingerprint_cache(table_name=spill_buffer.table_name).add_committed(fingerprints_to_insert) # they're durable and on their way in
+    newest_checkpoint = checkpoint_tracker.mark_batch_committed(sequence_number, on_advance=on_advance)
+    if newest_checkpoint is not None and newest_checkpoint != checkpoint:
+        # A concurrent writer finished the rest of the response in between. Its rows are all durable now, wherever they went.
+        spill_buffer.spill_checkpoint(newest_checkpoint)
+    return None
+
+
+def handle_api_returning_zero_tracks(useful_global_state:UsefulGlobalState, poll_scheduler:AdaptivePollScheduler, sleep:Optional[Callable[[float], None]]=None) -> None:
+    # The scheduler backs off between empty polls and raises once we've gone max_time_without_tracks_s without any
+    time_to_sleep_if_we_dont_receive_any_tracks = poll_scheduler.record_response(0)
+    logger.warning(f"Queried for tracks but didn't get any in return... Will retry the query with the same token in {time_to_sleep_if_we_dont_receive_any_tracks:.1f} seconds.")
     useful_global_state.number_of_queries_in_a_row_where_we_didnt_receive_any_tracks+=1
-    time.sleep(time_to_sleep_if_we_dont_receive_any_tracks)
+    (sleep or poll_scheduler.clock.sleep)(time_to_sleep_if_we_dont_receive_any_tracks)
+    return None
+
+
+def run_pipelined_scraper(requests_session:requests.Session, useful_global_state:UsefulGlobalState, mysql_conn:"MySQLConnection", max_threads:int, max_tracks_added_at_once:int, table_name:str, min_tracks_for_parallel_decode:int=DEFAULT_MIN_TRACKS_FOR_PARALLEL_DECODE, max_responses_in_flight:int=2, max_responses:Optional[int]=None, track_writer:str=WRITER_EXECUTEMANY, mysql_pool:Optional[MySQLConnectionPool]=None, num_db_writers:int=1, use_db_checkpoint:bool=False, idempotent_ingest:bool=False, poll_scheduler:Optional[AdaptivePollScheduler]=None, spill_buffer:Optional[SpillBuffer]=None, captured_responses:Optional[Iterable[CapturedResponse]]=None):
+    """
+    Same work as calling run_scraper in a loop, but fetch, decode and insert each run on their own thread and overlap:
+    the next API page is downloaded while the previous one is still being written. Stages are joined by bounded queues,
+    so a slow MySQL backs up into the decoder and then the fetcher instead of piling responses up in memory.
+    Runs until a stage fails (re-raised here) or max_responses non-empty responses have been written.
+    With a mysql_pool, num_db_writers write stages pull batches off the same queue and commit them concurrently on their own
+    pooled connections (the checkpoint tracker copes with out-of-order commits). Without one, a single writer uses mysql_conn.
+    With captured_responses (see helper_response_capture.py), those are fed in instead of fetching: no HTTP, no polling
+    waits, and it returns once they've all been written. requests_session is unused then.
+    """
+    runner = StageRunner()
+    checkpoint_tracker = TokenCheckpointTracker()
+    fetched_responses = queue.Queue(maxsize=max_responses_in_flight)
+    decoded_batches = queue.Queue(maxsize=max_responses_in_flight)
+    track_decoder = get_parallel_track_decoder(max_workers=max_threads, min_tracks_for_parallel_decode=min_tracks_for_parallel_decode)
+    # Read at scrape time, so watching the queues costs the stages nothing
+    metrics_registry = get_metrics_registry()
+    metrics_registry.gauge("pipeline_queue_depth", "Items waiting between pipeline stages", labels={"queue": "fetched_responses"}, callback=fetched_responses.qsize)
+    metrics_registry.gauge("pipeline_queue_depth", "Items waiting between pipeline stages", labels={"queue": "decoded_batches"}, callback=decoded_batches.qsize)
+    metrics_registry.gauge("responses_in_flight", "Fetched responses whose batches haven't all committed yet", callback=lambda: checkpoint_tracker.num_responses_in_flight)
+
+    if captured_responses is not None:
+        runner.start_stage("replay", _replay_stage, runner, fetched_responses, captured_responses, useful_global_state, max_responses)
+    else:
+        poll_scheduler = poll_scheduler if poll_scheduler is not None else get_poll_scheduler()
+        runner.start_stage("fetch", _fetch_stage, runner, fetched_responses, requests_session, useful_global_state, poll_scheduler, max_responses)
+    runner.start_stage("decode", _decode_stage, runner, fetched_responses, decoded_batches, checkpoint_tracker, track_decoder, max_tracks_added_at_once)
+    for writer_number in range(num_db_writers if mysql_pool is not None else 1):
+        runner.start_stage(f"write-{writer_number}", _write_stage, runner, decoded_batches, checkpoint_tracker, mysql_conn, useful_global_state, table_name, track_writer, mysql_pool, use_db_checkpoint, idempotent_ingest, spill_buffer)
+    runner.join()
     return None
 
 
+def _fetch_stage(runner:StageRunner, fetched_responses:queue.Queue, requests_session:requests.Session, useful_global_state:UsefulGlobalState, poll_scheduler:AdaptivePollScheduler, max_responses:Optional[int]):
+    # Chain tokens locally: start from the last checkpoint, then follow each response's token without waiting for the db.
+    next_token = useful_global_state.last_token_received_for_data_sucessfully_added_to_db
+    sequence_number = 0
+    while max_responses is None or sequence_number < max_responses:
+        start_time = timeit.default_timer()
+        spacex_api_message = query_api(requests_session, useful_global_state, token=next_token, poll_scheduler=poll_scheduler)
+        num_tracks_returned_by_this_spacex_api_query = len(spacex_api_message.udl_observation_responses)
+        if num_tracks_returned_by_this_spacex_api_query==0:
+            handle_api_returning_zero_tracks(useful_global_state, poll_scheduler, sleep=runner.sleep) # retry with the same token
+            continue
+        useful_global_state.number_of_queries_in_a_row_where_we_didnt_receive_any_tracks = 0
+        logger.info(f"START: Query returned {num_tracks_returned_by_this_spacex_api_query} tracks. The query completed in {(timeit.default_timer()-start_time):.1f}s")
+
+        runner.put(fetched_responses, (sequence_number, spacex_api_message.token, spacex_api_message)) # blocks while the queue is full
+        sequence_number += 1
+        next_token = spacex_api_message.token
+
+        # No ingest lag here: the tracks haven't been decoded yet, so pacing is off the arrival rate alone
+        next_poll_delay_s = poll_scheduler.record_response(num_tracks_returned_by_this_spacex_api_query)
+        if next_poll_delay_s > 0:
+            runner.sleep(next_poll_delay_s)
+    runner.put(fetched_responses, END_OF_STREAM)
+
+
+def _replay_stage(runner:StageRunner, fetched_responses:queue.Queue, captured_responses:Iterable[CapturedResponse], useful_global_state:UsefulGlobalState, max_responses:Optional[int]):
+    # Stands in for _fetch_stage. Responses come back to back off local files, as fast as decode and insert take them.
+    sequence_number = 0
+    for captured_response in captured_responses:
+        if max_responses is not None and sequence_number >= max_responses:
+            break
+        spacex_api_message = parse_api_response_body(captured_response.body)
+        if len(spacex_api_message.udl_observation_responses) == 0:
+            continue # the live loop retried these with the same token, so they carry nothing to replay
+        useful_global_state.last_token_received = captured_response.response_token
+        runner.put(fetched_responses, (sequence_number, captured_response.response_token, spacex_api_message))
+        sequence_number += 1
+    runner.put(fetched_responses, END_OF_STREAM)
+
+
+def _decode_stage(runner:StageRunner, fetched_responses:queue.Queue, decoded_batches:queue.Queue, checkpoint_tracker:TokenCheckpointTracker, track_decoder:ParallelTrackDecoder, max_tracks_added_at_once:int):
+    while True:
+        item = runner.get(fetched_responses)
+        if item is END_OF_STREAM:
+            runner.put(decoded_batches, END_OF_STREAM)
+            return
+        sequence_number, token, spacex_api_message = item
+        batches_of_record_tuples = list(track_decoder.yield_batches_of_record_tuples(spacex_api_message, num_tracks_per_batch=max_tracks_added_at_once))
+        # Register before handing anything to the writer, so the tracker knows how many commits this token is waiting on
+        checkpoint_tracker.register_response(sequence_number, token, len(batches_of_record_tuples))
+        for batch_of_record_tuples in batches_of_record_tuples:
+            runner.put(decoded_batches, (sequence_number, batch_of_record_tuples))
+
+
+def _write_stage(runner:StageRunner, decoded_batches:queue.Queue, checkpoint_tracker:TokenCheckpointTracker, mysql_conn:"MySQLConnection", useful_global_state:UsefulGlobalState, table_name:str, track_writer:str, mysql_pool:Optional[MySQLConnectionPool], use_db_checkpoint:bool, idempotent_ingest:bool, spill_buffer:Optional[SpillBuffer]=None):
+    while True:
+        item = runner.get(decoded_batches)
+        if item is END_OF_STREAM:
+            runner.put(decoded_batches, END_OF_STREAM) # pass it on to any sibling writers
+            return
+        sequence_number, batch_of_record_tuples = item
+        start_time = timeit.default_timer()
+        write_kwargs = dict(table_name=table_name, track_writer=track_writer, useful_global_state=useful_global_state, checkpoint_tracker=checkpoint_tracker, sequence_number=sequence_number, use_db_checkpoint=use_db_checkpoint, idempotent_ingest=idempotent_ingest, spill_buffer=spill_buffer)
+        if mysql_pool is not None and not (spill_buffer is not None and spill_buffer.should_spill()):
+            with mysql_pool.connection() as pooled_mysql_conn:
+                write_batch_and_checkpoint(batch_of_record_tuples, mysql_connection=pooled_mysql_conn, **write_kwargs)
+        else:
+            write_batch_and_checkpoint(batch_of_record_tuples, mysql_connection=mysql_conn, **write_kwargs)
+        logger.info(f"\tEND: Inserted batch of {len(batch_of_record_tuples)} tracks in {(timeit.default_timer()-start_time):.1f}s. {checkpoint_tracker.num_responses_in_flight} response(s) still in flight.")
+
+
     
 if __name__ == "__main__":
     print("LAUNCH THIS WITH nohup python -u src/a_main.py & ")
     TABLE_NAME = "spacewatch_2024_07_10"
-    MAX_THREADS = 4
+    MAX_THREADS = 4 # number of worker processes used to decode tracks
+    MIN_TRACKS_FOR_PARALLEL_DECODE = 500 # below this, decode in the main process since the IPC would cost more than it saves
+    USE_PIPELINED_STAGES = False # True: fetch/decode/insert overlap on separate threads (see run_pipelined_scraper)
+    MAX_RESPONSES_IN_FLIGHT = 2  # queue depth between pipeline stages. Bounds memory when MySQL falls behind.
+    NUM_DB_WRITERS = 1   # >1 commits independent batches concurrently, each on its own pooled connection
+    MYSQL_POOL_SIZE = 4  # must be >= NUM_DB_WRITERS
+    USE_DB_CHECKPOINT = True # write the token to MySQL in the same transaction as the data, and resume from it on startup
+    IDEMPOTENT_INGEST = True # skip tracks we already committed (replayed tokens) via a fingerprint cache + unique key / INSERT IGNORE
+    STREAM_API_RESPONSES = False # True: scan tracks out of the HTTP body as it downloads and decode them on the fly (run_scraper only)
+    TRACK_WRITER = WRITER_EXECUTEMANY # or WRITER_LOAD_DATA for LOAD DATA LOCAL INFILE (server needs local_infile=ON), or WRITER_MULTIROW (import it from db.mysql_bulk_load too) for packet-size-aware multi-row INSERTs. All log rows/s and MiB/s per batch.
     # MAX_TRACKS_ADDED_TO_TABLE_AT_A_TIME = 5
     MAX_TRACKS_ADDED_TO_TABLE_AT_A_TIME = 10_000 # Currently takes <2 seconds for 3k tracks (including query and upload to db)
     MAX_NUM_TRACKS_SPACEX_SENDS_PER_API_CALL = 3_000
@@ -72,23 +310,81 @@ if __name__ == "__main__":
     if MAX_TRACKS_ADDED_TO_TABLE_AT_A_TIME>MAX_NUM_TRACKS_SPACEX_SENDS_PER_API_CALL: logger.info("Uploading all tracks in one go without multiple threads. It may be worth splitting it into smaller chunks and comparing the timing.")
     
     MAX_UNCAUGHT_FAILURES_BEFORE_EXIT = 100
-    MIN_NUMBER_OF_TRACKS_RETURNED_BEFORE_10s_SLEEP = 100 # Prevents constant querying. If we only get <100 tracks upon querying, sleep for 10 seconds. This also helps prevent log clutter. Only takes 0.2s to process 100 tracks vs ~2s for 3000
+    # Local write-ahead buffer. While MySQL is down or slower than the budget, decoded batches are fsynced here and the token
+    # keeps moving, then a drainer thread replays them into MySQL once it's back. None to fail the batch and back off instead.
+    SPILL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "spill")
+    SPILL_MAX_BYTES = 8 * 1024**3         # past this, batches fail like they used to (and the token stops) rather than fill the disk
+    SPILL_SEGMENT_BYTES = 64 * 1024**2
+    DB_WRITE_LATENCY_BUDGET_S = 30        # a live batch write slower than this also switches over to the spill for a while
+    # Raw response capture, for reprocessing from source after a schema/mysqlify_track change or replaying real traffic as a
+    # load test: python -m protobuf_mysql_loader.helper_response_replay <table> --capture-dir capture/. None to turn off.
+    CAPTURE_DIR = None # e.g. os.path.join(<repo root>, "capture")
+    CAPTURE_MAX_BYTES = 50 * 1024**3      # oldest hourly segments are deleted past this
+    PARTITION_GRANULARITY = GRANULARITY_MONTHLY # or GRANULARITY_DAILY
+    PARTITION_PERIODS_AHEAD = 6           # future partitions kept split out of p_max
+    PARTITION_RETENTION_PERIODS = None    # e.g. 24 to drop/archive partitions older than 24 whole months. None keeps everything.
+    PARTITION_RETENTION_ACTION = RETENTION_ARCHIVE # archive swaps old partitions out into <table>_archive_<partition> tables instead of deleting them
+    PARTITION_CHECK_INTERVAL_S = 6*60*60
+    PARTITION_DRY_RUN = False             # True: print the partition DDL it would run instead of running it
+    # Polling pace. After a small response we wait about as long as it takes for this many tracks to arrive (at the observed
+    # rate), capped by the freshness target. Full pages are followed up immediately. Errors back off with jitter per error class.
+    DESIRED_TRACKS_PER_POLL = 100 # Prevents constant querying and log clutter. Only takes 0.2s to process 100 tracks vs ~2s for 3000
+    TARGET_FRESHNESS_LAG_S = 30   # never sit on arriving data for longer than this between polls
+    MAX_TIME_WITHOUT_TRACKS_S = 3600 # idk wait an hour then fail?
+    poll_scheduler = AdaptivePollScheduler(target_freshness_lag_s=TARGET_FRESHNESS_LAG_S, full_page_num_tracks=MAX_NUM_TRACKS_SPACEX_SENDS_PER_API_CALL, desired_tracks_per_poll=DESIRED_TRACKS_PER_POLL, max_time_without_tracks_s=MAX_TIME_WITHOUT_TRACKS_S)
+    
+    # HTTP transport (helper_http_transport.py). The read timeout bounds each wait for more bytes, so a stalled socket
+    # raises (and is retried with backoff) instead of hanging the loop. Responses are requested gzipped.
+    API_CONNECT_TIMEOUT_S = 10
+    API_READ_TIMEOUT_S = 120
+    API_COMPRESSION = True
     
-    useful_global_state = UsefulGlobalState.from_existing_state_file()
-    session = get_api_session()
-    mysql_conn = get_mysql_connection_object()
+    METRICS_PORT = 9108 # Prometheus text format on http://127.0.0.1:9108/metrics. None to turn off.
+    METRICS_SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "metrics_snapshot.json") # None to turn off
+    METRICS_SNAPSHOT_INTERVAL_S = 60
+    metrics_registry = get_metrics_registry()
+    metrics_registry.gauge("poll_arrival_rate_tracks_per_second", "Scheduler's smoothed estimate of how fast tracks arrive", callback=lambda: poll_scheduler.arrival_rate_tracks_per_s or 0)
+    metrics_registry.gauge("poll_next_delay_seconds", "How long the scheduler last decided to wait before polling", callback=lambda: poll_scheduler.next_poll_delay_s)
+    metrics_reporter = MetricsReporter(metrics_registry, port=METRICS_PORT, snapshot_path=METRICS_SNAPSHOT_FILE, snapshot_interval_s=METRICS_SNAPSHOT_INTERVAL_S).start()
+    
+    if CAPTURE_DIR:
+        set_response_recorder(ResponseRecorder(CAPTURE_DIR, max_total_bytes=CAPTURE_MAX_BYTES))
+    session = get_api_session(TransportSettings(connect_timeout_s=API_CONNECT_TIMEOUT_S, read_timeout_s=API_READ_TIMEOUT_S, compress=API_COMPRESSION))
+    mysql_conn = get_mysql_connection_object(allow_local_infile=(TRACK_WRITER==WRITER_LOAD_DATA)) # DDL and single-writer inserts
+    # The drainer gets its own connection, opened lazily and replaced whenever it fails
+    spill_buffer = SpillBuffer(SPILL_DIR, TABLE_NAME, connection_factory=lambda: get_mysql_connection_object(allow_local_infile=(TRACK_WRITER==WRITER_LOAD_DATA)), writer=TRACK_WRITER, max_segment_bytes=SPILL_SEGMENT_BYTES, max_total_bytes=SPILL_MAX_BYTES, ignore_duplicates=IDEMPOTENT_INGEST, use_db_checkpoint=USE_DB_CHECKPOINT, db_write_latency_budget_s=DB_WRITE_LATENCY_BUDGET_S) if SPILL_DIR else None
+    if USE_DB_CHECKPOINT:
+        create_checkpoint_table(mysql_conn)
+        useful_global_state = UsefulGlobalState.from_existing_state_file(mysql_connection=mysql_conn, table_name=TABLE_NAME, spilled_checkpoint=spill_buffer.newest_checkpoint() if spill_buffer is not None else None)
+    else:
+        useful_global_state = UsefulGlobalState.from_existing_state_file()
+    mysql_pool = MySQLConnectionPool(pool_size=MYSQL_POOL_SIZE, allow_local_infile=(TRACK_WRITER==WRITER_LOAD_DATA)) if NUM_DB_WRITERS>1 else None
+    db_writer = ParallelBatchWriter(mysql_pool, num_writers=NUM_DB_WRITERS) if mysql_pool is not None else None
     
     num_failures = 0
     
     create_initial_table(TABLE_NAME, mysql_conn)
+    ensure_sky_cell_index(TABLE_NAME, mysql_conn)
+    ensure_track_stats_columns(TABLE_NAME, mysql_conn) # older rows get theirs from db/mysql_track_stats.py
+    # Partition DDL runs on its own thread and connection, so a slow split or drop never stalls inserts
+    partition_manager = PartitionManager(TABLE_NAME, get_mysql_connection_object, granularity=PARTITION_GRANULARITY, periods_ahead=PARTITION_PERIODS_AHEAD, retention_periods=PARTITION_RETENTION_PERIODS, retention_action=PARTITION_RETENTION_ACTION, check_interval_s=PARTITION_CHECK_INTERVAL_S, dry_run=PARTITION_DRY_RUN).start()
+    if IDEMPOTENT_INGEST:
+        ensure_track_fingerprint_unique_key(TABLE_NAME, mysql_conn)
+    if spill_buffer is not None:
+        spill_buffer.start()
     
     while num_failures<MAX_UNCAUGHT_FAILURES_BEFORE_EXIT:
         useful_global_state.number_of_queries_in_a_row_where_we_didnt_receive_any_tracks = 0
         try:
-            check_on_mysql_connection(mysql_conn)
-            add_partitions(useful_global_state,TABLE_NAME,mysql_conn)
-            run_scraper(requests_session=session, useful_global_state=useful_global_state, mysql_conn=mysql_conn, max_threads=MAX_THREADS, max_tracks_added_at_once=MAX_TRACKS_ADDED_TO_TABLE_AT_A_TIME, table_name=TABLE_NAME, low_bound_num_track_threshold=MIN_NUMBER_OF_TRACKS_RETURNED_BEFORE_10s_SLEEP)
-        except Exception as e:
+            if spill_buffer is None or not spill_buffer.should_spill(): # while spilling, the drainer is the one waiting for MySQL
+                mysql_conn = check_on_mysql_connection(mysql_conn, allow_local_infile=(TRACK_WRITER==WRITER_LOAD_DATA))
+            if USE_PIPELINED_STAGES: # only returns by raising
+                run_pipelined_scraper(requests_session=session, useful_global_state=useful_global_state, mysql_conn=mysql_conn, max_threads=MAX_THREADS, max_tracks_added_at_once=MAX_TRACKS_ADDED_TO_TABLE_AT_A_TIME, table_name=TABLE_NAME, min_tracks_for_parallel_decode=MIN_TRACKS_FOR_PARALLEL_DECODE, max_responses_in_flight=MAX_RESPONSES_IN_FLIGHT, track_writer=TRACK_WRITER, mysql_pool=mysql_pool, num_db_writers=NUM_DB_WRITERS, use_db_checkpoint=USE_DB_CHECKPOINT, idempotent_ingest=IDEMPOTENT_INGEST, poll_scheduler=poll_scheduler, spill_buffer=spill_buffer)
+            else:
+                run_scraper(requests_session=session, useful_global_state=useful_global_state, mysql_conn=mysql_conn, max_threads=MAX_THREADS, max_tracks_added_at_once=MAX_TRACKS_ADDED_TO_TABLE_AT_A_TIME, table_name=TABLE_NAME, min_tracks_for_parallel_decode=MIN_TRACKS_FOR_PARALLEL_DECODE, track_writer=TRACK_WRITER, db_writer=db_writer, use_db_checkpoint=USE_DB_CHECKPOINT, idempotent_ingest=IDEMPOTENT_INGEST, stream_api_responses=STREAM_API_RESPONSES, poll_scheduler=poll_scheduler, spill_buffer=spill_buffer)
+        except Exception:
+            useful_global_state.mirror_state_to_file(force=True)
             num_failures+=1
-            logger.critical("Encountered something bad. Sleeping for 10mins then trying again", e, exc_info=True)
-            time.sleep(600)
\ No newline at end of file
+            time_to_sleep_s = poll_scheduler.record_error(ERROR_UNCAUGHT) # 30s doubling up to 10mins, reset by the next good response
+            logger.critical(f"Encountered something bad. Sleeping for {time_to_sleep_s:.0f}s then trying again", exc_info=True)
+            poll_scheduler.wait_for_next_poll()
\ No newline at end of file
@@ -0,0 +1,205 @@
+import os
+import tempfile
+import timeit
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Tuple, Sequence, Optional, Callable
+
+from protobuf_mysql_loader.db.mysql_utils import execute_many_returning_nothing
+from protobuf_mysql_loader.db.mysql_insert_engine import get_insert_engine
+from protobuf_mysql_loader.helper_table_schema import insert_sql
+from protobuf_mysql_loader.helper_record_batch import RecordBatch, RECORD_BATCH_COLUMN_KINDS, KIND_BLOB, KIND_STRING
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry, stage_seconds
+
+logger = logging.getLogger("main_logger")
+
+# Which path add_record_tuples_to_db pushes batches through. Pick one with the TRACK_WRITER config in a_main.
+WRITER_EXECUTEMANY = "executemany"
+WRITER_LOAD_DATA = "load_data"
+WRITER_MULTIROW = "multirow" # packet-size-aware multi-row INSERTs on cached prepared statements, see db/mysql_insert_engine.py
+TRACK_WRITERS = (WRITER_EXECUTEMANY, WRITER_LOAD_DATA, WRITER_MULTIROW)
+
+# How bytes columns are written into the LOAD DATA file.
+#   hex:     2 chars per byte, unhexed server side with SET col = UNHEX(@col). Plain ASCII, easy to eyeball.
+#   escaped: raw bytes with only \ TAB LF NUL escaped (MySQL's default LOAD DATA escaping). ~1 byte per byte.
+BLOB_ENCODING_HEX = "hex"
+BLOB_ENCODING_ESCAPED = "escaped"
+
+# /dev/shm keeps the "file" in RAM on Linux, which is the closest thing to an in-memory pipe the connector allows
+_DEFAULT_BULK_LOAD_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+_insert_seconds = stage_seconds("insert")
+_commit_seconds = stage_seconds("commit") # from before_commit to the end of the write, i.e. the checkpoint upsert plus COMMIT
+_rows_written_total = get_metrics_registry().counter("rows_written_total", "Track rows committed to MySQL")
+_bytes_written_total = get_metrics_registry().counter("payload_bytes_written_total", "Raw size of the values committed to MySQL (see estimate_payload_bytes)")
+
+_NULL = b"\\N"
+_STRING_ESCAPES = ((b"\\", b"\\\\"), (b"\t", b"\\t"), (b"\n", b"\\n"), (b"\x00", b"\\0"))
+
+
+@dataclass
+class WriteStats:
+    writer: str
+    rows: int
+    payload_bytes: int # raw size of the values (bytes/str lengths, 8 per number). Same measure for every writer so they compare.
+    seconds: float
+
+    @property
+    def rows_per_s(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+    @property
+    def bytes_per_s(self) -> float:
+        return self.payload_bytes / self.seconds if self.seconds > 0 else float("inf")
+
+    def __str__(self) -> str:
+        return f"{self.writer}: {self.rows} rows, {self.payload_bytes/(1024*1024):.1f} MiB in {self.seconds:.2f}s ({self.rows_per_s:,.0f} rows/s, {self.bytes_per_s/(1024*1024):.1f} MiB/s)"
+
+
+def estimate_payload_bytes(list_of_tuple_records:Sequence[Tuple]) -> int:
+    if isinstance(list_of_tuple_records, RecordBatch):
+        return list_of_tuple_records.payload_bytes()
+    return sum(len(value) if isinstance(value, (bytes, str)) else 8 for record in list_of_tuple_records for value in record)
+
+
+def _escape(raw:bytes) -> bytes:
+    for plain, escaped in _STRING_ESCAPES:
+        raw = raw.replace(plain, escaped)
+    return raw
+
+
+def _format_field(value, blob_encoding:str) -> bytes:
+    if value is None:
+        return _NULL
+    if isinstance(value, bytes):
+        return value.hex().encode("ascii") if blob_encoding == BLOB_ENCODING_HEX else _escape(value)
+    if isinstance(value, bool):
+        return b"1" if value else b"0"
+    if isinstance(value, float):
+        return repr(value).encode("ascii") # repr round-trips exactly
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ").encode("ascii")
+    return _escape(str(value).encode("utf-8"))
+
+
+def _format_record_batch_column(record_batch:RecordBatch, column:str, start:int, stop:int, blob_encoding:str) -> List[bytes]:
+    # Same bytes _format_field gives each value, but a column at a time: a hex blob column is hexed in one call and sliced,
+    # and a string column formats each distinct value once
+    kind = RECORD_BATCH_COLUMN_KINDS[column]
+    if kind == KIND_BLOB and blob_encoding == BLOB_ENCODING_HEX:
+        buffer, offsets = record_batch.blob_buffer_and_offsets(column)
+        bounds = offsets[start:stop+1].tolist()
+        hexed = buffer[bounds[0]:bounds[-1]].hex().encode("ascii")
+        return [hexed[2*(bounds[i]-bounds[0]):2*(bounds[i+1]-bounds[0])] for i in range(len(bounds) - 1)]
+    if kind == KIND_STRING:
+        codes, categories = record_batch.string_codes_and_categories(column)
+        formatted_categories = [_format_field(category, blob_encoding) for category in categories]
+        return [formatted_categories[code] for code in codes[start:stop].tolist()]
+    return [_format_field(value, blob_encoding) for value in record_batch.column_values(column, start, stop)]
+
+
+def _write_record_batch_load_data_file(record_batch:RecordBatch, output_file, blob_encoding:str, rows_per_chunk:int=4096) -> int:
+    num_bytes = 0
+    for start in range(0, len(record_batch), rows_per_chunk):
+        stop = min(start + rows_per_chunk, len(record_batch))
+        formatted_columns = [_format_record_batch_column(record_batch, column, start, stop, blob_encoding) for column in record_batch.columns]
+        chunk = b"".join([b"\t".join(fields) + b"\n" for fields in zip(*formatted_columns)])
+        output_file.write(chunk)
+        num_bytes += len(chunk)
+    return num_bytes
+
+
+def write_load_data_file(list_of_tuple_records:Sequence[Tuple], output_file, blob_encoding:str=BLOB_ENCODING_HEX) -> int:
+    """ Tab separated, LF terminated, \\N for NULL. Returns the number of bytes written. """
+    if isinstance(list_of_tuple_records, RecordBatch):
+        return _write_record_batch_load_data_file(list_of_tuple_records, output_file, blob_encoding)
+    num_bytes = 0
+    for record in list_of_tuple_records:
+        line = b"\t".join([_format_field(value, blob_encoding) for value in record]) + b"\n"
+        output_file.write(line)
+        num_bytes += len(line)
+    return num_bytes
+
+
+def build_load_data_statement(file_path:str, table_name:str, columns:Sequence[str], blob_columns:Sequence[str], blob_encoding:str=BLOB_ENCODING_HEX, ignore_duplicates:bool=False) -> str:
+    # With hex blobs the file column goes into a user variable and gets UNHEX'd on the way in
+    hex_columns = set(blob_columns) if blob_encoding == BLOB_ENCODING_HEX else set()
+    column_targets = ",".join([f"@{c}" if c in hex_columns else c for c in columns])
+    sql = f"""LOAD DATA LOCAL INFILE '{file_path}' {'IGNORE ' if ignore_duplicates else ''}INTO TABLE {table_name}
+CHARACTER SET binary
+FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+LINES TERMINATED BY '\\n'
+({column_targets})"""
+    if hex_columns:
+        sql += "\nSET " + ", ".join([f"{c} = UNHEX(@{c})" for c in columns if c in hex_columns])
+    return sql + ";"
+
+
+def load_data_returning_nothing(mysql_connection, table_name:str, columns:Sequence[str], blob_columns:Sequence[str], list_of_tuple_records:Sequence[Tuple], blob_encoding:str=BLOB_ENCODING_HEX, bulk_load_dir:Optional[str]=_DEFAULT_BULK_LOAD_DIR, before_commit:Optional[Callable]=None, ignore_duplicates:bool=False) -> int:
+    """
+    Streams the batch into a temp file and ingests it with one LOAD DATA LOCAL INFILE, skipping the client-side escaping and
+    giant statement text that executemany builds. The connection must be opened with allow_local_infile=True and the server
+    needs local_infile=ON. Returns the size of the file that was loaded.
+    """
+    with tempfile.NamedTemporaryFile(mode="wb", prefix=f"{table_name}_", suffix=".tsv", dir=bulk_load_dir, delete=False) as output_file:
+        file_path = output_file.name
+        num_file_bytes = write_load_data_file(list_of_tuple_records, output_file, blob_encoding)
+    try:
+        with mysql_connection.cursor() as cur:
+            cur.execute(build_load_data_statement(file_path, table_name, columns, blob_columns, blob_encoding, ignore_duplicates))
+        if before_commit is not None:
+            before_commit(mysql_connection)
+        mysql_connection.commit()
+    finally:
+        os.remove(file_path)
+    return num_file_bytes
+
+
+def write_record_tuples(mysql_connection, table_name:str, columns:Sequence[str], list_of_tuple_records:List[Tuple], writer:str=WRITER_EXECUTEMANY, blob_encoding:str=BLOB_ENCODING_HEX, before_commit:Optional[Callable]=None, ignore_duplicates:bool=False) -> WriteStats:
+    """
+    Inserts the batch with the chosen writer and reports throughput, so the writers can be measured against each other.
+    before_commit(mysql_connection), if given, runs in the batch's transaction right before it commits.
+    ignore_duplicates turns rows that hit a unique key (e.g. a replayed track_fingerprint) into no-ops instead of errors.
+    """
+    start_time = timeit.default_timer()
+    # Every writer calls before_commit right before COMMIT, so it doubles as the point where "insert" ends and "commit" starts
+    insert_finished_time = []
+    callers_before_commit = before_commit
+    def time_insert_then_before_commit(mysql_connection):
+        insert_finished_time.append(timeit.default_timer())
+        if callers_before_commit is not None:
+            callers_before_commit(mysql_connection)
+    before_commit = time_insert_then_before_commit
+    if isinstance(list_of_tuple_records, RecordBatch) and writer != WRITER_LOAD_DATA:
+        # These writers walk the rows more than once (chunking, retries), so build the tuples once up front
+        payload_bytes = list_of_tuple_records.payload_bytes()
+        list_of_tuple_records = list_of_tuple_records.to_insert_tuples()
+    else:
+        payload_bytes = estimate_payload_bytes(list_of_tuple_records)
+    if writer == WRITER_EXECUTEMANY:
+        execute_many_returning_nothing(
+            mysql_connection = mysql_connection,
+            sql_query_with_placeholders = insert_sql(table_name, columns, ignore_duplicates),
+            list_of_tuple_records = list_of_tuple_records,
+            before_commit = before_commit,
+        )
+    elif writer == WRITER_LOAD_DATA:
+        blob_columns = [c for c in columns if c.endswith("_blob")]
+        num_file_bytes = load_data_returning_nothing(mysql_connection, table_name, columns, blob_columns, list_of_tuple_records, blob_encoding, before_commit=before_commit, ignore_duplicates=ignore_duplicates)
+        logger.debug(f"LOAD DATA file for {len(list_of_tuple_records)} rows was {num_file_bytes} bytes ({blob_encoding} blobs)")
+    elif writer == WRITER_MULTIROW:
+        num_statements = get_insert_engine(mysql_connection, table_name, columns, ignore_duplicates).insert(mysql_connection, list_of_tuple_records, before_commit=before_commit)
+        logger.debug(f"Multi-row insert of {len(list_of_tuple_records)} rows took {num_statements} statement(s)")
+    else:
+        raise ValueError(f"Unknown track writer {writer!r}. Expected one of {TRACK_WRITERS}")
+
+    end_time = timeit.default_timer()
+    stats = WriteStats(writer=writer, rows=len(list_of_tuple_records), payload_bytes=payload_bytes, seconds=end_time-start_time)
+    commit_start_time = insert_finished_time[-1] if insert_finished_time else end_time
+    _insert_seconds.observe(commit_start_time - start_time)
+    _commit_seconds.observe(end_time - commit_start_time)
+    _rows_written_total.inc(stats.rows)
+    _bytes_written_total.inc(stats.payload_bytes)
+    logger.info(f"Wrote batch with {stats}")
+    return stats
@@ -0,0 +1,106 @@
+import logging
+from typing import Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("main_logger")
+
+# One row per data table. Written in the same transaction as the batch insert that completes a response, so the token
+# in here can never be ahead of the data that's actually committed.
+CHECKPOINT_TABLE_NAME = "scraper_checkpoints"
+# One row per (data table, backfill window). Same idea: each window's token moves in the transaction that commits its data.
+BACKFILL_PROGRESS_TABLE_NAME = "scraper_backfill_windows"
+
+
+class BackfillWindowProgress(NamedTuple):
+    window_start_s: int
+    window_end_s: int
+    next_token: Optional[str] # None until the window's first response has committed
+    num_tracks: int
+    is_done: bool
+
+
+def create_checkpoint_table(mysql_connection) -> None:
+    create_sql = f"""
+CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE_NAME} (
+    table_name VARCHAR(64) NOT NULL PRIMARY KEY, /* the data table this token belongs to */
+    last_token_received_for_data_sucessfully_added_to_db VARCHAR(2048) NOT NULL,
+    checkpoint_rank BIGINT UNSIGNED NOT NULL, /* only ever increases. Guards against an older token overwriting a newer one */
+    updated_at_utc TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
+);
+"""
+    with mysql_connection.cursor() as cur:
+        cur.execute(create_sql)
+    mysql_connection.commit()
+    return None
+
+
+def write_checkpoint_without_committing(mysql_connection, table_name:str, token:str, checkpoint_rank:int) -> None:
+    # Token and rank move together and only forwards. token is assigned first so the IF still sees the old rank.
+    upsert_sql = f"""
+INSERT INTO {CHECKPOINT_TABLE_NAME} (table_name, last_token_received_for_data_sucessfully_added_to_db, checkpoint_rank)
+VALUES (%s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    last_token_received_for_data_sucessfully_added_to_db = IF(VALUES(checkpoint_rank) > checkpoint_rank, VALUES(last_token_received_for_data_sucessfully_added_to_db), last_token_received_for_data_sucessfully_added_to_db),
+    checkpoint_rank = GREATEST(checkpoint_rank, VALUES(checkpoint_rank));"""
+    with mysql_connection.cursor() as cur:
+        cur.execute(upsert_sql, (table_name, token, checkpoint_rank))
+    return None
+
+
+def write_checkpoint(mysql_connection, table_name:str, token:str, checkpoint_rank:int) -> None:
+    # Standalone version, for when the data it covers is already committed
+    write_checkpoint_without_committing(mysql_connection, table_name, token, checkpoint_rank)
+    mysql_connection.commit()
+    return None
+
+
+def read_checkpoint_and_rank(mysql_connection, table_name:str) -> Optional[Tuple[str, int]]:
+    with mysql_connection.cursor() as cur:
+        cur.execute(f"SELECT last_token_received_for_data_sucessfully_added_to_db, checkpoint_rank FROM {CHECKPOINT_TABLE_NAME} WHERE table_name = %s;", (table_name,))
+        row = cur.fetchone()
+    return (row[0], int(row[1])) if row else None
+
+
+def read_checkpoint(mysql_connection, table_name:str) -> Optional[str]:
+    token_and_rank = read_checkpoint_and_rank(mysql_connection, table_name)
+    return token_and_rank[0] if token_and_rank else None
+
+
+def create_backfill_progress_table(mysql_connection) -> None:
+    create_sql = f"""
+CREATE TABLE IF NOT EXISTS {BACKFILL_PROGRESS_TABLE_NAME} (
+    table_name VARCHAR(64) NOT NULL,
+    window_start_s BIGINT NOT NULL, /* unix seconds, inclusive */
+    window_end_s BIGINT NOT NULL,   /* unix seconds, exclusive */
+    next_token VARCHAR(2048) NULL,  /* token to resume the window's chain from. NULL means start from window_start_s */
+    num_tracks BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    is_done TINYINT(1) NOT NULL DEFAULT 0,
+    updated_at_utc TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+    PRIMARY KEY (table_name, window_start_s)
+);
+"""
+    with mysql_connection.cursor() as cur:
+        cur.execute(create_sql)
+    mysql_connection.commit()
+    return None
+
+
+def write_backfill_progress_without_committing(mysql_connection, table_name:str, window_start_s:int, window_end_s:int, next_token:Optional[str], num_tracks_added:int, is_done:bool) -> None:
+    upsert_sql = f"""
+INSERT INTO {BACKFILL_PROGRESS_TABLE_NAME} (table_name, window_start_s, window_end_s, next_token, num_tracks, is_done)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    window_end_s = VALUES(window_end_s),
+    next_token = COALESCE(VALUES(next_token), next_token),
+    num_tracks = num_tracks + VALUES(num_tracks),
+    is_done = VALUES(is_done);"""
+    with mysql_connection.cursor() as cur:
+        cur.execute(upsert_sql, (table_name, window_start_s, window_end_s, next_token, num_tracks_added, int(is_done)))
+    return None
+
+
+def read_backfill_progress(mysql_connection, table_name:str) -> Dict[int, BackfillWindowProgress]:
+    """ window_start_s -> progress, for every window a backfill of table_name has started """
+    with mysql_connection.cursor() as cur:
+        cur.execute(f"SELECT window_start_s, window_end_s, next_token, num_tracks, is_done FROM {BACKFILL_PROGRESS_TABLE_NAME} WHERE table_name = %s;", (table_name,))
+        rows = cur.fetchall()
+    return {int(row[0]): BackfillWindowProgress(int(row[0]), int(row[1]), row[2], int(row[3]), bool(row[4])) for row in rows}
@@ -1,109 +1,110 @@
-from datetime import datetime, timezone
 import mysql.connector
-from dateutil.relativedelta import relativedelta
 
-from typing import TYPE_CHECKING
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, List, Tuple, Optional, Callable
+
+from protobuf_mysql_loader.db.mysql_partition_manager import PartitionManager, GRANULARITY_MONTHLY
+from protobuf_mysql_loader.db.mysql_bulk_load import write_record_tuples, WriteStats, WRITER_EXECUTEMANY
+from protobuf_mysql_loader.helper_api_2_mysql import MySQLRecord, MYSQL_RECORD_INSERT_COLUMNS, TRACK_TABLE_SCHEMA, mysql_record_to_insert_tuple
+from protobuf_mysql_loader.helper_track_stats import TRACK_STATS_COLUMNS
 
 if TYPE_CHECKING:
     from mysql.connector import MySQLConnection
 
+# Bound of the first partition. PartitionManager splits everything after it off the MAXVALUE catch-all.
+INITIAL_PARTITION_BOUND_UTC = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
 # view tables with a tool like MySQL Workbench
 def create_initial_table(table_name:str, mysql_connection:"MySQLConnection") -> None:
-    # NOTE: THIS TABLE NEEDS IMMEDIATE PARTITION CREATION!! ONLY HAS EMPTY BOUNDS RIGHT NOW.
-    create_sql = f"""
-CREATE TABLE IF NOT EXISTS {table_name} (
-    my_id BIG INT UNSIGNED NOT NULL AUTO_INCREMENT,
-    some_time_utc TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) /* %Y-%m-%d %H:%M:%S.%f  or something like 2025-09-15 17:11:31.123456   */
-    some_decimal_float DECIMAL(10,4) /* up to 10 sigfigs, up to four after the period like 123456.1234 */
-    some_blob BLOB /* some binary data in bytes. Need to parse later  */
-)
-
-PARTITION BY RANGE (FLOOR(UNIX_TIMESTAMP(some_time_utc))) (
-    PARTITION p_init VALUES LESS THAN (UNIX_TIMESTAMP('2024-01-01 00:00:00')),
-    PARTITION p_max VALUES LESS THAN MAXVALUE
-);
-"""
+    # Columns, types, keys and partitioning all come from MySQLRecord's column() specs (see helper_table_schema.py).
+    # NOTE: only p_init and the catch-all exist after this. Start a PartitionManager (or call add_partitions) right away.
+    create_sql = TRACK_TABLE_SCHEMA.create_table_sql(table_name, first_partition_bound_s=int(INITIAL_PARTITION_BOUND_UTC.timestamp()))
     with mysql_connection.cursor() as cur:
         cur.execute(create_sql)
     mysql_connection.commit()
     return None
 
-def _get_existing_partitions(mysql_connection, table_name) -> List[str]:
-    query=f"""
-SELECT PARTITION_NAME, PARTITION_DESCRIPTION /* name, desc something like (2025_01, 17234234234234) */
-FROM INFORMATION_SCHEMA.PARTITIONS
-WHERE TABLE_NAME= '{table_name}' AND PARTITION_NAME IS NOT NULL
-ORDER BY PARTITION_DESCRIPTION;"""
+def ensure_track_fingerprint_unique_key(table_name:str, mysql_connection:"MySQLConnection", partition_column:str="trackstart_utc") -> None:
+    # Backstop for idempotent ingest: replayed tracks hit this key and INSERT IGNORE skips them.
+    # MySQL wants every unique key on a partitioned table to include the partitioning column, hence the second column.
     with mysql_connection.cursor() as cur:
-        cur.execute(query)
-        rows=cur.fetchall()
-    
-    # Drop p_max, will add in again later
-    partition_names = [row[0] for row in rows] 
-    if "pmax" in partition_names:
-        with mysql_connection.cursor() as cur:
-            cur.execute(f"ALTER TABLE {table_name} DROP PARTITION pmax")
-            mysql_connection.commit()
-    # return only numeric
-    return [row[1] for row in rows if row[1] and row[1].isdigit()] # partition names like 2025_01 but this is description which is unixtimestamp
-
-def _create_monthly_partitions(mysql_connection, table_name, months_back=2, months_forward=6):
-    now = datetime.now().replace(day=1)
-    monthyear_set = set()
-
-    for offset in range(-months_back, months_forward+1):
-        dt_baseline_not_zerod = now + relativedelta(months=offset)
-        dt = datetime(dt_baseline_not_zerod.year, dt_baseline_not_zerod.month, 1, 0, 0, 0, tzinfo=timezone.utc)
-        bound_time = dt + relativedelta(months=1)
-        partition_name = f"p{dt.year}_{dt.month:02}"
-        partition_bound = int(bound_time.timestamp())
-        monthyear_set.add((partition_name, int(partition_bound), dt.year, dt.month))
-    existing_bounds = set(int(b) for b in _get_existing_partitions(mysql_connection, table_name) if b.isdigit())
+        cur.execute(f"""
+SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table_name}' AND COLUMN_NAME = 'track_fingerprint';""")
+        has_column = bool(cur.fetchall())
+        cur.execute(f"""
+SELECT INDEX_NAME FROM INFORMATION_SCHEMA.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table_name}' AND INDEX_NAME = 'uq_track_fingerprint';""")
+        has_key = bool(cur.fetchall())
+        if not has_column:
+            print(f"Adding track_fingerprint column to {table_name}")
+            cur.execute(f"ALTER TABLE {table_name} ADD COLUMN track_fingerprint BIGINT UNSIGNED NULL;") # NULL for old rows, which the unique key ignores
+        if not has_key:
+            print(f"Adding unique key on (track_fingerprint, {partition_column}) to {table_name}")
+            cur.execute(f"ALTER TABLE {table_name} ADD UNIQUE KEY uq_track_fingerprint (track_fingerprint, {partition_column});")
+    mysql_connection.commit()
+    return None
 
-    partitions_to_add = [
-        (name, bound, year, month) # something like (2025_01, 17223424523453, 1, 2025)
-        for name, bound, year, month in monthyear_set
-        if int(bound not in existing_bounds)
-    ]
+def ensure_sky_cell_index(table_name:str, mysql_connection:"MySQLConnection", partition_column:str="trackstart_utc") -> None:
+    # (sky_cell, trackstart_utc) lets a cone query range-scan its few cell ranges inside each pruned partition.
+    # Rows from before the column existed stay NULL and simply never match a sky region query.
+    with mysql_connection.cursor() as cur:
+        cur.execute(f"""
+SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table_name}' AND COLUMN_NAME = 'sky_cell';""")
+        has_column = bool(cur.fetchall())
+        cur.execute(f"""
+SELECT INDEX_NAME FROM INFORMATION_SCHEMA.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table_name}' AND INDEX_NAME = 'idx_sky_cell';""")
+        has_key = bool(cur.fetchall())
+        if not has_column:
+            print(f"Adding sky_cell column to {table_name}")
+            cur.execute(f"ALTER TABLE {table_name} ADD COLUMN sky_cell BIGINT UNSIGNED NULL;")
+        if not has_key:
+            print(f"Adding index on (sky_cell, {partition_column}) to {table_name}")
+            cur.execute(f"ALTER TABLE {table_name} ADD KEY idx_sky_cell (sky_cell, {partition_column});")
+    mysql_connection.commit()
+    return None
 
-    if not partitions_to_add:
-        print("No new partitions needed")
-        return
-    
-    alter_sql = f"ALTER TABLE {table_name} ADD PARTITION ("
-    alter_sql+= ",\n".join([f"PARTITION {name} VALUES LESS THAN ({bound})" for name, bound, _, _ in sorted(partitions_to_add, key=lambda x: x[1])])
-    alter_sql+=');'
+# The derived per-track stats (helper_track_stats.py), as MySQLRecord specifies them. All nullable: rows from before they
+# existed stay NULL until db/mysql_track_stats.py backfills them.
+TRACK_STATS_COLUMN_TYPES = {column: TRACK_TABLE_SCHEMA.column_by_name[column].sql_type for column in TRACK_STATS_COLUMNS}
+TRACK_STATS_INDEXES = {spec.index_name: spec.name for spec in TRACK_TABLE_SCHEMA.columns if spec.index_name and spec.name in TRACK_STATS_COLUMNS}
 
+def ensure_track_stats_columns(table_name:str, mysql_connection:"MySQLConnection", partition_column:str="trackstart_utc") -> None:
+    # Missing columns all go in with one ALTER, so an old table is only rebuilt once (MySQL 8 adds them instantly anyway)
     with mysql_connection.cursor() as cur:
-        cur.execute(alter_sql)
-        mysql_connection.commit()
-    
-    with mysql_connection.cursor() as cur:
-        cur.execute(f"ALTER TABLE {table_name} ADD PARTITION (PARTITION pmax VALUES LESS THAN (MAXVALUE));")
-        mysql_connection.commit()
+        cur.execute(f"""
+SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table_name}';""")
+        existing_columns = {row[0] for row in cur.fetchall()}
+        cur.execute(f"""
+SELECT DISTINCT INDEX_NAME FROM INFORMATION_SCHEMA.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table_name}';""")
+        existing_indexes = {row[0] for row in cur.fetchall()}
+        missing_columns = [column for column in TRACK_STATS_COLUMN_TYPES if column not in existing_columns]
+        if missing_columns:
+            print(f"Adding derived stats columns {', '.join(missing_columns)} to {table_name}")
+            cur.execute(f"ALTER TABLE {table_name} " + ", ".join(f"ADD COLUMN {column} {TRACK_STATS_COLUMN_TYPES[column]} NULL" for column in missing_columns) + ";")
+        for index_name, column in TRACK_STATS_INDEXES.items():
+            if index_name not in existing_indexes:
+                print(f"Adding index on ({column}, {partition_column}) to {table_name}")
+                cur.execute(f"ALTER TABLE {table_name} ADD KEY {index_name} ({column}, {partition_column});")
+    mysql_connection.commit()
+    return None
 
-    print(f"Added {len(partitions_to_add)} new partition(s)")
-    return
+def add_partitions(table_name:str, mysql_conn:"MySQLConnection", granularity:str=GRANULARITY_MONTHLY, dry_run:bool=False) -> List[str]:
+    # One synchronous round of partition maintenance on mysql_conn, e.g. right after create_initial_table in a script.
+    # The scraper runs a PartitionManager on its own thread and connection instead, see db/mysql_partition_manager.py.
+    return PartitionManager(table_name, connection_factory=None, granularity=granularity, dry_run=dry_run).run_once(mysql_conn)
 
 
-def add_partitions(table_name, mysql_conn, last_unix_timestamp_partitions_were_created):
-    # only add partitions once a week or so
-    if datetime.now().timestamp() - last_unix_timestamp_partitions_were_created > 7*24*60*60: # one week
-        print("Checking if we should add new partitions, then adding them if necessary.")
-        _create_monthly_partitions(mysql_conn, table_name)
+def add_tracks_to_db(records:List[MySQLRecord], mysql_connection, useful_global_state, table_name):
+    add_record_tuples_to_db(list(map(mysql_record_to_insert_tuple, records)), mysql_connection, table_name)
     return
-    
 
 
-
-def add_tracks_to_db(records:List[MySQLRecord], mysql_connection, useful_global_state, table_name):
-    execute_multiple_return_nothing(
-        connection = mysql_connection
-        query_without_values = f"INSERT INTO {table_name} ( {','.join([c for c in TABLE_COLUMNS])} ) VALUES ( {','.join(['%s']*len(TABLE_COLUMNS))} );",
-        list_of_tuple_records = [(
-            _object.attr1,
-            _object.attr2,
-            _object.attr3,
-        ) for _object in records]
-    )
-    return
\ No newline at end of file
+def add_record_tuples_to_db(list_of_tuple_records:List[Tuple], mysql_connection, table_name:str, writer:str=WRITER_EXECUTEMANY, before_commit:Optional[Callable]=None, ignore_duplicates:bool=False) -> WriteStats:
+    # Tuples are in MYSQL_RECORD_INSERT_COLUMNS order, e.g. straight out of the parallel track decoder.
+    # writer is "executemany", "load_data" or "multirow" (see db/mysql_bulk_load.py). before_commit runs in the insert's transaction.
+    return write_record_tuples(mysql_connection, table_name, MYSQL_RECORD_INSERT_COLUMNS, list_of_tuple_records, writer=writer, before_commit=before_commit, ignore_duplicates=ignore_duplicates)
@@ -0,0 +1,166 @@
+import logging
+from typing import Dict, List, Sequence, Tuple, Optional, Callable
+
+from mysql.connector import errorcode
+from mysql.connector import Error
+
+from protobuf_mysql_loader.helper_table_schema import insert_prefix_sql
+
+logger = logging.getLogger("main_logger")
+
+# Leave room for the protocol header and anything we under-estimate
+_PACKET_HEADROOM_FRACTION = 0.8
+_FALLBACK_MAX_ALLOWED_PACKET = 4*1024*1024 # the server default on older MySQLs, used if we can't ask
+_MIN_STATEMENT_BYTES = 16*1024
+# A prepared statement can have at most this many ? placeholders (ER_PS_MANY_PARAM past it), however small the rows are
+_MAX_PREPARED_STATEMENT_PLACEHOLDERS = 65_535
+# Errors the server (or connector) gives when a statement is bigger than max_allowed_packet. The server often just drops
+# the connection instead of answering, which shows up as "gone away"/"lost connection".
+_PACKET_TOO_LARGE_ERRNOS = {errorcode.ER_NET_PACKET_TOO_LARGE, errorcode.CR_SERVER_GONE_ERROR, errorcode.CR_SERVER_LOST}
+
+
+def _estimated_value_bytes(value, prepared:bool) -> int:
+    if isinstance(value, (bytes, bytearray)):
+        # Binary protocol sends blobs raw. Text protocol escapes them, worst case doubling the size.
+        return len(value) + 9 if prepared else 2*len(value) + 10
+    if isinstance(value, str):
+        return 2*len(value) + 4 # utf-8 plus escaping, roughly
+    return 24 # numbers, datetimes, None
+
+
+def _largest_power_of_two_at_most(n:int) -> int:
+    return 1 << (n.bit_length() - 1)
+
+
+class MultiRowInsertEngine:
+    """
+    Builds INSERT ... VALUES (...),(...) statements for one table, sized by estimated bytes instead of row count so a batch
+    of big-blob rows can't blow past max_allowed_packet.
+
+    Rows per statement are capped so a statement never has more than 65,535 placeholders (the server's limit for prepared
+    statements), then rounded down to a power of two, so only a handful of distinct statement shapes ever exist and
+    each one's server-side prepared statement gets reused. If the server still rejects a packet, the statement budget is
+    halved and the batch is retried (it's one transaction, so nothing is half-written).
+    """
+    def __init__(self, table_name:str, columns:Sequence[str], use_prepared_statements:bool=True, max_statement_bytes:Optional[int]=None, ignore_duplicates:bool=False):
+        self.table_name = table_name
+        self.columns = tuple(columns)
+        self.ignore_duplicates = ignore_duplicates
+        self.use_prepared_statements = use_prepared_statements
+        self.max_statement_bytes = max_statement_bytes # None until we've asked the server
+        self.max_rows_per_statement = max(1, _MAX_PREPARED_STATEMENT_PLACEHOLDERS // len(self.columns))
+        # Built once per table
+        self._statement_prefix = insert_prefix_sql(table_name, self.columns, ignore_duplicates)
+        self._row_placeholder = f"( {','.join(['%s']*len(self.columns))} )"
+        self._statements_by_num_rows:Dict[int, str] = {}
+        self._prepared_cursors_by_num_rows:Dict[int, object] = {}
+
+    def _statement(self, num_rows:int) -> str:
+        statement = self._statements_by_num_rows.get(num_rows)
+        if statement is None:
+            statement = self._statement_prefix + ",".join([self._row_placeholder]*num_rows)
+            self._statements_by_num_rows[num_rows] = statement
+        return statement
+
+    def _get_max_statement_bytes(self, mysql_connection) -> int:
+        if self.max_statement_bytes is None:
+            try:
+                with mysql_connection.cursor() as cur:
+                    cur.execute("SELECT @@max_allowed_packet")
+                    max_allowed_packet = int(cur.fetchone()[0])
+            except Error as e:
+                logger.warning(f"Couldn't read max_allowed_packet ({e}). Assuming {_FALLBACK_MAX_ALLOWED_PACKET} bytes.")
+                max_allowed_packet = _FALLBACK_MAX_ALLOWED_PACKET
+            self.max_statement_bytes = int(max_allowed_packet * _PACKET_HEADROOM_FRACTION) - len(self._statement_prefix)
+        return self.max_statement_bytes
+
+    def chunk_rows(self, list_of_tuple_records:Sequence[Tuple], max_statement_bytes:int) -> List[Sequence[Tuple]]:
+        row_bytes = [
+            len(self._row_placeholder) + sum(_estimated_value_bytes(value, self.use_prepared_statements) for value in record)
+            for record in list_of_tuple_records
+        ]
+        chunks = []
+        start = 0
+        while start < len(row_bytes):
+            statement_bytes = row_bytes[start] # always take at least one row, even if it's oversized on its own
+            end = start + 1
+            while end < len(row_bytes) and end - start < self.max_rows_per_statement and statement_bytes + row_bytes[end] <= max_statement_bytes:
+                statement_bytes += row_bytes[end]
+                end += 1
+            end = start + _largest_power_of_two_at_most(end - start)
+            chunks.append(list_of_tuple_records[start:end])
+            start = end
+        return chunks
+
+    def _cursor_for(self, mysql_connection, num_rows:int):
+        if not self.use_prepared_statements:
+            return mysql_connection.cursor(), False
+        cursor = self._prepared_cursors_by_num_rows.get(num_rows)
+        if cursor is None:
+            try:
+                cursor = mysql_connection.cursor(prepared=True)
+            except (TypeError, NotImplementedError, Error) as e:
+                logger.warning(f"Connector doesn't support prepared cursors ({e}). Falling back to client-side placeholders.")
+                self.use_prepared_statements = False
+                return mysql_connection.cursor(), False
+            self._prepared_cursors_by_num_rows[num_rows] = cursor
+        return cursor, True
+
+    def _forget_prepared_statements(self) -> None:
+        for cursor in self._prepared_cursors_by_num_rows.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self._prepared_cursors_by_num_rows = {}
+
+    def _insert_once(self, mysql_connection, list_of_tuple_records:Sequence[Tuple], max_statement_bytes:int, before_commit:Optional[Callable]) -> int:
+        num_statements = 0
+        for chunk in self.chunk_rows(list_of_tuple_records, max_statement_bytes):
+            cursor, is_cached = self._cursor_for(mysql_connection, len(chunk))
+            params = [value for record in chunk for value in record]
+            try:
+                cursor.execute(self._statement(len(chunk)), params)
+            finally:
+                if not is_cached:
+                    cursor.close()
+            num_statements += 1
+        if before_commit is not None:
+            before_commit(mysql_connection)
+        mysql_connection.commit()
+        return num_statements
+
+    def insert(self, mysql_connection, list_of_tuple_records:Sequence[Tuple], before_commit:Optional[Callable]=None) -> int:
+        """ Inserts and commits the whole batch. before_commit(mysql_connection) runs in the same transaction. Returns how many statements it took. """
+        while True:
+            max_statement_bytes = self._get_max_statement_bytes(mysql_connection)
+            try:
+                return self._insert_once(mysql_connection, list_of_tuple_records, max_statement_bytes, before_commit)
+            except Error as e:
+                if e.errno not in _PACKET_TOO_LARGE_ERRNOS or max_statement_bytes <= _MIN_STATEMENT_BYTES:
+                    raise
+                self.max_statement_bytes = max(_MIN_STATEMENT_BYTES, max_statement_bytes // 2)
+                logger.warning(f"Server rejected an INSERT packet ({e}). Retrying the batch with statements of at most {self.max_statement_bytes} bytes.")
+                self._forget_prepared_statements()
+                if mysql_connection.is_connected():
+                    mysql_connection.rollback()
+                else:
+                    mysql_connection.reconnect(attempts=3, delay=1)
+
+
+# One engine per (connection, table) so the prepared statements live as long as the connection does
+_insert_engines:Dict[Tuple[int, str, bool], MultiRowInsertEngine] = {}
+
+def get_insert_engine(mysql_connection, table_name:str, columns:Sequence[str], ignore_duplicates:bool=False) -> MultiRowInsertEngine:
+    key = (id(mysql_connection), table_name, ignore_duplicates)
+    engine = _insert_engines.get(key)
+    if engine is None or engine.columns != tuple(columns):
+        engine = MultiRowInsertEngine(table_name, columns, ignore_duplicates=ignore_duplicates)
+        _insert_engines[key] = engine
+    return engine
+
+
+def forget_insert_engines_for(mysql_connection) -> None:
+    # Called when a connection is thrown away so a new connection that happens to reuse its id() doesn't inherit its cursors
+    for key in [key for key in _insert_engines if key[0] == id(mysql_connection)]:
+        _insert_engines.pop(key)._forget_prepared_statements()
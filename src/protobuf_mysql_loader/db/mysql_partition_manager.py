@@ -0,0 +1,292 @@
+import argparse
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from dateutil.relativedelta import relativedelta
+
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry
+
+logger = logging.getLogger("main_logger")
+
+# Keeps the track table's RANGE partitions ahead of the data and behind the retention window, off the ingest path.
+#
+# The table is partitioned on UNIX_TIMESTAMP bounds (VALUES LESS THAN <epoch s of the next period start, UTC>) with a
+# MAXVALUE catch-all at the end. New periods are carved off the front of the catch-all with REORGANIZE PARTITION, which
+# only rewrites the catch-all's rows (normally none), instead of dropping and re-adding it. Old periods are dropped, or
+# swapped out into their own table with EXCHANGE PARTITION (metadata only) and then dropped.
+#
+# DDL needs a metadata lock on the table, and while it waits for one every new insert queues up behind it. So the manager
+# runs on its own connection with a short lock_wait_timeout: if ingest holds the table it gives up and tries again next run.
+
+GRANULARITY_DAILY = "daily"
+GRANULARITY_MONTHLY = "monthly"
+PARTITION_GRANULARITIES = (GRANULARITY_DAILY, GRANULARITY_MONTHLY)
+
+RETENTION_DROP = "drop"
+RETENTION_ARCHIVE = "archive" # EXCHANGE into <table>_archive_<partition>, then drop the emptied partition
+RETENTION_ACTIONS = (RETENTION_DROP, RETENTION_ARCHIVE)
+
+CATCH_ALL_PARTITION_NAME = "p_max" # the MAXVALUE partition is found by its bound, so an old "pmax" gets renamed to this on the next split
+
+# Where an archive got to. Each ALTER is atomic but the sequence isn't, so a run that died halfway picks up from here.
+ARCHIVE_TABLE_MISSING = "missing"
+ARCHIVE_TABLE_PARTITIONED = "partitioned" # created LIKE the data table, not yet de-partitioned
+ARCHIVE_TABLE_EMPTY = "empty"             # ready to EXCHANGE
+ARCHIVE_TABLE_FILLED = "filled"           # EXCHANGE done, partition is empty and only needs dropping
+ARCHIVE_TABLE_CONFLICT = "conflict"       # both hold rows. Exchanging would swap them back, so leave it for a human.
+
+DEFAULT_DDL_LOCK_WAIT_TIMEOUT_S = 10
+DEFAULT_PARTITION_CHECK_INTERVAL_S = 6*60*60
+
+_catch_all_rows = get_metrics_registry().gauge("partition_catch_all_rows", "Rows MySQL estimates are sitting in the MAXVALUE partition. Should stay ~0.")
+_partition_ddl_total = get_metrics_registry().counter("partition_ddl_statements_total", "Partition maintenance DDL statements executed")
+
+
+@dataclass
+class PartitionInfo:
+    name:str
+    bound:Optional[int] # exclusive upper bound in unix seconds, None for MAXVALUE
+    num_rows:int        # INFORMATION_SCHEMA's estimate
+
+    @property
+    def is_catch_all(self) -> bool:
+        return self.bound is None
+
+
+def get_partitions(mysql_connection, table_name:str) -> List[PartitionInfo]:
+    """ In partition order. Empty if the table isn't partitioned. """
+    with mysql_connection.cursor() as cur:
+        cur.execute("""
+SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+FROM INFORMATION_SCHEMA.PARTITIONS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+ORDER BY PARTITION_ORDINAL_POSITION;""", (table_name, ))
+        rows = cur.fetchall()
+    return [PartitionInfo(name=name, bound=None if str(description).upper() == "MAXVALUE" else int(description), num_rows=int(num_rows or 0))
+            for name, description, num_rows in rows]
+
+
+def archive_table_name_for(table_name:str, partition_name:str) -> str:
+    return f"{table_name}_archive_{partition_name}"[:64] # MySQL's identifier limit
+
+
+def get_archive_table_state(mysql_connection, table_name:str, partition_name:str) -> str:
+    archive_table_name = archive_table_name_for(table_name, partition_name)
+    with mysql_connection.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s;", (archive_table_name, ))
+        if not cur.fetchall()[0][0]:
+            return ARCHIVE_TABLE_MISSING
+        if get_partitions(mysql_connection, archive_table_name):
+            return ARCHIVE_TABLE_PARTITIONED
+        # Exact checks rather than TABLE_ROWS, which is only an estimate
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {archive_table_name});")
+        archive_has_rows = bool(cur.fetchall()[0][0])
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table_name} PARTITION ({partition_name}));")
+        partition_has_rows = bool(cur.fetchall()[0][0])
+    if not archive_has_rows:
+        return ARCHIVE_TABLE_EMPTY
+    return ARCHIVE_TABLE_CONFLICT if partition_has_rows else ARCHIVE_TABLE_FILLED
+
+
+def period_start(moment:datetime, granularity:str) -> datetime:
+    """ Start (UTC) of the day or month moment falls in """
+    moment = moment.astimezone(timezone.utc) if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+    if granularity == GRANULARITY_DAILY:
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == GRANULARITY_MONTHLY:
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"granularity must be one of {PARTITION_GRANULARITIES}, got {granularity!r}")
+
+
+def _period_step(granularity:str) -> relativedelta:
+    return relativedelta(days=1) if granularity == GRANULARITY_DAILY else relativedelta(months=1)
+
+
+def partition_name_for(start:datetime, granularity:str) -> str:
+    # Named after the period it holds: p2025_07 holds July, p2025_07_14 holds the 14th
+    return f"p{start.year}_{start.month:02}_{start.day:02}" if granularity == GRANULARITY_DAILY else f"p{start.year}_{start.month:02}"
+
+
+class PartitionManager:
+    """
+    Typical usage:
+    manager = PartitionManager(TABLE_NAME, get_mysql_connection_object, granularity=GRANULARITY_DAILY, retention_periods=90).start()
+    ...
+    manager.stop()
+
+    or, to see what it would do: PartitionManager(TABLE_NAME, get_mysql_connection_object, dry_run=True).run_once()
+
+    connection_factory is called once per run for a fresh connection that's closed afterwards, so a slow ALTER never holds
+    up (or gets held up by) the ingest connection. retention_periods=None keeps everything.
+    """
+    def __init__(
+            self,
+            table_name:str,
+            connection_factory:Callable,
+            granularity:str=GRANULARITY_MONTHLY,
+            periods_ahead:int=6,         # keep this many future periods split out of the catch-all
+            periods_behind:int=2,        # when the newest partition is older than this, start the new ones here. Anything older stays in the old partition.
+            retention_periods:Optional[int]=None, # drop/archive partitions whose data is entirely older than this many whole periods ago
+            retention_action:str=RETENTION_DROP,
+            dry_run:bool=False,          # print the DDL instead of running it
+            check_interval_s:float=DEFAULT_PARTITION_CHECK_INTERVAL_S,
+            lock_wait_timeout_s:int=DEFAULT_DDL_LOCK_WAIT_TIMEOUT_S,
+        ):
+        if granularity not in PARTITION_GRANULARITIES:
+            raise ValueError(f"granularity must be one of {PARTITION_GRANULARITIES}, got {granularity!r}")
+        if retention_action not in RETENTION_ACTIONS:
+            raise ValueError(f"retention_action must be one of {RETENTION_ACTIONS}, got {retention_action!r}")
+        self.table_name = table_name
+        self.connection_factory = connection_factory
+        self.granularity = granularity
+        self.periods_ahead = periods_ahead
+        self.periods_behind = periods_behind
+        self.retention_periods = retention_periods
+        self.retention_action = retention_action
+        self.dry_run = dry_run
+        self.check_interval_s = check_interval_s
+        self.lock_wait_timeout_s = lock_wait_timeout_s
+        self._stop_event = threading.Event()
+        self._thread:Optional[threading.Thread] = None
+
+    def expired_partitions(self, partitions:List[PartitionInfo], now:Optional[datetime]=None) -> List[PartitionInfo]:
+        """ Partitions whose rows are all older than the retention window. Never the catch-all or the newest finite partition. """
+        if self.retention_periods is None:
+            return []
+        now = now or datetime.now(timezone.utc)
+        cutoff_bound = int((period_start(now, self.granularity) - _period_step(self.granularity)*self.retention_periods).timestamp())
+        finite_partitions = [p for p in partitions if not p.is_catch_all]
+        expired = [p for p in finite_partitions if p.bound <= cutoff_bound]
+        return expired[:-1] if len(expired) == len(finite_partitions) else expired
+
+    def plan(self, partitions:List[PartitionInfo], now:Optional[datetime]=None, archive_table_states:Optional[Dict[str, str]]=None) -> List[str]:
+        """
+        DDL statements, in the order they should run, to bring partitions in line with the config.
+        archive_table_states maps expired partition names to get_archive_table_state(), for RETENTION_ARCHIVE. Missing = ARCHIVE_TABLE_MISSING.
+        """
+        if not partitions:
+            logger.warning(f"{self.table_name} isn't partitioned, nothing to maintain")
+            return []
+        now = now or datetime.now(timezone.utc)
+        step = _period_step(self.granularity)
+        current_start = period_start(now, self.granularity)
+        statements = self._plan_new_partitions(partitions, current_start, step)
+        statements += self._plan_retention(self.expired_partitions(partitions, now), archive_table_states or {})
+        return statements
+
+    def _plan_new_partitions(self, partitions:List[PartitionInfo], current_start:datetime, step:relativedelta) -> List[str]:
+        finite_bounds = [p.bound for p in partitions if not p.is_catch_all]
+        last_bound = max(finite_bounds) if finite_bounds else None
+        existing_names = {p.name for p in partitions}
+        new_partitions = []
+        for offset in range(-self.periods_behind, self.periods_ahead + 1):
+            start = current_start + step*offset
+            bound = int((start + step).timestamp())
+            if last_bound is not None and bound <= last_bound:
+                continue
+            name = partition_name_for(start, self.granularity)
+            if name in existing_names:
+                logger.warning(f"Not adding partition {name} to {self.table_name}: one with that name already exists with a different bound")
+                continue
+            new_partitions.append((name, bound))
+        if not new_partitions:
+            return []
+
+        definitions = [f"PARTITION {name} VALUES LESS THAN ({bound})" for name, bound in new_partitions]
+        catch_all = next((p for p in partitions if p.is_catch_all), None)
+        if catch_all is None:
+            # Only allowed when there's no MAXVALUE partition, and then it's cheap: nothing needs to move
+            return [f"ALTER TABLE {self.table_name} ADD PARTITION ({', '.join(definitions)});"]
+        if catch_all.num_rows:
+            logger.warning(f"{self.table_name}.{catch_all.name} holds ~{catch_all.num_rows} rows, so splitting it has to copy them. Partitions are falling behind the data.")
+        definitions.append(f"PARTITION {CATCH_ALL_PARTITION_NAME} VALUES LESS THAN (MAXVALUE)") # also renames a legacy pmax
+        return [f"ALTER TABLE {self.table_name} REORGANIZE PARTITION {catch_all.name} INTO ({', '.join(definitions)});"]
+
+    def _plan_retention(self, expired:List[PartitionInfo], archive_table_states:Dict[str, str]) -> List[str]:
+        statements = []
+        for partition in expired:
+            if self.retention_action == RETENTION_ARCHIVE:
+                archive_table_name = archive_table_name_for(self.table_name, partition.name)
+                state = archive_table_states.get(partition.name, ARCHIVE_TABLE_MISSING)
+                if state == ARCHIVE_TABLE_CONFLICT:
+                    logger.warning(f"Not archiving {self.table_name}.{partition.name}: it and {archive_table_name} both hold rows")
+                    continue
+                if state == ARCHIVE_TABLE_MISSING:
+                    statements.append(f"CREATE TABLE {archive_table_name} LIKE {self.table_name};")
+                if state in (ARCHIVE_TABLE_MISSING, ARCHIVE_TABLE_PARTITIONED):
+                    statements.append(f"ALTER TABLE {archive_table_name} REMOVE PARTITIONING;")
+                if state != ARCHIVE_TABLE_FILLED:
+                    # Swaps the partition's rows with the empty table's. Metadata only, no rows are copied.
+                    statements.append(f"ALTER TABLE {self.table_name} EXCHANGE PARTITION {partition.name} WITH TABLE {archive_table_name} WITHOUT VALIDATION;")
+            statements.append(f"ALTER TABLE {self.table_name} DROP PARTITION {partition.name};")
+        return statements
+
+    def run_once(self, mysql_connection=None, now:Optional[datetime]=None) -> List[str]:
+        """ Plans and (unless dry_run) executes. Returns the statements. Uses mysql_connection if given, else a fresh one. """
+        owns_connection = mysql_connection is None
+        mysql_connection = mysql_connection if mysql_connection is not None else self.connection_factory()
+        try:
+            partitions = get_partitions(mysql_connection, self.table_name)
+            catch_all = next((p for p in partitions if p.is_catch_all), None)
+            _catch_all_rows.set(catch_all.num_rows if catch_all else 0)
+            archive_table_states = {}
+            if self.retention_action == RETENTION_ARCHIVE:
+                archive_table_states = {p.name: get_archive_table_state(mysql_connection, self.table_name, p.name) for p in self.expired_partitions(partitions, now)}
+            statements = self.plan(partitions, now=now, archive_table_states=archive_table_states)
+            if not statements:
+                logger.info(f"Partitions of {self.table_name} are up to date")
+                return statements
+            if self.dry_run:
+                print(f"-- Dry run: partition maintenance for {self.table_name} would execute:")
+                for statement in statements:
+                    print(statement)
+                return statements
+            with mysql_connection.cursor() as cur:
+                cur.execute(f"SET SESSION lock_wait_timeout = {int(self.lock_wait_timeout_s)};")
+                for statement in statements:
+                    logger.info(f"Partition maintenance: {statement}")
+                    cur.execute(statement)
+                    _partition_ddl_total.inc()
+            mysql_connection.commit()
+            return statements
+        finally:
+            if owns_connection:
+                mysql_connection.close()
+
+    def start(self) -> "PartitionManager":
+        """ Runs now, then every check_interval_s, on a daemon thread. Failures (e.g. a lock wait timeout) are logged and retried next time. """
+        self._thread = threading.Thread(target=self._loop, name="partition-manager", daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning(f"Partition maintenance for {self.table_name} failed, will retry in {self.check_interval_s:.0f}s: {e}")
+            if self._stop_event.wait(self.check_interval_s):
+                return
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.check_interval_s)
+            self._thread = None
+
+
+if __name__ == "__main__":
+    from protobuf_mysql_loader.db.mysql_utils import get_mysql_connection_object
+    parser = argparse.ArgumentParser(description="One round of partition maintenance for a track table")
+    parser.add_argument("table_name")
+    parser.add_argument("--granularity", choices=PARTITION_GRANULARITIES, default=GRANULARITY_MONTHLY)
+    parser.add_argument("--periods-ahead", type=int, default=6)
+    parser.add_argument("--retention-periods", type=int, default=None)
+    parser.add_argument("--retention-action", choices=RETENTION_ACTIONS, default=RETENTION_DROP)
+    parser.add_argument("--execute", action="store_true", help="actually run the DDL. Without this it's a dry run.")
+    args = parser.parse_args()
+    PartitionManager(args.table_name, get_mysql_connection_object, granularity=args.granularity, periods_ahead=args.periods_ahead,
+                     retention_periods=args.retention_periods, retention_action=args.retention_action, dry_run=not args.execute).run_once()
@@ -0,0 +1,457 @@
+import os
+import mmap
+import time
+import zlib
+import pickle
+import random
+import struct
+import logging
+import threading
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+from mysql.connector import Error
+from mysql.connector.errors import InterfaceError, OperationalError
+
+from protobuf_mysql_loader.db.mysql_bulk_load import write_record_tuples, WRITER_EXECUTEMANY
+from protobuf_mysql_loader.db.mysql_checkpoint import write_checkpoint, write_checkpoint_without_committing
+from protobuf_mysql_loader.helper_api_2_mysql import MYSQL_RECORD_INSERT_COLUMNS
+from protobuf_mysql_loader.helper_record_batch import RecordBatch
+from protobuf_mysql_loader.helper_pipeline import Checkpoint
+from protobuf_mysql_loader.helper_poll_scheduler import BackoffPolicy
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry
+
+logger = logging.getLogger("main_logger")
+
+# Local write-ahead buffer for when MySQL is down or too slow, so the scraper keeps fetching inside the API's replay window.
+#
+# Decoded batches (insert tuples) are appended to segment files in <spill_dir>, each write fsynced before the caller is
+# told it's safe. A batch is followed by the checkpoint it completes (if any), so the token only moves once the rows are
+# on disk. A drainer thread replays sealed segments into MySQL in big coalesced writes, writing each spilled checkpoint
+# in the same transaction as the rows before it, then deletes the segment.
+#
+# Segment layout (little endian):
+#   file header:  b"PMLSPILL", format version (u8), 7 pad bytes
+#   entries:      b"SE", entry type (u8), pad, payload length (u32), crc32 of payload (u32), payload
+#   batch:        pickle of (columns, [insert tuple, ...]). Local files we wrote ourselves, and the crc is checked first.
+#   checkpoint:   rank (u64), sequence number (u64), token as utf-8
+# Entries are only ever appended, so a crash can at worst leave a torn last entry, which the crc or length catches. Nothing
+# after a bad entry is trusted. Readers mmap the segment and checksum/unpickle straight out of the mapping.
+
+SPILL_FILE_MAGIC = b"PMLSPILL"
+SPILL_FORMAT_VERSION = 1
+SPILL_FILE_SUFFIX = ".spill"
+CORRUPT_SPILL_FILE_SUFFIX = ".corrupt" # segments with unreadable entries are renamed to this after draining, for a human to look at
+FAILED_SPILL_FILE_SUFFIX = ".failed"   # segments MySQL rejected outright (not a connection problem), kept instead of retried forever
+
+ENTRY_BATCH = 1
+ENTRY_CHECKPOINT = 2
+
+_FILE_HEADER = struct.Struct("<8sB7x")
+_ENTRY_MAGIC = b"SE"
+_ENTRY_HEADER = struct.Struct("<2sBxII")
+_CHECKPOINT_HEADER = struct.Struct("<QQ")
+
+DEFAULT_SPILL_SEGMENT_BYTES = 64 * 1024**2
+DEFAULT_SPILL_MAX_BYTES = 8 * 1024**3
+DEFAULT_DRAIN_BATCH_ROWS = 20_000     # rows per drain transaction. Several spilled batches are coalesced into one write.
+DEFAULT_DB_WRITE_LATENCY_BUDGET_S = 30 # a live write slower than this switches ingest over to the spill
+DEFAULT_MIN_SPILL_MODE_S = 60          # once switched over, stay spilling at least this long so a slow DB gets some air
+DEFAULT_DRAIN_POLL_INTERVAL_S = 5
+
+# Lock wait timeout and deadlock. The server is up but the write lost, so it's worth spilling rather than failing.
+_RETRYABLE_MYSQL_ERRNOS = (1205, 1213)
+
+_spilled_rows_total = get_metrics_registry().counter("spill_rows_written_total", "Track rows written to the local spill buffer instead of MySQL")
+_drained_rows_total = get_metrics_registry().counter("spill_rows_drained_total", "Spilled track rows replayed into MySQL")
+_spill_full_total = get_metrics_registry().counter("spill_buffer_full_total", "Batches refused because the spill buffer hit its size limit")
+
+
+class SpillBufferFull(Exception):
+    pass
+
+
+def is_spillable_db_error(e:BaseException) -> bool:
+    """ Connection trouble or a transient lock failure, i.e. the same rows would go in fine later. Not bad data or bad SQL. """
+    if isinstance(e, (OperationalError, InterfaceError, ConnectionError)):
+        return True
+    return isinstance(e, Error) and getattr(e, "errno", None) in _RETRYABLE_MYSQL_ERRNOS
+
+
+def rollback_quietly(mysql_connection) -> None:
+    # Don't leave a half-done transaction on a connection that's still alive. A dead one has nothing to roll back.
+    try:
+        if mysql_connection is not None and mysql_connection.is_connected():
+            mysql_connection.rollback()
+    except Error:
+        pass
+
+
+def _encode_entry(entry_type:int, payload:bytes) -> bytes:
+    return _ENTRY_HEADER.pack(_ENTRY_MAGIC, entry_type, len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_batch_entry(columns:Sequence[str], list_of_tuple_records:Sequence[Tuple]) -> bytes:
+    # A RecordBatch pickles as its column buffers, which is both smaller and much faster than the tuples
+    rows = list_of_tuple_records if isinstance(list_of_tuple_records, RecordBatch) else list(list_of_tuple_records)
+    return _encode_entry(ENTRY_BATCH, pickle.dumps((tuple(columns), rows), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _coalesce_batches(batches:List[Sequence[Tuple]]) -> Sequence[Tuple]:
+    if all(isinstance(batch, RecordBatch) for batch in batches):
+        return RecordBatch.concatenate(batches)
+    return [record for batch in batches for record in batch]
+
+
+def encode_checkpoint_entry(checkpoint:Checkpoint) -> bytes:
+    return _encode_entry(ENTRY_CHECKPOINT, _CHECKPOINT_HEADER.pack(checkpoint.rank, checkpoint.sequence_number) + checkpoint.token.encode("utf-8"))
+
+
+def _decode_checkpoint(payload) -> Checkpoint:
+    rank, sequence_number = _CHECKPOINT_HEADER.unpack_from(payload, 0)
+    return Checkpoint(sequence_number, bytes(payload[_CHECKPOINT_HEADER.size:]).decode("utf-8"), rank)
+
+
+class SpillSegmentReader:
+    """
+    Walks one segment's entries out of an mmap. Stops at the first torn or corrupt entry; num_unreadable_bytes says how
+    much of the file that left unread (0 for a healthy segment).
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.num_unreadable_bytes = 0
+
+    def entries(self, decode_batches:bool=True) -> Iterator[Tuple[int, object]]:
+        """ Yields (ENTRY_BATCH, (columns, rows)) and (ENTRY_CHECKPOINT, Checkpoint). Batches are (ENTRY_BATCH, None) without decode_batches. """
+        self.num_unreadable_bytes = 0
+        with open(self.path, "rb") as segment_file:
+            file_size = os.fstat(segment_file.fileno()).st_size
+            if file_size < _FILE_HEADER.size:
+                self.num_unreadable_bytes = file_size # died before the header made it to disk, so nothing was ever acknowledged
+                return
+            with mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                magic, version = _FILE_HEADER.unpack_from(view, 0)
+                if magic != SPILL_FILE_MAGIC or version != SPILL_FORMAT_VERSION:
+                    raise ValueError(f"{self.path} isn't a version {SPILL_FORMAT_VERSION} spill segment (magic {magic!r}, version {version})")
+                offset = _FILE_HEADER.size
+                while offset < file_size:
+                    if offset + _ENTRY_HEADER.size > file_size:
+                        break
+                    entry_magic, entry_type, payload_length, crc = _ENTRY_HEADER.unpack_from(view, offset)
+                    payload_start = offset + _ENTRY_HEADER.size
+                    payload_end = payload_start + payload_length
+                    if entry_magic != _ENTRY_MAGIC or payload_end > file_size:
+                        break
+                    with view[payload_start:payload_end] as payload:
+                        if zlib.crc32(payload) != crc:
+                            break
+                        if entry_type == ENTRY_CHECKPOINT:
+                            value = _decode_checkpoint(payload)
+                        elif entry_type == ENTRY_BATCH:
+                            value = pickle.loads(payload) if decode_batches else None
+                        else:
+                            break
+                    yield entry_type, value
+                    offset = payload_end
+                self.num_unreadable_bytes = file_size - offset
+        if self.num_unreadable_bytes:
+            logger.error(f"Spill segment {self.path} has {self.num_unreadable_bytes} unreadable bytes at offset {file_size - self.num_unreadable_bytes}. Everything before them is fine.")
+
+
+class SpillBuffer:
+    """
+    Size-limited, fsynced spill of decoded batches for one table, plus the drainer that puts them back into MySQL.
+
+    The live write path asks should_spill() before each batch. It's on while there's anything left to drain (so a recovering
+    DB gets the drainer's big writes, not both at once), for at least min_spill_mode_s after a failed or over-budget live
+    write, and always at startup if segments were left behind. spill() raises SpillBufferFull rather than grow past
+    max_total_bytes, and the caller then fails the batch like before, without moving the token.
+    """
+    def __init__(
+            self,
+            spill_dir:str,
+            table_name:str,
+            connection_factory:Optional[Callable]=None,
+            columns:Sequence[str]=MYSQL_RECORD_INSERT_COLUMNS,
+            writer:str=WRITER_EXECUTEMANY,
+            max_segment_bytes:int=DEFAULT_SPILL_SEGMENT_BYTES,
+            max_total_bytes:int=DEFAULT_SPILL_MAX_BYTES,
+            drain_batch_rows:int=DEFAULT_DRAIN_BATCH_ROWS,
+            ignore_duplicates:bool=False, # True with idempotent ingest, so a segment replayed twice (crash mid-drain) is harmless
+            use_db_checkpoint:bool=False,
+            db_write_latency_budget_s:float=DEFAULT_DB_WRITE_LATENCY_BUDGET_S,
+            min_spill_mode_s:float=DEFAULT_MIN_SPILL_MODE_S,
+            drain_poll_interval_s:float=DEFAULT_DRAIN_POLL_INTERVAL_S,
+            drain_retry_backoff:BackoffPolicy=BackoffPolicy(base_s=5, max_s=300),
+    ):
+        self.spill_dir = spill_dir
+        self.table_name = table_name
+        self.connection_factory = connection_factory
+        self.columns = tuple(columns)
+        self.writer = writer
+        self.max_segment_bytes = max_segment_bytes
+        self.max_total_bytes = max_total_bytes
+        self.drain_batch_rows = drain_batch_rows
+        self.ignore_duplicates = ignore_duplicates
+        self.use_db_checkpoint = use_db_checkpoint
+        self.db_write_latency_budget_s = db_write_latency_budget_s
+        self.min_spill_mode_s = min_spill_mode_s
+        self.drain_poll_interval_s = drain_poll_interval_s
+        self.drain_retry_backoff = drain_retry_backoff
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread:Optional[threading.Thread] = None
+        self._rng = random.Random()
+        self._drain_connection = None
+
+        os.makedirs(spill_dir, exist_ok=True)
+        self._sealed_segments:List[str] = self._find_segments() # oldest first
+        self._segment_bytes = {path: os.path.getsize(path) for path in self._sealed_segments}
+        self._next_segment_number = self._first_unused_segment_number()
+        self._active_file = None
+        self._active_path:Optional[str] = None
+        self._spill_mode_until_s = time.monotonic() + min_spill_mode_s if self._sealed_segments else 0.0
+        self._spilling = bool(self._sealed_segments)
+        if self._sealed_segments:
+            logger.warning(f"Found {len(self._sealed_segments)} spill segment(s) ({self.num_bytes/1024**2:.1f} MiB) for {table_name} in {spill_dir}. They'll be drained into MySQL before live writes resume.")
+
+        metrics_registry = get_metrics_registry()
+        metrics_registry.gauge("spill_buffer_bytes", "Bytes waiting in the local spill buffer", callback=lambda: self.num_bytes)
+        metrics_registry.gauge("spill_buffer_segments", "Spill segment files waiting to be drained, including the one being written", callback=lambda: self.num_segments)
+        metrics_registry.gauge("spill_mode", "1 while live writes go to the spill buffer instead of MySQL", callback=lambda: int(self._spilling))
+
+    def _find_segments(self) -> List[str]:
+        prefix = f"{self.table_name}_"
+        names = [name for name in os.listdir(self.spill_dir) if name.startswith(prefix) and name.endswith(SPILL_FILE_SUFFIX) and name[len(prefix):-len(SPILL_FILE_SUFFIX)].isdigit()]
+        return sorted((os.path.join(self.spill_dir, name) for name in names), key=self._segment_number)
+
+    def _first_unused_segment_number(self) -> int:
+        # Parked .corrupt/.failed segments count too, so a new segment never gets renamed over one later
+        prefix = f"{self.table_name}_"
+        numbers = [name[len(prefix):name.index(SPILL_FILE_SUFFIX)] for name in os.listdir(self.spill_dir) if name.startswith(prefix) and SPILL_FILE_SUFFIX in name]
+        return max((int(number) for number in numbers if number.isdigit()), default=-1) + 1
+
+    def _segment_number(self, path:str) -> int:
+        return int(os.path.basename(path)[len(self.table_name) + 1:-len(SPILL_FILE_SUFFIX)])
+
+    @property
+    def num_bytes(self) -> int:
+        return sum(list(self._segment_bytes.values())) # copied first, since the metrics thread calls this without the lock
+
+    @property
+    def num_segments(self) -> int:
+        return len(self._segment_bytes)
+
+    def should_spill(self) -> bool:
+        return self._spilling
+
+    def record_db_write_seconds(self, seconds:float) -> None:
+        """ Called after each successful live write. Over budget means MySQL is struggling, so back off onto the spill. """
+        if seconds > self.db_write_latency_budget_s:
+            logger.warning(f"MySQL write took {seconds:.1f}s, over the {self.db_write_latency_budget_s}s budget. Spilling batches to disk for at least {self.min_spill_mode_s}s.")
+            self._enter_spill_mode()
+
+    def record_db_failure(self) -> None:
+        self._enter_spill_mode()
+
+    def _enter_spill_mode(self) -> None:
+        with self._lock:
+            self._spilling = True
+            self._spill_mode_until_s = time.monotonic() + self.min_spill_mode_s
+
+    def spill(self, list_of_tuple_records:Sequence[Tuple], checkpoint:Optional[Checkpoint]=None) -> None:
+        """ Returns once the rows (and the checkpoint they complete, if any) are fsynced. Raises SpillBufferFull instead of going over the limit. """
+        chunk = encode_batch_entry(self.columns, list_of_tuple_records)
+        if checkpoint is not None:
+            chunk += encode_checkpoint_entry(checkpoint)
+        self._append(chunk)
+        _spilled_rows_total.inc(len(list_of_tuple_records))
+
+    def spill_checkpoint(self, checkpoint:Checkpoint) -> None:
+        self._append(encode_checkpoint_entry(checkpoint))
+
+    def _append(self, chunk:bytes) -> None:
+        with self._lock:
+            if self.num_bytes + len(chunk) > self.max_total_bytes:
+                _spill_full_total.inc()
+                raise SpillBufferFull(f"Spill buffer for {self.table_name} is full ({self.num_bytes/1024**2:.1f} MiB of {self.max_total_bytes/1024**2:.0f} MiB)")
+            if self._active_file is not None and self._segment_bytes[self._active_path] + len(chunk) > self.max_segment_bytes:
+                self._seal_active_segment()
+            if self._active_file is None:
+                self._open_active_segment()
+            size_before = self._segment_bytes[self._active_path]
+            try:
+                self._active_file.write(chunk)
+                self._active_file.flush()
+                os.fsync(self._active_file.fileno())
+            except OSError:
+                # e.g. disk full. Cut the partial entry off so later appends don't land behind a torn one.
+                self._active_file.truncate(size_before)
+                raise
+            self._segment_bytes[self._active_path] = size_before + len(chunk)
+            self._spilling = True
+
+    def _open_active_segment(self) -> None:
+        # Caller holds the lock
+        self._active_path = os.path.join(self.spill_dir, f"{self.table_name}_{self._next_segment_number:010d}{SPILL_FILE_SUFFIX}")
+        self._next_segment_number += 1
+        self._active_file = open(self._active_path, "ab")
+        self._active_file.write(_FILE_HEADER.pack(SPILL_FILE_MAGIC, SPILL_FORMAT_VERSION))
+        self._active_file.flush()
+        os.fsync(self._active_file.fileno())
+        directory_fd = os.open(self.spill_dir, os.O_RDONLY) # so the new file's directory entry survives a power cut too
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+        self._segment_bytes[self._active_path] = _FILE_HEADER.size
+
+    def _seal_active_segment(self) -> None:
+        # Caller holds the lock. Every append was already fsynced, so sealing is just closing and handing it to the drainer.
+        self._active_file.close()
+        self._sealed_segments.append(self._active_path)
+        self._active_file, self._active_path = None, None
+
+    def newest_checkpoint(self) -> Optional[Checkpoint]:
+        """ Highest ranked checkpoint still in the spill, i.e. the furthest token whose data is durable but maybe not in MySQL yet. """
+        with self._lock:
+            paths = list(self._sealed_segments) + ([self._active_path] if self._active_path else [])
+        newest = None
+        for path in paths:
+            for entry_type, value in SpillSegmentReader(path).entries(decode_batches=False):
+                if entry_type == ENTRY_CHECKPOINT and (newest is None or value.rank > newest.rank):
+                    newest = value
+        return newest
+
+    def drain_once(self, mysql_connection=None) -> int:
+        """
+        Replays every sealed segment (sealing the active one first if it's all that's left) and returns the number of rows
+        written. Leaves spill mode once there's nothing left and min_spill_mode_s has passed.
+        """
+        with self._lock:
+            if not self._sealed_segments and self._active_file is not None:
+                self._seal_active_segment()
+            segments = list(self._sealed_segments)
+        num_rows = 0
+        if segments:
+            if mysql_connection is None:
+                mysql_connection = self._get_drain_connection()
+            for path in segments:
+                num_rows += self._drain_segment(mysql_connection, path)
+        with self._lock:
+            # Anything spilled while we were draining keeps spill mode on until the next pass
+            if self._spilling and not self._sealed_segments and self._active_file is None and time.monotonic() >= self._spill_mode_until_s:
+                logger.info(f"Spill buffer for {self.table_name} is empty. Live writes go straight to MySQL again.")
+                self._spilling = False
+        return num_rows
+
+    def _get_drain_connection(self):
+        if self._drain_connection is None:
+            self._drain_connection = self.connection_factory()
+        return self._drain_connection
+
+    def _drain_segment(self, mysql_connection, path:str) -> int:
+        start_time = time.monotonic()
+        reader = SpillSegmentReader(path)
+        pending_columns:Optional[Tuple[str, ...]] = None
+        pending_batches:List[Sequence[Tuple]] = []
+        num_pending_rows = 0
+        pending_checkpoints:List[Checkpoint] = []
+        num_rows = 0
+
+        def flush():
+            nonlocal num_pending_rows
+            # Checkpoints go in with the rows written so far, which include every row they cover
+            newest_checkpoint = max(pending_checkpoints, key=lambda checkpoint: checkpoint.rank, default=None)
+            if newest_checkpoint is not None and not self.use_db_checkpoint:
+                newest_checkpoint = None
+            if num_pending_rows:
+                def write_checkpoint_in_same_transaction(mysql_connection):
+                    if newest_checkpoint is not None:
+                        write_checkpoint_without_committing(mysql_connection, self.table_name, newest_checkpoint.token, newest_checkpoint.rank)
+                write_record_tuples(mysql_connection, self.table_name, pending_columns, _coalesce_batches(pending_batches), writer=self.writer, before_commit=write_checkpoint_in_same_transaction, ignore_duplicates=self.ignore_duplicates)
+            elif newest_checkpoint is not None:
+                write_checkpoint(mysql_connection, self.table_name, newest_checkpoint.token, newest_checkpoint.rank)
+            _drained_rows_total.inc(num_pending_rows)
+            pending_batches.clear()
+            num_pending_rows = 0
+            pending_checkpoints.clear()
+
+        try:
+            for entry_type, value in reader.entries():
+                if entry_type == ENTRY_CHECKPOINT:
+                    pending_checkpoints.append(value)
+                    continue
+                columns, rows = value
+                if num_pending_rows and (columns != pending_columns or num_pending_rows + len(rows) > self.drain_batch_rows):
+                    flush()
+                pending_columns = columns
+                pending_batches.append(rows)
+                num_pending_rows += len(rows)
+                num_rows += len(rows)
+            flush()
+        except Exception as e:
+            rollback_quietly(mysql_connection)
+            if is_spillable_db_error(e):
+                raise
+            # MySQL said no to the rows themselves, so retrying won't help. Park the segment and carry on with the rest.
+            failed_path = path + FAILED_SPILL_FILE_SUFFIX
+            logger.critical(f"MySQL rejected rows from spill segment {path}. Moved it to {failed_path} and skipped it.", exc_info=True)
+            os.replace(path, failed_path)
+            self._forget_segment(path)
+            return 0
+
+        if reader.num_unreadable_bytes:
+            os.replace(path, path + CORRUPT_SPILL_FILE_SUFFIX)
+        else:
+            os.remove(path)
+        self._forget_segment(path)
+        logger.info(f"Drained {num_rows} spilled rows from {os.path.basename(path)} in {time.monotonic()-start_time:.1f}s. {self.num_segments} segment(s) left.")
+        return num_rows
+
+    def _forget_segment(self, path:str) -> None:
+        with self._lock:
+            self._sealed_segments.remove(path)
+            self._segment_bytes.pop(path, None)
+
+    def start(self) -> "SpillBuffer":
+        """ Drains on a daemon thread: every drain_poll_interval_s while idle, with jittered backoff while MySQL is unreachable. """
+        self._thread = threading.Thread(target=self._drain_loop, name="spill-drainer", daemon=True)
+        self._thread.start()
+        return self
+
+    def _drain_loop(self) -> None:
+        num_consecutive_errors = 0
+        while not self._stop_event.is_set():
+            try:
+                num_rows = self.drain_once()
+                num_consecutive_errors = 0
+            except Exception as e:
+                num_consecutive_errors += 1
+                delay_s = self.drain_retry_backoff.delay_s(num_consecutive_errors, self._rng)
+                logger.warning(f"Draining the spill buffer failed ({e}). {self.num_bytes/1024**2:.1f} MiB still spilled. Retrying in {delay_s:.0f}s.")
+                self._close_drain_connection()
+                if self._stop_event.wait(delay_s):
+                    return
+                continue
+            if num_rows == 0 and self._stop_event.wait(self.drain_poll_interval_s):
+                return
+
+    def _close_drain_connection(self) -> None:
+        if self._drain_connection is not None:
+            try:
+                self._drain_connection.close()
+            except Error:
+                pass
+            self._drain_connection = None
+
+    def stop(self) -> None:
+        """ Stops the drainer and closes the active segment. Whatever is left gets drained by the next process. """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=60)
+            self._thread = None
+        with self._lock:
+            if self._active_file is not None:
+                self._seal_active_segment()
+        self._close_drain_connection()
@@ -0,0 +1,417 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from protobuf_mysql_loader.helper_blob_codec import decode_blob, decode_blobs_concatenated
+from protobuf_mysql_loader.helper_sky_cells import CellRange, cell_ranges_sql, sky_cell_ranges
+from protobuf_mysql_loader.helper_track_stats import TRACK_STATS_COLUMNS
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry, stage_seconds
+
+logger = logging.getLogger("main_logger")
+
+# Read side of the track table. Queries are plain parameterized SELECTs that compare the partition column directly
+# (no DATE(), UNIX_TIMESTAMP() etc. wrapped around it) so MySQL can prune to the partitions the time range touches.
+# Rows are streamed with an unbuffered cursor and fetchmany, and the blobs are viewed with np.frombuffer rather than
+# unpacked into Python lists. Arrays that come straight off a raw blob share its memory, so they're read-only.
+
+DEFAULT_PARTITION_COLUMN = "trackstart_utc"
+DEFAULT_FETCH_SIZE = 2_000 # rows per fetchmany, i.e. per columnar batch when streaming batches
+DEFAULT_TRACK_CACHE_SIZE = 20_000 # tracks, ~50 obs each is a few tens of MB
+_MAX_IDS_PER_IN_CLAUSE = 1_000
+StatRange = Tuple[Optional[float], Optional[float]] # inclusive (low, high) on a derived stats column, None for unbounded
+
+TRACK_METADATA_COLUMNS:Tuple[str, ...] = ("track_id", "orig_sensor_id", "orig_object_id", "sat_no", "uct", "trackstart_utc", "trackend_utc", "median_ra_deg", "median_dec_deg")
+# (blob column, dtype char for headerless blobs, values per ob, DecodedTrack attribute). Same layout mysqlify_track writes.
+TRACK_BLOB_LAYOUTS:Tuple[Tuple[str, str, int, str], ...] = (
+    ("timestamp_us_blob",         "Q", 1, "timestamps_us"),
+    ("ra_and_dec_deg_blob",       "d", 2, "ra_dec_deg"),
+    ("ra_and_dec_unc_deg_blob",   "f", 2, "ra_dec_unc_deg"),
+    ("sen_pos_xyz_itrf_km_blob",  "f", 3, "sen_pos_xyz_itrf_km"),
+    ("sen_vel_xyz_itrf_kms_blob", "f", 3, "sen_vel_xyz_itrf_kms"),
+    ("mag_blob",                  "f", 1, "mag"),
+)
+TRACK_READ_COLUMNS:Tuple[str, ...] = TRACK_METADATA_COLUMNS + tuple(layout[0] for layout in TRACK_BLOB_LAYOUTS)
+_NUM_METADATA_COLUMNS = len(TRACK_METADATA_COLUMNS)
+
+_read_decode_seconds = stage_seconds("read_decode")
+_tracks_read_total = get_metrics_registry().counter("tracks_read_total", "Track rows read back out of MySQL")
+_track_cache_hits_total = get_metrics_registry().counter("track_cache_hits_total", "Decoded tracks served from the TrackCache")
+
+
+@dataclass
+class DecodedTrack:
+    track_id:int
+    orig_sensor_id:str
+    orig_object_id:str
+    sat_no:str
+    uct:bool
+    trackstart_utc:datetime # naive UTC, same as the table
+    trackend_utc:datetime
+    median_ra_deg:float
+    median_dec_deg:float
+    timestamps_us:np.ndarray        # (n_obs,) u64
+    ra_dec_deg:np.ndarray           # (n_obs, 2) f64
+    ra_dec_unc_deg:np.ndarray       # (n_obs, 2) f32
+    sen_pos_xyz_itrf_km:np.ndarray  # (n_obs, 3) f32
+    sen_vel_xyz_itrf_kms:np.ndarray # (n_obs, 3) f32
+    mag:np.ndarray                  # (n_obs,) f32
+
+    @property
+    def n_obs(self) -> int:
+        return len(self.timestamps_us)
+
+
+def decode_track_row(row:Sequence) -> DecodedTrack:
+    """ row is in TRACK_READ_COLUMNS order """
+    track_id, orig_sensor_id, orig_object_id, sat_no, uct, trackstart_utc, trackend_utc, median_ra_deg, median_dec_deg = row[:_NUM_METADATA_COLUMNS]
+    arrays = {attribute: decode_blob(blob, dtype_char, num_components)
+              for (_, dtype_char, num_components, attribute), blob in zip(TRACK_BLOB_LAYOUTS, row[_NUM_METADATA_COLUMNS:])}
+    return DecodedTrack(track_id=int(track_id), orig_sensor_id=orig_sensor_id, orig_object_id=orig_object_id, sat_no=sat_no,
+                        uct=bool(uct), trackstart_utc=trackstart_utc, trackend_utc=trackend_utc,
+                        median_ra_deg=float(median_ra_deg), median_dec_deg=float(median_dec_deg), **arrays)
+
+
+@dataclass
+class ColumnarTrackBatch:
+    """
+    Many tracks' obs concatenated into one array per blob column. Track i's obs are rows obs_offsets[i]:obs_offsets[i+1].
+    Per-track columns are arrays of length num_tracks. track(i) gives a DecodedTrack whose arrays are slices (views) of these.
+    """
+    track_ids:np.ndarray            # (num_tracks,) i64
+    orig_sensor_ids:np.ndarray      # (num_tracks,) object (str)
+    orig_object_ids:np.ndarray      # (num_tracks,) object (str)
+    sat_nos:np.ndarray              # (num_tracks,) object (str)
+    uct:np.ndarray                  # (num_tracks,) bool
+    trackstart_utc:np.ndarray       # (num_tracks,) datetime64[us]
+    trackend_utc:np.ndarray         # (num_tracks,) datetime64[us]
+    median_ra_deg:np.ndarray        # (num_tracks,) f64
+    median_dec_deg:np.ndarray       # (num_tracks,) f64
+    obs_offsets:np.ndarray          # (num_tracks + 1,) i64
+    timestamps_us:np.ndarray        # (num_obs,) u64
+    ra_dec_deg:np.ndarray           # (num_obs, 2) f64
+    ra_dec_unc_deg:np.ndarray       # (num_obs, 2) f32
+    sen_pos_xyz_itrf_km:np.ndarray  # (num_obs, 3) f32
+    sen_vel_xyz_itrf_kms:np.ndarray # (num_obs, 3) f32
+    mag:np.ndarray                  # (num_obs,) f32
+
+    def __len__(self) -> int:
+        return len(self.track_ids)
+
+    @property
+    def num_obs(self) -> int:
+        return int(self.obs_offsets[-1])
+
+    def obs_track_index(self) -> np.ndarray:
+        """ Which track (0..num_tracks-1) every ob belongs to, for groupbys and masks over the ob arrays. """
+        return np.repeat(np.arange(len(self.track_ids)), np.diff(self.obs_offsets))
+
+    def track(self, i:int) -> DecodedTrack:
+        start, end = self.obs_offsets[i], self.obs_offsets[i+1]
+        return DecodedTrack(
+            track_id=int(self.track_ids[i]), orig_sensor_id=self.orig_sensor_ids[i], orig_object_id=self.orig_object_ids[i],
+            sat_no=self.sat_nos[i], uct=bool(self.uct[i]),
+            trackstart_utc=self.trackstart_utc[i].astype(datetime), trackend_utc=self.trackend_utc[i].astype(datetime),
+            median_ra_deg=float(self.median_ra_deg[i]), median_dec_deg=float(self.median_dec_deg[i]),
+            **{attribute: getattr(self, attribute)[start:end] for _, _, _, attribute in TRACK_BLOB_LAYOUTS},
+        )
+
+    def select(self, tracks:np.ndarray) -> "ColumnarTrackBatch":
+        """ A new batch with only these tracks, given as a boolean mask or indices. Copies, since obs are gathered. """
+        tracks = np.flatnonzero(tracks) if np.asarray(tracks).dtype == bool else np.asarray(tracks, dtype=np.int64)
+        starts, counts = self.obs_offsets[tracks], np.diff(self.obs_offsets)[tracks]
+        obs_offsets = np.zeros(len(tracks) + 1, dtype=np.int64)
+        np.cumsum(counts, out=obs_offsets[1:])
+        obs_index = np.arange(obs_offsets[-1]) + np.repeat(starts - obs_offsets[:-1], counts)
+        per_obs = {attribute for _, _, _, attribute in TRACK_BLOB_LAYOUTS}
+        return ColumnarTrackBatch(obs_offsets=obs_offsets, **{
+            name: getattr(self, name)[obs_index if name in per_obs else tracks]
+            for name in self.__dataclass_fields__ if name != "obs_offsets"
+        })
+
+    @classmethod
+    def from_rows(cls, rows:Sequence[Sequence]) -> "ColumnarTrackBatch":
+        """ rows are in TRACK_READ_COLUMNS order, e.g. straight from fetchmany """
+        columns = list(zip(*rows)) if rows else [()] * len(TRACK_READ_COLUMNS)
+        track_ids, orig_sensor_ids, orig_object_ids, sat_nos, uct, trackstart_utc, trackend_utc, median_ra_deg, median_dec_deg = columns[:_NUM_METADATA_COLUMNS]
+        arrays, obs_counts = {}, None
+        for (column_name, dtype_char, num_components, attribute), blobs in zip(TRACK_BLOB_LAYOUTS, columns[_NUM_METADATA_COLUMNS:]):
+            values, counts = decode_blobs_concatenated(blobs, dtype_char, num_components)
+            if obs_counts is None:
+                obs_counts = counts
+            elif not np.array_equal(counts, obs_counts):
+                raise ValueError(f"{column_name} has a different number of obs per track than timestamp_us_blob")
+            arrays[attribute] = values
+        obs_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(obs_counts, out=obs_offsets[1:])
+        return cls(
+            track_ids=np.array(track_ids, dtype=np.int64),
+            orig_sensor_ids=np.array(orig_sensor_ids, dtype=object),
+            orig_object_ids=np.array(orig_object_ids, dtype=object),
+            sat_nos=np.array(sat_nos, dtype=object),
+            uct=np.array(uct, dtype=bool),
+            trackstart_utc=np.array(trackstart_utc, dtype="datetime64[us]"),
+            trackend_utc=np.array(trackend_utc, dtype="datetime64[us]"),
+            median_ra_deg=np.array(median_ra_deg, dtype=np.float64),
+            median_dec_deg=np.array(median_dec_deg, dtype=np.float64),
+            obs_offsets=obs_offsets,
+            **arrays,
+        )
+
+    @classmethod
+    def concatenate(cls, batches:Sequence["ColumnarTrackBatch"]) -> "ColumnarTrackBatch":
+        if len(batches) == 1:
+            return batches[0]
+        if not batches:
+            return cls.from_rows([])
+        obs_offsets = [batches[0].obs_offsets]
+        for batch in batches[1:]:
+            obs_offsets.append(batch.obs_offsets[1:] + obs_offsets[-1][-1])
+        joined = {name: np.concatenate([getattr(batch, name) for batch in batches])
+                  for name in cls.__dataclass_fields__ if name != "obs_offsets"}
+        return cls(obs_offsets=np.concatenate(obs_offsets), **joined)
+
+
+class TrackCache:
+    """ LRU of DecodedTracks keyed by track_id. Thread-safe, so one cache can sit behind several readers. """
+    def __init__(self, max_tracks:int=DEFAULT_TRACK_CACHE_SIZE):
+        self.max_tracks = max_tracks
+        self._tracks:"OrderedDict[int, DecodedTrack]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def get(self, track_id:int) -> Optional[DecodedTrack]:
+        with self._lock:
+            track = self._tracks.get(track_id)
+            if track is not None:
+                self._tracks.move_to_end(track_id)
+        if track is not None:
+            _track_cache_hits_total.inc()
+        return track
+
+    def put(self, track:DecodedTrack) -> None:
+        if self.max_tracks <= 0:
+            return None
+        with self._lock:
+            self._tracks[track.track_id] = track
+            self._tracks.move_to_end(track.track_id)
+            while len(self._tracks) > self.max_tracks:
+                self._tracks.popitem(last=False)
+        return None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tracks.clear()
+
+
+_track_cache:Optional[TrackCache] = None
+
+def get_track_cache() -> TrackCache:
+    global _track_cache
+    if _track_cache is None:
+        _track_cache = TrackCache()
+    return _track_cache
+
+
+def _to_naive_utc(moment:datetime) -> datetime:
+    # The table stores naive UTC datetimes. Aware datetimes get converted so the comparison means what the caller meant.
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def build_track_query(
+        table_name:str,
+        start_utc:Optional[datetime]=None, # inclusive
+        end_utc:Optional[datetime]=None,   # exclusive
+        orig_sensor_ids:Optional[Sequence[str]]=None,
+        orig_object_ids:Optional[Sequence[str]]=None,
+        track_ids:Optional[Sequence[int]]=None,
+        sky_cell_ranges:Optional[Sequence[CellRange]]=None,
+        stat_ranges:Optional[Dict[str, StatRange]]=None,
+        missing_track_stats:bool=False,
+        columns:Sequence[str]=TRACK_READ_COLUMNS,
+        partition_column:str=DEFAULT_PARTITION_COLUMN,
+        order_by_partition_column:bool=False,
+        limit:Optional[int]=None,
+    ) -> Tuple[str, tuple]:
+    """
+    Returns (sql, params) for cursor.execute. The time range is a half-open range on the bare partition column, which is
+    what lets MySQL prune partitions. Leave it off and every partition gets scanned.
+    sky_cell_ranges (from sky_cell_ranges(region)) pre-filters on the sky_cell index. The cover is conservative.
+    stat_ranges filters on the derived stats columns, e.g. {"angular_rate_deg_per_s": (0.5, None), "mag_min": (None, 6.0)}
+    (inclusive, None is unbounded). Rows whose stats are still NULL never match. missing_track_stats picks out exactly those.
+    Ordering is off by default: ORDER BY makes MySQL sort the whole result before the first row can be streamed.
+    """
+    conditions, params = [], []
+    if start_utc is not None:
+        conditions.append(f"{partition_column} >= %s")
+        params.append(_to_naive_utc(start_utc))
+    if end_utc is not None:
+        conditions.append(f"{partition_column} < %s")
+        params.append(_to_naive_utc(end_utc))
+    for column_name, values in (("orig_sensor_id", orig_sensor_ids), ("orig_object_id", orig_object_ids), ("track_id", track_ids)):
+        if values is None:
+            continue
+        values = list(values)
+        if not values:
+            conditions.append("FALSE") # an empty IN () is a syntax error, and asking for nothing should return nothing
+            continue
+        conditions.append(f"{column_name} IN ({','.join(['%s']*len(values))})")
+        params.extend(values)
+    if sky_cell_ranges is not None:
+        ranges_sql, ranges_params = cell_ranges_sql(sky_cell_ranges)
+        conditions.append(ranges_sql)
+        params.extend(ranges_params)
+    for column_name, (low, high) in (stat_ranges or {}).items():
+        if column_name not in TRACK_STATS_COLUMNS:
+            raise ValueError(f"{column_name} isn't a derived stats column. Pick from {TRACK_STATS_COLUMNS}")
+        if low is not None:
+            conditions.append(f"{column_name} >= %s")
+            params.append(low)
+        if high is not None:
+            conditions.append(f"{column_name} <= %s")
+            params.append(high)
+    if missing_track_stats:
+        conditions.append("n_obs IS NULL") # written with every other stat, so it stands in for all of them
+
+    sql = f"SELECT {', '.join(columns)} FROM {table_name}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if order_by_partition_column:
+        sql += f" ORDER BY {partition_column}"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql + ";", tuple(params)
+
+
+def iter_row_chunks(mysql_connection, sql:str, params:tuple=(), fetch_size:int=DEFAULT_FETCH_SIZE) -> Iterator[List[tuple]]:
+    """
+    Streams the result with an unbuffered cursor, fetch_size rows at a time, so a day of tracks never sits in memory as
+    one result set. The connection can't run anything else until the generator is exhausted or closed.
+    """
+    cursor = mysql_connection.cursor(buffered=False)
+    finished = False
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield rows
+        finished = True
+    finally:
+        if not finished:
+            # Stopped early. The rest of the result is still on the wire and has to be drained before the cursor closes.
+            try:
+                mysql_connection.consume_results()
+            except Exception as e:
+                logger.warning(f"Couldn't drain the rest of an abandoned track query: {e}")
+        cursor.close()
+
+
+_MEDIAN_RA_INDEX = TRACK_READ_COLUMNS.index("median_ra_deg")
+_MEDIAN_DEC_INDEX = TRACK_READ_COLUMNS.index("median_dec_deg")
+
+def _rows_in_sky_region(rows:Sequence[Sequence], sky_region) -> np.ndarray:
+    ra_deg = np.fromiter((row[_MEDIAN_RA_INDEX] for row in rows), dtype=np.float64, count=len(rows))
+    dec_deg = np.fromiter((row[_MEDIAN_DEC_INDEX] for row in rows), dtype=np.float64, count=len(rows))
+    return sky_region.contains(ra_deg, dec_deg)
+
+
+class TrackReader:
+    """
+    Typical usage:
+    reader = TrackReader(mysql_connection, "my_table")
+    batch = reader.read_track_batch(start_utc=datetime(2025, 7, 1), end_utc=datetime(2025, 7, 2))
+    batch.ra_dec_deg[batch.obs_offsets[5]:batch.obs_offsets[6]] # track 5's ra/dec
+
+    Give it its own connection (see get_mysql_connection_object), not the one the scraper is writing with.
+    """
+    def __init__(self, mysql_connection, table_name:str, fetch_size:int=DEFAULT_FETCH_SIZE, track_cache:Optional[TrackCache]=None, partition_column:str=DEFAULT_PARTITION_COLUMN):
+        self.mysql_connection = mysql_connection
+        self.table_name = table_name
+        self.fetch_size = fetch_size
+        self.track_cache = track_cache if track_cache is not None else get_track_cache()
+        self.partition_column = partition_column
+
+    def _query(self, sky_region=None, **filters) -> Tuple[str, tuple]:
+        ranges = sky_cell_ranges(sky_region) if sky_region is not None else None
+        return build_track_query(self.table_name, partition_column=self.partition_column, sky_cell_ranges=ranges, **filters)
+
+    def iter_tracks(self, start_utc:Optional[datetime]=None, end_utc:Optional[datetime]=None, orig_sensor_ids:Optional[Sequence[str]]=None, orig_object_ids:Optional[Sequence[str]]=None, sky_region=None, stat_ranges:Optional[Dict[str, StatRange]]=None, limit:Optional[int]=None) -> Iterator[DecodedTrack]:
+        """
+        One DecodedTrack at a time. Tracks already in the cache aren't decoded again, and new ones are added to it.
+        sky_region (a SkyCone or SkyBox from helper_sky_cells) matches on the track's median RA/Dec. limit counts rows
+        before that exact check, so with a sky_region it can return fewer than limit tracks. stat_ranges is as in
+        build_track_query, and is answered from the stats columns without touching a blob.
+        """
+        sql, params = self._query(start_utc=start_utc, end_utc=end_utc, orig_sensor_ids=orig_sensor_ids, orig_object_ids=orig_object_ids, sky_region=sky_region, stat_ranges=stat_ranges, limit=limit)
+        for rows in iter_row_chunks(self.mysql_connection, sql, params, self.fetch_size):
+            _tracks_read_total.inc(len(rows))
+            with _read_decode_seconds.time():
+                if sky_region is not None:
+                    rows = [row for row, inside in zip(rows, _rows_in_sky_region(rows, sky_region)) if inside]
+                tracks = []
+                for row in rows:
+                    track = self.track_cache.get(row[0])
+                    if track is None:
+                        track = decode_track_row(row)
+                        self.track_cache.put(track)
+                    tracks.append(track)
+            yield from tracks
+
+    def iter_track_batches(self, start_utc:Optional[datetime]=None, end_utc:Optional[datetime]=None, orig_sensor_ids:Optional[Sequence[str]]=None, orig_object_ids:Optional[Sequence[str]]=None, sky_region=None, stat_ranges:Optional[Dict[str, StatRange]]=None, limit:Optional[int]=None) -> Iterator[ColumnarTrackBatch]:
+        """ One ColumnarTrackBatch per fetch_size rows (fewer with a sky_region). Bypasses the cache, this is the bulk path. """
+        sql, params = self._query(start_utc=start_utc, end_utc=end_utc, orig_sensor_ids=orig_sensor_ids, orig_object_ids=orig_object_ids, sky_region=sky_region, stat_ranges=stat_ranges, limit=limit)
+        for rows in iter_row_chunks(self.mysql_connection, sql, params, self.fetch_size):
+            _tracks_read_total.inc(len(rows))
+            with _read_decode_seconds.time():
+                if sky_region is not None:
+                    # Refine before decoding, so blobs of tracks that were only in the cover never get touched
+                    rows = [row for row, inside in zip(rows, _rows_in_sky_region(rows, sky_region)) if inside]
+                batch = ColumnarTrackBatch.from_rows(rows)
+            yield batch
+
+    def read_track_batch(self, start_utc:Optional[datetime]=None, end_utc:Optional[datetime]=None, orig_sensor_ids:Optional[Sequence[str]]=None, orig_object_ids:Optional[Sequence[str]]=None, sky_region=None, stat_ranges:Optional[Dict[str, StatRange]]=None, limit:Optional[int]=None) -> ColumnarTrackBatch:
+        """ Everything matching, as one ColumnarTrackBatch """
+        return ColumnarTrackBatch.concatenate(list(self.iter_track_batches(start_utc, end_utc, orig_sensor_ids, orig_object_ids, sky_region, stat_ranges, limit)))
+
+    def get_tracks(self, track_ids:Iterable[int]) -> Dict[int, DecodedTrack]:
+        """
+        Cache first, then one query per _MAX_IDS_PER_IN_CLAUSE misses. Ids that aren't in the table are left out of the result.
+        Lookups by track_id alone can't be pruned, so this checks every partition's primary key index.
+        """
+        found:Dict[int, DecodedTrack] = {}
+        missing = []
+        for track_id in dict.fromkeys(track_ids): # dedupe, keep order
+            track = self.track_cache.get(track_id)
+            if track is None:
+                missing.append(track_id)
+            else:
+                found[track_id] = track
+        for i in range(0, len(missing), _MAX_IDS_PER_IN_CLAUSE):
+            sql, params = self._query(track_ids=missing[i:i+_MAX_IDS_PER_IN_CLAUSE])
+            for rows in iter_row_chunks(self.mysql_connection, sql, params, self.fetch_size):
+                _tracks_read_total.inc(len(rows))
+                for row in rows:
+                    track = decode_track_row(row)
+                    self.track_cache.put(track)
+                    found[track.track_id] = track
+        return found
+
+    def explain_partitions(self, start_utc:Optional[datetime]=None, end_utc:Optional[datetime]=None, orig_sensor_ids:Optional[Sequence[str]]=None, orig_object_ids:Optional[Sequence[str]]=None, sky_region=None, stat_ranges:Optional[Dict[str, StatRange]]=None) -> List[str]:
+        """ The partitions MySQL will actually read for these filters, from EXPLAIN. Handy for checking pruning works. """
+        sql, params = self._query(start_utc=start_utc, end_utc=end_utc, orig_sensor_ids=orig_sensor_ids, orig_object_ids=orig_object_ids, sky_region=sky_region, stat_ranges=stat_ranges)
+        with self.mysql_connection.cursor() as cur:
+            cur.execute("EXPLAIN " + sql, params)
+            column_names = [d[0] for d in cur.description]
+            rows = cur.fetchall()
+        partitions_index = column_names.index("partitions")
+        return [name for row in rows if row[partitions_index] for name in row[partitions_index].split(",")]
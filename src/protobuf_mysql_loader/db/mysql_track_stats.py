@@ -0,0 +1,147 @@
+import argparse
+import logging
+import timeit
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from protobuf_mysql_loader.db.mysql_track_reader import ColumnarTrackBatch, build_track_query, iter_row_chunks, DEFAULT_PARTITION_COLUMN
+from protobuf_mysql_loader.db.mysql_creation import ensure_track_stats_columns
+from protobuf_mysql_loader.helper_api_2_mysql import TRACK_TABLE_SCHEMA
+from protobuf_mysql_loader.helper_track_stats import TrackStats, compute_track_stats, TRACK_STATS_COLUMNS
+from protobuf_mysql_loader.helper_sky_cells import sky_cell_ids
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry
+
+logger = logging.getLogger("main_logger")
+
+# Backfill of the derived stats columns (and the true medians and sky_cell that go with them) for rows written before
+# ingest computed them. Rows are read a window of the partition column at a time, so each query prunes to one or two
+# partitions, and decoded as a ColumnarTrackBatch. Their stats are computed in one vectorized pass per fetch, bulk inserted
+# into a temporary table and applied with a single UPDATE ... JOIN per fetch, which is far cheaper than one UPDATE per row.
+#
+# Only rows whose n_obs is still NULL are read (unless recompute), and every fetch commits, so it can be stopped at any
+# point and rerun to pick up where it left off. It reads on one connection and writes on another, and is safe to run next
+# to the live scraper, whose new rows already come with their stats.
+
+DEFAULT_STATS_BACKFILL_WINDOW_S = 6*60*60
+DEFAULT_STATS_BACKFILL_FETCH_SIZE = 5_000
+
+# Everything the backfill writes. Medians that come out NaN (every ob NaN) leave the old value alone.
+_UPDATED_COLUMNS:Tuple[str, ...] = ("median_ra_deg", "median_dec_deg", "median_mag", "sky_cell") + TRACK_STATS_COLUMNS
+_KEEP_OLD_VALUE_IF_NULL = ("median_ra_deg", "median_dec_deg", "median_mag", "sky_cell")
+_STAGING_COLUMN_TYPES = {column: TRACK_TABLE_SCHEMA.column_by_name[column].sql_type for column in ("track_id", "trackstart_utc") + _UPDATED_COLUMNS}
+
+_track_stats_backfilled_total = get_metrics_registry().counter("track_stats_backfilled_total", "Existing track rows given their derived stats by the backfill")
+
+
+def _staging_table_name(table_name:str) -> str:
+    return f"{table_name}_stats_staging"
+
+
+def _create_staging_table(mysql_connection, table_name:str) -> None:
+    # TEMPORARY: private to this connection and gone when it closes, so concurrent backfills can't collide
+    column_definitions = ", ".join(f"{column} {_STAGING_COLUMN_TYPES[column]} NULL" for column in _UPDATED_COLUMNS)
+    with mysql_connection.cursor() as cur:
+        cur.execute(f"""
+CREATE TEMPORARY TABLE IF NOT EXISTS {_staging_table_name(table_name)} (
+    track_id {_STAGING_COLUMN_TYPES["track_id"]} NOT NULL,
+    trackstart_utc {_STAGING_COLUMN_TYPES["trackstart_utc"]} NOT NULL,
+    {column_definitions},
+    PRIMARY KEY (track_id, trackstart_utc)
+);""")
+
+
+def track_stats_update_rows(batch:ColumnarTrackBatch) -> List[tuple]:
+    """ (track_id, trackstart_utc, *_UPDATED_COLUMNS) per track of the batch, ready for the staging table """
+    track_stats:TrackStats = compute_track_stats(batch.timestamps_us, batch.ra_dec_deg, batch.ra_dec_unc_deg, batch.mag, batch.obs_offsets)
+    finite = np.isfinite(track_stats.median_ra_deg) & np.isfinite(track_stats.median_dec_deg)
+    cells = [int(cell) if is_finite else None for cell, is_finite in zip(sky_cell_ids(track_stats.median_ra_deg, track_stats.median_dec_deg).tolist(), finite.tolist())]
+    stats_rows = track_stats.rows(_UPDATED_COLUMNS[:3] + TRACK_STATS_COLUMNS)
+    return [(track_id, moment, *stats_row[:3], cell, *stats_row[3:])
+            for track_id, moment, stats_row, cell in zip(batch.track_ids.tolist(), batch.trackstart_utc.tolist(), stats_rows, cells)]
+
+
+def _apply_update_rows(mysql_connection, table_name:str, update_rows:List[tuple]) -> None:
+    staging_table_name = _staging_table_name(table_name)
+    assignments = ", ".join(f"t.{column} = COALESCE(s.{column}, t.{column})" if column in _KEEP_OLD_VALUE_IF_NULL else f"t.{column} = s.{column}" for column in _UPDATED_COLUMNS)
+    with mysql_connection.cursor() as cur:
+        cur.execute(f"DELETE FROM {staging_table_name};")
+        cur.executemany(f"INSERT INTO {staging_table_name} (track_id, trackstart_utc, {', '.join(_UPDATED_COLUMNS)}) VALUES ({', '.join(['%s'] * (len(_UPDATED_COLUMNS) + 2))})", update_rows)
+        # Joining on trackstart_utc too means each row is looked up in its own partition only
+        cur.execute(f"UPDATE {table_name} t JOIN {staging_table_name} s ON t.track_id = s.track_id AND t.trackstart_utc = s.trackstart_utc SET {assignments};")
+    mysql_connection.commit()
+
+
+def _table_time_range(mysql_connection, table_name:str, partition_column:str) -> Tuple[Optional[datetime], Optional[datetime]]:
+    with mysql_connection.cursor() as cur:
+        cur.execute(f"SELECT MIN({partition_column}), MAX({partition_column}) FROM {table_name};")
+        return cur.fetchone()
+
+
+def backfill_track_stats(
+        read_connection,
+        write_connection,
+        table_name:str,
+        start_utc:Optional[datetime]=None,
+        end_utc:Optional[datetime]=None,
+        window_s:int=DEFAULT_STATS_BACKFILL_WINDOW_S,
+        fetch_size:int=DEFAULT_STATS_BACKFILL_FETCH_SIZE,
+        recompute:bool=False,
+        partition_column:str=DEFAULT_PARTITION_COLUMN,
+) -> int:
+    """
+    Fills the derived stats of every row in [start_utc, end_utc) that doesn't have them yet (all of them with recompute,
+    e.g. after a change to helper_track_stats). The range defaults to the whole table. Returns the number of rows updated.
+    read_connection and write_connection must be different connections: the read streams while the writes commit.
+    """
+    ensure_track_stats_columns(table_name, write_connection, partition_column=partition_column)
+    _create_staging_table(write_connection, table_name)
+    if start_utc is None or end_utc is None:
+        table_start_utc, table_end_utc = _table_time_range(read_connection, table_name, partition_column)
+        if table_start_utc is None:
+            logger.info(f"{table_name} is empty, no track stats to backfill.")
+            return 0
+        start_utc = start_utc or table_start_utc
+        end_utc = end_utc or table_end_utc + timedelta(microseconds=1) # end is exclusive
+
+    start_time = timeit.default_timer()
+    num_rows = 0
+    window_start_utc = start_utc
+    while window_start_utc < end_utc:
+        window_end_utc = min(window_start_utc + timedelta(seconds=window_s), end_utc)
+        sql, params = build_track_query(table_name, start_utc=window_start_utc, end_utc=window_end_utc, missing_track_stats=not recompute, partition_column=partition_column)
+        num_window_rows = 0
+        for rows in iter_row_chunks(read_connection, sql, params, fetch_size):
+            _apply_update_rows(write_connection, table_name, track_stats_update_rows(ColumnarTrackBatch.from_rows(rows)))
+            num_window_rows += len(rows)
+            _track_stats_backfilled_total.inc(len(rows))
+        num_rows += num_window_rows
+        logger.info(f"Track stats backfill of {table_name} [{window_start_utc}, {window_end_utc}): {num_window_rows} rows ({num_rows} so far, {timeit.default_timer()-start_time:.0f}s)")
+        window_start_utc = window_end_utc
+    return num_rows
+
+
+def _parse_utc(value:str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed.tzinfo else parsed # naive UTC, like the table
+
+
+if __name__ == "__main__":
+    from protobuf_mysql_loader.db.mysql_utils import get_mysql_connection_object
+    parser = argparse.ArgumentParser(description="Fill the derived per-track stats columns (and true medians) for rows written before ingest computed them. Safe to stop and rerun.")
+    parser.add_argument("table_name")
+    parser.add_argument("--start", type=_parse_utc, default=None, help="UTC, ISO 8601. Defaults to the oldest row.")
+    parser.add_argument("--end", type=_parse_utc, default=None, help="UTC, ISO 8601 (exclusive). Defaults to just past the newest row.")
+    parser.add_argument("--window-hours", type=float, default=DEFAULT_STATS_BACKFILL_WINDOW_S / 3600)
+    parser.add_argument("--fetch-size", type=int, default=DEFAULT_STATS_BACKFILL_FETCH_SIZE, help="rows per read, stats pass and UPDATE")
+    parser.add_argument("--recompute", action="store_true", help="redo rows that already have stats too")
+    args = parser.parse_args()
+
+    read_connection, write_connection = get_mysql_connection_object(), get_mysql_connection_object()
+    try:
+        num_rows = backfill_track_stats(read_connection, write_connection, args.table_name, start_utc=args.start, end_utc=args.end, window_s=int(args.window_hours*3600), fetch_size=args.fetch_size, recompute=args.recompute)
+        print(f"Backfilled derived stats for {num_rows} rows of {args.table_name}")
+    finally:
+        read_connection.close()
+        write_connection.close()
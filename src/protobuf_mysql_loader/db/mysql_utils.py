@@ -1,34 +1,168 @@
-from typing import List, Tuple
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from typing import List, Tuple, Callable, Optional
 
 import mysql.connector
 from mysql.connector import Error
 
+from protobuf_mysql_loader.db.mysql_insert_engine import forget_insert_engines_for
+
+logger = logging.getLogger("main_logger")
+
 
 def get_mysql_connection_object(
         host:str='localhost',
         user:str='root',
         password:str='password',
         database:str='some_database',
+        allow_local_infile:bool=False, # needed for the "load_data" track writer
     ):
     return mysql.connector.connect(
         host=host,
         user=user,
         password=password,
         database=database,
+        allow_local_infile=allow_local_infile,
+        time_zone='+00:00', # naive datetimes here are UTC, and the track table's TIMESTAMP columns convert through the session zone
     )
 
 
-def check_on_mysql_connection(mysql_connection):
+def check_on_mysql_connection(mysql_connection, allow_local_infile:Optional[bool]=None):
+    """
+    Returns the connection to keep using. That's a brand new one if the old one couldn't be revived, so callers must reassign.
+    The new one gets the old one's allow_local_infile unless told otherwise, so the "load_data" writer keeps working.
+    """
+    if allow_local_infile is None:
+        allow_local_infile = bool(getattr(mysql_connection, "_allow_local_infile", False))
     try:
         # if connection is lost, ping will raise an error
         mysql_connection.ping(reconnect=True, attempts=5, delay=60)
     except Error as e:
-        print("DB error:", e)
+        logger.error(f"MySQL connection lost and didn't come back on ping ({e}). Opening a new one.")
+        try:
+            mysql_connection = get_mysql_connection_object(allow_local_infile=allow_local_infile)
+        except Error as reconnect_error:
+            logger.error(f"Reconnect failed: {reconnect_error}")
+    return mysql_connection
+
+
+class MySQLConnectionPool:
+    """
+    Fixed-size pool of connections made with get_mysql_connection_object(**connection_kwargs).
+    Connections are opened lazily, pinged before reuse if they've sat idle longer than health_check_interval_s, and dead
+    ones are closed and replaced transparently. Use it as:
+        with pool.connection() as mysql_connection:
+            ...
+    """
+    def __init__(self, pool_size:int=4, health_check_interval_s:float=30, **connection_kwargs):
+        self.pool_size = pool_size
+        self.health_check_interval_s = health_check_interval_s
+        self._connection_kwargs = connection_kwargs
+        self._idle = queue.LifoQueue() # LIFO so the warmest connections get reused and the rest can go stale quietly
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._all_connections = []
+
+    def _open_connection(self):
+        mysql_connection = get_mysql_connection_object(**self._connection_kwargs)
+        with self._lock:
+            self._all_connections.append(mysql_connection)
+        return mysql_connection
+
+    def _discard(self, mysql_connection) -> None:
+        forget_insert_engines_for(mysql_connection) # its cached prepared statements die with it
+        with self._lock:
+            if mysql_connection in self._all_connections:
+                self._all_connections.remove(mysql_connection)
+        try:
+            mysql_connection.close()
+        except Error:
+            pass
+
+    def _is_healthy(self, mysql_connection) -> bool:
+        try:
+            mysql_connection.ping(reconnect=False)
+            return True
+        except Error as e:
+            logger.warning(f"Pooled MySQL connection failed its health check ({e}). Replacing it.")
+            return False
+
+    def _checkout(self):
+        try:
+            mysql_connection, last_returned_s = self._idle.get_nowait()
+        except queue.Empty:
+            return self._open_connection()
+        if time.monotonic() - last_returned_s > self.health_check_interval_s and not self._is_healthy(mysql_connection):
+            self._discard(mysql_connection)
+            return self._open_connection()
+        return mysql_connection
+
+    @contextmanager
+    def connection(self, timeout:float=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No MySQL connection became free within {timeout}s (pool size {self.pool_size})")
+        try:
+            mysql_connection = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        healthy = True
         try:
-            mysql_connection = get_mysql_connection_object()
-        except Error as reconnect_eror:
-            print("Reconnect failed:", reconnect_eror)
-    return None
+            yield mysql_connection
+        except BaseException:
+            # Whatever went wrong (a MySQL error, a bad value while encoding, Ctrl-C), don't hand the next user a
+            # half-done transaction. If it can't be rolled back, the connection isn't reused.
+            try:
+                healthy = mysql_connection.is_connected()
+                if healthy:
+                    mysql_connection.rollback()
+            except Exception as rollback_error:
+                logger.warning(f"Rolling back a pooled MySQL connection failed ({rollback_error}). Replacing it.")
+                healthy = False
+            raise
+        finally:
+            if healthy:
+                self._idle.put((mysql_connection, time.monotonic()))
+            else:
+                self._discard(mysql_connection)
+            self._slots.release()
+
+    def close_all(self) -> None:
+        with self._lock:
+            connections = list(self._all_connections)
+        for mysql_connection in connections:
+            self._discard(mysql_connection)
+        self._idle = queue.LifoQueue()
+
+
+class ParallelBatchWriter:
+    """
+    Commits independent batches concurrently, each on its own pooled connection, so ingest is bound by what the server can
+    write rather than one socket's round trips. write_function gets the connection as its mysql_connection keyword argument.
+    """
+    def __init__(self, mysql_pool:MySQLConnectionPool, num_writers:int):
+        self.mysql_pool = mysql_pool
+        self.num_writers = num_writers
+        self._executor = ThreadPoolExecutor(max_workers=num_writers, thread_name_prefix="mysql-writer")
+
+    def _write_on_pooled_connection(self, write_function:Callable, *args, **kwargs):
+        with self.mysql_pool.connection() as mysql_connection:
+            return write_function(*args, mysql_connection=mysql_connection, **kwargs)
+
+    def submit(self, write_function:Callable, *args, **kwargs) -> Future:
+        return self._executor.submit(self._write_on_pooled_connection, write_function, *args, **kwargs)
+
+    def write_all(self, write_function:Callable, list_of_args:List[Tuple], **kwargs) -> List:
+        """ Submits write_function(*args) for each args tuple and waits for every one. Re-raises the first failure. """
+        futures = [self.submit(write_function, *args, **kwargs) for args in list_of_args]
+        return [future.result() for future in futures]
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
 
 
 def execute_single_sql_statement_returning_results(mysql_connection, sql_command:str):
@@ -43,7 +177,7 @@ def execute_single_sql_statement_returning_results(mysql_connection, sql_command
     return results
 
 
-def execute_many_returning_nothing(mysql_connection, sql_query_with_placeholders:str, list_of_tuple_records:List[Tuple]):
+def execute_many_returning_nothing(mysql_connection, sql_query_with_placeholders:str, list_of_tuple_records:List[Tuple], before_commit:Optional[Callable]=None):
     """
     Typical usage:
     sql_query_with_placeholders = f"INSERT INTO {table_name} ( {','.join([c for c in TABLE_COLUMNS])} ) VALUES ( {','.join(['%s']*len(TABLE_COLUMNS))} );"
@@ -51,10 +185,14 @@ def execute_many_returning_nothing(mysql_connection, sql_query_with_placeholders
     list_of_tuple_records = [ (val11, val12, val13), (val21, val22, val23), (val31, val32, val33) ]
 
     could probably make a more useful function here by having function parameters for TABLE_COLUMNS and doing this logic for them!
+
+    before_commit(mysql_connection) runs inside the same transaction, e.g. to write the token checkpoint alongside the rows.
     
     """
     
     with mysql_connection.cursor() as cur:
         cur.executemany(sql_query_with_placeholders, list_of_tuple_records)
+    if before_commit is not None:
+        before_commit(mysql_connection)
     mysql_connection.commit()
     return None
\ No newline at end of file
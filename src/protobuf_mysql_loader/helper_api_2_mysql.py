@@ -1,14 +1,25 @@
 import struct
+import hashlib
+import numpy as np
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from uuid import uuid4
-from typing import List, Optional
+from typing import Callable, List, Optional, Sequence, Tuple
 from enum import Enum
 
+from protobuf_mysql_loader.helper_timestamps import zulu_iso8601_batch_to_us, us_to_naive_utc_datetime
+from protobuf_mysql_loader.helper_sky_cells import sky_cell_id
+from protobuf_mysql_loader.helper_track_stats import TrackStats, compute_track_stats, TRACK_STATS_COLUMNS
+from protobuf_mysql_loader.helper_table_schema import TableSchema, column, KIND_STRING, KIND_BOOL, KIND_UINT64, KIND_NULLABLE_UINT64, KIND_FLOAT, KIND_NULLABLE_FLOAT, KIND_DATETIME, KIND_BLOB
+from protobuf_mysql_loader.helper_blob_codec import BlobCodec, encode_blob, decode_blob, is_encoded_blob, RAW_BLOB_CODEC, CODEC_DELTA_VARINT, CODEC_QUANTIZED_DELTA_VARINT
+
 UTC_STRFTIME_STRING_SAFE_FOR_MYSQL = "%Y-%m-%d %H:%M:%S.%f"
 # __UTC_STRFTIME_STRING = "%Y-%m-%dT%H:%M:%S.%f%z" # Mysql can't handle T or Z
 
 def datetime_to_us(dt: datetime) -> int:
+    # Naive datetimes in this project are UTC (see us_to_zulu). dt.timestamp() alone would read them as local time.
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
     return int(dt.timestamp() * 1_000_000)
 
 def us_to_zulu(micro_time:int) -> str:
@@ -28,6 +39,9 @@ def pack_list_of_values_as_little_endian_bytes(values:List, dtype:ObDataType) ->
     return struct.pack(f"<{len(values)}{dtype.value}", *values)
 
 def unpack_little_endian_bytes_to_values(blob:bytes, dtype:ObDataType) -> List:
+    # Encoded blobs (see helper_blob_codec.py) carry their own header. Multi-component ones come back interleaved, same as raw.
+    if is_encoded_blob(blob):
+        return decode_blob(blob, dtype.value).ravel().tolist()
     item_size = struct.calcsize(dtype.value)
     count = len(blob) // item_size
     return list(struct.unpack(f"<{count}{dtype.value}", blob))
@@ -76,96 +90,249 @@ class Observation:
 
 @dataclass
 class MySQLRecord:
+    # The one specification of the track table: every field is a column, and helper_table_schema.TableSchema derives the
+    # CREATE TABLE, the insert column order, the INSERT template and the RecordBatch layout from these column() calls.
+    # The time columns are TIMESTAMP(6) because partitioning on UNIX_TIMESTAMP() needs that type. Connections run with
+    # time_zone '+00:00' (see get_mysql_connection_object), so the naive UTC datetimes go in and come out unshifted.
+
     # Categorical data about the track. Ref Frame is given to us in ECEF.
-    track_id:Optional[int]  # auto-incrementing integer added by the mysql db. Keep this exposed here so we can load from tables into this data structure.
-    id_on_orbit:str         # Usually blank for . Unique ID of the satellite being observed. orig_sensor_id contains this info. If UCT, this could be an internal identifier rather than an official one.
-    id_sensor:str           # Usually blank for . Unique ID of the sensor. orig_sensor_id contains this info.
-    sat_no: str             # Satellite/Catalog number of the target on-orbit object if correlated.
-    orig_object_id:str      # Detected object. Sometimes NORAD sometimes internal (if starlink) If they give something like satellite34366 it means starlink-34366 (We shouldn't rename it!)
-    orig_sensor_id: str     # Something like sdfsdf-11269-4 
-    uct: bool               # if True then either didn't try to correlate the track or couldn't.
+    track_id:Optional[int] = column("BIGINT UNSIGNED", KIND_UINT64, auto_increment=True) # auto-incrementing integer added by the mysql db. Keep this exposed here so we can load from tables into this data structure.
+    id_on_orbit:str = column("VARCHAR(64)", KIND_STRING)    # Usually blank for . Unique ID of the satellite being observed. orig_sensor_id contains this info. If UCT, this could be an internal identifier rather than an official one.
+    id_sensor:str = column("VARCHAR(64)", KIND_STRING)      # Usually blank for . Unique ID of the sensor. orig_sensor_id contains this info.
+    sat_no:str = column("VARCHAR(16)", KIND_STRING)         # Satellite/Catalog number of the target on-orbit object if correlated.
+    orig_object_id:str = column("VARCHAR(64)", KIND_STRING) # Detected object. Sometimes NORAD sometimes internal (if starlink) If they give something like satellite34366 it means starlink-34366 (We shouldn't rename it!)
+    orig_sensor_id:str = column("VARCHAR(64)", KIND_STRING) # Something like sdfsdf-11269-4 
+    uct:bool = column("BOOLEAN", KIND_BOOL)                 # if True then either didn't try to correlate the track or couldn't.
+    track_fingerprint:int = column("BIGINT UNSIGNED", KIND_UINT64, nullable=True, index_name="uq_track_fingerprint", unique=True) # u64 hash of (orig_sensor_id, orig_object_id, trackstart us, n_obs). Same track replayed -> same value. NULL only on rows from before it existed.
     
     # Timestamps. These come to us as ISO 8601 UTC with microsecond precision. #NOTE: right of this comment is old: we convert them to Unix Timestamps (microseconds since 1970) e.g. 1751915752503105
-    trackstart_utc: int          # The earliest timestamp in the track
-    trackend_utc: int            # The latest timestamp in the track
-    median_timestamp_utc: int    # The middle timestamp in the track
-    rx_time_utc: int             # The time MITLL uploaded the record to the mysql database
+    trackstart_utc:int = column("TIMESTAMP(6)", KIND_DATETIME)       # The earliest timestamp in the track. The partition column.
+    trackend_utc:int = column("TIMESTAMP(6)", KIND_DATETIME)         # The latest timestamp in the track
+    median_timestamp_utc:int = column("TIMESTAMP(6)", KIND_DATETIME) # The middle ob's timestamp
+    rx_time_utc:int = column("DATETIME(6)", KIND_STRING)             # The time MITLL uploaded the record to the mysql database. Written as a local-time string, so not a TIMESTAMP.
     
     # Summary Stats. Really what we're calling itrf are ECEF values given to us by SpaceX. RA/Dec are J2000.
-    median_ra_deg: float    # [0 and 360]
-    median_dec_deg: float   # [-90,90]
-    median_senx_itrf_km: float # e.g. 4040300.0
-    median_seny_itrf_km: float # e.g. -3428865.8
-    median_senz_itrf_km: float # e.g. -4479361.5
-    median_mag: float       # Usually between -0.5 and 9 e.g. 3.34
+    median_ra_deg:float = column("DOUBLE", KIND_FLOAT)  # [0 and 360]. True median over the obs (RA unwrapped first, so tracks across 0h are fine)
+    median_dec_deg:float = column("DOUBLE", KIND_FLOAT) # [-90,90]. True median over the obs
+    sky_cell:Optional[int] = column("BIGINT UNSIGNED", KIND_NULLABLE_UINT64, nullable=True, index_name="idx_sky_cell") # nested sky cell of (median_ra_deg, median_dec_deg), see helper_sky_cells.py. Indexed for cone/box queries.
+    median_senx_itrf_km:float = column("DOUBLE", KIND_FLOAT) # e.g. 4040300.0. The sensor position at the middle ob, like median_timestamp_utc
+    median_seny_itrf_km:float = column("DOUBLE", KIND_FLOAT) # e.g. -3428865.8
+    median_senz_itrf_km:float = column("DOUBLE", KIND_FLOAT) # e.g. -4479361.5
+    median_mag:float = column("DOUBLE", KIND_FLOAT)          # Usually between -0.5 and 9 e.g. 3.34. True median over the obs, NaN mags ignored
     
     # BLOBS (Binary Large OBjectS). These are encoded and decoded (little-endian) without delimiters so knowing the datatype of the underlying data is crucial!
-    timestamp_us_blob: bytes         # u64 ints representing the unix timestamps in microseconds
-    ra_and_dec_deg_blob: bytes       # f64
-    ra_and_dec_unc_deg_blob: bytes   # f32, allegedly 1 sigma uncertainty
-    sen_pos_xyz_itrf_km_blob: bytes  # f32, but three-times as many values as some other blobs since we have x,y,z 
-    sen_vel_xyz_itrf_kms_blob: bytes # f32, but three-times as many values as some other blobs since we have x,y,z 
-    mag_blob: bytes                  # f32
-    
+    # MEDIUMBLOB because a plain BLOB tops out at 64 KiB, i.e. ~5k obs of sensor positions.
+    timestamp_us_blob:bytes = column("MEDIUMBLOB", KIND_BLOB)         # u64 ints representing the unix timestamps in microseconds
+    ra_and_dec_deg_blob:bytes = column("MEDIUMBLOB", KIND_BLOB)       # f64
+    ra_and_dec_unc_deg_blob:bytes = column("MEDIUMBLOB", KIND_BLOB)   # f32, allegedly 1 sigma uncertainty
+    sen_pos_xyz_itrf_km_blob:bytes = column("MEDIUMBLOB", KIND_BLOB)  # f32, but three-times as many values as some other blobs since we have x,y,z 
+    sen_vel_xyz_itrf_kms_blob:bytes = column("MEDIUMBLOB", KIND_BLOB) # f32, but three-times as many values as some other blobs since we have x,y,z 
+    mag_blob:bytes = column("MEDIUMBLOB", KIND_BLOB)                  # f32
 
-def mysqlify_track(sx_api_track):
-    # Cast raw data into usable structures
-    distilled_observations:List[Observation] = [Observation.from_proto(ob) for ob in sx_api_track.udl_observation_data]
-    n_obs = len(distilled_observations)
+    # Derived per-track stats (see helper_track_stats.py), so screening queries never have to decode the blobs. NULL
+    # where undefined, e.g. no rate for a one-ob track, and on rows from before the columns existed until backfilled.
+    # Mags and uncertainties come off f32 blobs, so FLOAT loses nothing.
+    n_obs:Optional[int] = column("INT UNSIGNED", KIND_UINT64, nullable=True, default=None)
+    duration_s:Optional[float] = column("DOUBLE", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+    ra_rate_deg_per_s:Optional[float] = column("DOUBLE", KIND_NULLABLE_FLOAT, nullable=True, default=None) # on-sky, i.e. dRA/dt * cos(dec), from a least-squares line
+    dec_rate_deg_per_s:Optional[float] = column("DOUBLE", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+    angular_rate_deg_per_s:Optional[float] = column("DOUBLE", KIND_NULLABLE_FLOAT, nullable=True, index_name="idx_angular_rate", default=None)
+    rate_fit_rms_arcsec:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, default=None) # on-sky RMS residual of that line. Large for curving tracks or outlier obs.
+    mag_min:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, index_name="idx_mag_min", default=None)
+    mag_max:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+    mag_mean:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+    ra_unc_min_deg:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+    ra_unc_max_deg:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+    ra_unc_mean_deg:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+    dec_unc_min_deg:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+    dec_unc_max_deg:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+    dec_unc_mean_deg:Optional[float] = column("FLOAT", KIND_NULLABLE_FLOAT, nullable=True, default=None)
+
+
+TRACK_TABLE_SCHEMA = TableSchema(MySQLRecord, partition_column="trackstart_utc")
+
+# Column order used when inserting. track_id is assigned by MySQL so it's never pushed.
+MYSQL_RECORD_INSERT_COLUMNS:Tuple[str, ...] = TRACK_TABLE_SCHEMA.insert_columns
+mysql_record_to_insert_tuple:Callable[[MySQLRecord], Tuple] = TRACK_TABLE_SCHEMA.record_to_insert_tuple # operator.attrgetter, one C call per record
+
+TRACK_FINGERPRINT_INSERT_INDEX = MYSQL_RECORD_INSERT_COLUMNS.index("track_fingerprint")
+TRACKSTART_UTC_INSERT_INDEX = MYSQL_RECORD_INSERT_COLUMNS.index("trackstart_utc")
+TRACKEND_UTC_INSERT_INDEX = MYSQL_RECORD_INSERT_COLUMNS.index("trackend_utc")
+assert MYSQL_RECORD_INSERT_COLUMNS[-len(TRACK_STATS_COLUMNS):] == TRACK_STATS_COLUMNS, "the derived stats go last, in TRACK_STATS_COLUMNS order"
+# DATETIME columns in the table. Inside a RecordBatch (and in track_insert_values) they're epoch us ints until a tuple is built.
+DATETIME_INSERT_COLUMNS:Tuple[str, ...] = tuple(name for name, kind in TRACK_TABLE_SCHEMA.insert_column_kinds.items() if kind == KIND_DATETIME)
+DATETIME_INSERT_INDICES:Tuple[int, ...] = tuple(MYSQL_RECORD_INSERT_COLUMNS.index(column) for column in DATETIME_INSERT_COLUMNS)
+
+
+def compute_track_fingerprint(orig_sensor_id:str, orig_object_id:str, trackstart_us:int, n_obs:int) -> int:
+    # 8 bytes is plenty to tell tracks apart and fits a BIGINT UNSIGNED column
+    key = f"{orig_sensor_id}|{orig_object_id}|{trackstart_us}|{n_obs}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+# Column layout of the per-ob float matrix built by columnize_track. One row per ob, filled with a single tuple assignment.
+_RA, _DEC, _RA_UNC, _DEC_UNC = 0, 1, 2, 3
+_SENX, _SENY, _SENZ = 4, 5, 6
+_SENVELX, _SENVELY, _SENVELZ = 7, 8, 9
+_MAG = 10
+_NUM_FLOAT_FIELDS_PER_OB = 11
+
+
+# How each blob column is written. Everything defaults to the bare little-endian layout, so rows stay readable by any
+# existing np.frombuffer/struct reader. Encoded blobs are self-describing, so switching a column over (e.g. to
+# COMPACT_BLOB_CODEC_BY_COLUMN's, where lossless delta varints shrink the timestamps ~2.5x) only needs readers that go
+# through decode_blob. Changes here must be made before the decode workers start.
+BLOB_CODEC_BY_COLUMN = {
+    "timestamp_us_blob":         RAW_BLOB_CODEC,
+    "ra_and_dec_deg_blob":       RAW_BLOB_CODEC,
+    "ra_and_dec_unc_deg_blob":   RAW_BLOB_CODEC,
+    "sen_pos_xyz_itrf_km_blob":  RAW_BLOB_CODEC,
+    "sen_vel_xyz_itrf_kms_blob": RAW_BLOB_CODEC,
+    "mag_blob":                  RAW_BLOB_CODEC,
+}
+# A ready-made smaller (lossy) setup. Steps are well under each column's measurement uncertainty. Quantized codecs
+# refuse NaN, so columns where NaN is a normal value (missing mags and uncertainties) stay raw.
+COMPACT_BLOB_CODEC_BY_COLUMN = {
+    "timestamp_us_blob":         BlobCodec(CODEC_DELTA_VARINT),
+    "ra_and_dec_deg_blob":       BlobCodec(CODEC_QUANTIZED_DELTA_VARINT, quantization_step=1e-9), # ~4 micro-arcsec
+    "ra_and_dec_unc_deg_blob":   RAW_BLOB_CODEC,
+    "sen_pos_xyz_itrf_km_blob":  BlobCodec(CODEC_QUANTIZED_DELTA_VARINT, quantization_step=1e-4), # 10 cm
+    "sen_vel_xyz_itrf_kms_blob": BlobCodec(CODEC_QUANTIZED_DELTA_VARINT, quantization_step=1e-7), # 0.1 mm/s
+    "mag_blob":                  RAW_BLOB_CODEC,
+}
+
+
+@dataclass
+class TrackColumns:
+    # Typed NumPy arrays with one row per ob. dtypes match the blob layouts that unpack_little_endian_bytes_to_values expects.
+    timestamps_us: np.ndarray   # (n_obs,)   little-endian u64
+    ra_dec_deg: np.ndarray      # (n_obs, 2) little-endian f64, ra then dec so tobytes() interleaves them
+    ra_dec_unc_deg: np.ndarray  # (n_obs, 2) little-endian f32
+    sen_pos_xyz_itrf_km: np.ndarray  # (n_obs, 3) little-endian f32
+    sen_vel_xyz_itrf_kms: np.ndarray # (n_obs, 3) little-endian f32
+    mag: np.ndarray             # (n_obs,)   little-endian f32
+
+    @property
+    def n_obs(self) -> int:
+        return len(self.timestamps_us)
+
+
+def columnize_track(sx_api_track) -> TrackColumns:
+    """
+    Walks the obs of a track exactly once, dropping each ob's numeric fields straight into preallocated NumPy arrays.
+    Replaces building an Observation per ob and then re-walking that list once per blob.
+    """
+    obs = sx_api_track.udl_observation_data
+    n_obs = len(obs)
+    ob_times = [""] * n_obs
+    float_values = np.empty((n_obs, _NUM_FLOAT_FIELDS_PER_OB), dtype=np.float64)
+    for i, ob in enumerate(obs):
+        ob_times[i] = ob.ob_time.value
+        float_values[i] = (
+            ob.ra.value, ob.declination.value, ob.ra_unc.value, ob.declination_unc.value,
+            ob.senx.value, ob.seny.value, ob.senz.value,
+            ob.senvelx.value, ob.senvely.value, ob.senvelz.value,
+            ob.mag.value,
+        )
+
+    return TrackColumns(
+        timestamps_us = zulu_iso8601_batch_to_us(ob_times), # UTC epoch us, no per-ob datetime objects
+        ra_dec_deg = float_values[:, _RA:_DEC+1].astype("<f8"),
+        ra_dec_unc_deg = float_values[:, _RA_UNC:_DEC_UNC+1].astype("<f4"),
+        sen_pos_xyz_itrf_km = float_values[:, _SENX:_SENZ+1].astype("<f4"),
+        sen_vel_xyz_itrf_kms = float_values[:, _SENVELX:_SENVELZ+1].astype("<f4"),
+        mag = float_values[:, _MAG].astype("<f4"),
+    )
+
+
+def compute_track_stats_of_columns(columns_per_track:Sequence[TrackColumns]) -> TrackStats:
+    """ compute_track_stats over many tracks' TrackColumns, concatenated so it's one vectorized pass for all of them """
+    if not columns_per_track:
+        return compute_track_stats(np.empty(0, dtype="<u8"), np.empty((0, 2)), np.empty((0, 2)), np.empty(0), np.zeros(1, dtype=np.int64))
+    obs_offsets = np.zeros(len(columns_per_track) + 1, dtype=np.int64)
+    np.cumsum([columns.n_obs for columns in columns_per_track], out=obs_offsets[1:])
+    return compute_track_stats(
+        np.concatenate([columns.timestamps_us for columns in columns_per_track]),
+        np.concatenate([columns.ra_dec_deg for columns in columns_per_track]),
+        np.concatenate([columns.ra_dec_unc_deg for columns in columns_per_track]),
+        np.concatenate([columns.mag for columns in columns_per_track]),
+        obs_offsets,
+    )
+
+
+def tracks_insert_values(sx_api_tracks:Sequence, rx_time_utc:Optional[str]=None) -> List[Tuple]:
+    """
+    Each track's values in MYSQL_RECORD_INSERT_COLUMNS order, except the DATETIME_INSERT_COLUMNS are still epoch us ints.
+    That's what RecordBatchBuilder stores (see helper_record_batch.py). mysqlify_track turns them into datetimes.
+    The medians and derived stats are computed for all the tracks at once, so pass a whole chunk rather than one at a time.
+    """
+    if rx_time_utc is None:
+        rx_time_utc = datetime.now().strftime(UTC_STRFTIME_STRING_SAFE_FOR_MYSQL) # supposed to be the time the database received the data... so this is close enough for jazz
+    columns_per_track = [columnize_track(sx_api_track) for sx_api_track in sx_api_tracks]
+    track_stats = compute_track_stats_of_columns(columns_per_track)
+    median_rows = track_stats.rows(("median_ra_deg", "median_dec_deg", "median_mag"))
+    stats_rows = track_stats.rows(TRACK_STATS_COLUMNS)
+    return [_track_insert_values(sx_api_track, columns, medians, stats, rx_time_utc)
+            for sx_api_track, columns, medians, stats in zip(sx_api_tracks, columns_per_track, median_rows, stats_rows)]
+
+
+def track_insert_values(sx_api_track, rx_time_utc:Optional[str]=None) -> Tuple:
+    """ tracks_insert_values for a single track """
+    return tracks_insert_values([sx_api_track], rx_time_utc)[0]
+
+
+def _track_insert_values(sx_api_track, columns:TrackColumns, medians:Tuple, stats:Tuple, rx_time_utc:str) -> Tuple:
+    obs = sx_api_track.udl_observation_data
+    n_obs = len(obs)
     assert n_obs > 0 # each track should have obs...
     
     # get track-level data from one of the obs
-    id_on_orbit = distilled_observations[0].id_on_orbit # DON'T RENAME "satellite" to "Starlink". Keep it as is!
-    id_sensor = distilled_observations[0].id_sensor
-    sat_no = distilled_observations[0].sat_no
-    orig_object_id = distilled_observations[0].orig_object_id
-    orig_sensor_id = distilled_observations[0].orig_sensor_id
-    uct = distilled_observations[0].uct
+    first_ob, middle_ob = obs[0], obs[n_obs//2]
+    id_on_orbit = str(first_ob.id_on_orbit.value) # DON'T RENAME "satellite" to "Starlink". Keep it as is!
+    id_sensor = str(first_ob.id_sensor.value)
+    sat_no = str(first_ob.sat_no.value)
+    orig_object_id = str(first_ob.orig_object_id.value)
+    orig_sensor_id = str(first_ob.orig_sensor_id.value)
+    uct = bool(first_ob.uct.value)
+    track_fingerprint = compute_track_fingerprint(orig_sensor_id, orig_object_id, int(columns.timestamps_us[0]), n_obs)
     
-    trackstart_utc = distilled_observations[0].obtime
-    trackend_utc = distilled_observations[-1].obtime
-    median_timestamp_utc = distilled_observations[n_obs//2].obtime
-    rx_time_utc = datetime.now().strftime(UTC_STRFTIME_STRING_SAFE_FOR_MYSQL) # supposed to be the time the database received the data... so this is close enough for jazz
+    trackstart_us = int(columns.timestamps_us[0])
+    trackend_us = int(columns.timestamps_us[-1])
+    median_timestamp_us = int(columns.timestamps_us[n_obs//2])
     
-    median_ra_deg = distilled_observations[n_obs//2].ra
-    median_dec_deg = distilled_observations[n_obs//2].dec
-    median_senx_itrf_km = distilled_observations[n_obs//2].pitrf[0] # 0 is x coord
-    median_seny_itrf_km = distilled_observations[n_obs//2].pitrf[1] # 1 is y coord
-    median_senz_itrf_km = distilled_observations[n_obs//2].pitrf[2] # 2 is z coord
-    median_mag = distilled_observations[n_obs//2].mag
+    median_ra_deg, median_dec_deg, median_mag = medians
+    if median_ra_deg is None or median_dec_deg is None: # NaN coordinates in every ob. Keep the middle ob's, as before.
+        median_ra_deg, median_dec_deg = float(columns.ra_dec_deg[n_obs//2, 0]), float(columns.ra_dec_deg[n_obs//2, 1])
+    if median_mag is None:
+        median_mag = float(middle_ob.mag.value)
+    sky_cell = sky_cell_id(median_ra_deg, median_dec_deg)
+    median_senx_itrf_km = float(middle_ob.senx.value) # kept at full precision, the blob is only f32
+    median_seny_itrf_km = float(middle_ob.seny.value)
+    median_senz_itrf_km = float(middle_ob.senz.value)
     
-    timestamp_us_blob         = pack_list_of_values_as_little_endian_bytes([datetime_to_us(o.obtime) for o in distilled_observations], ObDataType.U64)
-    ra_and_dec_deg_blob       = pack_list_of_values_as_little_endian_bytes([ra_or_dec for ra_dec_pair in zip([o.ra for o in distilled_observations], [o.dec for o in distilled_observations]) for ra_or_dec in ra_dec_pair], ObDataType.F64) # sexy one liner sorry for anyone else who has to read this (or my future self) 
-    ra_and_dec_unc_deg_blob   = pack_list_of_values_as_little_endian_bytes([ra_or_dec_unc for ra_dec_unc_pair in zip([o.ra_unc for o in distilled_observations], [o.dec_unc for o in distilled_observations]) for ra_or_dec_unc in ra_dec_unc_pair], ObDataType.F32) # same apologies as above
-    sen_pos_xyz_itrf_km_blob  = pack_list_of_values_as_little_endian_bytes([coord for o in distilled_observations for coord in [o.pitrf[0],o.pitrf[1],o.pitrf[2]]], ObDataType.F32)
-    sen_vel_xyz_itrf_kms_blob = pack_list_of_values_as_little_endian_bytes([coord for o in distilled_observations for coord in [o.vitrf[0],o.vitrf[1],o.vitrf[2]]], ObDataType.F32)
-    mag_blob                  = pack_list_of_values_as_little_endian_bytes([o.mag for o in distilled_observations], ObDataType.F32)
+    # RAW columns get the same little-endian, delimiter-free layout that pack_list_of_values_as_little_endian_bytes produces
+    timestamp_us_blob         = encode_blob(columns.timestamps_us, ObDataType.U64.value, BLOB_CODEC_BY_COLUMN["timestamp_us_blob"])
+    ra_and_dec_deg_blob       = encode_blob(columns.ra_dec_deg, ObDataType.F64.value, BLOB_CODEC_BY_COLUMN["ra_and_dec_deg_blob"])
+    ra_and_dec_unc_deg_blob   = encode_blob(columns.ra_dec_unc_deg, ObDataType.F32.value, BLOB_CODEC_BY_COLUMN["ra_and_dec_unc_deg_blob"])
+    sen_pos_xyz_itrf_km_blob  = encode_blob(columns.sen_pos_xyz_itrf_km, ObDataType.F32.value, BLOB_CODEC_BY_COLUMN["sen_pos_xyz_itrf_km_blob"])
+    sen_vel_xyz_itrf_kms_blob = encode_blob(columns.sen_vel_xyz_itrf_kms, ObDataType.F32.value, BLOB_CODEC_BY_COLUMN["sen_vel_xyz_itrf_kms_blob"])
+    mag_blob                  = encode_blob(columns.mag, ObDataType.F32.value, BLOB_CODEC_BY_COLUMN["mag_blob"])
     
-    return MySQLRecord(
-        track_id = None, # make sure to not push this when adding to the table!!
-        id_on_orbit = id_on_orbit,
-        sat_no = sat_no,
-        id_sensor = id_sensor,
-        orig_object_id = orig_object_id,
-        orig_sensor_id = orig_sensor_id,
-        uct = uct,
-
-        trackstart_utc = trackstart_utc,
-        trackend_utc = trackend_utc,
-        median_timestamp_utc = median_timestamp_utc,
-        rx_time_utc = rx_time_utc,
-        
-        median_ra_deg = median_ra_deg,
-        median_dec_deg = median_dec_deg,
-        median_senx_itrf_km = median_senx_itrf_km,
-        median_seny_itrf_km = median_seny_itrf_km,
-        median_senz_itrf_km = median_senz_itrf_km,
-        median_mag = median_mag,
-        
-        timestamp_us_blob = timestamp_us_blob,
-        ra_and_dec_deg_blob = ra_and_dec_deg_blob,
-        ra_and_dec_unc_deg_blob = ra_and_dec_unc_deg_blob,
-        sen_pos_xyz_itrf_km_blob = sen_pos_xyz_itrf_km_blob,
-        sen_vel_xyz_itrf_kms_blob = sen_vel_xyz_itrf_kms_blob,
-        mag_blob = mag_blob,
-    )
\ No newline at end of file
+    return (
+        id_on_orbit, id_sensor, sat_no, orig_object_id, orig_sensor_id, uct, track_fingerprint,
+        trackstart_us, trackend_us, median_timestamp_us, rx_time_utc,
+        median_ra_deg, median_dec_deg, sky_cell, median_senx_itrf_km, median_seny_itrf_km, median_senz_itrf_km, median_mag,
+        timestamp_us_blob, ra_and_dec_deg_blob, ra_and_dec_unc_deg_blob, sen_pos_xyz_itrf_km_blob, sen_vel_xyz_itrf_kms_blob, mag_blob,
+    ) + stats
+
+
+def insert_values_to_mysql_record(values:Sequence, track_id:Optional[int]=None) -> MySQLRecord:
+    # values as track_insert_values returns them. Only these three per track become datetimes (naive UTC), built from the already-decoded ints.
+    values = list(values)
+    for i in DATETIME_INSERT_INDICES:
+        values[i] = us_to_naive_utc_datetime(values[i])
+    return MySQLRecord(track_id, *values)
+
+
+def mysqlify_track(sx_api_track):
+    return insert_values_to_mysql_record(track_insert_values(sx_api_track)) # track_id is None: make sure to not push this when adding to the table!!
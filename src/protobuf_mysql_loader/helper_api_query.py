@@ -1,37 +1,59 @@
-from typing import TYPE_CHECKING, List, Generator
+from typing import TYPE_CHECKING, List, Generator, Optional
 if TYPE_CHECKING:
-    from proj.helper_sxapi_2_mysql import MySQLRecord 
-from proj.helper_scraper_state import UsefulGlobalState
-from proj.helper_logging import get_logger; logger=get_logger()
+    from protobuf_mysql_loader.helper_api_2_mysql import MySQLRecord 
+from protobuf_mysql_loader.helper_scraper_state import UsefulGlobalState
+from protobuf_mysql_loader.helper_logging import get_logger; logger=get_logger()
 from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
 import requests
 import os
-import time
 
 
 # For understanding the input data format
-from proj.spacex.proj_pb2import SomeClass
-from proj.helper_sxapi_2_mysql import mysqlify_track
+from protobuf_mysql_loader.api_provider.project_pb2 import SomeClass
+from protobuf_mysql_loader.helper_api_2_mysql import mysqlify_track
+from protobuf_mysql_loader.helper_wire_scanner import StreamingTrackScanner, get_field_numbers
+from protobuf_mysql_loader.helper_poll_scheduler import AdaptivePollScheduler, get_poll_scheduler, parse_retry_after_s, ERROR_RATE_LIMITED, ERROR_SERVER, ERROR_NETWORK
+from protobuf_mysql_loader.helper_http_transport import TransportSettings, configure_api_session, client_cert_ssl_context, transport_settings_of, read_response_body, read_error_body
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry, stage_seconds
+from protobuf_mysql_loader.helper_response_capture import capture_response, get_response_recorder
 
 __BASEURL = f"https://someapi.com/api/v1/abc" 
+DEFAULT_STREAM_CHUNK_SIZE = 64*1024 # bytes per socket read when streaming a response
+MAX_ATTEMPTS_PER_QUERY = 5 # for 429s, 5xxs and timeouts. After that the error goes up to the main loop.
 
-def __generate_api_query(useful_global_state:UsefulGlobalState):
+_fetch_seconds = stage_seconds("fetch")
+_parse_seconds = stage_seconds("parse")
+_api_responses_total = get_metrics_registry().counter("api_responses_total", "Successful (200) API responses")
+_api_response_bytes_total = get_metrics_registry().counter("api_response_bytes_total", "Bytes of successful API response bodies, decompressed")
+_api_response_wire_bytes_total = get_metrics_registry().counter("api_response_wire_bytes_total", "Bytes of successful API response bodies as received, i.e. compressed if the server compressed them")
+_api_errors_total = {status_class: get_metrics_registry().counter("api_errors_total", "Non-200 API responses, and requests that got no response at all", labels={"status_class": status_class}) for status_class in ("429", "5xx", "network", "other")}
+
+def __generate_api_query(useful_global_state:UsefulGlobalState, token:Optional[str]=None, start_time_s:Optional[int]=None, base_url:Optional[str]=None):
     
-    token = useful_global_state.last_token_received_for_data_sucessfully_added_to_db
+    # base_url lets one process poll several feeds (helper_multi_feed.py). Everything else uses __BASEURL.
+    base_url = base_url or __BASEURL
+    # Normally resume from the last token whose data made it into the db. The pipelined scraper passes the
+    # latest fetched token instead, since it fetches the next page before the previous one has been written.
+    # The backfill passes start_time_s to begin a window's token chain at a given unix time.
+    if start_time_s is not None and not token:
+        return f"{base_url}?startTime={int(start_time_s)}"
+    if token is None:
+        token = useful_global_state.last_token_received_for_data_sucessfully_added_to_db
     # check if token is not a blank string and that it has some length to it
     if bool(token) and len(token) > 10:
         # Then we probably have a good token. Now even if the time is more than 24 hours back, which is the max, Spacex only gives us 24 hours so no harm in just sending it without checking
-        url = f"{__BASEURL}?token={token}"
+        url = f"{base_url}?token={token}"
         return url
         
     # if we don't have a token to work with, just get the last 30 seconds of data
     else:
         logger.warning("No token found. This should only happen upon startup if no api_state.json file is present. Will query for the last one hour of data...")
         unixtime = int(datetime.now().timestamp())
-        url = f"{__BASEURL}?startTime={unixtime-3600}"
+        url = f"{base_url}?startTime={unixtime-3600}"
         return url
 
-def get_api_session(): 
+def get_api_session(transport_settings:Optional[TransportSettings]=None) -> requests.Session: 
     required_location_of_client_cert_and_priv_key = os.path.join(
         os.path.dirname(os.path.abspath(__file__)), # the parent dir of this file
         'api_provider' # Some directory containing the .crt and .key 
@@ -49,46 +71,142 @@ def get_api_session():
     if not (os.path.exists(client_cert_path) and os.path.exists(client_priv_key_path)):
         raise FileNotFoundError("Can't find both client.crt and client.key in the api provider dir.")     
     
-    session = requests.Session()
-    # Set the certs 
-    session.cert = (client_cert_path, client_priv_key_path)
-    
-    return session
+    # The certs go into one SSLContext that every pooled connection shares, instead of being loaded per connection via session.cert
+    return configure_api_session(requests.Session(), transport_settings, ssl_context=client_cert_ssl_context(client_cert_path, client_priv_key_path))
 
 
-def query_api(session:requests.Session, useful_global_state:UsefulGlobalState): 
-    url = __generate_api_query(useful_global_state)
-    response = session.get(url)
-    
-    if response.status_code == 429:
-        logger.warning("Received HTTP code 429; too many requests; watiing 5 seconds")
-        time.sleep(5)
-        response = session.get(url)
+def _get_checked_response(session:requests.Session, url:str, poll_scheduler:Optional[AdaptivePollScheduler]=None) -> requests.Response:
+    # 429s, 5xxs and timeouts are retried after whatever the scheduler says (Retry-After if the server sent one, else jittered backoff).
+    # Always streamed: only the headers have arrived when this returns, and the caller reads the body (see helper_http_transport.py).
+    poll_scheduler = poll_scheduler if poll_scheduler is not None else get_poll_scheduler()
+    for attempt_number in range(1, MAX_ATTEMPTS_PER_QUERY+1):
+        retry_after_s = None
+        try:
+            with _fetch_seconds.time():
+                response = session.get(url, stream=True)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e: # no status at all. Timeouts are set by the session's transport.
+            _api_errors_total["network"].inc()
+            error_class = ERROR_NETWORK
+            logger.warning(f"Request failed before a response arrived: {e}")
+            if attempt_number == MAX_ATTEMPTS_PER_QUERY:
+                raise
+        else:
+            if response.status_code == 200:
+                return response
+            if response.status_code == 429:
+                _api_errors_total["429"].inc()
+                error_class = ERROR_RATE_LIMITED
+                logger.warning("Received HTTP code 429; too many requests")
+            elif 500 <= response.status_code < 600:
+                _api_errors_total["5xx"].inc()
+                error_class = ERROR_SERVER
+                logger.warning(f"Received status code of {response.status_code}. Maybe their server is down.")
+            else:
+                _api_errors_total["other"].inc()
+                break
+            if attempt_number == MAX_ATTEMPTS_PER_QUERY:
+                break
+            retry_after_s = parse_retry_after_s(response.headers.get("Retry-After"))
+            response.close()
+        poll_scheduler.record_error(error_class, retry_after_s=retry_after_s)
+        poll_scheduler.wait_for_next_poll()
     
-    if response.status_code == 500:
-        logger.warning("Received status code of 500. Maybe their server is down. Sleeping for 60 seconds and then resuming.")
-        time.sleep(60)
-    
-    if response.status_code != 200:
-        logger.error("Received Non-200 Status Code")
-        logger.error(f"{response.status_code=}")
-        logger.error(f"{response.text=}")
-        logger.error(f"{response=}")
-        raise ValueError("Received Non-200 Status Code While Querying API")
+    logger.error("Received Non-200 Status Code")
+    logger.error(f"{response.status_code=}")
+    logger.error(f"{response.headers.get('Content-Type')=}")
+    logger.error(f"body={read_error_body(response, transport_settings_of(session))}") # the start of it. Protobuf bodies can run to megabytes.
+    logger.error(f"{response=}")
+    raise ValueError("Received Non-200 Status Code While Querying API")
+
+
+def _request_token_of(url:str) -> str:
+    # What the capture files each response under. "" for startTime queries.
+    return parse_qs(urlsplit(url).query).get("token", [""])[0]
+
+
+def _record_successful_response(useful_global_state:UsefulGlobalState, token:str, num_bytes:int, num_wire_bytes:int) -> None:
+    useful_global_state.last_token_received = token
+    useful_global_state.total_gigabytes_this_session += num_wire_bytes/(1024*1024*1024) # what actually crossed the network
+    useful_global_state.num_successful_api_calls_this_session+=1
+    _api_responses_total.inc()
+    _api_response_bytes_total.inc(num_bytes)
+    _api_response_wire_bytes_total.inc(num_wire_bytes)
+    useful_global_state.mirror_state_to_file() # rate-limited. The real checkpoint is written to MySQL with the data.
+    return None
+
+
+def parse_api_response_body(body:bytes) -> SomeClass:
+    # For bodies that didn't come off the wire just now, e.g. captured responses being replayed
+    api_message = SomeClass()
+    with _parse_seconds.time():
+        api_message.ParseFromString(body)
+    return api_message
+
+
+def query_api(session:requests.Session, useful_global_state:UsefulGlobalState, token:Optional[str]=None, poll_scheduler:Optional[AdaptivePollScheduler]=None, start_time_s:Optional[int]=None, base_url:Optional[str]=None): 
+    url = __generate_api_query(useful_global_state, token, start_time_s, base_url=base_url)
+    response = _get_checked_response(session, url, poll_scheduler=poll_scheduler)
+    # Decompressed into this thread's reusable buffer. ParseFromString copies what it keeps, so the buffer is free again once it returns.
+    response_body = read_response_body(response, transport_settings_of(session))
     
     api_message = SomeClass() 
-    api_message.ParseFromString(response.content)
-    useful_global_state.last_token_received = api_message.token
-    useful_global_state.total_gigabytes_this_session += len(response.content)/(1024*1024*1024) #NOTE: This is assuming one content-character = one byte which I'm not sure about
-    useful_global_state.num_successful_api_calls_this_session+=1
-    useful_global_state.save_state()
+    with _parse_seconds.time():
+        api_message.ParseFromString(response_body.body)
+    _record_successful_response(useful_global_state, api_message.token, response_body.num_bytes, response_body.num_wire_bytes)
+    capture_response(_request_token_of(url), response_body.body, api_message.token) # no-op unless a ResponseRecorder is set
     
     return api_message
 
 
+class StreamedApiResponse:
+    """
+    One API response read off the socket in chunks instead of parsed as a whole. iter_track_views() yields each track's
+    serialized bytes as soon as they have fully arrived, so decoding can start before the download finishes and the
+    full response (or its SomeClass object tree) is never held in memory. token and num_tracks are set once the
+    iterator is exhausted, which is also when the scraper state is updated, same as query_api does.
+    """
+    def __init__(self, response:requests.Response, useful_global_state:UsefulGlobalState, chunk_size:int, request_token:str=""):
+        self._response = response
+        self._request_token = request_token
+        self._captured_chunks = [] if get_response_recorder() is not None else None # only kept when capture is on
+        self._useful_global_state = useful_global_state
+        self._chunk_size = chunk_size
+        self._scanner = StreamingTrackScanner(*get_field_numbers(SomeClass))
+        self.finished:bool = False
+
+    @property
+    def token(self) -> str:
+        return self._scanner.token
+
+    @property
+    def num_tracks(self) -> int:
+        return self._scanner.num_tracks
+
+    def iter_track_views(self) -> Generator[memoryview, None, None]:
+        try:
+            for chunk in self._response.iter_content(chunk_size=self._chunk_size): # decompresses gzip for us
+                if self._captured_chunks is not None:
+                    self._captured_chunks.append(bytes(chunk))
+                yield from self._scanner.feed(chunk)
+            self._scanner.finish()
+        finally:
+            self._response.close()
+        # raw.tell() is what came over the wire, before iter_content decompressed it
+        _record_successful_response(self._useful_global_state, self._scanner.token, self._scanner.num_bytes_scanned, self._response.raw.tell())
+        if self._captured_chunks is not None:
+            capture_response(self._request_token, b"".join(self._captured_chunks), self._scanner.token)
+            self._captured_chunks = None
+        self.finished = True
+
+
+def stream_api_response(session:requests.Session, useful_global_state:UsefulGlobalState, token:Optional[str]=None, chunk_size:int=DEFAULT_STREAM_CHUNK_SIZE, poll_scheduler:Optional[AdaptivePollScheduler]=None, base_url:Optional[str]=None) -> StreamedApiResponse:
+    url = __generate_api_query(useful_global_state, token, base_url=base_url)
+    return StreamedApiResponse(_get_checked_response(session, url, poll_scheduler=poll_scheduler), useful_global_state, chunk_size, request_token=_request_token_of(url))
+
+
 def yield_batches_of_docs(api_message, num_tracks_per_batch:int) -> Generator[List["MySQLRecord"], None, None]:
     buffer=[] # This resets after each batch of documents is sent out
-    for track in api_message.class_attribute: 
+    for track in api_message.udl_observation_responses: 
         buffer.append(mysqlify_track(track)) # fill buffer with a track's worth of data
         if len(buffer) == num_tracks_per_batch:
             yield buffer
@@ -0,0 +1,201 @@
+import argparse
+import threading
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from protobuf_mysql_loader.db.mysql_utils import get_mysql_connection_object
+from protobuf_mysql_loader.db.mysql_creation import add_record_tuples_to_db, ensure_track_fingerprint_unique_key, ensure_track_stats_columns
+from protobuf_mysql_loader.db.mysql_bulk_load import WRITER_LOAD_DATA, TRACK_WRITERS
+from protobuf_mysql_loader.db.mysql_checkpoint import create_backfill_progress_table, write_backfill_progress_without_committing, read_backfill_progress
+from protobuf_mysql_loader.helper_scraper_state import UsefulGlobalState
+from protobuf_mysql_loader.helper_api_query import get_api_session, query_api
+from protobuf_mysql_loader.helper_parallel_decode import get_parallel_track_decoder
+from protobuf_mysql_loader.helper_poll_scheduler import AdaptivePollScheduler
+from protobuf_mysql_loader.helper_record_batch import RecordBatch
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry
+from protobuf_mysql_loader.helper_logging import get_logger; logger=get_logger()
+
+# Historical backfill: [start, end) is cut into windows, and each window is fetched by its own token chain, starting
+# from ?startTime=<window start> and followed until the chain has moved past the window end. Several windows run at
+# once, each on its own HTTP session, MySQL connection and backoff state, and they share the decoder's process pool.
+#
+# It never touches what the live tail loop owns: not api_state.json, not the scraper_checkpoints row, not the live poll
+# scheduler. So it can run as a separate process next to a_main. Progress is per window, in scraper_backfill_windows,
+# written in the same transaction as the last batch of each response, so a restart resumes every window from its last
+# committed token.
+#
+# Chains overlap a little at the window edges (and with the live tail), so rows always go in with INSERT IGNORE against the
+# track_fingerprint unique key. The API only replays so far back (~24h), so older windows just come back empty.
+
+DEFAULT_BACKFILL_WINDOW_S = 60*60
+DEFAULT_NUM_BACKFILL_SESSIONS = 4
+DEFAULT_BACKFILL_TRACKS_PER_BATCH = 10_000
+
+_backfill_tracks_total = get_metrics_registry().counter("backfill_tracks_total", "Tracks fetched and written by the historical backfill")
+_backfill_windows_done_total = get_metrics_registry().counter("backfill_windows_done_total", "Backfill windows whose token chain has passed the window end")
+
+
+@dataclass
+class BackfillWindow:
+    start_s:int # unix seconds, inclusive
+    end_s:int   # unix seconds, exclusive
+    next_token:Optional[str] = None
+    num_tracks:int = 0
+    is_done:bool = False
+
+    @property
+    def end_utc(self) -> datetime:
+        return datetime.fromtimestamp(self.end_s, timezone.utc).replace(tzinfo=None) # naive UTC, like the insert tuples
+
+    def __str__(self) -> str:
+        start_utc = datetime.fromtimestamp(self.start_s, timezone.utc)
+        return f"[{start_utc:%Y-%m-%d %H:%M}, {self.end_utc:%Y-%m-%d %H:%M}) UTC"
+
+
+def split_into_windows(start_s:int, end_s:int, window_s:int) -> List[BackfillWindow]:
+    return [BackfillWindow(window_start_s, min(window_start_s + window_s, end_s)) for window_start_s in range(start_s, end_s, window_s)]
+
+
+def _chain_has_passed(record_batch:RecordBatch, window_end_s:int) -> bool:
+    # The median rather than the oldest track, so a few late arrivals on a page don't keep a chain going to the present.
+    # Anything that arrived late is picked up by the next window's chain or the live tail, and the overlap is deduplicated.
+    trackstart_us = np.sort(record_batch.column("trackstart_utc"))
+    return int(trackstart_us[(len(trackstart_us) - 1) // 2]) >= window_end_s * 1_000_000 # median_low
+
+
+class HistoricalBackfill:
+    """
+    backfill = HistoricalBackfill("my_table", start_utc, end_utc)
+    backfill.run() # blocks until every window is done or has failed. Rerunning picks up where it left off.
+    """
+    def __init__(
+            self,
+            table_name:str,
+            start_utc:datetime,
+            end_utc:datetime,
+            window_s:int=DEFAULT_BACKFILL_WINDOW_S,
+            num_sessions:int=DEFAULT_NUM_BACKFILL_SESSIONS,
+            max_decode_workers:int=4,
+            track_writer:str=WRITER_LOAD_DATA,
+            tracks_per_batch:int=DEFAULT_BACKFILL_TRACKS_PER_BATCH,
+            session_factory:Callable=get_api_session,
+            connection_factory:Optional[Callable]=None,
+    ):
+        self.table_name = table_name
+        self.start_s = int(start_utc.replace(tzinfo=start_utc.tzinfo or timezone.utc).timestamp())
+        self.end_s = int(end_utc.replace(tzinfo=end_utc.tzinfo or timezone.utc).timestamp())
+        self.window_s = window_s
+        self.num_sessions = num_sessions
+        self.track_writer = track_writer
+        self.tracks_per_batch = tracks_per_batch
+        self.session_factory = session_factory
+        self.connection_factory = connection_factory if connection_factory is not None else lambda: get_mysql_connection_object(allow_local_infile=(track_writer==WRITER_LOAD_DATA))
+        self.track_decoder = get_parallel_track_decoder(max_workers=max_decode_workers)
+        self._stop_event = threading.Event()
+
+    def plan(self, mysql_connection) -> List[BackfillWindow]:
+        """ Windows for [start, end), with whatever progress earlier runs recorded for the same window starts """
+        progress = read_backfill_progress(mysql_connection, self.table_name)
+        windows = split_into_windows(self.start_s, self.end_s, self.window_s)
+        for window in windows:
+            if window.start_s in progress:
+                window_progress = progress[window.start_s]
+                window.next_token, window.num_tracks, window.is_done = window_progress.next_token, window_progress.num_tracks, window_progress.is_done
+        return windows
+
+    def run(self) -> List[BackfillWindow]:
+        mysql_connection = self.connection_factory()
+        try:
+            create_backfill_progress_table(mysql_connection)
+            ensure_track_fingerprint_unique_key(self.table_name, mysql_connection) # the overlap between chains relies on it
+            ensure_track_stats_columns(self.table_name, mysql_connection)
+            windows = self.plan(mysql_connection)
+        finally:
+            mysql_connection.close()
+
+        pending_windows = [window for window in windows if not window.is_done]
+        logger.info(f"Backfilling {self.table_name}: {len(pending_windows)} of {len(windows)} window(s) to go, {self.num_sessions} at a time.")
+        start_time = timeit.default_timer()
+        failed_windows = []
+        with ThreadPoolExecutor(max_workers=self.num_sessions, thread_name_prefix="backfill") as executor:
+            futures = {executor.submit(self.run_window, window): window for window in pending_windows}
+            for future, window in futures.items():
+                try:
+                    future.result()
+                except Exception:
+                    failed_windows.append(window)
+                    logger.error(f"Backfill window {window} failed after {window.num_tracks} tracks. Rerun the backfill to resume it.", exc_info=True)
+        logger.info(f"Backfill of {self.table_name} finished in {timeit.default_timer()-start_time:.0f}s. {sum(w.num_tracks for w in windows)} tracks across {len(windows)} window(s), {len(failed_windows)} failed.")
+        return windows
+
+    def run_window(self, window:BackfillWindow) -> None:
+        # Private state for everything query_api would otherwise share with the live loop
+        useful_global_state = UsefulGlobalState(num_successful_api_calls_this_session=0, total_gigabytes_this_session=0, last_successful_time_we_saved_data_to_db_s=0, last_token_received='', last_token_received_for_data_sucessfully_added_to_db='', last_time_partitions_were_created_s=0)
+        useful_global_state.json_mirror_enabled = False
+        poll_scheduler = AdaptivePollScheduler() # only its error backoff is used. Pages are fetched back to back.
+        session = self.session_factory()
+        mysql_connection = self.connection_factory()
+        try:
+            while not window.is_done and not self._stop_event.is_set():
+                self._fetch_and_write_one_response(window, session, mysql_connection, useful_global_state, poll_scheduler)
+        finally:
+            mysql_connection.close()
+            session.close()
+
+    def _fetch_and_write_one_response(self, window:BackfillWindow, session, mysql_connection, useful_global_state:UsefulGlobalState, poll_scheduler:AdaptivePollScheduler) -> None:
+        start_time = timeit.default_timer()
+        spacex_api_message = query_api(session, useful_global_state, token=window.next_token, poll_scheduler=poll_scheduler, start_time_s=window.start_s)
+        record_batch = self.track_decoder.decode_tracks(spacex_api_message.udl_observation_responses)
+        # An empty page means the chain has caught up with the present (or the API has nothing that old)
+        is_done = not len(record_batch) or _chain_has_passed(record_batch, window.end_s)
+        next_token = spacex_api_message.token or window.next_token
+
+        def write_progress_in_same_transaction(mysql_connection):
+            write_backfill_progress_without_committing(mysql_connection, self.table_name, window.start_s, window.end_s, next_token, len(record_batch), is_done)
+        batch_starts = range(0, len(record_batch), self.tracks_per_batch) if len(record_batch) else [0] # an empty page still commits the progress
+        for i, batch_start in enumerate(batch_starts):
+            is_last_batch = i == len(batch_starts) - 1
+            add_record_tuples_to_db(record_batch[batch_start:batch_start+self.tracks_per_batch], mysql_connection, self.table_name, writer=self.track_writer, before_commit=write_progress_in_same_transaction if is_last_batch else None, ignore_duplicates=True)
+
+        window.next_token, window.num_tracks, window.is_done = next_token, window.num_tracks + len(record_batch), is_done
+        _backfill_tracks_total.inc(len(record_batch))
+        if is_done:
+            _backfill_windows_done_total.inc()
+        logger.info(f"Backfill window {window}: {len(record_batch)} tracks in {timeit.default_timer()-start_time:.1f}s ({window.num_tracks} so far){'. Done.' if is_done else ''}")
+
+    def stop(self) -> None:
+        """ Windows finish the response they're on and stop. Their progress is committed, so a rerun resumes them. """
+        self._stop_event.set()
+
+
+def _parse_utc(value:str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill a time range into a track table with several API sessions at once. Safe to run next to the live scraper, and to rerun: windows resume from their last committed token.")
+    parser.add_argument("table_name")
+    parser.add_argument("--start", type=_parse_utc, required=True, help="UTC, ISO 8601, e.g. 2024-07-10T00:00")
+    parser.add_argument("--end", type=_parse_utc, default=None, help="UTC, ISO 8601. Defaults to now.")
+    parser.add_argument("--window-minutes", type=int, default=DEFAULT_BACKFILL_WINDOW_S // 60)
+    parser.add_argument("--sessions", type=int, default=DEFAULT_NUM_BACKFILL_SESSIONS, help="windows fetched concurrently")
+    parser.add_argument("--decode-workers", type=int, default=4, help="processes shared by every window for decoding")
+    parser.add_argument("--writer", choices=TRACK_WRITERS, default=WRITER_LOAD_DATA)
+    parser.add_argument("--status", action="store_true", help="print the recorded progress of each window and exit")
+    args = parser.parse_args()
+
+    backfill = HistoricalBackfill(args.table_name, args.start, args.end or datetime.now(timezone.utc), window_s=args.window_minutes*60, num_sessions=args.sessions, max_decode_workers=args.decode_workers, track_writer=args.writer)
+    if args.status:
+        status_connection = backfill.connection_factory()
+        create_backfill_progress_table(status_connection)
+        for window in backfill.plan(status_connection):
+            print(f"{window}  {'done' if window.is_done else 'started' if window.next_token else 'pending':8s}  {window.num_tracks} tracks")
+        status_connection.close()
+    else:
+        backfill.run()
@@ -0,0 +1,289 @@
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import lz4.block as lz4_block # optional, pip install lz4
+except ImportError:
+    lz4_block = None
+
+# Versioned, self-describing blob encodings for the *_blob columns.
+#
+# Blobs written before this existed are bare little-endian arrays with no header. Encoded blobs start with _BLOB_MAGIC,
+# so readers check for that and otherwise fall back to the old layout. A column whose codec is plain RAW with no
+# compression is still written bare, byte-for-byte the same as before, so switching codecs is per column and opt-in.
+#
+# Header (little-endian, 12 bytes, then 8 more for quantized codecs):
+#   magic "PMB" | version u8 | codec u8 | compression u8 | dtype char ('Q','d','f') | num_components u8 | num_rows u32 | [quantization_step f64]
+# Multi-component columns (ra/dec, xyz) are delta-encoded per component, component-major, so each delta stream is smooth.
+
+_BLOB_MAGIC = b"PMB"
+_BLOB_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<3sBBBcBI")
+_QUANTIZATION_STEP = struct.Struct("<d")
+
+CODEC_RAW = 0                      # little-endian array, same bytes as the headerless layout
+CODEC_DELTA_VARINT = 1             # integers only. Per-component deltas, zig-zag, LEB128 varints. Lossless.
+CODEC_QUANTIZED_DELTA_VARINT = 2   # floats. Rounded to a multiple of quantization_step, then as above. Error <= step/2. Finite values only.
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZ4 = 2
+
+_NUMPY_DTYPE_BY_CHAR = {"Q": np.dtype("<u8"), "d": np.dtype("<f8"), "f": np.dtype("<f4")}
+_MAX_VARINT_BYTES = 10
+_VARINT_THRESHOLDS = np.array([1 << (7*k) for k in range(1, _MAX_VARINT_BYTES)], dtype=np.uint64)
+_VARINT_SHIFTS = np.arange(_MAX_VARINT_BYTES, dtype=np.uint64) * np.uint64(7)
+_VARINT_GROUP_INDEX = np.arange(_MAX_VARINT_BYTES)
+# A track's blob is a few dozen values, where a plain Python loop beats NumPy's per-call overhead (~6us vs ~16us for 25).
+# Past this many values the vectorized path wins.
+_MAX_VALUES_FOR_PYTHON_VARINTS = 128
+_MAX_ABS_QUANTIZED = float(2**62)
+
+
+@dataclass(frozen=True)
+class BlobCodec:
+    codec: int = CODEC_RAW
+    compression: int = COMPRESSION_NONE
+    quantization_step: Optional[float] = None # required for CODEC_QUANTIZED_DELTA_VARINT, e.g. 1e-4 km = 10 cm
+    compression_level: int = 6 # zlib only
+
+    @property
+    def writes_header(self) -> bool:
+        return self.codec != CODEC_RAW or self.compression != COMPRESSION_NONE
+
+
+RAW_BLOB_CODEC = BlobCodec()
+
+
+def _zigzag(values:np.ndarray) -> np.ndarray:
+    values = values.astype(np.int64, copy=False)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def _unzigzag(values:np.ndarray) -> np.ndarray:
+    return ((values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64))
+
+
+def _varint_encode(values:np.ndarray) -> bytes:
+    # Vectorized LEB128: lay every value out as 10 candidate 7-bit groups, set the continuation bits, keep the used ones
+    num_bytes = np.searchsorted(_VARINT_THRESHOLDS, values, side="right") + 1
+    groups = ((values[:, None] >> _VARINT_SHIFTS) & np.uint64(0x7F)).astype(np.uint8)
+    groups |= (_VARINT_GROUP_INDEX < (num_bytes[:, None] - 1)).view(np.uint8) << 7
+    return groups[_VARINT_GROUP_INDEX < num_bytes[:, None]].tobytes()
+
+
+def _varint_decode(payload:bytes, num_values:int) -> np.ndarray:
+    encoded = np.frombuffer(payload, dtype=np.uint8)
+    ends = np.flatnonzero(encoded < 0x80)
+    if len(ends) != num_values or ends[-1] != len(encoded) - 1:
+        raise ValueError(f"Corrupt varint stream: expected {num_values} values in {len(encoded)} bytes, found {len(ends)}")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position_in_value = np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)
+    shifted_groups = (encoded & 0x7F).astype(np.uint64) << (position_in_value.astype(np.uint64) * np.uint64(7))
+    return np.bitwise_or.reduceat(shifted_groups, starts)
+
+
+def _zigzag_varint_encode(deltas:np.ndarray) -> bytes:
+    if deltas.size > _MAX_VALUES_FOR_PYTHON_VARINTS:
+        return _varint_encode(_zigzag(deltas))
+    encoded = bytearray()
+    for delta in deltas.tolist():
+        value = (delta << 1) ^ (delta >> 63)
+        while value >= 0x80:
+            encoded.append((value & 0x7F) | 0x80)
+            value >>= 7
+        encoded.append(value)
+    return bytes(encoded)
+
+
+def _zigzag_varint_decode(payload:bytes, num_values:int) -> np.ndarray:
+    if num_values == 0:
+        return np.empty(0, dtype=np.int64)
+    if num_values > _MAX_VALUES_FOR_PYTHON_VARINTS:
+        return _unzigzag(_varint_decode(payload, num_values))
+    deltas = []
+    value, shift = 0, 0
+    for byte in payload:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            deltas.append((value >> 1) ^ -(value & 1))
+            value, shift = 0, 0
+    if len(deltas) != num_values or shift:
+        raise ValueError(f"Corrupt varint stream: expected {num_values} values in {len(payload)} bytes, found {len(deltas)}")
+    return np.array(deltas, dtype=np.int64)
+
+
+def _compress(payload:bytes, blob_codec:BlobCodec) -> bytes:
+    if blob_codec.compression == COMPRESSION_NONE:
+        return payload
+    if blob_codec.compression == COMPRESSION_ZLIB:
+        return zlib.compress(payload, blob_codec.compression_level)
+    if blob_codec.compression == COMPRESSION_LZ4:
+        if lz4_block is None:
+            raise ImportError("COMPRESSION_LZ4 needs the lz4 package (pip install lz4)")
+        return lz4_block.compress(payload, store_size=True)
+    raise ValueError(f"Unknown blob compression {blob_codec.compression}")
+
+
+def _decompress(payload:bytes, compression:int) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return payload
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(payload)
+    if compression == COMPRESSION_LZ4:
+        if lz4_block is None:
+            raise ImportError("This blob is LZ4 compressed, which needs the lz4 package (pip install lz4)")
+        return lz4_block.decompress(payload)
+    raise ValueError(f"Unknown blob compression {compression}")
+
+
+def encode_blob(values:np.ndarray, dtype_char:str, blob_codec:BlobCodec=RAW_BLOB_CODEC) -> bytes:
+    """
+    values is (num_rows,) or (num_rows, num_components). dtype_char is the ObDataType value the column is stored as.
+    With RAW_BLOB_CODEC this is exactly values.astype(dtype).tobytes(), i.e. the old headerless layout.
+    """
+    numpy_dtype = _NUMPY_DTYPE_BY_CHAR[dtype_char]
+    values = np.asarray(values)
+    num_rows = values.shape[0]
+    num_components = 1 if values.ndim == 1 else values.shape[1]
+    if not blob_codec.writes_header:
+        return values.astype(numpy_dtype, copy=False).tobytes()
+
+    extra_header = b""
+    if blob_codec.codec == CODEC_RAW:
+        payload = values.astype(numpy_dtype, copy=False).tobytes()
+    else:
+        if blob_codec.codec == CODEC_DELTA_VARINT:
+            if numpy_dtype.kind != "u":
+                raise ValueError("CODEC_DELTA_VARINT is for integer columns. Use CODEC_QUANTIZED_DELTA_VARINT for floats.")
+            integers = values.astype(np.int64) # u64 epoch microseconds are nowhere near 2**63
+        elif blob_codec.codec == CODEC_QUANTIZED_DELTA_VARINT:
+            if not blob_codec.quantization_step or blob_codec.quantization_step <= 0:
+                raise ValueError("CODEC_QUANTIZED_DELTA_VARINT needs a positive quantization_step")
+            scaled = np.rint(values.astype(np.float64) / blob_codec.quantization_step)
+            # astype(int64) turns NaN/inf into INT64_MIN without a word. 2**62 leaves room for the deltas to fit too.
+            if not np.all(np.abs(scaled) < _MAX_ABS_QUANTIZED):
+                raise ValueError(f"CODEC_QUANTIZED_DELTA_VARINT can't store NaN, inf or values beyond {_MAX_ABS_QUANTIZED:g} steps of {blob_codec.quantization_step:g}. Use CODEC_RAW for this column.")
+            integers = scaled.astype(np.int64)
+            extra_header = _QUANTIZATION_STEP.pack(blob_codec.quantization_step)
+        else:
+            raise ValueError(f"Unknown blob codec {blob_codec.codec}")
+        component_major = integers.reshape(num_rows, num_components).T
+        deltas = component_major.copy() # np.diff(prepend=0) does the same but is several times slower on short arrays
+        deltas[:, 1:] -= component_major[:, :-1]
+        payload = _zigzag_varint_encode(deltas.ravel())
+
+    header = _HEADER.pack(_BLOB_MAGIC, _BLOB_FORMAT_VERSION, blob_codec.codec, blob_codec.compression, dtype_char.encode("ascii"), num_components, num_rows)
+    return header + extra_header + _compress(payload, blob_codec)
+
+
+def _parse_header(blob:bytes):
+    # A bare legacy blob could in theory start with "PMB", so everything else in the header has to check out too
+    if len(blob) < _HEADER.size or blob[:3] != _BLOB_MAGIC:
+        return None
+    magic, version, codec, compression, dtype_char, num_components, num_rows = _HEADER.unpack_from(blob)
+    dtype_char = dtype_char.decode("ascii", errors="replace")
+    if version != _BLOB_FORMAT_VERSION or codec > CODEC_QUANTIZED_DELTA_VARINT or compression > COMPRESSION_LZ4 or dtype_char not in _NUMPY_DTYPE_BY_CHAR or num_components == 0:
+        return None
+    return codec, compression, dtype_char, num_components, num_rows
+
+
+def is_encoded_blob(blob:bytes) -> bool:
+    return _parse_header(blob) is not None
+
+
+def decode_blob(blob:bytes, legacy_dtype_char:str, legacy_num_components:int=1) -> np.ndarray:
+    """
+    Inverse of encode_blob. Headerless (pre-codec) blobs are read as bare little-endian legacy_dtype_char arrays.
+    Returns (num_rows,) for single-component columns, else (num_rows, num_components).
+    """
+    header = _parse_header(blob)
+    if header is None:
+        values = np.frombuffer(blob, dtype=_NUMPY_DTYPE_BY_CHAR[legacy_dtype_char])
+        return values if legacy_num_components == 1 else values.reshape(-1, legacy_num_components)
+
+    codec, compression, dtype_char, num_components, num_rows = header
+    numpy_dtype = _NUMPY_DTYPE_BY_CHAR[dtype_char]
+    offset = _HEADER.size
+    quantization_step = None
+    if codec == CODEC_QUANTIZED_DELTA_VARINT:
+        quantization_step = _QUANTIZATION_STEP.unpack_from(blob, offset)[0]
+        offset += _QUANTIZATION_STEP.size
+    payload = _decompress(bytes(blob[offset:]), compression)
+
+    if codec == CODEC_RAW:
+        values = np.frombuffer(payload, dtype=numpy_dtype)
+    else:
+        deltas = _zigzag_varint_decode(payload, num_rows * num_components).reshape(num_components, num_rows)
+        integers = np.cumsum(deltas, axis=1).T
+        values = integers.astype(numpy_dtype) if quantization_step is None else (integers * quantization_step).astype(numpy_dtype)
+    return values.reshape(num_rows) if num_components == 1 else values.reshape(num_rows, num_components)
+
+
+def decode_blobs_concatenated(blobs:Sequence[bytes], legacy_dtype_char:str, legacy_num_components:int=1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Many tracks' blobs for one column, decoded end to end: (values, num_rows per blob). values is (total_rows,) or
+    (total_rows, num_components), same as concatenating decode_blob over blobs, but without a Python loop per value.
+    Headerless blobs are one join + frombuffer. Encoded blobs that share a codec, dtype and step have their varints
+    decoded in one pass and their per-blob, per-component delta streams summed with one segmented cumsum.
+    """
+    num_components = legacy_num_components
+    headers = [_parse_header(blob) for blob in blobs]
+    if all(header is None for header in headers):
+        numpy_dtype = _NUMPY_DTYPE_BY_CHAR[legacy_dtype_char]
+        row_size = numpy_dtype.itemsize * num_components
+        num_rows = np.fromiter((len(blob) for blob in blobs), dtype=np.int64, count=len(blobs)) // row_size
+        values = np.frombuffer(b"".join(blobs), dtype=numpy_dtype)
+        return (values if num_components == 1 else values.reshape(-1, num_components)), num_rows
+
+    layouts = set()
+    payloads, quantization_steps = [], set()
+    for blob, header in zip(blobs, headers):
+        if header is None:
+            break
+        codec, compression, dtype_char, num_components, _ = header
+        offset = _HEADER.size
+        if codec == CODEC_QUANTIZED_DELTA_VARINT:
+            quantization_steps.add(_QUANTIZATION_STEP.unpack_from(blob, offset)[0])
+            offset += _QUANTIZATION_STEP.size
+        layouts.add((codec, dtype_char, num_components))
+        payloads.append(_decompress(bytes(blob[offset:]), compression))
+    if len(payloads) != len(blobs) or len(layouts) != 1 or len(quantization_steps) > 1 or next(iter(layouts))[0] == CODEC_RAW:
+        # A mix of layouts (e.g. rows from before and after a codec switch). Rare enough to just go blob by blob.
+        decoded = [decode_blob(blob, legacy_dtype_char, legacy_num_components) for blob in blobs]
+        num_rows = np.fromiter((len(values) for values in decoded), dtype=np.int64, count=len(decoded))
+        values = np.concatenate([values.reshape(-1) for values in decoded])
+        return (values if legacy_num_components == 1 else values.reshape(-1, legacy_num_components)), num_rows
+
+    codec, dtype_char, num_components = layouts.pop()
+    num_rows = np.fromiter((header[4] for header in headers), dtype=np.int64, count=len(headers))
+    total_rows = int(num_rows.sum())
+    numpy_dtype = _NUMPY_DTYPE_BY_CHAR[dtype_char]
+    if total_rows == 0:
+        return np.empty((0,) if num_components == 1 else (0, num_components), dtype=numpy_dtype), num_rows
+    deltas = _unzigzag(_varint_decode(b"".join(payloads), total_rows * num_components))
+
+    # Every blob holds num_components runs of num_rows deltas. cumsum the lot (in u64, where wrapping is defined and
+    # cancels out) and subtract each run's starting total to get per-run sums.
+    run_lengths = np.repeat(num_rows, num_components)
+    running_totals = np.cumsum(deltas.view(np.uint64))
+    run_starts = np.cumsum(run_lengths) - run_lengths
+    totals_before_run = np.where(run_starts > 0, running_totals[np.maximum(run_starts - 1, 0)], np.uint64(0))
+    integers = (running_totals - np.repeat(totals_before_run, run_lengths)).view(np.int64)
+
+    if num_components > 1:
+        # Component-major within each blob -> (total_rows, num_components) row-major
+        row_offsets = np.concatenate(([0], np.cumsum(num_rows)[:-1]))
+        blob_of_row = np.repeat(np.arange(len(blobs)), num_rows)
+        row_in_blob = np.arange(total_rows) - row_offsets[blob_of_row]
+        source_index = (num_components*row_offsets[blob_of_row] + row_in_blob)[:, None] + np.arange(num_components)[None, :] * num_rows[blob_of_row][:, None]
+        integers = integers[source_index]
+
+    values = integers.astype(numpy_dtype) if not quantization_steps else (integers * quantization_steps.pop()).astype(numpy_dtype)
+    return values, num_rows
@@ -0,0 +1,80 @@
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from protobuf_mysql_loader.helper_api_2_mysql import TRACK_FINGERPRINT_INSERT_INDEX
+from protobuf_mysql_loader.helper_record_batch import RecordBatch
+
+# Replays are at most a few responses (a retried token), so remembering roughly the last 30 responses' worth is plenty
+DEFAULT_NUM_RECENT_FINGERPRINTS = 100_000
+
+
+class RecentFingerprintCache:
+    """
+    Bounded, exact set of the track fingerprints we most recently committed. Two generations of plain sets: once the
+    current one fills up it becomes the previous one and the old previous one is dropped. Lookups and evictions are O(1)
+    with no per-entry bookkeeping, and memory stays between capacity/2 and capacity entries.
+    Exact on purpose. A Bloom filter's false positives would silently drop brand-new tracks.
+    """
+    def __init__(self, capacity:int=DEFAULT_NUM_RECENT_FINGERPRINTS):
+        self._generation_size = max(1, capacity // 2)
+        self._current:set = set()
+        self._previous:set = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, fingerprint:int) -> bool:
+        return fingerprint in self._current or fingerprint in self._previous
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def add_committed(self, fingerprints:Sequence[int]) -> None:
+        with self._lock:
+            for fingerprint in fingerprints:
+                if len(self._current) >= self._generation_size:
+                    self._previous, self._current = self._current, set()
+                self._current.add(fingerprint)
+
+    def drop_already_committed(self, list_of_tuple_records:Sequence[Tuple]) -> Tuple[Sequence[Tuple], List[int]]:
+        """ Returns the records still worth inserting (also deduped within the batch), plus their fingerprints. """
+        if isinstance(list_of_tuple_records, RecordBatch):
+            return self._drop_already_committed_from_record_batch(list_of_tuple_records)
+        records_to_insert = []
+        fingerprints_to_insert = []
+        seen_in_this_batch = set()
+        with self._lock:
+            for record in list_of_tuple_records:
+                fingerprint = record[TRACK_FINGERPRINT_INSERT_INDEX]
+                if fingerprint in self._current or fingerprint in self._previous or fingerprint in seen_in_this_batch:
+                    continue
+                seen_in_this_batch.add(fingerprint)
+                records_to_insert.append(record)
+                fingerprints_to_insert.append(fingerprint)
+        return records_to_insert, fingerprints_to_insert
+
+    def _drop_already_committed_from_record_batch(self, record_batch:RecordBatch) -> Tuple[RecordBatch, List[int]]:
+        # Only the fingerprint column is looked at, and the batch stays columnar (nothing dropped, nothing copied)
+        keep = []
+        fingerprints_to_insert = []
+        seen_in_this_batch = set()
+        with self._lock:
+            for i, fingerprint in enumerate(record_batch.column("track_fingerprint").tolist()):
+                if fingerprint in self._current or fingerprint in self._previous or fingerprint in seen_in_this_batch:
+                    continue
+                seen_in_this_batch.add(fingerprint)
+                keep.append(i)
+                fingerprints_to_insert.append(fingerprint)
+        if len(keep) == len(record_batch):
+            return record_batch, fingerprints_to_insert
+        return record_batch.take(keep), fingerprints_to_insert
+
+
+# Shared by every writer of a table in the process (same idea as get_logger). One per table, so a track that two feeds
+# both deliver still goes into each feed's table.
+_fingerprint_caches:Dict[Optional[str], RecentFingerprintCache] = {}
+_fingerprint_caches_lock = threading.Lock()
+
+def get_recent_fingerprint_cache(capacity:int=DEFAULT_NUM_RECENT_FINGERPRINTS, table_name:Optional[str]=None) -> RecentFingerprintCache:
+    with _fingerprint_caches_lock:
+        if table_name not in _fingerprint_caches:
+            _fingerprint_caches[table_name] = RecentFingerprintCache(capacity)
+        return _fingerprint_caches[table_name]
@@ -0,0 +1,208 @@
+import ssl
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_CA_BUNDLE_PATH
+from urllib3.util.ssl_ import create_urllib3_context
+
+# Transport for the API client. requests on its own reads each body into a list of chunks and joins them (so the body is
+# briefly in memory twice), has no timeouts (a stalled socket blocks the loop forever), and transparently decompresses,
+# so what we count is never what came over the wire. Here instead:
+#   - connections are kept alive in a pool sized for the threads that use the session, and the HTTPS ones share one
+#     SSLContext with the client cert loaded once, so a handshake only happens when a pooled connection has to be replaced
+#   - gzip/deflate is asked for explicitly, and only those, because the body is read raw and decompressed here
+#   - bodies are decompressed into a grow-only buffer that each thread reuses, and parsed straight out of it
+#   - every request gets a connect timeout and a read timeout. The read timeout bounds each socket read, not the whole body.
+#   - wire and decompressed byte counts are both reported
+#   - an error body is only read up to max_error_body_bytes, for the log
+
+CONTENT_ENCODINGS = "gzip, deflate" # what read_response_body can decode
+DEFAULT_INITIAL_BODY_BUFFER_BYTES = 8 * 1024**2
+
+
+@dataclass
+class TransportSettings:
+    connect_timeout_s:float = 10
+    read_timeout_s:float = 120          # longest wait for the next bytes of a response, not for the whole of it
+    pool_maxsize:int = 4                # keep-alive connections kept per host. Set it to the number of threads sharing the session.
+    compress:bool = True                # ask for gzip/deflate
+    read_chunk_size:int = 256 * 1024    # wire bytes per socket read
+    max_body_bytes:int = 1024**3        # decompressed. Past this the response is abandoned rather than inflated any further.
+    max_error_body_bytes:int = 2048     # of a non-200 body, kept for the log
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        return (self.connect_timeout_s, self.read_timeout_s)
+
+
+@dataclass
+class ResponseBody:
+    body:memoryview # into the reading thread's buffer: valid until that thread reads its next response
+    num_wire_bytes:int
+
+    @property
+    def num_bytes(self) -> int:
+        return len(self.body)
+
+
+class ApiTransportAdapter(HTTPAdapter):
+    """ HTTPAdapter with a default (connect, read) timeout and, optionally, one SSLContext shared by every pooled connection """
+    def __init__(self, settings:TransportSettings, ssl_context:Optional[ssl.SSLContext]=None):
+        self.settings = settings
+        self._ssl_context = ssl_context # set before HTTPAdapter.__init__, which builds the pool manager
+        super().__init__(pool_connections=1, pool_maxsize=settings.pool_maxsize)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self._ssl_context is not None:
+            kwargs["ssl_context"] = self._ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout if timeout is not None else self.settings.timeout, **kwargs)
+
+
+def client_cert_ssl_context(client_cert_path:str, client_priv_key_path:str) -> ssl.SSLContext:
+    ssl_context = create_urllib3_context()
+    # urllib3 loads no CAs into a context it's handed, and requests only passes a bundle along for verify=<path> (or
+    # REQUESTS_CA_BUNDLE). So trust what requests would have trusted by default.
+    ssl_context.load_verify_locations(DEFAULT_CA_BUNDLE_PATH)
+    ssl_context.load_cert_chain(client_cert_path, client_priv_key_path)
+    return ssl_context
+
+
+def configure_api_session(session:requests.Session, settings:Optional[TransportSettings]=None, ssl_context:Optional[ssl.SSLContext]=None) -> requests.Session:
+    """ Mounts the transport on session for http and https. Returns the session, with the settings as session.transport_settings. """
+    settings = settings if settings is not None else TransportSettings()
+    adapter = ApiTransportAdapter(settings, ssl_context=ssl_context)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = CONTENT_ENCODINGS if settings.compress else "identity"
+    session.headers["Connection"] = "keep-alive"
+    session.transport_settings = settings
+    return session
+
+
+def transport_settings_of(session:requests.Session) -> TransportSettings:
+    return getattr(session, "transport_settings", None) or TransportSettings()
+
+
+class BodyBuffer:
+    """ Grow-only bytearray. Growing copies into a new one instead of resizing, so an outstanding view never blocks it. """
+    def __init__(self, initial_bytes:int=DEFAULT_INITIAL_BODY_BUFFER_BYTES):
+        self._buffer = bytearray(initial_bytes)
+        self._length = 0
+
+    def reset(self, size_hint:int=0) -> None:
+        self._length = 0
+        self._reserve(size_hint)
+
+    def _reserve(self, num_bytes:int) -> None:
+        if num_bytes > len(self._buffer):
+            grown = bytearray(max(num_bytes, 2 * len(self._buffer)))
+            grown[:self._length] = self._buffer[:self._length]
+            self._buffer = grown
+
+    def append(self, data:bytes) -> None:
+        end = self._length + len(data)
+        self._reserve(end)
+        self._buffer[self._length:end] = data
+        self._length = end
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer)
+
+    def view(self) -> memoryview:
+        return memoryview(self._buffer)[:self._length]
+
+
+# One buffer per thread: the pipelined fetch stage, the backfill windows and the multi-feed workers each read their own
+_body_buffers = threading.local()
+
+def get_body_buffer() -> BodyBuffer:
+    if not hasattr(_body_buffers, "buffer"):
+        _body_buffers.buffer = BodyBuffer()
+    return _body_buffers.buffer
+
+
+class _DeflateDecoder:
+    # "deflate" is meant to be zlib-wrapped, but some servers send raw deflate. Try the former, fall back on the first chunk.
+    def __init__(self):
+        self._decoder = zlib.decompressobj()
+        self._is_first_chunk = True
+
+    def decompress(self, data:bytes, max_length:int) -> bytes:
+        if not self._is_first_chunk:
+            return self._decoder.decompress(data, max_length)
+        self._is_first_chunk = False
+        try:
+            return self._decoder.decompress(data, max_length)
+        except zlib.error:
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decoder.decompress(data, max_length)
+
+    def flush(self) -> bytes:
+        return self._decoder.flush()
+
+
+def _content_decoder(content_encoding:Optional[str]):
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return _DeflateDecoder()
+    raise ValueError(f"Unsupported Content-Encoding {content_encoding!r} (asked for {CONTENT_ENCODINGS})")
+
+
+def read_response_body(response:requests.Response, settings:TransportSettings, body_buffer:Optional[BodyBuffer]=None) -> ResponseBody:
+    """
+    Reads a response made with stream=True off the socket (raw, so still compressed) and decompresses it into body_buffer,
+    the calling thread's by default. Closes the response.
+    """
+    body_buffer = body_buffer if body_buffer is not None else get_body_buffer()
+    decoder = _content_decoder(response.headers.get("Content-Encoding"))
+    content_length = response.headers.get("Content-Length")
+    body_buffer.reset(size_hint=int(content_length) if decoder is None and content_length and content_length.isdigit() else 0)
+    num_wire_bytes = 0
+    is_complete = False
+    try:
+        while True:
+            chunk = response.raw.read(settings.read_chunk_size, decode_content=False)
+            if not chunk:
+                break
+            num_wire_bytes += len(chunk)
+            if decoder is not None:
+                room = settings.max_body_bytes - len(body_buffer)
+                chunk = decoder.decompress(chunk, room + 1) # never inflates more than the limit, however well it compresses
+            if len(body_buffer) + len(chunk) > settings.max_body_bytes:
+                raise ValueError(f"API response body is over {settings.max_body_bytes} bytes. Raise TransportSettings.max_body_bytes if that's expected.")
+            body_buffer.append(chunk)
+        if decoder is not None:
+            body_buffer.append(decoder.flush())
+        is_complete = True
+    finally:
+        if is_complete:
+            response.raw.release_conn() # back to the pool for the next request. Anything else closes the connection.
+        response.close()
+    return ResponseBody(body_buffer.view(), num_wire_bytes)
+
+
+def read_error_body(response:requests.Response, settings:TransportSettings) -> str:
+    """ The start of a non-200 body, for logging, without downloading (or decoding as text) the rest. Closes the response. """
+    try:
+        head = response.raw.read(settings.max_error_body_bytes + 1, decode_content=True) or b""
+    except Exception as e:
+        head = f"<couldn't read the body: {e}>".encode()
+    finally:
+        response.close() # drops the connection rather than draining a body nobody wants
+    truncated = len(head) > settings.max_error_body_bytes
+    return repr(head[:settings.max_error_body_bytes]) + (f" ... (truncated to {settings.max_error_body_bytes} bytes)" if truncated else "")
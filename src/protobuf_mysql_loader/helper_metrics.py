@@ -0,0 +1,298 @@
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from protobuf_mysql_loader.helper_logging import get_logger; logger=get_logger()
+
+# Hot-path recording never takes a lock and never formats a string. Each thread bumps its own shard (plain list / float
+# slots) and the shards are only summed and rendered when someone scrapes /metrics or the snapshot file is written.
+# Shards are registered once per thread per metric, which is the only time the lock is touched.
+
+DEFAULT_LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DEFAULT_LAG_BUCKETS_S = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600, 4*3600, 24*3600)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _ShardedMetric:
+    def __init__(self, name:str, help_text:str, labels:Labels, num_slots:int):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._num_slots = num_slots
+        self._local = threading.local()
+        self._shards:List[list] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> list:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = [0] * self._num_slots
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _summed_slots(self) -> list:
+        with self._shards_lock:
+            shards = list(self._shards)
+        return [sum(slot) for slot in zip(*shards)] if shards else [0] * self._num_slots
+
+
+class Counter(_ShardedMetric):
+    kind = "counter"
+
+    def __init__(self, name:str, help_text:str, labels:Labels=()):
+        super().__init__(name, help_text, labels, num_slots=1)
+
+    def inc(self, amount:float=1) -> None:
+        self._shard()[0] += amount
+
+    @property
+    def value(self) -> float:
+        return self._summed_slots()[0]
+
+
+class Histogram(_ShardedMetric):
+    """ Prometheus-style histogram. Slots are [count per bucket..., +Inf count, sum]. """
+    kind = "histogram"
+
+    def __init__(self, name:str, help_text:str, labels:Labels=(), buckets:Sequence[float]=DEFAULT_LATENCY_BUCKETS_S):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labels, num_slots=len(self.buckets) + 2)
+
+    def observe(self, value:float) -> None:
+        shard = self._shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def observe_many(self, values:Sequence[float]) -> None:
+        shard = self._shard()
+        buckets = self.buckets
+        for value in values:
+            shard[bisect.bisect_left(buckets, value)] += 1
+        shard[-1] += sum(values)
+
+    def time(self) -> "_Timer":
+        """ with histogram.time(): ... observes the wall time of the block. """
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], int, float]:
+        """ (cumulative counts per bucket, total count, sum) """
+        slots = self._summed_slots()
+        cumulative, running = [], 0
+        for count in slots[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative[:-1], running, slots[-1]
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram:Histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class Gauge:
+    """ Either set() directly (a single attribute store, so no lock needed) or computed at scrape time from a callback. """
+    kind = "gauge"
+
+    def __init__(self, name:str, help_text:str, labels:Labels=(), callback:Optional[Callable[[], float]]=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.callback = callback
+        self._value:float = 0.0
+
+    def set(self, value:float) -> None:
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        if self.callback is not None:
+            try:
+                return float(self.callback())
+            except Exception:
+                return float("nan")
+        return self._value
+
+
+def _freeze_labels(labels:Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _render_labels(labels:Labels, extra:Tuple[Tuple[str, str], ...]=()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class MetricsRegistry:
+    """
+    Asking for the same name + labels twice returns the same metric, so modules can grab their metrics at import time.
+    Rates (tracks/s, bytes/s) are derived from counter deltas between two collections, not computed on the hot path.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics:Dict[Tuple[str, Labels], object] = {}
+        self._last_counter_values:Dict[Tuple[str, Labels], Tuple[float, float]] = {}
+
+    def _get_or_create(self, metric_class, name:str, help_text:str, labels:Optional[Dict[str, str]], **kwargs):
+        key = (name, _freeze_labels(labels))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = metric_class(name, help_text, key[1], **kwargs)
+                self._metrics[key] = metric
+            elif kwargs.get("callback") is not None:
+                metric.callback = kwargs["callback"] # e.g. a new pipeline run with new queues
+            return metric
+
+    def counter(self, name:str, help_text:str, labels:Optional[Dict[str, str]]=None) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def histogram(self, name:str, help_text:str, labels:Optional[Dict[str, str]]=None, buckets:Sequence[float]=DEFAULT_LATENCY_BUCKETS_S) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def gauge(self, name:str, help_text:str, labels:Optional[Dict[str, str]]=None, callback:Optional[Callable[[], float]]=None) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labels, callback=callback)
+
+    def _sorted_metrics(self) -> list:
+        with self._lock:
+            return [self._metrics[key] for key in sorted(self._metrics)]
+
+    def render_prometheus_text(self) -> str:
+        """ Prometheus text exposition format (version 0.0.4) """
+        lines = []
+        last_name = None
+        for metric in self._sorted_metrics():
+            if metric.name != last_name:
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                last_name = metric.name
+            if isinstance(metric, Histogram):
+                cumulative_counts, count, total = metric.snapshot()
+                for upper_bound, cumulative_count in zip(metric.buckets, cumulative_counts):
+                    lines.append(f"{metric.name}_bucket{_render_labels(metric.labels, (('le', repr(float(upper_bound))),))} {cumulative_count}")
+                lines.append(f"{metric.name}_bucket{_render_labels(metric.labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{metric.name}_sum{_render_labels(metric.labels)} {total}")
+                lines.append(f"{metric.name}_count{_render_labels(metric.labels)} {count}")
+            else:
+                lines.append(f"{metric.name}{_render_labels(metric.labels)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """ Plain-dict view for the snapshot file, with per-second rates for every counter since the previous snapshot. """
+        now_s = time.monotonic()
+        snapshot = {"unix_time_s": time.time(), "counters": {}, "rates_per_s": {}, "gauges": {}, "histograms": {}}
+        for metric in self._sorted_metrics():
+            key = metric.name + _render_labels(metric.labels)
+            if isinstance(metric, Histogram):
+                cumulative_counts, count, total = metric.snapshot()
+                snapshot["histograms"][key] = {"count": count, "sum": total, "mean": total / count if count else None,
+                                               "buckets": dict(zip([str(b) for b in metric.buckets], cumulative_counts))}
+            elif isinstance(metric, Counter):
+                value = metric.value
+                snapshot["counters"][key] = value
+                previous = self._last_counter_values.get((metric.name, metric.labels))
+                if previous is not None and now_s > previous[1]:
+                    snapshot["rates_per_s"][key] = (value - previous[0]) / (now_s - previous[1])
+                self._last_counter_values[(metric.name, metric.labels)] = (value, now_s)
+            else:
+                snapshot["gauges"][key] = metric.value
+        return snapshot
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry:MetricsRegistry = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render_prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # scrapes every few seconds would drown the real log
+
+
+class MetricsReporter:
+    """
+    Serves /metrics on host:port (Prometheus text format) and/or writes the snapshot dict as JSON to snapshot_path every
+    snapshot_interval_s, each on its own daemon thread. Pass port=None or snapshot_path=None to turn either off.
+    """
+    def __init__(self, registry:MetricsRegistry, host:str="127.0.0.1", port:Optional[int]=9108, snapshot_path:Optional[str]=None, snapshot_interval_s:float=60):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval_s = snapshot_interval_s
+        self._server:Optional[ThreadingHTTPServer] = None
+        self._stop_event = threading.Event()
+
+    def start(self) -> "MetricsReporter":
+        if self.port is not None:
+            handler_class = type("MetricsRequestHandler", (_MetricsRequestHandler, ), {"registry": self.registry})
+            self._server = ThreadingHTTPServer((self.host, self.port), handler_class)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info(f"Serving metrics on http://{self.host}:{self._server.server_address[1]}/metrics")
+        if self.snapshot_path is not None:
+            threading.Thread(target=self._snapshot_loop, name="metrics-snapshot", daemon=True).start()
+        return self
+
+    def write_snapshot(self) -> None:
+        # Write to a temp file and rename over the old one, so readers never see half a snapshot
+        temp_path = f"{self.snapshot_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.registry.snapshot(), f, indent=1)
+        os.replace(temp_path, self.snapshot_path)
+
+    def _snapshot_loop(self) -> None:
+        while not self._stop_event.wait(self.snapshot_interval_s):
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.warning(f"Couldn't write metrics snapshot to {self.snapshot_path}: {e}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# One registry per process (same idea as get_logger). Metrics recorded in the decode worker processes aren't visible
+# here, so the decoder times its calls from the parent side.
+_metrics_registry:Optional[MetricsRegistry] = None
+
+def get_metrics_registry() -> MetricsRegistry:
+    global _metrics_registry
+    if _metrics_registry is None:
+        _metrics_registry = MetricsRegistry()
+    return _metrics_registry
+
+
+def stage_seconds(stage:str) -> Histogram:
+    # Shared by every instrumented stage so they line up under one metric name in Prometheus
+    return get_metrics_registry().histogram("ingest_stage_seconds", "Wall time spent in each ingest stage, per call", labels={"stage": stage})
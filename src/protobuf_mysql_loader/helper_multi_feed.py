@@ -0,0 +1,313 @@
+import argparse
+import json
+import os
+import threading
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from protobuf_mysql_loader.db.mysql_utils import MySQLConnectionPool, ParallelBatchWriter, get_mysql_connection_object
+from protobuf_mysql_loader.db.mysql_creation import create_initial_table, ensure_track_fingerprint_unique_key, ensure_sky_cell_index, ensure_track_stats_columns
+from protobuf_mysql_loader.db.mysql_bulk_load import WRITER_EXECUTEMANY, WRITER_LOAD_DATA, TRACK_WRITERS
+from protobuf_mysql_loader.db.mysql_checkpoint import create_checkpoint_table
+from protobuf_mysql_loader.db.mysql_partition_manager import PartitionManager
+from protobuf_mysql_loader.helper_scraper_state import UsefulGlobalState
+from protobuf_mysql_loader.helper_api_query import get_api_session, query_api
+from protobuf_mysql_loader.helper_http_transport import TransportSettings
+from protobuf_mysql_loader.helper_parallel_decode import get_parallel_track_decoder, DEFAULT_MIN_TRACKS_FOR_PARALLEL_DECODE, ParallelTrackDecoder
+from protobuf_mysql_loader.helper_pipeline import TokenCheckpointTracker
+from protobuf_mysql_loader.helper_poll_scheduler import AdaptivePollScheduler, SystemClock, ERROR_UNCAUGHT
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry, MetricsReporter
+from protobuf_mysql_loader.helper_logging import get_logger; logger=get_logger()
+from protobuf_mysql_loader import a_main
+
+# Several feeds (API endpoint -> track table) scraped by one process. Each feed keeps what a_main keeps for its one feed:
+# its own token chain and checkpoint row, api_state JSON mirror, AdaptivePollScheduler and table. What they share is the
+# expensive part: one HTTP session (so one connection pool and TLS session per host), the decoder's process pool, and one
+# MySQL connection pool with its ParallelBatchWriter.
+#
+# A feed's polls are sequential (each one starts from the token the last one returned), so at most one per feed is in flight
+# and num_workers feeds are polled at once. When more feeds are due than there are workers, WeightedFairScheduler picks
+# which goes next, so a feed that keeps returning full pages can't crowd out one that only has a few tracks now and then.
+#
+# python -m protobuf_mysql_loader.helper_multi_feed feeds.json, where feeds.json is
+#   {"feeds": [{"name": "spacewatch", "base_url": "https://someapi.com/api/v1/abc", "table_name": "spacewatch_2024_07_10",
+#               "weight": 2, "polling": {"target_freshness_lag_s": 30, "desired_tracks_per_poll": 100}}, ...]}
+
+DEFAULT_MULTI_FEED_TRACKS_PER_BATCH = 10_000
+MAX_DISPATCH_WAIT_S = 1.0 # the dispatcher rechecks at least this often, so stop() is noticed promptly
+MAX_UNCAUGHT_FAILURES_PER_FEED = 100 # after that the feed is dropped (the others carry on), like a_main's MAX_UNCAUGHT_FAILURES_BEFORE_EXIT
+
+# Keyword arguments of AdaptivePollScheduler a feed's "polling" section may set
+POLLING_SETTINGS = ("target_freshness_lag_s", "min_poll_interval_s", "max_poll_interval_s", "full_page_num_tracks", "desired_tracks_per_poll", "max_time_without_tracks_s", "arrival_rate_smoothing")
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@dataclass
+class FeedConfig:
+    name:str
+    base_url:str
+    table_name:str                  # also the key of the feed's checkpoint row, so no two feeds may share one
+    weight:float = 1.0              # share of the workers while feeds are competing for them
+    state_file:Optional[str] = None # api_state JSON mirror. Defaults to api_state_<name>.json in the repo root.
+    polling:Dict[str, float] = field(default_factory=dict) # any of POLLING_SETTINGS
+
+    def __post_init__(self):
+        if self.weight <= 0:
+            raise ValueError(f"Feed {self.name!r}: weight must be > 0, got {self.weight}")
+        unknown = set(self.polling) - set(POLLING_SETTINGS)
+        if unknown:
+            raise ValueError(f"Feed {self.name!r}: unknown polling settings {sorted(unknown)}. Allowed: {POLLING_SETTINGS}")
+        if self.state_file is None:
+            self.state_file = os.path.join(_REPO_ROOT, f"api_state_{self.name}.json")
+
+
+def load_feed_configs(path:str) -> List[FeedConfig]:
+    with open(path, "r") as config_file:
+        config = json.load(config_file)
+    feed_configs = [FeedConfig(**feed) for feed in config["feeds"]]
+    for attribute in ("name", "table_name", "state_file"):
+        values = [getattr(feed_config, attribute) for feed_config in feed_configs]
+        duplicates = sorted({value for value in values if values.count(value) > 1})
+        if duplicates:
+            raise ValueError(f"Feeds must each have their own {attribute}. Shared: {duplicates}")
+    if not feed_configs:
+        raise ValueError(f"No feeds in {path}")
+    return feed_configs
+
+
+class Feed:
+    """ A feed's runtime state. Only the thread polling it touches the token state, scheduler and tracker. """
+    def __init__(self, config:FeedConfig, useful_global_state:UsefulGlobalState, poll_scheduler:AdaptivePollScheduler):
+        self.config = config
+        self.useful_global_state = useful_global_state
+        self.poll_scheduler = poll_scheduler
+        self.checkpoint_tracker = TokenCheckpointTracker()
+        self.next_poll_at_s:float = 0.0
+        self.in_flight:bool = False
+        self.is_active:bool = True
+        self.num_failures:int = 0
+        # Fair queueing tags, in "tracks per unit weight"
+        self.start_tag:float = 0.0
+        self.finish_tag:float = 0.0
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+
+class WeightedFairScheduler:
+    """
+    Start-time fair queueing over the feeds that are due. Each poll is charged its number of tracks (at least 1, for the
+    request itself) divided by the feed's weight. Among the feeds that are due and not already being polled, the one
+    with the smallest start tag max(its finish tag, the virtual time) goes next, and the virtual time moves up to it.
+    So while several feeds are backlogged they get workers in proportion to their weights, measured in tracks, and a
+    feed that was idle comes back at the current virtual time: it goes ahead of busier feeds, but can't bank credit for
+    the time it spent idle. Not thread-safe, MultiFeedRunner calls it under its lock.
+    """
+    def __init__(self, feeds:List[Feed]):
+        self.feeds = feeds
+        self.virtual_time:float = 0.0
+
+    def has_active_feeds(self) -> bool:
+        return any(feed.is_active for feed in self.feeds)
+
+    def _is_ready(self, feed:Feed, now_s:float) -> bool:
+        return feed.is_active and not feed.in_flight and feed.next_poll_at_s <= now_s
+
+    def next_ready(self, now_s:float) -> Optional[Feed]:
+        ready_feeds = [feed for feed in self.feeds if self._is_ready(feed, now_s)]
+        if not ready_feeds:
+            return None
+        feed = min(ready_feeds, key=lambda feed: (max(feed.finish_tag, self.virtual_time), feed.next_poll_at_s))
+        feed.start_tag = max(feed.finish_tag, self.virtual_time)
+        self.virtual_time = feed.start_tag
+        feed.in_flight = True
+        return feed
+
+    def complete(self, feed:Feed, num_tracks:int, next_poll_delay_s:float, now_s:float) -> None:
+        feed.finish_tag = feed.start_tag + max(1, num_tracks) / feed.config.weight
+        feed.next_poll_at_s = now_s + next_poll_delay_s
+        feed.in_flight = False
+
+    def seconds_until_next_ready(self, now_s:float) -> Optional[float]:
+        """ None when every active feed is being polled, i.e. only a completion can make one due """
+        waiting = [feed.next_poll_at_s for feed in self.feeds if feed.is_active and not feed.in_flight]
+        return max(0.0, min(waiting) - now_s) if waiting else None
+
+
+class MultiFeedRunner:
+    """
+    runner = MultiFeedRunner(load_feed_configs("feeds.json"))
+    runner.run() # until stop(), or until every feed has failed MAX_UNCAUGHT_FAILURES_PER_FEED times
+    """
+    def __init__(
+            self,
+            feed_configs:List[FeedConfig],
+            num_workers:Optional[int]=None,
+            max_decode_workers:int=4,
+            min_tracks_for_parallel_decode:int=DEFAULT_MIN_TRACKS_FOR_PARALLEL_DECODE,
+            tracks_per_batch:int=DEFAULT_MULTI_FEED_TRACKS_PER_BATCH,
+            track_writer:str=WRITER_EXECUTEMANY,
+            num_db_writers:int=4,
+            use_db_checkpoint:bool=True,
+            idempotent_ingest:bool=True,
+            session:Optional[requests.Session]=None, # defaults to get_api_session with a keep-alive pool of num_workers connections
+            mysql_pool:Optional[MySQLConnectionPool]=None,
+            clock=None,
+    ):
+        self.feed_configs = feed_configs
+        self.num_workers = num_workers or max(1, min(len(feed_configs), os.cpu_count() or 1))
+        self.tracks_per_batch = tracks_per_batch
+        self.track_writer = track_writer
+        self.use_db_checkpoint = use_db_checkpoint
+        self.idempotent_ingest = idempotent_ingest
+        self.clock = clock if clock is not None else SystemClock()
+        self.session = session if session is not None else get_api_session(TransportSettings(pool_maxsize=self.num_workers))
+        self.track_decoder:ParallelTrackDecoder = get_parallel_track_decoder(max_workers=max_decode_workers, min_tracks_for_parallel_decode=min_tracks_for_parallel_decode)
+        self.mysql_pool = mysql_pool if mysql_pool is not None else MySQLConnectionPool(pool_size=num_db_writers + 1, allow_local_infile=(track_writer==WRITER_LOAD_DATA))
+        self.db_writer = ParallelBatchWriter(self.mysql_pool, num_writers=num_db_writers)
+        self.feeds:List[Feed] = []
+        self.scheduler:Optional[WeightedFairScheduler] = None
+        self._condition = threading.Condition()
+        self._num_in_flight = 0
+        self._stop_event = threading.Event()
+
+    def setup(self) -> List[Feed]:
+        """ Creates or upgrades every feed's table and loads its token state. run() calls it if it hasn't been. """
+        feeds = []
+        with self.mysql_pool.connection() as mysql_connection:
+            if self.use_db_checkpoint:
+                create_checkpoint_table(mysql_connection)
+            for feed_config in self.feed_configs:
+                create_initial_table(feed_config.table_name, mysql_connection)
+                ensure_sky_cell_index(feed_config.table_name, mysql_connection)
+                ensure_track_stats_columns(feed_config.table_name, mysql_connection)
+                if self.idempotent_ingest:
+                    ensure_track_fingerprint_unique_key(feed_config.table_name, mysql_connection)
+                if self.use_db_checkpoint:
+                    useful_global_state = UsefulGlobalState.from_existing_state_file(mysql_connection=mysql_connection, table_name=feed_config.table_name, state_filename=feed_config.state_file)
+                else:
+                    useful_global_state = UsefulGlobalState.from_existing_state_file(state_filename=feed_config.state_file)
+                feeds.append(Feed(feed_config, useful_global_state, AdaptivePollScheduler(clock=self.clock, **feed_config.polling)))
+        self.feeds = feeds
+        self.scheduler = WeightedFairScheduler(feeds)
+        self._register_metrics()
+        return feeds
+
+    def _register_metrics(self) -> None:
+        metrics_registry = get_metrics_registry()
+        metrics_registry.gauge("multi_feed_polls_in_flight", "Feeds being polled right now", callback=lambda: self._num_in_flight)
+        for feed in self.feeds:
+            labels = {"feed": feed.name}
+            metrics_registry.gauge("feed_next_poll_delay_seconds", "How long the feed's scheduler last decided to wait before polling", labels=labels, callback=lambda feed=feed: feed.poll_scheduler.next_poll_delay_s)
+            metrics_registry.gauge("feed_arrival_rate_tracks_per_second", "Feed scheduler's smoothed estimate of how fast tracks arrive", labels=labels, callback=lambda feed=feed: feed.poll_scheduler.arrival_rate_tracks_per_s or 0)
+            metrics_registry.gauge("feed_is_active", "0 once the feed has been dropped after too many failures", labels=labels, callback=lambda feed=feed: int(feed.is_active))
+
+    def poll_feed(self, feed:Feed) -> Tuple[int, float]:
+        """ Fetches, decodes and writes one response of the feed. Returns its number of tracks and how long to wait before the next poll. """
+        start_time = timeit.default_timer()
+        useful_global_state = feed.useful_global_state
+        spacex_api_message = query_api(self.session, useful_global_state, poll_scheduler=feed.poll_scheduler, base_url=feed.config.base_url)
+        num_tracks = len(spacex_api_message.udl_observation_responses)
+        if num_tracks == 0:
+            useful_global_state.number_of_queries_in_a_row_where_we_didnt_receive_any_tracks += 1
+            return 0, feed.poll_scheduler.record_response(0) # the runner waits it out, not this worker
+        useful_global_state.number_of_queries_in_a_row_where_we_didnt_receive_any_tracks = 0
+
+        batches_of_record_tuples = list(self.track_decoder.yield_batches_of_record_tuples(spacex_api_message, num_tracks_per_batch=self.tracks_per_batch))
+        sequence_number = feed.checkpoint_tracker.allocate_sequence_number()
+        feed.checkpoint_tracker.register_response(sequence_number, useful_global_state.last_token_received, len(batches_of_record_tuples))
+        # The writer pool is shared by every feed, so the batches of busy feeds and quiet ones interleave on it
+        try:
+            self.db_writer.write_all(a_main.write_batch_and_checkpoint, [(batch, ) for batch in batches_of_record_tuples],
+                table_name=feed.config.table_name, track_writer=self.track_writer, useful_global_state=useful_global_state, checkpoint_tracker=feed.checkpoint_tracker,
+                sequence_number=sequence_number, use_db_checkpoint=self.use_db_checkpoint, idempotent_ingest=self.idempotent_ingest)
+        except BaseException:
+            feed.checkpoint_tracker.abandon(sequence_number) # the feed's next poll resumes from its checkpoint and fetches these again
+            raise
+        get_metrics_registry().counter("feed_tracks_total", "Tracks fetched and written per feed", labels={"feed": feed.name}).inc(num_tracks)
+        logger.info(f"[{feed.name}] {num_tracks} tracks fetched and written to {feed.config.table_name} in {timeit.default_timer()-start_time:.1f}s")
+        return num_tracks, feed.poll_scheduler.record_response(num_tracks, ingest_lag_s=a_main.newest_track_age_s(batches_of_record_tuples))
+
+    def _poll_and_reschedule(self, feed:Feed) -> None:
+        num_tracks = 0
+        try:
+            num_tracks, next_poll_delay_s = self.poll_feed(feed)
+            get_metrics_registry().counter("feed_polls_total", "API polls per feed", labels={"feed": feed.name}).inc()
+        except Exception:
+            feed.useful_global_state.mirror_state_to_file(force=True)
+            feed.num_failures += 1
+            next_poll_delay_s = feed.poll_scheduler.record_error(ERROR_UNCAUGHT)
+            logger.critical(f"[{feed.name}] Poll failed ({feed.num_failures} so far). Trying this feed again in {next_poll_delay_s:.0f}s", exc_info=True)
+        with self._condition:
+            if feed.num_failures >= MAX_UNCAUGHT_FAILURES_PER_FEED:
+                feed.is_active = False
+                logger.critical(f"[{feed.name}] Dropped after {feed.num_failures} failures. The other feeds carry on.")
+            self.scheduler.complete(feed, num_tracks, next_poll_delay_s, self.clock.now())
+            self._num_in_flight -= 1
+            self._condition.notify()
+
+    def run(self, max_polls:Optional[int]=None) -> None:
+        """ Polls feeds as they come due until stop(), every feed is dropped, or max_polls polls have been started. """
+        if self.scheduler is None:
+            self.setup()
+        logger.info(f"Polling {len(self.feeds)} feed(s) with {self.num_workers} worker(s): {', '.join(f'{feed.name} -> {feed.config.table_name} (weight {feed.config.weight:g})' for feed in self.feeds)}")
+        num_polls = 0
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="feed") as executor:
+            while not self._stop_event.is_set() and (max_polls is None or num_polls < max_polls):
+                with self._condition:
+                    if not self.scheduler.has_active_feeds():
+                        break
+                    feed = self.scheduler.next_ready(self.clock.now()) if self._num_in_flight < self.num_workers else None
+                    if feed is None:
+                        wait_s = self.scheduler.seconds_until_next_ready(self.clock.now()) if self._num_in_flight < self.num_workers else None
+                        self._condition.wait(timeout=min(MAX_DISPATCH_WAIT_S, wait_s) if wait_s is not None else MAX_DISPATCH_WAIT_S)
+                        continue
+                    self._num_in_flight += 1
+                executor.submit(self._poll_and_reschedule, feed)
+                num_polls += 1
+        for feed in self.feeds:
+            feed.useful_global_state.mirror_state_to_file(force=True)
+
+    def stop(self) -> None:
+        """ Feeds finish the poll they're on. Their checkpoints are committed with their data, so a restart resumes them. """
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        self.db_writer.shutdown()
+        self.mysql_pool.close_all()
+        self.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape several API feeds into their own track tables from one process, sharing the HTTP session, the decoder processes and the MySQL writers.")
+    parser.add_argument("config", help="JSON file with a \"feeds\" list (see the top of helper_multi_feed.py)")
+    parser.add_argument("--workers", type=int, default=None, help="feeds polled at once. Defaults to min(feeds, cores).")
+    parser.add_argument("--decode-workers", type=int, default=os.cpu_count() or 4, help="processes shared by every feed for decoding")
+    parser.add_argument("--db-writers", type=int, default=4, help="pooled connections shared by every feed for inserts")
+    parser.add_argument("--writer", choices=TRACK_WRITERS, default=WRITER_EXECUTEMANY)
+    parser.add_argument("--no-db-checkpoint", action="store_true", help="keep tokens in each feed's JSON state file only")
+    parser.add_argument("--no-idempotent", action="store_true", help="plain INSERTs, no fingerprint dedupe")
+    parser.add_argument("--manage-partitions", action="store_true", help="run a PartitionManager (defaults) for every feed's table")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Prometheus text format on http://127.0.0.1:<port>/metrics")
+    args = parser.parse_args()
+
+    runner = MultiFeedRunner(load_feed_configs(args.config), num_workers=args.workers, max_decode_workers=args.decode_workers, track_writer=args.writer, num_db_writers=args.db_writers, use_db_checkpoint=not args.no_db_checkpoint, idempotent_ingest=not args.no_idempotent)
+    runner.setup()
+    partition_managers = [PartitionManager(feed.config.table_name, get_mysql_connection_object).start() for feed in runner.feeds] if args.manage_partitions else []
+    metrics_reporter = MetricsReporter(get_metrics_registry(), port=args.metrics_port).start() if args.metrics_port else None
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        runner.stop()
+    finally:
+        for partition_manager in partition_managers:
+            partition_manager.stop()
+        runner.close()
@@ -0,0 +1,163 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Generator, Iterable, Optional, Sequence, Union
+
+from protobuf_mysql_loader.api_provider.project_pb2 import SomeClass
+from protobuf_mysql_loader.helper_api_2_mysql import tracks_insert_values, UTC_STRFTIME_STRING_SAFE_FOR_MYSQL
+from protobuf_mysql_loader.helper_record_batch import RecordBatch, RecordBatchBuilder
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry, stage_seconds, DEFAULT_LAG_BUCKETS_S
+from protobuf_mysql_loader.helper_logging import get_logger; logger=get_logger()
+
+
+# Below this many tracks, pickling bytes to the workers and tuples back costs more than decoding in this process.
+DEFAULT_MIN_TRACKS_FOR_PARALLEL_DECODE = 500
+# A few chunks per worker so one slow chunk doesn't leave the rest of the pool idle.
+_CHUNKS_PER_WORKER = 4
+# When the response is streamed we don't know the track count up front, so chunks are a fixed number of tracks instead
+DEFAULT_NUM_TRACKS_PER_STREAMED_CHUNK = 250
+
+_mysqlify_seconds = stage_seconds("mysqlify")
+_stream_fetch_and_mysqlify_seconds = stage_seconds("stream_fetch_and_mysqlify") # network and decoding overlap, so they can't be split
+_tracks_decoded_total = get_metrics_registry().counter("tracks_decoded_total", "Tracks turned into insert-ready tuples")
+_ingest_lag_seconds = get_metrics_registry().histogram("ingest_lag_seconds", "Time from a track's last ob to when we decoded it (i.e. its rx_time_utc)", buckets=DEFAULT_LAG_BUCKETS_S)
+
+_track_message_class = None
+
+def _get_track_message_class():
+    # The generated module doesn't give the repeated track message a stable import name, so grab it off the response message.
+    global _track_message_class
+    if _track_message_class is None:
+        _track_message_class = type(SomeClass().udl_observation_responses.add())
+    return _track_message_class
+
+
+def _view_to_bytes(track_view:Union[bytes, memoryview]) -> bytes:
+    # Views from StreamingTrackScanner cover a whole bytes object already, so hand that over instead of copying it again
+    if isinstance(track_view, memoryview):
+        if isinstance(track_view.obj, bytes) and track_view.nbytes == len(track_view.obj):
+            return track_view.obj
+        return track_view.tobytes()
+    return track_view
+
+
+def _decode_tracks_into_record_batch(tracks:Iterable) -> RecordBatch:
+    # One rx_time_utc per chunk instead of per track: they'd only differ by the microseconds it takes to decode them
+    rx_time_utc = datetime.now().strftime(UTC_STRFTIME_STRING_SAFE_FOR_MYSQL)
+    builder = RecordBatchBuilder()
+    for values in tracks_insert_values(list(tracks), rx_time_utc): # the whole chunk at once, for the vectorized stats
+        builder.append(values)
+    return builder.build()
+
+
+def decode_serialized_tracks(serialized_tracks:Sequence[bytes]) -> RecordBatch:
+    """ Runs inside the worker processes. Only bytes come in and only a columnar RecordBatch (a few arrays and buffers) goes out. """
+    track_message_class = _get_track_message_class()
+    def parse(serialized_track):
+        track = track_message_class()
+        track.ParseFromString(serialized_track)
+        return track
+    return _decode_tracks_into_record_batch(parse(serialized_track) for serialized_track in serialized_tracks)
+
+
+def _observe_decoded_tracks(record_batch:RecordBatch) -> None:
+    # Once per response, in the parent process (worker processes have their own, unscraped, metrics registry)
+    _tracks_decoded_total.inc(len(record_batch))
+    now_us = int(datetime.now(timezone.utc).timestamp() * 1_000_000) # rx_time_utc is a local-time string, so measure against real UTC here
+    _ingest_lag_seconds.observe_many(((now_us - record_batch.column("trackend_utc")) / 1e6).tolist())
+
+
+class ParallelTrackDecoder:
+    """
+    Persistent process pool for turning the tracks of one API response into insert-ready tuples.
+    mysqlify_track is CPU-bound so threads don't help (GIL). Small responses are decoded serially in this process.
+    """
+    def __init__(self, max_workers:int, min_tracks_for_parallel_decode:int=DEFAULT_MIN_TRACKS_FOR_PARALLEL_DECODE):
+        self.max_workers:int = max_workers
+        self.min_tracks_for_parallel_decode:int = min_tracks_for_parallel_decode
+        self._executor:Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock() # several threads (e.g. backfill windows) can share one decoder
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Spawned on first use and then kept for the life of the scraper, so we pay worker startup once.
+        with self._executor_lock:
+            if self._executor is None:
+                logger.info(f"Starting track decoding process pool with {self.max_workers} workers.")
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def decode_tracks(self, tracks) -> RecordBatch:
+        """ tracks is a repeated field (or list) of track messages. Output order matches input order. """
+        with _mysqlify_seconds.time():
+            record_batch = self._decode_tracks(tracks)
+        _observe_decoded_tracks(record_batch)
+        return record_batch
+
+    def _decode_tracks(self, tracks) -> RecordBatch:
+        num_tracks = len(tracks)
+        if self.max_workers <= 1 or num_tracks < self.min_tracks_for_parallel_decode:
+            return _decode_tracks_into_record_batch(tracks)
+
+        serialized_tracks = [track.SerializeToString() for track in tracks]
+        chunk_size = -(-num_tracks // (self.max_workers * _CHUNKS_PER_WORKER)) # ceil
+        chunks = [serialized_tracks[i:i+chunk_size] for i in range(0, num_tracks, chunk_size)]
+        # executor.map hands results back in submission order, so the original track order is kept
+        return RecordBatch.concatenate(list(self._get_executor().map(decode_serialized_tracks, chunks)))
+
+    def decode_serialized_track_stream(self, track_views:Iterable[Union[bytes, memoryview]], num_tracks_per_chunk:int=DEFAULT_NUM_TRACKS_PER_STREAMED_CHUNK) -> RecordBatch:
+        """
+        Same output as decode_tracks, but for serialized tracks that are still arriving (see helper_wire_scanner).
+        Chunks are submitted to the pool as soon as they fill, so decoding overlaps the download, and nothing is
+        re-serialized on the way to the workers. Streams shorter than min_tracks_for_parallel_decode are decoded in this process.
+        """
+        with _stream_fetch_and_mysqlify_seconds.time():
+            record_batch = self._decode_serialized_track_stream(track_views, num_tracks_per_chunk)
+        _observe_decoded_tracks(record_batch)
+        return record_batch
+
+    def _decode_serialized_track_stream(self, track_views:Iterable[Union[bytes, memoryview]], num_tracks_per_chunk:int) -> RecordBatch:
+        pending_serialized_tracks:List[bytes] = []
+        futures = []
+        for track_view in track_views:
+            pending_serialized_tracks.append(_view_to_bytes(track_view))
+            if self.max_workers <= 1:
+                continue
+            if futures or len(pending_serialized_tracks) >= self.min_tracks_for_parallel_decode:
+                # Big enough to be worth the IPC. Ship everything we have in chunk-sized pieces and keep going.
+                while len(pending_serialized_tracks) >= num_tracks_per_chunk:
+                    futures.append(self._get_executor().submit(decode_serialized_tracks, pending_serialized_tracks[:num_tracks_per_chunk]))
+                    pending_serialized_tracks = pending_serialized_tracks[num_tracks_per_chunk:]
+        # Whatever is left over (or the whole stream, if it stayed small) is decoded here while the workers finish up
+        record_batch_of_tail = decode_serialized_tracks(pending_serialized_tracks)
+        return RecordBatch.concatenate([future.result() for future in futures] + [record_batch_of_tail])
+
+    def yield_batches_of_record_tuples(self, api_message, num_tracks_per_batch:int) -> Generator[RecordBatch, None, None]:
+        # Same batching as yield_batches_of_docs, but the whole response is decoded up front across the pool. Each batch is
+        # a RecordBatch slice, which the writers take as a sequence of insert tuples.
+        record_batch = self.decode_tracks(api_message.udl_observation_responses)
+        for i in range(0, len(record_batch), num_tracks_per_batch):
+            yield record_batch[i:i+num_tracks_per_batch]
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+
+# Module-level decoder so the pool survives across run_scraper calls (same idea as get_logger)
+_track_decoder:Optional[ParallelTrackDecoder] = None
+
+def get_parallel_track_decoder(max_workers:int, min_tracks_for_parallel_decode:int=DEFAULT_MIN_TRACKS_FOR_PARALLEL_DECODE) -> ParallelTrackDecoder:
+    global _track_decoder
+    if _track_decoder is None or _track_decoder.max_workers != max_workers:
+        if _track_decoder is not None:
+            _track_decoder.shutdown()
+        _track_decoder = ParallelTrackDecoder(max_workers=max_workers, min_tracks_for_parallel_decode=min_tracks_for_parallel_decode)
+    _track_decoder.min_tracks_for_parallel_decode = min_tracks_for_parallel_decode
+    return _track_decoder
@@ -0,0 +1,159 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, NamedTuple
+
+from protobuf_mysql_loader.helper_logging import get_logger; logger=get_logger()
+
+
+# Put on a queue by a stage that has nothing more to send downstream
+END_OF_STREAM = object()
+_QUEUE_POLL_INTERVAL_S = 0.5
+
+
+class PipelineStopped(Exception):
+    """ Raised inside a stage when another stage failed, so every stage unwinds instead of blocking on a queue forever. """
+
+
+class StageRunner:
+    """
+    Runs pipeline stages on their own threads, connected by bounded queue.Queue objects.
+    A full queue blocks the producer (backpressure). The first exception in any stage stops every stage, and join() re-raises it.
+    """
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self._threads:List[threading.Thread] = []
+        self._errors:List[BaseException] = []
+
+    def start_stage(self, name:str, target:Callable, *args) -> None:
+        def _run_stage():
+            try:
+                target(*args)
+            except PipelineStopped:
+                pass
+            except BaseException as e:
+                logger.error(f"Pipeline stage '{name}' failed: {e}", exc_info=True)
+                self._errors.append(e)
+                self.stop_event.set()
+        thread = threading.Thread(target=_run_stage, name=f"pipeline-{name}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def put(self, q:queue.Queue, item:Any) -> None:
+        while True:
+            if self.stop_event.is_set():
+                raise PipelineStopped()
+            try:
+                q.put(item, timeout=_QUEUE_POLL_INTERVAL_S)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, q:queue.Queue) -> Any:
+        while True:
+            if self.stop_event.is_set():
+                raise PipelineStopped()
+            try:
+                return q.get(timeout=_QUEUE_POLL_INTERVAL_S)
+            except queue.Empty:
+                continue
+
+    def sleep(self, seconds:float) -> None:
+        # Like time.sleep but wakes up (and unwinds the stage) as soon as the pipeline is stopped
+        if self.stop_event.wait(seconds):
+            raise PipelineStopped()
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+
+class Checkpoint(NamedTuple):
+    sequence_number: int
+    token: str
+    rank: int # strictly increases across responses and across restarts, so a late write can never move the db checkpoint backwards
+
+
+class TokenCheckpointTracker:
+    """
+    Responses are numbered in the order they were fetched. The token returned with response N only becomes the
+    'successfully added to db' checkpoint once every batch of response N, and of every response before it, has committed.
+    That way a restart never skips data even if batches from several responses are in flight (or commit out of order).
+    A response whose write failed is abandon()ed: it never becomes the checkpoint itself, and stops holding back the ones after it.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending:Dict[int, List] = {} # sequence_number -> [token, num_batches_not_yet_committed], or [token, None] once abandoned
+        self._next_sequence_number_to_checkpoint:int = 0
+        self._next_sequence_number_to_allocate:int = 0
+        # Seconds since 1970 in the high digits, sequence number in the low ones. Fits a BIGINT UNSIGNED until the year 2554.
+        self._rank_base:int = int(time.time()) * 1_000_000_000
+
+    def allocate_sequence_number(self) -> int:
+        with self._lock:
+            sequence_number = self._next_sequence_number_to_allocate
+            self._next_sequence_number_to_allocate += 1
+            return sequence_number
+
+    def register_response(self, sequence_number:int, token:str, num_batches:int) -> None:
+        with self._lock:
+            self._pending[sequence_number] = [token, num_batches]
+            self._next_sequence_number_to_allocate = max(self._next_sequence_number_to_allocate, sequence_number + 1)
+
+    def _advance_frontier(self, committed_sequence_number:Optional[int], dry_run:bool) -> Optional[Checkpoint]:
+        # Caller holds the lock. With dry_run, answers "what would the checkpoint become if this batch committed?"
+        remaining = {seq: pending[1] for seq, pending in self._pending.items()}
+        if remaining.get(committed_sequence_number) is not None:
+            remaining[committed_sequence_number] -= 1
+        checkpoint = None
+        next_sequence_number = self._next_sequence_number_to_checkpoint
+        while next_sequence_number in remaining and remaining[next_sequence_number] in (0, None):
+            if remaining[next_sequence_number] == 0: # abandoned ones are stepped over without becoming the checkpoint
+                checkpoint = Checkpoint(next_sequence_number, self._pending[next_sequence_number][0], self._rank_base + next_sequence_number)
+            next_sequence_number += 1
+        if not dry_run:
+            for seq, count in remaining.items():
+                self._pending[seq][1] = count
+            for seq in range(self._next_sequence_number_to_checkpoint, next_sequence_number):
+                self._pending.pop(seq)
+            self._next_sequence_number_to_checkpoint = next_sequence_number
+        return checkpoint
+
+    def checkpoint_if_committed(self, sequence_number:int) -> Optional[Checkpoint]:
+        """
+        Peek used inside a batch's transaction, right before commit, to write the checkpoint alongside the data.
+        Only counts batches that have actually been marked committed, so it can lag but never run ahead of the data.
+        """
+        with self._lock:
+            return self._advance_frontier(sequence_number, dry_run=True)
+
+    def mark_batch_committed(self, sequence_number:int, on_advance:Optional[Callable[[Checkpoint], None]]=None) -> Optional[Checkpoint]:
+        """ Returns the new checkpoint if this commit moved it forward, else None. on_advance runs under the lock, so callbacks see checkpoints in order. """
+        with self._lock:
+            checkpoint = self._advance_frontier(sequence_number, dry_run=False)
+            if checkpoint is not None and on_advance is not None:
+                on_advance(checkpoint)
+        return checkpoint
+
+    def abandon(self, sequence_number:int) -> None:
+        """
+        Call when a batch of this response failed to commit. Its token is never checkpointed, and later responses can move
+        the checkpoint past it. Only safe because the caller's next fetch resumes from the last checkpoint, so the abandoned
+        response's tracks get fetched again under a new sequence number. Its other batches may still mark themselves
+        committed afterwards; that's ignored.
+        """
+        with self._lock:
+            if sequence_number not in self._pending:
+                return
+            self._pending[sequence_number][1] = None
+            # Drop it now if nothing older is waiting. Anything committed behind it is left for the next commit to checkpoint.
+            while self._pending.get(self._next_sequence_number_to_checkpoint, [None, 0])[1] is None:
+                self._pending.pop(self._next_sequence_number_to_checkpoint)
+                self._next_sequence_number_to_checkpoint += 1
+
+    @property
+    def num_responses_in_flight(self) -> int:
+        with self._lock:
+            return len(self._pending)
@@ -0,0 +1,177 @@
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+
+from protobuf_mysql_loader.helper_logging import get_logger; logger=get_logger()
+
+
+class SystemClock:
+    def now(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds:float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class FakeClock:
+    """ Drop-in for SystemClock that never blocks: sleep() just moves now() forward and remembers how long it was asked to wait. """
+    def __init__(self, start_s:float=0.0):
+        self._now_s = start_s
+        self.sleeps:List[float] = []
+
+    def now(self) -> float:
+        return self._now_s
+
+    def sleep(self, seconds:float) -> None:
+        self.sleeps.append(seconds)
+        self._now_s += max(0.0, seconds)
+
+    def advance(self, seconds:float) -> None:
+        self._now_s += seconds
+
+
+# Error classes, each with its own backoff counter
+ERROR_RATE_LIMITED = "rate_limited" # HTTP 429
+ERROR_SERVER = "server_error"       # HTTP 5xx
+ERROR_NETWORK = "network"           # connect/read timeouts and dropped connections
+ERROR_NO_TRACKS = "no_tracks"       # 200 but nothing in it
+ERROR_UNCAUGHT = "uncaught"         # anything that made it all the way up to the __main__ loop
+
+
+@dataclass
+class BackoffPolicy:
+    base_s: float
+    max_s: float
+    multiplier: float = 2.0
+
+    def delay_s(self, num_consecutive_errors:int, rng:random.Random) -> float:
+        # "Equal jitter": half the exponential delay is guaranteed, the other half is random, so retries from several
+        # scrapers (or feeds) spread out instead of hitting the API in lockstep.
+        capped_s = min(self.max_s, self.base_s * self.multiplier ** max(0, num_consecutive_errors - 1))
+        return capped_s / 2 + rng.uniform(0, capped_s / 2)
+
+
+DEFAULT_BACKOFF_POLICIES = {
+    ERROR_RATE_LIMITED: BackoffPolicy(base_s=5, max_s=120),
+    ERROR_SERVER: BackoffPolicy(base_s=10, max_s=300),
+    ERROR_NETWORK: BackoffPolicy(base_s=5, max_s=120),
+    ERROR_NO_TRACKS: BackoffPolicy(base_s=5, max_s=60),
+    ERROR_UNCAUGHT: BackoffPolicy(base_s=30, max_s=600),
+}
+
+
+def parse_retry_after_s(header_value:Optional[str], now_utc:Optional[datetime]=None) -> Optional[float]:
+    """ Retry-After is either a number of seconds or an HTTP date. Returns None if it's missing or unreadable. """
+    if not header_value:
+        return None
+    header_value = header_value.strip()
+    if header_value.isdigit():
+        return float(header_value)
+    try:
+        retry_at = parsedate_to_datetime(header_value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - (now_utc or datetime.now(timezone.utc))).total_seconds())
+
+
+class AdaptivePollScheduler:
+    """
+    Decides how long to wait before the next API poll, instead of fixed sleeps scattered around the main loop.
+      - A (nearly) full page, or falling behind the freshness target on a decent sized response: poll again right away.
+      - Otherwise wait roughly as long as it takes for desired_tracks_per_poll tracks to arrive at the observed rate
+        (EWMA of tracks/s), but never longer than target_freshness_lag_s, and clamped to [min, max]_poll_interval_s.
+      - Errors back off exponentially (with jitter) per error class. A Retry-After from the server wins over the backoff,
+        up to max_retry_after_s, so a bogus header (say a date next year) can't stall polling indefinitely.
+    Any response with tracks in it resets every error counter. All waiting goes through clock, so a FakeClock makes it testable.
+    """
+    def __init__(self, clock=None, target_freshness_lag_s:float=30, min_poll_interval_s:float=1, max_poll_interval_s:float=60, full_page_num_tracks:int=3000, desired_tracks_per_poll:int=100, max_time_without_tracks_s:float=3600, max_retry_after_s:float=600, arrival_rate_smoothing:float=0.3, backoff_policies:Optional[Dict[str, BackoffPolicy]]=None, rng:Optional[random.Random]=None):
+        self.clock = clock if clock is not None else SystemClock()
+        self.target_freshness_lag_s = target_freshness_lag_s
+        self.min_poll_interval_s = min_poll_interval_s
+        self.max_poll_interval_s = max_poll_interval_s
+        self.full_page_num_tracks = full_page_num_tracks
+        self.desired_tracks_per_poll = desired_tracks_per_poll
+        self.max_time_without_tracks_s = max_time_without_tracks_s
+        self.max_retry_after_s = max_retry_after_s
+        self.arrival_rate_smoothing = arrival_rate_smoothing
+        self.backoff_policies = {**DEFAULT_BACKOFF_POLICIES, **(backoff_policies or {})}
+        self.rng = rng if rng is not None else random.Random()
+
+        self.arrival_rate_tracks_per_s:Optional[float] = None
+        self.last_ingest_lag_s:Optional[float] = None
+        self._num_consecutive_errors:Dict[str, int] = {error_class: 0 for error_class in self.backoff_policies}
+        self._last_response_s:Optional[float] = None
+        self._last_tracks_s:float = self.clock.now()
+        self._next_poll_delay_s:float = 0.0
+
+    @property
+    def next_poll_delay_s(self) -> float:
+        return self._next_poll_delay_s
+
+    def record_response(self, num_tracks:int, ingest_lag_s:Optional[float]=None) -> float:
+        """
+        Call after every successful API response. ingest_lag_s is how old the newest data in it was (None if unknown).
+        Returns (and remembers) how long to wait before the next poll. Raises if we haven't seen tracks in too long.
+        """
+        now_s = self.clock.now()
+        if self._last_response_s is not None and now_s > self._last_response_s:
+            rate_sample = num_tracks / (now_s - self._last_response_s)
+            if self.arrival_rate_tracks_per_s is None:
+                self.arrival_rate_tracks_per_s = rate_sample
+            else:
+                self.arrival_rate_tracks_per_s += self.arrival_rate_smoothing * (rate_sample - self.arrival_rate_tracks_per_s)
+        self._last_response_s = now_s
+        if ingest_lag_s is not None:
+            self.last_ingest_lag_s = ingest_lag_s
+
+        if num_tracks == 0:
+            if now_s - self._last_tracks_s > self.max_time_without_tracks_s:
+                raise Exception(f"Haven't received any tracks in {now_s-self._last_tracks_s:.0f}s... what's up?")
+            self._next_poll_delay_s = self._backoff_delay_s(ERROR_NO_TRACKS)
+            return self._next_poll_delay_s
+
+        self._last_tracks_s = now_s
+        for error_class in self._num_consecutive_errors:
+            self._num_consecutive_errors[error_class] = 0
+
+        behind = ingest_lag_s is not None and ingest_lag_s > self.target_freshness_lag_s and num_tracks >= self.desired_tracks_per_poll
+        if num_tracks >= 0.9 * self.full_page_num_tracks or behind:
+            self._next_poll_delay_s = 0.0 # there's a backlog waiting for us
+        else:
+            rate = self.arrival_rate_tracks_per_s
+            time_to_fill_s = self.desired_tracks_per_poll / rate if rate else self.max_poll_interval_s
+            self._next_poll_delay_s = min(self.max_poll_interval_s, max(self.min_poll_interval_s, min(time_to_fill_s, self.target_freshness_lag_s)))
+        return self._next_poll_delay_s
+
+    def _backoff_delay_s(self, error_class:str) -> float:
+        self._num_consecutive_errors[error_class] += 1
+        return self.backoff_policies[error_class].delay_s(self._num_consecutive_errors[error_class], self.rng)
+
+    def record_error(self, error_class:str, retry_after_s:Optional[float]=None) -> float:
+        """ Returns (and remembers) how long to wait before trying again. """
+        backoff_delay_s = self._backoff_delay_s(error_class)
+        self._next_poll_delay_s = min(max(0.0, retry_after_s), self.max_retry_after_s) if retry_after_s is not None else backoff_delay_s
+        logger.warning(f"{error_class} #{self._num_consecutive_errors[error_class]} in a row. Waiting {self._next_poll_delay_s:.1f}s before trying again.")
+        return self._next_poll_delay_s
+
+    def num_consecutive_errors(self, error_class:str) -> int:
+        return self._num_consecutive_errors[error_class]
+
+    def wait_for_next_poll(self) -> None:
+        self.clock.sleep(self._next_poll_delay_s)
+
+
+# Module-level scheduler so the arrival rate and backoff state carry over between run_scraper calls (same idea as get_logger)
+_poll_scheduler:Optional[AdaptivePollScheduler] = None
+
+def get_poll_scheduler() -> AdaptivePollScheduler:
+    global _poll_scheduler
+    if _poll_scheduler is None:
+        _poll_scheduler = AdaptivePollScheduler()
+    return _poll_scheduler
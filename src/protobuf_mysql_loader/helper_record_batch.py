@@ -0,0 +1,299 @@
+from collections.abc import Sequence as SequenceABC
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from protobuf_mysql_loader.helper_api_2_mysql import MySQLRecord, MYSQL_RECORD_INSERT_COLUMNS, DATETIME_INSERT_COLUMNS, TRACK_TABLE_SCHEMA
+from protobuf_mysql_loader.helper_table_schema import KIND_STRING, KIND_BOOL, KIND_UINT64, KIND_NULLABLE_UINT64, KIND_FLOAT, KIND_NULLABLE_FLOAT, KIND_DATETIME, KIND_BLOB
+from protobuf_mysql_loader.helper_timestamps import naive_utc_datetime_to_us
+
+# A batch of tracks stored column by column instead of as one tuple (or MySQLRecord) per track:
+#   strings   -> dictionary encoded: the distinct values once, plus an int32 code per row (sensor ids repeat a lot)
+#   numbers   -> one typed NumPy array per column (sky_cell also has a validity mask, since it can be NULL, and NULL
+#                derived stats are NaN in theirs)
+#   datetimes -> int64 epoch us, only turned into datetime objects when a tuple is built
+#   blobs     -> one contiguous bytes buffer per column plus n+1 offsets
+# That's a few dozen objects per batch instead of ~25 per track, so it's much smaller in memory and pickles (to and from the
+# decode workers, into the spill buffer) at close to memcpy speed.
+#
+# RecordBatch is also a Sequence of insert tuples in MYSQL_RECORD_INSERT_COLUMNS order, built lazily a chunk of rows at a
+# time, so every writer that takes a list of tuples takes a RecordBatch unchanged. Hot paths (dedupe, LOAD DATA, payload
+# estimates, lag metrics) read the columns directly instead.
+
+# How each column is stored comes from its column() spec on MySQLRecord
+RECORD_BATCH_COLUMN_KINDS:Dict[str, str] = TRACK_TABLE_SCHEMA.insert_column_kinds
+
+_NUMPY_DTYPE_BY_KIND = {KIND_BOOL: np.bool_, KIND_UINT64: np.uint64, KIND_NULLABLE_UINT64: np.uint64, KIND_FLOAT: np.float64, KIND_NULLABLE_FLOAT: np.float64, KIND_DATETIME: np.int64}
+_ROWS_PER_TUPLE_CHUNK = 1024 # tuples are built this many rows at a time, column lists zipped together
+
+# Per column: (codes, categories) for strings, (values, valid) for nullable ints, (buffer, offsets) for blobs, else an array
+ColumnData = Union[np.ndarray, Tuple[np.ndarray, list], Tuple[np.ndarray, np.ndarray], Tuple[bytes, np.ndarray]]
+
+
+class RecordBatch(SequenceABC):
+    """ Columnar batch of tracks. Build with RecordBatchBuilder (or from_insert_tuples); iterate or index it for insert tuples. """
+    def __init__(self, num_rows:int, column_data:Dict[str, ColumnData]):
+        self._num_rows = num_rows
+        self._column_data = column_data
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return MYSQL_RECORD_INSERT_COLUMNS
+
+    def __len__(self) -> int:
+        return self._num_rows
+
+    def __repr__(self) -> str:
+        return f"RecordBatch({self._num_rows} rows, {self.nbytes/1024:.0f} KiB)"
+
+    @property
+    def nbytes(self) -> int:
+        """ Bytes held by the column buffers (string categories not counted) """
+        total = 0
+        for column, kind in RECORD_BATCH_COLUMN_KINDS.items():
+            data = self._column_data[column]
+            if kind == KIND_BLOB:
+                total += len(data[0]) + data[1].nbytes
+            elif kind in (KIND_STRING, KIND_NULLABLE_UINT64):
+                total += data[0].nbytes + (data[1].nbytes if kind == KIND_NULLABLE_UINT64 else 0)
+            else:
+                total += data.nbytes
+        return total
+
+    # ---- column access ----
+
+    def column(self, column:str) -> np.ndarray:
+        """ Raw array of a numeric or datetime column (datetimes as int64 epoch us). sky_cell's NULLs read as 0 (see is_valid) and the stats' as NaN. """
+        kind = RECORD_BATCH_COLUMN_KINDS[column]
+        if kind == KIND_NULLABLE_UINT64:
+            return self._column_data[column][0]
+        if kind in (KIND_STRING, KIND_BLOB):
+            raise TypeError(f"{column} is a {kind} column. Use column_values() for it.")
+        return self._column_data[column]
+
+    def is_valid(self, column:str) -> np.ndarray:
+        data = self._column_data[column]
+        if RECORD_BATCH_COLUMN_KINDS[column] == KIND_NULLABLE_UINT64:
+            return data[1]
+        if RECORD_BATCH_COLUMN_KINDS[column] == KIND_NULLABLE_FLOAT:
+            return ~np.isnan(data)
+        return np.ones(self._num_rows, dtype=bool)
+
+    def blob_buffer_and_offsets(self, column:str) -> Tuple[bytes, np.ndarray]:
+        """ Row i's blob is buffer[offsets[i]:offsets[i+1]] """
+        if RECORD_BATCH_COLUMN_KINDS[column] != KIND_BLOB:
+            raise TypeError(f"{column} isn't a blob column")
+        return self._column_data[column]
+
+    def string_codes_and_categories(self, column:str) -> Tuple[np.ndarray, list]:
+        """ Row i's value is categories[codes[i]] """
+        if RECORD_BATCH_COLUMN_KINDS[column] != KIND_STRING:
+            raise TypeError(f"{column} isn't a string column")
+        return self._column_data[column]
+
+    def column_values(self, column:str, start:int=0, stop:Optional[int]=None) -> list:
+        """ Plain Python values of one column, exactly as they appear in the insert tuples """
+        stop = self._num_rows if stop is None else stop
+        kind = RECORD_BATCH_COLUMN_KINDS[column]
+        data = self._column_data[column]
+        if kind == KIND_STRING:
+            codes, categories = data
+            return [categories[code] for code in codes[start:stop].tolist()]
+        if kind == KIND_BLOB:
+            buffer, offsets = data
+            bounds = offsets[start:stop+1].tolist()
+            return [buffer[bounds[i]:bounds[i+1]] for i in range(len(bounds) - 1)]
+        if kind == KIND_DATETIME:
+            return data[start:stop].astype("datetime64[us]").tolist() # naive datetime objects, same as us_to_naive_utc_datetime
+        if kind == KIND_NULLABLE_UINT64:
+            values, valid = data
+            return [value if is_valid else None for value, is_valid in zip(values[start:stop].tolist(), valid[start:stop].tolist())]
+        if kind == KIND_NULLABLE_FLOAT:
+            return [None if value != value else value for value in data[start:stop].tolist()] # NaN != NaN
+        return data[start:stop].tolist()
+
+    # ---- row access ----
+
+    def __iter__(self) -> Iterator[Tuple]:
+        for start in range(0, self._num_rows, _ROWS_PER_TUPLE_CHUNK):
+            stop = min(start + _ROWS_PER_TUPLE_CHUNK, self._num_rows)
+            yield from zip(*[self.column_values(column, start, stop) for column in MYSQL_RECORD_INSERT_COLUMNS])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._num_rows)
+            if step != 1:
+                return self.take(np.arange(start, stop, step))
+            return self._slice(start, max(start, stop))
+        if index < 0:
+            index += self._num_rows
+        if not 0 <= index < self._num_rows:
+            raise IndexError(f"row {index} out of range for a batch of {self._num_rows}")
+        return tuple(self.column_values(column, index, index + 1)[0] for column in MYSQL_RECORD_INSERT_COLUMNS)
+
+    def to_insert_tuples(self) -> List[Tuple]:
+        return list(self)
+
+    def mysql_record(self, index:int) -> MySQLRecord:
+        return MySQLRecord(None, *self[index])
+
+    def to_mysql_records(self) -> List[MySQLRecord]:
+        """ The per-track dataclass view, for callers that want attribute access. Costs what the columnar layout saves. """
+        return [MySQLRecord(None, *record) for record in self]
+
+    # ---- reshaping ----
+
+    def _slice(self, start:int, stop:int) -> "RecordBatch":
+        # Numeric columns are views. Blob bytes are copied (one memcpy per column) so a slice never pins or pickles the whole buffer.
+        column_data = {}
+        for column, kind in RECORD_BATCH_COLUMN_KINDS.items():
+            data = self._column_data[column]
+            if kind == KIND_BLOB:
+                buffer, offsets = data
+                column_data[column] = (buffer[offsets[start]:offsets[stop]], offsets[start:stop+1] - offsets[start])
+            elif kind == KIND_STRING:
+                column_data[column] = (data[0][start:stop], data[1])
+            elif kind == KIND_NULLABLE_UINT64:
+                column_data[column] = (data[0][start:stop], data[1][start:stop])
+            else:
+                column_data[column] = data[start:stop]
+        return RecordBatch(stop - start, column_data)
+
+    def take(self, indices:Union[Sequence[int], np.ndarray]) -> "RecordBatch":
+        """ Rows at indices (or where a boolean mask is True), in that order """
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        indices = indices.astype(np.int64, copy=False)
+        column_data = {}
+        for column, kind in RECORD_BATCH_COLUMN_KINDS.items():
+            data = self._column_data[column]
+            if kind == KIND_BLOB:
+                buffer, offsets = data
+                column_data[column] = _take_blobs(buffer, offsets, indices)
+            elif kind == KIND_STRING:
+                column_data[column] = (data[0][indices], data[1])
+            elif kind == KIND_NULLABLE_UINT64:
+                column_data[column] = (data[0][indices], data[1][indices])
+            else:
+                column_data[column] = data[indices]
+        return RecordBatch(len(indices), column_data)
+
+    @classmethod
+    def concatenate(cls, batches:Sequence["RecordBatch"]) -> "RecordBatch":
+        batches = [batch for batch in batches if len(batch)]
+        if len(batches) == 1:
+            return batches[0]
+        if not batches:
+            return RecordBatchBuilder().build()
+        column_data = {}
+        for column, kind in RECORD_BATCH_COLUMN_KINDS.items():
+            parts = [batch._column_data[column] for batch in batches]
+            if kind == KIND_BLOB:
+                offsets = [parts[0][1]]
+                for buffer, part_offsets in parts[1:]:
+                    offsets.append(part_offsets[1:] + offsets[-1][-1])
+                column_data[column] = (b"".join(buffer for buffer, _ in parts), np.concatenate(offsets))
+            elif kind == KIND_STRING:
+                column_data[column] = _concatenate_dictionary_columns(parts)
+            elif kind == KIND_NULLABLE_UINT64:
+                column_data[column] = (np.concatenate([values for values, _ in parts]), np.concatenate([valid for _, valid in parts]))
+            else:
+                column_data[column] = np.concatenate(parts)
+        return cls(sum(len(batch) for batch in batches), column_data)
+
+    @classmethod
+    def from_insert_tuples(cls, list_of_tuple_records:Sequence[Tuple]) -> "RecordBatch":
+        """ For tuples from elsewhere (old spill segments, tests). Datetime columns must hold naive UTC datetimes. """
+        if isinstance(list_of_tuple_records, RecordBatch):
+            return list_of_tuple_records
+        datetime_indices = [MYSQL_RECORD_INSERT_COLUMNS.index(column) for column in DATETIME_INSERT_COLUMNS]
+        builder = RecordBatchBuilder()
+        for record in list_of_tuple_records:
+            values = list(record)
+            for i in datetime_indices:
+                values[i] = naive_utc_datetime_to_us(values[i])
+            builder.append(values)
+        return builder.build()
+
+    # ---- fast paths for the writers ----
+
+    def payload_bytes(self) -> int:
+        """ Same number as mysql_bulk_load.estimate_payload_bytes on the tuples: str/bytes by length, everything else 8 """
+        total = 0
+        for column, kind in RECORD_BATCH_COLUMN_KINDS.items():
+            data = self._column_data[column]
+            if kind == KIND_BLOB:
+                total += len(data[0])
+            elif kind == KIND_STRING:
+                codes, categories = data
+                category_lengths = np.fromiter((len(category) for category in categories), dtype=np.int64, count=len(categories))
+                total += int(category_lengths[codes].sum()) if len(codes) else 0
+            else:
+                total += 8 * self._num_rows
+        return total
+
+
+def _take_blobs(buffer:bytes, offsets:np.ndarray, indices:np.ndarray) -> Tuple[bytes, np.ndarray]:
+    bounds = offsets.tolist()
+    pieces = [buffer[bounds[i]:bounds[i+1]] for i in indices.tolist()]
+    new_offsets = np.zeros(len(pieces) + 1, dtype=np.int64)
+    if pieces:
+        np.cumsum([len(piece) for piece in pieces], out=new_offsets[1:])
+    return b"".join(pieces), new_offsets
+
+
+def _concatenate_dictionary_columns(parts:List[Tuple[np.ndarray, list]]) -> Tuple[np.ndarray, list]:
+    # Merge the dictionaries and remap each part's codes into the merged one
+    categories:list = []
+    index_of:Dict[str, int] = {}
+    remapped_codes = []
+    for codes, part_categories in parts:
+        remap = np.empty(len(part_categories), dtype=np.int32)
+        for i, category in enumerate(part_categories):
+            code = index_of.get(category)
+            if code is None:
+                code = index_of[category] = len(categories)
+                categories.append(category)
+            remap[i] = code
+        remapped_codes.append(remap[codes] if len(codes) else codes.astype(np.int32))
+    return np.concatenate(remapped_codes), categories
+
+
+class RecordBatchBuilder:
+    """
+    Collects tracks one at a time (values as helper_api_2_mysql.track_insert_values returns them) and turns them into a
+    RecordBatch. Each column is appended to a plain list and converted once, in build().
+    """
+    def __init__(self):
+        self._values_by_column:List[list] = [[] for _ in MYSQL_RECORD_INSERT_COLUMNS]
+        self._num_rows = 0
+
+    def __len__(self) -> int:
+        return self._num_rows
+
+    def append(self, values:Sequence) -> None:
+        for column_values, value in zip(self._values_by_column, values):
+            column_values.append(value)
+        self._num_rows += 1
+
+    def build(self) -> RecordBatch:
+        column_data = {}
+        for column_values, (column, kind) in zip(self._values_by_column, RECORD_BATCH_COLUMN_KINDS.items()):
+            if kind == KIND_STRING:
+                dictionary:Dict[str, int] = {}
+                codes = np.fromiter((dictionary.setdefault(value, len(dictionary)) for value in column_values), dtype=np.int32, count=len(column_values))
+                column_data[column] = (codes, list(dictionary))
+            elif kind == KIND_BLOB:
+                offsets = np.zeros(len(column_values) + 1, dtype=np.int64)
+                if column_values:
+                    np.cumsum([len(value) for value in column_values], out=offsets[1:])
+                column_data[column] = (b"".join(column_values), offsets)
+            elif kind == KIND_NULLABLE_UINT64:
+                valid = np.fromiter((value is not None for value in column_values), dtype=bool, count=len(column_values))
+                column_data[column] = (np.fromiter((value or 0 for value in column_values), dtype=np.uint64, count=len(column_values)), valid)
+            elif kind == KIND_NULLABLE_FLOAT:
+                column_data[column] = np.fromiter((np.nan if value is None else value for value in column_values), dtype=np.float64, count=len(column_values))
+            else:
+                column_data[column] = np.array(column_values, dtype=_NUMPY_DTYPE_BY_KIND[kind])
+        return RecordBatch(self._num_rows, column_data)
@@ -0,0 +1,313 @@
+import os
+import mmap
+import json
+import time
+import zlib
+import struct
+import threading
+from datetime import datetime, timezone
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry
+from protobuf_mysql_loader.helper_logging import get_logger; logger=get_logger()
+
+# Capture of raw API responses, so rows can be re-derived from source after mysqlify_track or the schema changes, and so
+# real traffic can be replayed as a load test (see helper_response_replay.py).
+#
+# Every successful response body is appended, zlib compressed, to the active segment in <capture_dir>, together with the
+# token it was requested with, the token it returned and when it arrived. Segments rotate by size and by age, and the
+# oldest are deleted once the directory goes over max_total_bytes.
+#
+# Segment layout (little endian):
+#   file header:  b"PMLCAPTR", format version (u8), 7 pad bytes
+#   records:      b"CR", pad, request token length (u16), response token length (u16), compressed length (u32),
+#                 body length (u32), crc32 of the compressed body (u32), received time in epoch us (i64),
+#                 then the request token, the response token (both utf-8) and the compressed body
+# Each segment has a sidecar <segment>.idx with one JSON line per record (offset, time, tokens, sizes), so a replay can
+# find where to start without decompressing anything. The index is a convenience: records past its last line (a crash
+# between the two writes) are found by scanning the segment, and a torn last record is skipped the same way spill
+# segments handle it.
+
+CAPTURE_FILE_MAGIC = b"PMLCAPTR"
+CAPTURE_FORMAT_VERSION = 1
+CAPTURE_FILE_SUFFIX = ".cap"
+CAPTURE_INDEX_SUFFIX = ".idx"
+
+_FILE_HEADER = struct.Struct("<8sB7x")
+_RECORD_MAGIC = b"CR"
+_RECORD_HEADER = struct.Struct("<2sxxHHIIIq")
+
+DEFAULT_CAPTURE_SEGMENT_BYTES = 256 * 1024**2
+DEFAULT_CAPTURE_SEGMENT_AGE_S = 60*60 # one segment per hour at most, so old hours can be deleted (or copied off) as files
+DEFAULT_CAPTURE_MAX_BYTES = 50 * 1024**3
+DEFAULT_CAPTURE_COMPRESSION_LEVEL = 1 # the blobs are mostly packed floats, so higher levels cost CPU in the fetch path for little gain
+
+_captured_responses_total = get_metrics_registry().counter("capture_responses_total", "API responses appended to the capture")
+_captured_bytes_total = get_metrics_registry().counter("capture_bytes_written_total", "Compressed bytes appended to the capture")
+_capture_errors_total = get_metrics_registry().counter("capture_errors_total", "API responses that couldn't be captured (the scrape itself carried on)")
+
+
+class CapturedResponse(NamedTuple):
+    received_us:int # epoch us, UTC
+    request_token:str # "" for startTime queries
+    response_token:str
+    body:bytes # the serialized SomeClass, exactly as the API sent it (after HTTP decompression)
+
+    @property
+    def received_utc(self) -> datetime:
+        return datetime.fromtimestamp(self.received_us / 1e6, timezone.utc)
+
+
+class CaptureIndexEntry(NamedTuple):
+    segment_path:str
+    offset:int
+    received_us:int
+    request_token:str
+    response_token:str
+    body_bytes:int
+    compressed_bytes:int
+
+
+def _segment_number(path:str) -> int:
+    return int(os.path.basename(path).split("_", 1)[0])
+
+
+def list_capture_segments(capture_dir:str) -> List[str]:
+    """ Oldest first """
+    if not os.path.isdir(capture_dir):
+        return []
+    names = [name for name in os.listdir(capture_dir) if name.endswith(CAPTURE_FILE_SUFFIX) and name.split("_", 1)[0].isdigit()]
+    return sorted((os.path.join(capture_dir, name) for name in names), key=_segment_number)
+
+
+class CaptureSegmentReader:
+    """ Reads one segment out of an mmap. num_unreadable_bytes says how much a torn or corrupt tail left unread (0 for a healthy segment). """
+    def __init__(self, path:str):
+        self.path = path
+        self.num_unreadable_bytes = 0
+
+    def _records(self, start_offset:int, check_and_decompress:bool) -> Iterator[Tuple[int, int, str, str, int, int, Optional[bytes]]]:
+        # (offset, received_us, request_token, response_token, body length, compressed length, body or None)
+        self.num_unreadable_bytes = 0
+        with open(self.path, "rb") as segment_file:
+            file_size = os.fstat(segment_file.fileno()).st_size
+            if file_size < _FILE_HEADER.size:
+                return
+            with mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, version = _FILE_HEADER.unpack_from(mapped, 0)
+                if magic != CAPTURE_FILE_MAGIC or version != CAPTURE_FORMAT_VERSION:
+                    raise ValueError(f"{self.path} isn't a version {CAPTURE_FORMAT_VERSION} capture segment (magic {magic!r}, version {version})")
+                offset = max(start_offset, _FILE_HEADER.size)
+                while offset + _RECORD_HEADER.size <= file_size:
+                    magic, request_token_length, response_token_length, compressed_length, body_length, crc, received_us = _RECORD_HEADER.unpack_from(mapped, offset)
+                    tokens_start = offset + _RECORD_HEADER.size
+                    body_start = tokens_start + request_token_length + response_token_length
+                    end = body_start + compressed_length
+                    if magic != _RECORD_MAGIC or end > file_size:
+                        break
+                    body = None
+                    if check_and_decompress:
+                        compressed_body = mapped[body_start:end]
+                        if zlib.crc32(compressed_body) != crc:
+                            break
+                        body = zlib.decompress(compressed_body, bufsize=max(body_length, 1))
+                    request_token = mapped[tokens_start:tokens_start+request_token_length].decode("utf-8")
+                    response_token = mapped[tokens_start+request_token_length:body_start].decode("utf-8")
+                    yield offset, received_us, request_token, response_token, body_length, compressed_length, body
+                    offset = end
+                self.num_unreadable_bytes = file_size - offset
+        if self.num_unreadable_bytes:
+            logger.error(f"Capture segment {self.path} has {self.num_unreadable_bytes} unreadable bytes at offset {file_size - self.num_unreadable_bytes}. Everything before them is fine.")
+
+    def index_entries(self, start_offset:int=_FILE_HEADER.size) -> Iterator[CaptureIndexEntry]:
+        """ Walks the record headers from start_offset without checksumming or decompressing any bodies """
+        for offset, received_us, request_token, response_token, body_length, compressed_length, _ in self._records(start_offset, check_and_decompress=False):
+            yield CaptureIndexEntry(self.path, offset, received_us, request_token, response_token, body_length, compressed_length)
+
+    def responses(self, start_offset:int=_FILE_HEADER.size) -> Iterator[CapturedResponse]:
+        for _, received_us, request_token, response_token, _, _, body in self._records(start_offset, check_and_decompress=True):
+            yield CapturedResponse(received_us, request_token, response_token, body)
+
+
+def read_capture_index(segment_path:str) -> List[CaptureIndexEntry]:
+    """ The segment's sidecar index, plus anything appended after its last line (found by scanning the segment) """
+    entries:List[CaptureIndexEntry] = []
+    index_path = segment_path + CAPTURE_INDEX_SUFFIX
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as index_file:
+            for line in index_file:
+                try:
+                    fields = json.loads(line)
+                except ValueError:
+                    break # torn last line
+                entries.append(CaptureIndexEntry(segment_path, fields["offset"], fields["received_us"], fields["request_token"], fields["response_token"], fields["body_bytes"], fields["compressed_bytes"]))
+    end_of_indexed = entries[-1].offset + _RECORD_HEADER.size + len(entries[-1].request_token.encode("utf-8")) + len(entries[-1].response_token.encode("utf-8")) + entries[-1].compressed_bytes if entries else _FILE_HEADER.size
+    if end_of_indexed < os.path.getsize(segment_path):
+        entries.extend(CaptureSegmentReader(segment_path).index_entries(end_of_indexed))
+    return entries
+
+
+def iter_captured_responses(capture_dir:str, since_utc:Optional[datetime]=None, until_utc:Optional[datetime]=None, start_token:Optional[str]=None) -> Iterator[CapturedResponse]:
+    """
+    Captured responses oldest first. since_utc/until_utc bound the receive time ([since, until)). start_token skips ahead to
+    the response that was requested with that token, e.g. the checkpoint a table was at before the change being reprocessed.
+    The indexes pick the segment and offset to start from, so skipped records are never decompressed.
+    """
+    since_us = None if since_utc is None else int(since_utc.replace(tzinfo=since_utc.tzinfo or timezone.utc).timestamp() * 1_000_000)
+    until_us = None if until_utc is None else int(until_utc.replace(tzinfo=until_utc.tzinfo or timezone.utc).timestamp() * 1_000_000)
+    waiting_for_start_token = bool(start_token)
+    for segment_path in list_capture_segments(capture_dir):
+        index = read_capture_index(segment_path)
+        if not index:
+            continue
+        if waiting_for_start_token:
+            matches = [entry for entry in index if entry.request_token == start_token]
+            if not matches:
+                continue
+            waiting_for_start_token = False
+            start_offset = matches[0].offset
+        else:
+            start_offset = index[0].offset
+        if since_us is not None:
+            if index[-1].received_us < since_us:
+                continue
+            start_offset = max(start_offset, next(entry.offset for entry in index if entry.received_us >= since_us))
+        if until_us is not None and index[0].received_us >= until_us:
+            return
+        for captured_response in CaptureSegmentReader(segment_path).responses(start_offset):
+            if until_us is not None and captured_response.received_us >= until_us:
+                return
+            yield captured_response
+    if waiting_for_start_token:
+        logger.warning(f"No captured response was requested with token {start_token!r}. Nothing replayed.")
+
+
+class ResponseRecorder:
+    """
+    recorder = ResponseRecorder("capture/")
+    set_response_recorder(recorder) # query_api and stream_api_response now capture every successful response
+    ...
+    recorder.close()
+    Thread safe. Appends are flushed but not fsynced: a crash loses at most the last few responses, and the capture is a
+    copy of data that's also in MySQL, not the only one.
+    """
+    def __init__(
+            self,
+            capture_dir:str,
+            max_segment_bytes:int=DEFAULT_CAPTURE_SEGMENT_BYTES,
+            max_segment_age_s:float=DEFAULT_CAPTURE_SEGMENT_AGE_S,
+            max_total_bytes:Optional[int]=DEFAULT_CAPTURE_MAX_BYTES,
+            compression_level:int=DEFAULT_CAPTURE_COMPRESSION_LEVEL,
+    ):
+        self.capture_dir = capture_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age_s = max_segment_age_s
+        self.max_total_bytes = max_total_bytes
+        self.compression_level = compression_level
+
+        self._lock = threading.Lock()
+        os.makedirs(capture_dir, exist_ok=True)
+        existing_segments = list_capture_segments(capture_dir)
+        self._segment_bytes = {path: os.path.getsize(path) + self._index_size(path) for path in existing_segments}
+        self._next_segment_number = _segment_number(existing_segments[-1]) + 1 if existing_segments else 0
+        self._active_file = None
+        self._active_index_file = None
+        self._active_path:Optional[str] = None
+        self._active_opened_s = 0.0
+
+        metrics_registry = get_metrics_registry()
+        metrics_registry.gauge("capture_bytes", "Bytes of captured responses on disk, indexes included", callback=lambda: self.num_bytes)
+        metrics_registry.gauge("capture_segments", "Capture segment files on disk", callback=lambda: len(self._segment_bytes))
+
+    @staticmethod
+    def _index_size(segment_path:str) -> int:
+        index_path = segment_path + CAPTURE_INDEX_SUFFIX
+        return os.path.getsize(index_path) if os.path.exists(index_path) else 0
+
+    @property
+    def num_bytes(self) -> int:
+        return sum(list(self._segment_bytes.values())) # copied first, since the metrics thread calls this without the lock
+
+    def record(self, request_token:str, body:bytes, response_token:str, received_s:Optional[float]=None) -> None:
+        received_us = int((time.time() if received_s is None else received_s) * 1_000_000)
+        compressed_body = zlib.compress(body, self.compression_level) # outside the lock, it's the slow part
+        request_token_bytes = (request_token or "").encode("utf-8")
+        response_token_bytes = (response_token or "").encode("utf-8")
+        header = _RECORD_HEADER.pack(_RECORD_MAGIC, len(request_token_bytes), len(response_token_bytes), len(compressed_body), len(body), zlib.crc32(compressed_body), received_us)
+        with self._lock:
+            if self._active_file is not None and (self._segment_bytes[self._active_path] >= self.max_segment_bytes or time.monotonic() - self._active_opened_s >= self.max_segment_age_s):
+                self._seal_active_segment()
+            if self._active_file is None:
+                self._open_active_segment(received_us)
+            offset = self._active_file.tell()
+            self._active_file.write(header + request_token_bytes + response_token_bytes)
+            self._active_file.write(compressed_body)
+            self._active_file.flush()
+            index_line = json.dumps({"offset": offset, "received_us": received_us, "request_token": request_token or "", "response_token": response_token or "", "body_bytes": len(body), "compressed_bytes": len(compressed_body)}) + "\n"
+            self._active_index_file.write(index_line)
+            self._active_index_file.flush()
+            num_bytes_written = len(header) + len(request_token_bytes) + len(response_token_bytes) + len(compressed_body) + len(index_line)
+            self._segment_bytes[self._active_path] += num_bytes_written
+            self._delete_oldest_segments_over_limit()
+        _captured_responses_total.inc()
+        _captured_bytes_total.inc(num_bytes_written)
+
+    def _open_active_segment(self, received_us:int) -> None:
+        # Caller holds the lock. The name carries the first record's UTC hour so a human can find a time range with ls.
+        opened_utc = datetime.fromtimestamp(received_us / 1e6, timezone.utc)
+        self._active_path = os.path.join(self.capture_dir, f"{self._next_segment_number:010d}_{opened_utc:%Y%m%dT%H%M%SZ}{CAPTURE_FILE_SUFFIX}")
+        self._next_segment_number += 1
+        self._active_file = open(self._active_path, "ab")
+        self._active_file.write(_FILE_HEADER.pack(CAPTURE_FILE_MAGIC, CAPTURE_FORMAT_VERSION))
+        self._active_index_file = open(self._active_path + CAPTURE_INDEX_SUFFIX, "a", encoding="utf-8")
+        self._active_opened_s = time.monotonic()
+        self._segment_bytes[self._active_path] = _FILE_HEADER.size
+
+    def _seal_active_segment(self) -> None:
+        # Caller holds the lock
+        for f in (self._active_file, self._active_index_file):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self._active_file, self._active_index_file, self._active_path = None, None, None
+
+    def _delete_oldest_segments_over_limit(self) -> None:
+        # Caller holds the lock. The active segment is never deleted, even if it alone is over the limit.
+        while self.max_total_bytes is not None and self.num_bytes > self.max_total_bytes:
+            oldest_path = min(self._segment_bytes, key=_segment_number)
+            if oldest_path == self._active_path:
+                return
+            for path in (oldest_path, oldest_path + CAPTURE_INDEX_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+            del self._segment_bytes[oldest_path]
+            logger.info(f"Deleted capture segment {os.path.basename(oldest_path)} to stay under {self.max_total_bytes/1024**3:.1f} GiB")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._active_file is not None:
+                self._seal_active_segment()
+
+
+# The live process has at most one (same idea as get_logger). None means capture is off.
+_response_recorder:Optional[ResponseRecorder] = None
+
+def set_response_recorder(recorder:Optional[ResponseRecorder]) -> None:
+    global _response_recorder
+    _response_recorder = recorder
+
+def get_response_recorder() -> Optional[ResponseRecorder]:
+    return _response_recorder
+
+
+def capture_response(request_token:Optional[str], body:bytes, response_token:str) -> None:
+    # Called by helper_api_query after each successful response. Capturing is best effort: a full disk must not stop the scrape.
+    recorder = _response_recorder
+    if recorder is None:
+        return None
+    try:
+        recorder.record(request_token or "", body, response_token)
+    except (OSError, ValueError):
+        _capture_errors_total.inc()
+        logger.error(f"Couldn't capture a {len(body)} byte API response", exc_info=True)
+    return None
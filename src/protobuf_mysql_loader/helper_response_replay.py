@@ -0,0 +1,133 @@
+import argparse
+import timeit
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
+
+from protobuf_mysql_loader.db.mysql_utils import get_mysql_connection_object, MySQLConnectionPool
+from protobuf_mysql_loader.db.mysql_creation import ensure_track_fingerprint_unique_key, ensure_track_stats_columns
+from protobuf_mysql_loader.db.mysql_checkpoint import create_checkpoint_table
+from protobuf_mysql_loader.db.mysql_bulk_load import WRITER_LOAD_DATA, TRACK_WRITERS
+from protobuf_mysql_loader.helper_scraper_state import UsefulGlobalState
+from protobuf_mysql_loader.helper_response_capture import CapturedResponse, iter_captured_responses
+from protobuf_mysql_loader.helper_metrics import get_metrics_registry
+from protobuf_mysql_loader.helper_logging import get_logger; logger=get_logger()
+from protobuf_mysql_loader import a_main
+
+# Replays captured API responses (helper_response_capture.py) through the live pipeline's decode and write stages, minus
+# the HTTP and the polling waits, so it runs as fast as the decoder pool and MySQL allow. Two uses:
+#   reprocessing: after a mysqlify_track or schema change, rebuild a table from the raw responses instead of the API,
+#                 which only goes back ~24h
+#   load testing: real responses, real sizes, real track mix, at full speed (and repeat to make it last)
+#
+# By default rows go in with INSERT IGNORE against the track_fingerprint unique key and the table's checkpoint row is
+# left alone, so replaying into a table the live scraper also writes to is safe.
+
+DEFAULT_REPLAY_TRACKS_PER_BATCH = 10_000
+
+
+@dataclass
+class ReplayStats:
+    responses:int
+    tracks:int
+    body_bytes:int
+    seconds:float
+
+    def __str__(self) -> str:
+        seconds = max(self.seconds, 1e-9)
+        return f"{self.responses} responses, {self.tracks} tracks, {self.body_bytes/1024**2:.1f} MiB in {self.seconds:.1f}s ({self.tracks/seconds:,.0f} tracks/s, {self.body_bytes/1024**2/seconds:.1f} MiB/s of responses)"
+
+
+class _CountingResponses:
+    def __init__(self, captured_responses:Iterable[CapturedResponse]):
+        self._captured_responses = captured_responses
+        self.num_responses = 0
+        self.num_body_bytes = 0
+
+    def __iter__(self) -> Iterator[CapturedResponse]:
+        for captured_response in self._captured_responses:
+            self.num_responses += 1
+            self.num_body_bytes += len(captured_response.body)
+            yield captured_response
+
+
+def replay_captured_responses(
+        capture_dir:str,
+        table_name:str,
+        mysql_conn,
+        since_utc:Optional[datetime]=None,
+        until_utc:Optional[datetime]=None,
+        start_token:Optional[str]=None,
+        max_responses:Optional[int]=None,
+        repeat:int=1,
+        max_decode_workers:int=4,
+        track_writer:str=WRITER_LOAD_DATA,
+        tracks_per_batch:int=DEFAULT_REPLAY_TRACKS_PER_BATCH,
+        mysql_pool:Optional[MySQLConnectionPool]=None,
+        num_db_writers:int=1,
+        idempotent_ingest:bool=True,
+        use_db_checkpoint:bool=False,
+) -> ReplayStats:
+    """
+    Feeds the captured responses in [since_utc, until_utc) (or from start_token on) through run_pipelined_scraper's
+    decode and write stages. repeat > 1 goes over the same responses again, which only inserts anything the second time
+    with idempotent_ingest off, i.e. as a load test against a scratch table.
+    use_db_checkpoint writes the captured tokens to the table's checkpoint row, which only makes sense for a table nothing
+    else is scraping into.
+    """
+    # Private state, like the backfill: nothing here touches api_state.json or the live scraper's in-memory token
+    useful_global_state = UsefulGlobalState(num_successful_api_calls_this_session=0, total_gigabytes_this_session=0, last_successful_time_we_saved_data_to_db_s=0, last_token_received='', last_token_received_for_data_sucessfully_added_to_db='', last_time_partitions_were_created_s=0)
+    useful_global_state.json_mirror_enabled = False
+    tracks_decoded_total = get_metrics_registry().counter("tracks_decoded_total", "Tracks turned into insert-ready tuples")
+    num_tracks_before = tracks_decoded_total.value
+
+    def captured_responses_for_every_pass():
+        for _ in range(repeat):
+            yield from iter_captured_responses(capture_dir, since_utc=since_utc, until_utc=until_utc, start_token=start_token)
+    counting_responses = _CountingResponses(captured_responses_for_every_pass())
+
+    start_time = timeit.default_timer()
+    a_main.run_pipelined_scraper(
+        requests_session=None, useful_global_state=useful_global_state, mysql_conn=mysql_conn, max_threads=max_decode_workers,
+        max_tracks_added_at_once=tracks_per_batch, table_name=table_name, max_responses=max_responses, track_writer=track_writer,
+        mysql_pool=mysql_pool, num_db_writers=num_db_writers, use_db_checkpoint=use_db_checkpoint, idempotent_ingest=idempotent_ingest,
+        captured_responses=counting_responses,
+    )
+    stats = ReplayStats(counting_responses.num_responses, int(tracks_decoded_total.value - num_tracks_before), counting_responses.num_body_bytes, timeit.default_timer() - start_time)
+    logger.info(f"Replayed into {table_name}: {stats}")
+    return stats
+
+
+def _parse_utc(value:str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured API responses into a track table through the normal decode and insert path, with no HTTP and no polling waits.")
+    parser.add_argument("table_name")
+    parser.add_argument("--capture-dir", required=True)
+    parser.add_argument("--since", type=_parse_utc, default=None, help="UTC receive time, ISO 8601")
+    parser.add_argument("--until", type=_parse_utc, default=None, help="UTC receive time, ISO 8601 (exclusive)")
+    parser.add_argument("--start-token", default=None, help="start at the response that was requested with this token")
+    parser.add_argument("--max-responses", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the same responses, for load testing (use with --no-idempotent)")
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--db-writers", type=int, default=1, help=">1 commits batches concurrently on pooled connections")
+    parser.add_argument("--writer", choices=TRACK_WRITERS, default=WRITER_LOAD_DATA)
+    parser.add_argument("--no-idempotent", action="store_true", help="plain INSERTs, no fingerprint dedupe (scratch tables only)")
+    parser.add_argument("--write-checkpoint", action="store_true", help="also move the table's checkpoint row to the replayed tokens")
+    args = parser.parse_args()
+
+    allow_local_infile = args.writer == WRITER_LOAD_DATA
+    mysql_conn = get_mysql_connection_object(allow_local_infile=allow_local_infile)
+    ensure_track_stats_columns(args.table_name, mysql_conn)
+    if not args.no_idempotent:
+        ensure_track_fingerprint_unique_key(args.table_name, mysql_conn)
+    if args.write_checkpoint:
+        create_checkpoint_table(mysql_conn)
+    mysql_pool = MySQLConnectionPool(pool_size=args.db_writers, allow_local_infile=allow_local_infile) if args.db_writers > 1 else None
+    try:
+        print(replay_captured_responses(args.capture_dir, args.table_name, mysql_conn, since_utc=args.since, until_utc=args.until, start_token=args.start_token, max_responses=args.max_responses, repeat=args.repeat, max_decode_workers=args.decode_workers, track_writer=args.writer, mysql_pool=mysql_pool, num_db_writers=args.db_writers, idempotent_ingest=not args.no_idempotent, use_db_checkpoint=args.write_checkpoint))
+    finally:
+        mysql_conn.close()
@@ -1,6 +1,10 @@
 import json
 import os
+import time
 import logging
+from typing import Optional
+
+from protobuf_mysql_loader.db.mysql_checkpoint import read_checkpoint_and_rank
 logger = logging.getLogger("main_logger")
 
 
@@ -17,7 +21,9 @@ class UsefulGlobalState:
             last_token_received:str,
             last_token_received_for_data_sucessfully_added_to_db:str,
             last_time_partitions_were_created_s:float,
+            state_filename:Optional[str]=None, # one per feed when a process runs several (helper_multi_feed.py)
     ):
+        self.state_filename:str = state_filename or UsefulGlobalState.desired_state_filename
         self.last_token_received:str = last_token_received
         self.total_gigabytes_this_session:float = total_gigabytes_this_session
         self.num_successful_api_calls_this_session:int = num_successful_api_calls_this_session
@@ -25,9 +31,22 @@ class UsefulGlobalState:
         self.last_token_received_for_data_sucessfully_added_to_db:str = last_token_received_for_data_sucessfully_added_to_db
         self.number_of_queries_in_a_row_where_we_didnt_receive_any_tracks:int = 0
         self.last_time_partitions_were_created_s:int = last_time_partitions_were_created_s
+        # api_state.json is only a mirror now (the db checkpoint table is the source of truth), so don't rewrite it on every API call
+        self.json_mirror_enabled:bool = True
+        self.json_mirror_interval_s:float = 60
+        self._last_json_mirror_s:float = 0
+
+    def mirror_state_to_file(self, force:bool=False) -> None:
+        # Cheap to call on the hot path. Writes api_state.json at most once every json_mirror_interval_s.
+        if not self.json_mirror_enabled:
+            return
+        now_s = time.monotonic()
+        if force or now_s - self._last_json_mirror_s >= self.json_mirror_interval_s:
+            self.save_state()
+            self._last_json_mirror_s = now_s
 
     def save_state(self):
-        with open(UsefulGlobalState.desired_state_filename, 'w') as output_file:
+        with open(self.state_filename, 'w') as output_file:
             output_file.write(
                 json.dumps(
                     {
@@ -42,9 +61,29 @@ class UsefulGlobalState:
             )
      
     @classmethod   
-    def from_existing_state_file(cls):
+    def from_existing_state_file(cls, mysql_connection=None, table_name:Optional[str]=None, spilled_checkpoint=None, state_filename:Optional[str]=None):
+        """
+        If a connection and table are given, the token checkpoint stored in MySQL (written in the same transactions as the data) wins over the JSON file.
+        spilled_checkpoint is the newest one left in the spill buffer (see db/mysql_spill_buffer.py). Its data is durable on
+        disk and will be drained, so it wins over the MySQL one when it ranks higher.
+        """
+        useful_global_state = cls._from_json_state_file(state_filename or UsefulGlobalState.desired_state_filename)
+        if mysql_connection is not None and table_name is not None:
+            db_token, db_rank = read_checkpoint_and_rank(mysql_connection, table_name) or (None, -1)
+            if spilled_checkpoint is not None and spilled_checkpoint.rank > db_rank:
+                logger.warning(f"The spill buffer holds data past the MySQL checkpoint for {table_name}. Resuming from the spilled checkpoint.")
+                db_token = spilled_checkpoint.token
+            if db_token:
+                if db_token != useful_global_state.last_token_received_for_data_sucessfully_added_to_db:
+                    logger.warning(f"api_state.json token differs from the MySQL checkpoint for {table_name}. Resuming from the MySQL checkpoint.")
+                useful_global_state.last_token_received_for_data_sucessfully_added_to_db = db_token
+                useful_global_state.last_token_received = db_token
+        return useful_global_state
+
+    @classmethod
+    def _from_json_state_file(cls, state_filename:str):
         try:
-            with open(UsefulGlobalState.desired_state_filename, 'r') as input_file:
+            with open(state_filename, 'r') as input_file:
                 state = json.loads(input_file.read())
                 logger.warning(f"Loaded state from existing api_state.json file. This should only happen at script startup! Resetting total_gigabytes_this_sessionto zero.")
                 return UsefulGlobalState(
@@ -53,7 +92,8 @@ class UsefulGlobalState:
                     last_token_received=state['last_token_received'],
                     last_token_received_for_data_sucessfully_added_to_db=state['last_token_received_for_data_sucessfully_added_to_db'],
                     last_successful_time_we_saved_data_to_db_s= state['last_successful_time_we_saved_data_to_db_s'],
-                    last_time_partitions_were_created_s=state['last_time_partitions_were_created_s']
+                    last_time_partitions_were_created_s=state['last_time_partitions_were_created_s'],
+                    state_filename=state_filename,
                 )
         except:
             logger.warning(f"Failed to load state from existing api_state.json file. Will initialize a blank one!")
@@ -64,4 +104,5 @@ class UsefulGlobalState:
                 last_token_received='',
                 last_token_received_for_data_sucessfully_added_to_db='',
                 last_time_partitions_were_created_s = 0,
+                state_filename=state_filename,
             )
\ No newline at end of file
@@ -0,0 +1,172 @@
+import math
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Hierarchical sky cells for the sky_cell column, so "tracks near this RA/Dec" can use an index instead of a scan.
+#
+# The sky is cut into 2**SKY_CELL_LEVEL RA bins by 2**SKY_CELL_LEVEL bins of z = sin(dec). Bins of equal z are equal area
+# (Lambert's cylindrical projection, the same trick HEALPix uses for its polar caps), so cells near the poles aren't
+# slivers. The cell id interleaves the RA bin's bits (even) with the z bin's bits (odd), i.e. a Z-order curve, which makes
+# the ids nested: a cell's parent k levels up is id >> 2k, and every descendant of a coarse cell is one contiguous id range.
+# A cone or box is therefore covered by a handful of coarse cells -> a handful of BETWEEN ranges on the index.
+#
+# At level 20 a cell is ~1.2 arcsec of RA by ~0.4 arcsec of dec at the equator, and ids fit in 40 bits.
+# Stored ids depend on the level, so changing SKY_CELL_LEVEL means recomputing the column for every row.
+
+SKY_CELL_LEVEL = 20
+DEFAULT_MAX_CELL_RANGES = 24 # BETWEENs per query. More ranges = tighter cover but a longer range scan plan.
+_MAX_CELLS_TO_ENUMERATE = 4096
+
+CellRange = Tuple[int, int] # inclusive, at SKY_CELL_LEVEL
+
+
+def _spread_bits(x:int) -> int:
+    # Moves bit i of a 32 bit int to bit 2i
+    x &= 0xFFFFFFFF
+    x = (x | (x << 16)) & 0x0000FFFF0000FFFF
+    x = (x | (x << 8)) & 0x00FF00FF00FF00FF
+    x = (x | (x << 4)) & 0x0F0F0F0F0F0F0F0F
+    x = (x | (x << 2)) & 0x3333333333333333
+    x = (x | (x << 1)) & 0x5555555555555555
+    return x
+
+
+def _cell_bins(ra_deg:float, dec_deg:float, level:int) -> Tuple[int, int]:
+    num_bins = 1 << level
+    ra_bin = int((ra_deg % 360.0) / 360.0 * num_bins)
+    z_bin = int((math.sin(math.radians(dec_deg)) + 1.0) * 0.5 * num_bins)
+    return min(ra_bin, num_bins - 1), min(max(z_bin, 0), num_bins - 1) # ra % 360 can round to 360.0 for tiny negatives
+
+
+def sky_cell_id(ra_deg:float, dec_deg:float, level:int=SKY_CELL_LEVEL) -> Optional[int]:
+    """ None for NaN/inf coordinates, which the nullable column stores as NULL """
+    if not (math.isfinite(ra_deg) and math.isfinite(dec_deg)):
+        return None
+    ra_bin, z_bin = _cell_bins(ra_deg, dec_deg, level)
+    return _spread_bits(ra_bin) | (_spread_bits(z_bin) << 1)
+
+
+def sky_cell_ids(ra_deg:np.ndarray, dec_deg:np.ndarray, level:int=SKY_CELL_LEVEL) -> np.ndarray:
+    """ Vectorized sky_cell_id, for backfilling the column. Non-finite coordinates come out as cell 0, so mask them first. """
+    num_bins = 1 << level
+    finite = np.isfinite(ra_deg) & np.isfinite(dec_deg)
+    ra_bin = np.where(finite, np.mod(ra_deg, 360.0) / 360.0 * num_bins, 0).astype(np.uint64)
+    z_bin = np.where(finite, (np.sin(np.radians(dec_deg)) + 1.0) * 0.5 * num_bins, 0).astype(np.uint64)
+    ra_bin, z_bin = np.minimum(ra_bin, np.uint64(num_bins - 1)), np.minimum(z_bin, np.uint64(num_bins - 1))
+
+    def spread_bits(x:np.ndarray) -> np.ndarray:
+        for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333), (1, 0x5555555555555555)):
+            x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+        return x
+    return spread_bits(ra_bin) | (spread_bits(z_bin) << np.uint64(1))
+
+
+@dataclass(frozen=True)
+class SkyCone:
+    ra_deg:float
+    dec_deg:float
+    radius_deg:float
+
+    def bounding_intervals(self) -> Tuple[List[Tuple[float, float]], float, float]:
+        """ ([(ra_lo, ra_hi), ...] within [0, 360], dec_lo, dec_hi) that contain the cone """
+        dec_lo, dec_hi = max(-90.0, self.dec_deg - self.radius_deg), min(90.0, self.dec_deg + self.radius_deg)
+        sin_radius, cos_dec = math.sin(math.radians(self.radius_deg)), math.cos(math.radians(self.dec_deg))
+        if self.radius_deg >= 90 or sin_radius >= cos_dec or dec_lo <= -90 or dec_hi >= 90:
+            return [(0.0, 360.0)], dec_lo, dec_hi # the cone contains a pole, so every RA is in play
+        half_width_deg = math.degrees(math.asin(sin_radius / cos_dec)) # widest RA extent of a small circle, exact
+        return _wrap_ra_interval(self.ra_deg - half_width_deg, self.ra_deg + half_width_deg), dec_lo, dec_hi
+
+    def contains(self, ra_deg:np.ndarray, dec_deg:np.ndarray) -> np.ndarray:
+        # Haversine, compared in haversine space so there's no arcsin per point
+        ra, dec = np.radians(ra_deg), np.radians(dec_deg)
+        center_ra, center_dec = math.radians(self.ra_deg), math.radians(self.dec_deg)
+        haversine = np.sin((dec - center_dec) / 2)**2 + np.cos(dec) * math.cos(center_dec) * np.sin((ra - center_ra) / 2)**2
+        return haversine <= math.sin(math.radians(self.radius_deg) / 2)**2
+
+
+@dataclass(frozen=True)
+class SkyBox:
+    """ ra_min_deg > ra_max_deg means the box wraps through RA 0, e.g. 350 -> 10 """
+    ra_min_deg:float
+    ra_max_deg:float
+    dec_min_deg:float
+    dec_max_deg:float
+
+    def bounding_intervals(self) -> Tuple[List[Tuple[float, float]], float, float]:
+        if self.ra_max_deg - self.ra_min_deg >= 360:
+            return [(0.0, 360.0)], self.dec_min_deg, self.dec_max_deg
+        ra_min, ra_max = self.ra_min_deg % 360.0, self.ra_max_deg % 360.0
+        ra_intervals = [(ra_min, ra_max)] if ra_min <= ra_max else [(ra_min, 360.0), (0.0, ra_max)]
+        return ra_intervals, max(-90.0, self.dec_min_deg), min(90.0, self.dec_max_deg)
+
+    def contains(self, ra_deg:np.ndarray, dec_deg:np.ndarray) -> np.ndarray:
+        in_dec = (dec_deg >= self.dec_min_deg) & (dec_deg <= self.dec_max_deg)
+        if self.ra_max_deg - self.ra_min_deg >= 360:
+            return in_dec
+        ra, ra_min, ra_max = np.mod(ra_deg, 360.0), self.ra_min_deg % 360.0, self.ra_max_deg % 360.0
+        in_ra = ((ra >= ra_min) & (ra <= ra_max)) if ra_min <= ra_max else ((ra >= ra_min) | (ra <= ra_max))
+        return in_dec & in_ra
+
+
+def _wrap_ra_interval(ra_lo:float, ra_hi:float) -> List[Tuple[float, float]]:
+    if ra_hi - ra_lo >= 360:
+        return [(0.0, 360.0)]
+    ra_lo, ra_hi = ra_lo % 360.0, ra_hi % 360.0
+    return [(ra_lo, ra_hi)] if ra_lo <= ra_hi else [(ra_lo, 360.0), (0.0, ra_hi)]
+
+
+def _bin_span(lo:float, hi:float, scale:float, num_bins:int) -> Tuple[int, int]:
+    return min(int(lo * scale), num_bins - 1), min(int(hi * scale), num_bins - 1)
+
+
+def sky_cell_ranges(region, max_ranges:int=DEFAULT_MAX_CELL_RANGES) -> List[CellRange]:
+    """
+    Inclusive (lo, hi) sky_cell ranges whose union covers region (a SkyCone or SkyBox). The cover is conservative, so
+    rows in range still need region.contains() to be exact. Uses the finest level whose cover is cheap to enumerate,
+    then merges the ranges closest together until there are at most max_ranges.
+    """
+    ra_intervals, dec_lo, dec_hi = region.bounding_intervals()
+    z_lo, z_hi = (math.sin(math.radians(dec_lo)) + 1.0) * 0.5, (math.sin(math.radians(dec_hi)) + 1.0) * 0.5
+    for level in range(SKY_CELL_LEVEL, -1, -1):
+        num_bins = 1 << level
+        ra_spans = [_bin_span(lo, hi, num_bins / 360.0, num_bins) for lo, hi in ra_intervals]
+        z_span = _bin_span(z_lo, z_hi, num_bins, num_bins)
+        num_cells = sum(hi - lo + 1 for lo, hi in ra_spans) * (z_span[1] - z_span[0] + 1)
+        if num_cells <= _MAX_CELLS_TO_ENUMERATE:
+            break
+
+    shift = 2 * (SKY_CELL_LEVEL - level)
+    codes = sorted(
+        _spread_bits(ra_bin) | (_spread_bits(z_bin) << 1)
+        for ra_lo, ra_hi in ra_spans for ra_bin in range(ra_lo, ra_hi + 1) for z_bin in range(z_span[0], z_span[1] + 1)
+    )
+    ranges:List[List[int]] = []
+    for code in codes:
+        lo, hi = code << shift, ((code + 1) << shift) - 1
+        if ranges and lo <= ranges[-1][1] + 1:
+            ranges[-1][1] = max(ranges[-1][1], hi)
+        else:
+            ranges.append([lo, hi])
+
+    if len(ranges) > max_ranges:
+        # Bridge the smallest gaps. Costs a few extra cells scanned, saves a lot of plan/ranges overhead.
+        gaps = sorted(range(len(ranges) - 1), key=lambda i: ranges[i+1][0] - ranges[i][1])
+        bridged = set(gaps[:len(ranges) - max_ranges])
+        merged = [ranges[0]]
+        for i in range(1, len(ranges)):
+            if i - 1 in bridged:
+                merged[-1] = [merged[-1][0], ranges[i][1]]
+            else:
+                merged.append(ranges[i])
+        ranges = merged
+    return [(lo, hi) for lo, hi in ranges]
+
+
+def cell_ranges_sql(ranges:Sequence[CellRange], column_name:str="sky_cell") -> Tuple[str, tuple]:
+    """ ("(sky_cell BETWEEN %s AND %s OR ...)", params) """
+    if not ranges:
+        return "FALSE", ()
+    sql = "(" + " OR ".join([f"{column_name} BETWEEN %s AND %s"] * len(ranges)) + ")"
+    return sql, tuple(bound for lo_hi in ranges for bound in lo_hi)
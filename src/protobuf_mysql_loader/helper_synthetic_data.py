@@ -0,0 +1,73 @@
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from protobuf_mysql_loader.api_provider.project_pb2 import SomeClass
+
+# Realistic-looking SomeClass responses for benchmarks and offline runs. Nothing here is physically accurate, it just has
+# the same shapes, value ranges and string lengths as what the API sends, so decode and insert costs are representative.
+_EARTH_RADIUS_KM = 6378.137
+_EARTH_ROTATION_RAD_PER_S = 7.2921159e-5
+_SENSOR_SITES = [(-33.1, 116.2, 0.3), (32.9, -106.7, 1.5), (19.8, -155.5, 4.2), (37.2, -2.5, 2.1), (-30.2, -70.8, 2.4)] # lat deg, lon deg, alt km
+
+
+def _sensor_position_and_velocity_itrf(site_index:int):
+    lat_deg, lon_deg, alt_km = _SENSOR_SITES[site_index % len(_SENSOR_SITES)]
+    lat, lon = math.radians(lat_deg), math.radians(lon_deg)
+    r_km = _EARTH_RADIUS_KM + alt_km
+    position_km = (r_km*math.cos(lat)*math.cos(lon), r_km*math.cos(lat)*math.sin(lon), r_km*math.sin(lat))
+    # A ground sensor only moves with the earth's rotation
+    velocity_kms = (-_EARTH_ROTATION_RAD_PER_S*position_km[1], _EARTH_ROTATION_RAD_PER_S*position_km[0], 0.0)
+    return position_km, velocity_kms
+
+
+def fill_synthetic_track(track, num_obs:int, rng:random.Random, start_time_utc:datetime) -> None:
+    """ Appends num_obs obs to an empty track message: one sensor, one object, ~1s cadence, a smooth arc across the sky. """
+    site_index = rng.randrange(len(_SENSOR_SITES))
+    position_km, velocity_kms = _sensor_position_and_velocity_itrf(site_index)
+    norad_id = rng.randint(1, 60_000)
+    orig_object_id = f"satellite{norad_id}" if rng.random() < 0.5 else str(norad_id)
+    orig_sensor_id = f"sensor-{11000+site_index*37}-{rng.randint(1, 8)}"
+    uct = rng.random() < 0.1
+    ra_deg, dec_deg = rng.uniform(0, 360), rng.uniform(-60, 60)
+    ra_rate_deg_per_s, dec_rate_deg_per_s = rng.uniform(-0.5, 0.5), rng.uniform(-0.5, 0.5)
+    mag = rng.uniform(6, 15)
+    for i in range(num_obs):
+        elapsed_s = i * rng.uniform(0.9, 1.1)
+        ob = track.udl_observation_data.add()
+        ob.ob_time.value = (start_time_utc + timedelta(seconds=elapsed_s)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        ob.ra.value = (ra_deg + ra_rate_deg_per_s*elapsed_s + rng.gauss(0, 1e-4)) % 360
+        ob.declination.value = max(-90.0, min(90.0, dec_deg + dec_rate_deg_per_s*elapsed_s + rng.gauss(0, 1e-4)))
+        ob.ra_unc.value = abs(rng.gauss(2e-4, 5e-5))
+        ob.declination_unc.value = abs(rng.gauss(2e-4, 5e-5))
+        ob.senx.value, ob.seny.value, ob.senz.value = position_km
+        ob.senvelx.value, ob.senvely.value, ob.senvelz.value = velocity_kms
+        ob.mag.value = mag + rng.gauss(0, 0.2)
+        # Track-level fields are repeated on every ob, same as the real feed
+        ob.id_on_orbit.value = ""
+        ob.id_sensor.value = ""
+        ob.sat_no.value = "" if uct else str(norad_id)
+        ob.orig_object_id.value = orig_object_id
+        ob.orig_sensor_id.value = orig_sensor_id
+        ob.uct.value = uct
+
+
+def make_synthetic_response(num_tracks:int, num_obs_per_track:int=20, token:Optional[str]=None, seed:int=0, end_time_utc:Optional[datetime]=None, obs_per_track_jitter:float=0.0) -> SomeClass:
+    """
+    num_obs_per_track is the mean. obs_per_track_jitter=0.5 draws each track's length uniformly from +-50% of it.
+    Tracks end at end_time_utc (default: now) minus a few minutes, so ingest lag looks like the live feed's.
+    """
+    rng = random.Random(seed)
+    end_time_utc = end_time_utc or datetime.now(timezone.utc).replace(tzinfo=None)
+    api_message = SomeClass()
+    api_message.token = token if token is not None else f"synthetic-token-{seed:08d}-{rng.getrandbits(64):016x}"
+    for _ in range(num_tracks):
+        num_obs = max(1, round(num_obs_per_track * (1 + rng.uniform(-obs_per_track_jitter, obs_per_track_jitter))))
+        start_time_utc = end_time_utc - timedelta(seconds=num_obs + rng.uniform(30, 300))
+        fill_synthetic_track(api_message.udl_observation_responses.add(), num_obs, rng, start_time_utc)
+    return api_message
+
+
+def make_synthetic_response_bytes(num_tracks:int, num_obs_per_track:int=20, token:Optional[str]=None, seed:int=0, **kwargs) -> bytes:
+    return make_synthetic_response(num_tracks, num_obs_per_track, token=token, seed=seed, **kwargs).SerializeToString()
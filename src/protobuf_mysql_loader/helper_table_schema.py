@@ -0,0 +1,106 @@
+from dataclasses import dataclass, field, fields, MISSING
+from operator import attrgetter
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# A table is specified once, as a dataclass whose fields are made with column(): each carries its SQL type and how a
+# RecordBatch stores it. TableSchema reads that back and derives everything that used to be a hand-kept copy of the
+# dataclass: the CREATE TABLE, the insert column order, the INSERT template, the RecordBatch column kinds and the
+# record -> insert tuple extractor. Add or change a field and all of them follow.
+
+# How a RecordBatch stores each column (see helper_record_batch.py)
+KIND_STRING = "string"
+KIND_BOOL = "bool"
+KIND_UINT64 = "uint64"
+KIND_NULLABLE_UINT64 = "nullable_uint64"
+KIND_FLOAT = "float"
+KIND_NULLABLE_FLOAT = "nullable_float"
+KIND_DATETIME = "datetime"
+KIND_BLOB = "blob"
+
+_COLUMN_METADATA_KEY = "mysql_column"
+
+
+@dataclass(frozen=True)
+class ColumnSpec:
+    name:str
+    sql_type:str               # e.g. "DOUBLE", "VARCHAR(64)", "TIMESTAMP(6)"
+    kind:str                   # one of the KIND_* above
+    nullable:bool = False
+    auto_increment:bool = False # assigned by MySQL, so never in the inserts
+    index_name:Optional[str] = None # KEY index_name (column, partition column)
+    unique:bool = False        # ... as a UNIQUE KEY
+
+    @property
+    def is_inserted(self) -> bool:
+        return not self.auto_increment
+
+    def definition_sql(self) -> str:
+        return f"{self.name} {self.sql_type} {'NULL' if self.nullable else 'NOT NULL'}{' AUTO_INCREMENT' if self.auto_increment else ''}"
+
+
+def column(sql_type:str, kind:str, nullable:bool=False, auto_increment:bool=False, index_name:Optional[str]=None, unique:bool=False, default=MISSING):
+    """ A dataclass field that is also a table column. default works like dataclasses.field's. """
+    spec = dict(sql_type=sql_type, kind=kind, nullable=nullable, auto_increment=auto_increment, index_name=index_name, unique=unique)
+    return field(default=default, metadata={_COLUMN_METADATA_KEY: spec})
+
+
+def insert_prefix_sql(table_name:str, columns:Sequence[str], ignore_duplicates:bool=False) -> str:
+    """ "INSERT [IGNORE] INTO table ( columns ) VALUES ", for single-row templates and multi-row statements alike """
+    return f"INSERT {'IGNORE ' if ignore_duplicates else ''}INTO {table_name} ( {','.join(columns)} ) VALUES "
+
+
+def insert_sql(table_name:str, columns:Sequence[str], ignore_duplicates:bool=False) -> str:
+    """ One-row INSERT with %s placeholders, as cursor.executemany wants it """
+    return insert_prefix_sql(table_name, columns, ignore_duplicates) + f"( {','.join(['%s']*len(columns))} );"
+
+
+class TableSchema:
+    """
+    schema = TableSchema(MySQLRecord, partition_column="trackstart_utc")
+    schema.create_table_sql("my_table")       # CREATE TABLE, partitioned for PartitionManager
+    schema.insert_sql("my_table")             # INSERT ... VALUES (%s, ...)
+    schema.record_to_insert_tuple(record)     # the record's values in schema.insert_columns order
+    """
+    def __init__(self, record_class, partition_column:str):
+        self.record_class = record_class
+        self.partition_column = partition_column
+        self.columns:Tuple[ColumnSpec, ...] = tuple(
+            ColumnSpec(name=f.name, **f.metadata[_COLUMN_METADATA_KEY]) for f in fields(record_class) if _COLUMN_METADATA_KEY in f.metadata
+        )
+        unspecified = [f.name for f in fields(record_class) if _COLUMN_METADATA_KEY not in f.metadata]
+        if unspecified:
+            raise TypeError(f"{record_class.__name__} fields {unspecified} weren't made with column(), so they have no SQL type")
+        self.column_by_name:Dict[str, ColumnSpec] = {spec.name: spec for spec in self.columns}
+        if partition_column not in self.column_by_name:
+            raise ValueError(f"{record_class.__name__} has no {partition_column} field to partition on")
+        self.insert_columns:Tuple[str, ...] = tuple(spec.name for spec in self.columns if spec.is_inserted)
+        self.insert_column_kinds:Dict[str, str] = {spec.name: spec.kind for spec in self.columns if spec.is_inserted}
+        # A single C-level call per record, instead of a Python-level getattr walk over the columns
+        self.record_to_insert_tuple:Callable = attrgetter(*self.insert_columns)
+        self.primary_key:Tuple[str, ...] = tuple(spec.name for spec in self.columns if spec.auto_increment) + (partition_column,)
+
+    def insert_sql(self, table_name:str, ignore_duplicates:bool=False) -> str:
+        return insert_sql(table_name, self.insert_columns, ignore_duplicates)
+
+    def index_definitions_sql(self) -> Dict[str, str]:
+        """ Key name -> its definition. Each key ends in the partition column: MySQL needs that for unique keys on a partitioned table, and it keeps range scans inside each pruned partition. """
+        return {spec.index_name: f"{'UNIQUE ' if spec.unique else ''}KEY {spec.index_name} ({spec.name}, {self.partition_column})"
+                for spec in self.columns if spec.index_name}
+
+    def create_table_sql(self, table_name:str, first_partition_bound_s:int) -> str:
+        """
+        RANGE partitioned on UNIX_TIMESTAMP(partition column), with one partition below first_partition_bound_s (unix
+        seconds) and the MAXVALUE catch-all. PartitionManager carves the real periods off the catch-all from there.
+        """
+        definitions = [spec.definition_sql() for spec in self.columns]
+        definitions.append(f"PRIMARY KEY ({', '.join(self.primary_key)})")
+        definitions.extend(self.index_definitions_sql().values())
+        body = ",\n    ".join(definitions)
+        return f"""
+CREATE TABLE IF NOT EXISTS {table_name} (
+    {body}
+)
+PARTITION BY RANGE (FLOOR(UNIX_TIMESTAMP({self.partition_column}))) (
+    PARTITION p_init VALUES LESS THAN ({int(first_partition_bound_s)}),
+    PARTITION p_max VALUES LESS THAN (MAXVALUE)
+);"""
@@ -0,0 +1,114 @@
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+from typing import Sequence
+
+import numpy as np
+
+# The API hands us ob_time as fixed-format Zulu strings like 2025-07-07T19:15:52.503105Z
+#                                                            0123456789012345678901234567
+# Slicing them by position is a lot cheaper than datetime.strptime, and never goes through local time.
+_DATE_END = 10
+_FRACTION_START = 20
+_MIN_ZULU_LENGTH = 21 # length with zero fractional digits, which isn't valid. Need at least one, like 2025-07-07T19:15:52.5Z
+_MAX_FRACTION_DIGITS = 6
+_SEPARATORS = ((4, ord('-')), (7, ord('-')), (10, ord('T')), (13, ord(':')), (16, ord(':')), (19, ord('.')))
+
+_US_PER_SECOND = 1_000_000
+_US_PER_DAY = 86_400 * _US_PER_SECOND
+_UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_UNIX_EPOCH_NAIVE_UTC = datetime(1970, 1, 1)
+
+
+@lru_cache(maxsize=1024)
+def _date_part_to_us(date_part:str) -> int:
+    # Obs in a track (and usually in a whole API response) share one or two dates, so this is almost always a cache hit.
+    return (date(int(date_part[0:4]), int(date_part[5:7]), int(date_part[8:10])).toordinal() - _UNIX_EPOCH_ORDINAL) * _US_PER_DAY
+
+
+def _looks_like_zulu(zulutime:str) -> bool:
+    # Every field is plain ASCII digits, so int() can't be handed signs, spaces or underscores it would happily accept
+    digits = zulutime[0:4] + zulutime[5:7] + zulutime[8:10] + zulutime[11:13] + zulutime[14:16] + zulutime[17:19] + zulutime[_FRACTION_START:-1]
+    return (
+        _MIN_ZULU_LENGTH < len(zulutime) <= _MIN_ZULU_LENGTH + _MAX_FRACTION_DIGITS
+        and zulutime[-1] == 'Z'
+        and all(ord(zulutime[i]) == sep for i, sep in _SEPARATORS)
+        and digits.isascii() and digits.isdigit()
+    )
+
+
+def zulu_iso8601_to_us(zulutime:str) -> int:
+    """
+    '2025-07-07T19:15:52.503105Z' -> 1751915752503105 (UTC microseconds since 1970). 1-6 fractional digits are accepted, like
+    strptime's %f. Anything before 1970 is rejected, since the blobs store these as unsigned.
+    """
+    if not _looks_like_zulu(zulutime):
+        raise ValueError(f"Not a fixed-format Zulu ISO-8601 timestamp: {zulutime!r}")
+    fraction = zulutime[_FRACTION_START:-1]
+    try:
+        hours, minutes, seconds = int(zulutime[11:13]), int(zulutime[14:16]), int(zulutime[17:19])
+        if not (0 <= hours < 24 and 0 <= minutes < 60 and 0 <= seconds < 60): # strptime rejected these, so we do too
+            raise ValueError("time of day out of range")
+        micro_time = (
+            _date_part_to_us(zulutime[:_DATE_END])
+            + (hours*3600 + minutes*60 + seconds) * _US_PER_SECOND
+            + int(fraction) * 10**(_MAX_FRACTION_DIGITS - len(fraction))
+        )
+        if micro_time < 0:
+            raise ValueError("before the unix epoch")
+        return micro_time
+    except ValueError as e:
+        raise ValueError(f"Not a fixed-format Zulu ISO-8601 timestamp: {zulutime!r}") from e
+
+
+def zulu_iso8601_batch_to_us(zulutimes:Sequence[str]) -> np.ndarray:
+    """
+    Vectorized zulu_iso8601_to_us for a whole track's worth of ob_time strings. Returns little-endian u64 epoch microseconds.
+    The strings are laid side by side in one uint8 matrix and every field is computed column-wise, so there's no per-ob Python work
+    beyond the join. Falls back to the scalar decoder if the strings don't all share one length (e.g. trimmed fractional digits).
+    """
+    n = len(zulutimes)
+    if n == 0:
+        return np.empty(0, dtype="<u8")
+    width = len(zulutimes[0])
+    joined = "".join(zulutimes).encode("ascii", errors="replace")
+    if len(joined) != width * n or not _looks_like_zulu(zulutimes[0]):
+        return np.fromiter((zulu_iso8601_to_us(z) for z in zulutimes), dtype="<u8", count=n)
+
+    chars = np.frombuffer(joined, dtype=np.uint8).reshape(n, width)
+    separators_ok = all((chars[:, i] == sep).all() for i, sep in _SEPARATORS) and (chars[:, -1] == ord('Z')).all()
+    digits = chars.astype(np.int64) - ord('0')
+    digit_columns = np.r_[0:4, 5:7, 8:10, 11:13, 14:16, 17:19, _FRACTION_START:width-1]
+    if not separators_ok or ((digits[:, digit_columns] < 0) | (digits[:, digit_columns] > 9)).any():
+        return np.fromiter((zulu_iso8601_to_us(z) for z in zulutimes), dtype="<u8", count=n) # raises on the bad one
+
+    n_fraction_digits = width - 1 - _FRACTION_START
+    fraction_weights = 10 ** np.arange(_MAX_FRACTION_DIGITS - 1, _MAX_FRACTION_DIGITS - 1 - n_fraction_digits, -1, dtype=np.int64)
+    fraction_us = digits[:, _FRACTION_START:width-1] @ fraction_weights
+    hours = digits[:, 11]*10 + digits[:, 12]
+    minutes = digits[:, 14]*10 + digits[:, 15]
+    seconds = digits[:, 17]*10 + digits[:, 18]
+    if (hours >= 24).any() or (minutes >= 60).any() or (seconds >= 60).any():
+        return np.fromiter((zulu_iso8601_to_us(z) for z in zulutimes), dtype="<u8", count=n) # raises on the bad one
+    seconds_of_day = hours*3600 + minutes*60 + seconds
+
+    # Dates repeat, so only look up each distinct one. Usually the whole track shares the first ob's date.
+    first_date = zulutimes[0][:_DATE_END]
+    if (chars[:, :_DATE_END] == chars[0, :_DATE_END]).all():
+        date_us = _date_part_to_us(first_date)
+    else:
+        date_us = np.fromiter((_date_part_to_us(z[:_DATE_END]) for z in zulutimes), dtype=np.int64, count=n)
+
+    micro_times = date_us + seconds_of_day * _US_PER_SECOND + fraction_us
+    if (micro_times < 0).any():
+        return np.fromiter((zulu_iso8601_to_us(z) for z in zulutimes), dtype="<u8", count=n) # raises on the bad one
+    return micro_times.astype("<u8")
+
+
+def us_to_naive_utc_datetime(micro_time:int) -> datetime:
+    # Exact (no float round trip). Only meant for the handful of per-track columns that MySQL wants as a DATETIME/TIMESTAMP.
+    return _UNIX_EPOCH_NAIVE_UTC + timedelta(microseconds=int(micro_time))
+
+
+def naive_utc_datetime_to_us(value:datetime) -> int:
+    # Exact inverse of us_to_naive_utc_datetime
+    return (value - _UNIX_EPOCH_NAIVE_UTC) // timedelta(microseconds=1)
@@ -0,0 +1,180 @@
+from dataclasses import dataclass, fields
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# Per-track statistics derived from the ob arrays, computed for a whole batch of tracks at once: every ob of every track
+# sits in one array and track i is rows obs_offsets[i]:obs_offsets[i+1] (the ColumnarTrackBatch layout). Sums go through
+# np.bincount, min/max through reduceat and medians through one lexsort, so the cost is a few dozen NumPy calls per batch
+# no matter how many tracks are in it.
+#
+# Ingest stores them as plain indexed columns next to the blobs (see helper_api_2_mysql.tracks_insert_values), and
+# db/mysql_track_stats.py backfills them for rows written before they existed. So a screening query like "fast movers
+# brighter than mag 6 yesterday" is an index range scan, not a decode of every blob in the partition.
+#
+# RA/Dec rates come from a least-squares line per track, fit on RA unwrapped around the track's first ob so a track that
+# crosses 0h doesn't jump by 360 deg. The RA rate is on-sky (dRA/dt * cos(dec)), so it and the Dec rate are comparable
+# and angular_rate_deg_per_s is just their hypot. The fit residual RMS is on-sky too, in arcsec: a high one means the
+# track curves (close or manoeuvring object) or has outlier obs.
+
+ARCSEC_PER_DEG = 3600.0
+
+# Columns stored per track besides the three true medians, in table order. Undefined values (the rate of a one-ob
+# track, the mean of all-NaN mags) are NaN here and NULL in the table.
+TRACK_STATS_COLUMNS:Tuple[str, ...] = (
+    "n_obs", "duration_s",
+    "ra_rate_deg_per_s", "dec_rate_deg_per_s", "angular_rate_deg_per_s", "rate_fit_rms_arcsec",
+    "mag_min", "mag_max", "mag_mean",
+    "ra_unc_min_deg", "ra_unc_max_deg", "ra_unc_mean_deg",
+    "dec_unc_min_deg", "dec_unc_max_deg", "dec_unc_mean_deg",
+)
+
+
+@dataclass
+class TrackStats:
+    # One entry per track
+    median_ra_deg:np.ndarray          # f64, [0, 360). Median of the unwrapped RAs, so tracks across 0h come out right
+    median_dec_deg:np.ndarray         # f64
+    median_mag:np.ndarray             # f64, NaN mags ignored
+    n_obs:np.ndarray                  # i64
+    duration_s:np.ndarray             # f64, last ob time - first ob time
+    ra_rate_deg_per_s:np.ndarray      # f64, on-sky: dRA/dt * cos(median dec)
+    dec_rate_deg_per_s:np.ndarray     # f64
+    angular_rate_deg_per_s:np.ndarray # f64
+    rate_fit_rms_arcsec:np.ndarray    # f64, on-sky RMS of the residuals from both linear fits
+    mag_min:np.ndarray                # f64, NaN mags ignored, likewise for the uncertainties
+    mag_max:np.ndarray
+    mag_mean:np.ndarray
+    ra_unc_min_deg:np.ndarray
+    ra_unc_max_deg:np.ndarray
+    ra_unc_mean_deg:np.ndarray
+    dec_unc_min_deg:np.ndarray
+    dec_unc_max_deg:np.ndarray
+    dec_unc_mean_deg:np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.n_obs)
+
+    def rows(self, columns:Sequence[str]) -> List[tuple]:
+        """ Plain Python values of these columns, one tuple per track. NaN becomes None, i.e. NULL. """
+        per_column = []
+        for column in columns:
+            values = getattr(self, column)
+            if values.dtype.kind == "f" and np.isnan(values).any():
+                per_column.append([None if value != value else value for value in values.tolist()])
+            else:
+                per_column.append(values.tolist())
+        return list(zip(*per_column))
+
+
+def _segment_sums(track_index:np.ndarray, values:np.ndarray, num_tracks:int) -> np.ndarray:
+    return np.bincount(track_index, weights=values, minlength=num_tracks)
+
+
+def _segment_extreme(values:np.ndarray, obs_offsets:np.ndarray, ufunc, fill:float) -> np.ndarray:
+    # NaN-ignoring min/max per track. Empty and all-NaN tracks come out NaN.
+    num_tracks = len(obs_offsets) - 1
+    result = np.full(num_tracks, np.nan)
+    has_obs = np.diff(obs_offsets) > 0
+    if has_obs.any():
+        # reduceat over only the non-empty starts: each segment then runs to the next non-empty start, which is its own end
+        result[has_obs] = ufunc.reduceat(np.where(np.isnan(values), fill, values), obs_offsets[:-1][has_obs])
+    result[np.isinf(result)] = np.nan
+    return result
+
+
+def _segment_medians(values:np.ndarray, track_index:np.ndarray, obs_offsets:np.ndarray) -> np.ndarray:
+    # One lexsort orders every track's values in place (NaNs last), then each median is the middle one or two of its valid values
+    num_tracks = len(obs_offsets) - 1
+    sorted_values = values[np.lexsort((values, track_index))]
+    num_valid = np.bincount(track_index, weights=~np.isnan(values), minlength=num_tracks).astype(np.int64)
+    medians = np.full(num_tracks, np.nan)
+    has_valid = num_valid > 0
+    starts = obs_offsets[:-1][has_valid]
+    lower = sorted_values[starts + (num_valid[has_valid] - 1) // 2]
+    upper = sorted_values[starts + num_valid[has_valid] // 2]
+    medians[has_valid] = (lower + upper) / 2
+    return medians
+
+
+def _nan_means(values:np.ndarray, track_index:np.ndarray, num_tracks:int) -> np.ndarray:
+    is_valid = ~np.isnan(values)
+    num_valid = np.bincount(track_index, weights=is_valid, minlength=num_tracks)
+    sums = _segment_sums(track_index, np.where(is_valid, values, 0.0), num_tracks)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(num_valid > 0, sums / num_valid, np.nan)
+
+
+def compute_track_stats(timestamps_us:np.ndarray, ra_dec_deg:np.ndarray, ra_dec_unc_deg:np.ndarray, mag:np.ndarray, obs_offsets:np.ndarray) -> TrackStats:
+    """
+    timestamps_us (num_obs,), ra_dec_deg (num_obs, 2), ra_dec_unc_deg (num_obs, 2) and mag (num_obs,) hold every track's
+    obs back to back, track i being rows obs_offsets[i]:obs_offsets[i+1]. Obs are assumed to be in time order, as the
+    API sends them.
+    """
+    obs_offsets = np.asarray(obs_offsets, dtype=np.int64)
+    num_tracks = len(obs_offsets) - 1
+    n_obs = np.diff(obs_offsets)
+    track_index = np.repeat(np.arange(num_tracks), n_obs)
+    if not len(track_index): # no obs at all, so nothing is defined and there's nothing to index into below
+        nothing = np.full(num_tracks, np.nan)
+        return TrackStats(**{f.name: (n_obs if f.name == "n_obs" else nothing.copy()) for f in fields(TrackStats)})
+    has_obs = n_obs > 0
+    # Index of each track's first and last ob. Empty tracks get a valid index whose value is never used.
+    first_ob = np.minimum(obs_offsets[:-1], len(track_index) - 1)
+    last_ob = np.maximum(obs_offsets[1:] - 1, 0)
+
+    timestamps_us = np.asarray(timestamps_us, dtype=np.int64)
+    ra_deg = np.asarray(ra_dec_deg[:, 0], dtype=np.float64)
+    dec_deg = np.asarray(ra_dec_deg[:, 1], dtype=np.float64)
+    ra_unc_deg = np.asarray(ra_dec_unc_deg[:, 0], dtype=np.float64)
+    dec_unc_deg = np.asarray(ra_dec_unc_deg[:, 1], dtype=np.float64)
+    mag = np.asarray(mag, dtype=np.float64)
+
+    # RA unwrapped to within 180 deg of the track's first ob, so medians and fits don't see the 360 -> 0 jump
+    ra_reference_deg = ra_deg[first_ob][track_index]
+    ra_unwrapped_deg = ra_reference_deg + (ra_deg - ra_reference_deg + 180.0) % 360.0 - 180.0
+
+    median_ra_deg = _segment_medians(ra_unwrapped_deg, track_index, obs_offsets) % 360.0
+    median_dec_deg = _segment_medians(dec_deg, track_index, obs_offsets)
+    cos_median_dec = np.cos(np.radians(median_dec_deg))
+
+    # Least squares, on time and positions centered per track so nothing cancels catastrophically. Seconds since the
+    # track's first ob keep the t values small too.
+    t_s = (timestamps_us - timestamps_us[first_ob][track_index]) / 1e6
+    duration_s = np.where(has_obs, (timestamps_us[last_ob] - timestamps_us[first_ob]) / 1e6, np.nan)
+    counts = np.maximum(n_obs, 1).astype(np.float64)
+    t_centered = t_s - (_segment_sums(track_index, t_s, num_tracks) / counts)[track_index]
+    ra_centered = ra_unwrapped_deg - (_segment_sums(track_index, ra_unwrapped_deg, num_tracks) / counts)[track_index]
+    dec_centered = dec_deg - (_segment_sums(track_index, dec_deg, num_tracks) / counts)[track_index]
+    t_variance_sum = _segment_sums(track_index, t_centered * t_centered, num_tracks)
+    can_fit = (n_obs >= 2) & (t_variance_sum > 0)
+    safe_t_variance_sum = np.where(can_fit, t_variance_sum, 1.0)
+    ra_slope = np.where(can_fit, _segment_sums(track_index, t_centered * ra_centered, num_tracks) / safe_t_variance_sum, np.nan)
+    dec_rate_deg_per_s = np.where(can_fit, _segment_sums(track_index, t_centered * dec_centered, num_tracks) / safe_t_variance_sum, np.nan)
+    ra_rate_deg_per_s = ra_slope * cos_median_dec
+    angular_rate_deg_per_s = np.hypot(ra_rate_deg_per_s, dec_rate_deg_per_s)
+
+    ra_residual_deg = (ra_centered - np.nan_to_num(ra_slope)[track_index] * t_centered) * cos_median_dec[track_index]
+    dec_residual_deg = dec_centered - np.nan_to_num(dec_rate_deg_per_s)[track_index] * t_centered
+    squared_residual_sums = _segment_sums(track_index, ra_residual_deg**2 + dec_residual_deg**2, num_tracks)
+    rate_fit_rms_arcsec = np.where(can_fit, np.sqrt(squared_residual_sums / counts) * ARCSEC_PER_DEG, np.nan)
+
+    median_mag = _segment_medians(mag, track_index, obs_offsets)
+    return TrackStats(
+        median_ra_deg=median_ra_deg, median_dec_deg=median_dec_deg, median_mag=median_mag,
+        n_obs=n_obs, duration_s=duration_s,
+        ra_rate_deg_per_s=ra_rate_deg_per_s, dec_rate_deg_per_s=dec_rate_deg_per_s, angular_rate_deg_per_s=angular_rate_deg_per_s,
+        rate_fit_rms_arcsec=rate_fit_rms_arcsec,
+        mag_min=_segment_extreme(mag, obs_offsets, np.minimum, np.inf),
+        mag_max=_segment_extreme(mag, obs_offsets, np.maximum, -np.inf),
+        mag_mean=_nan_means(mag, track_index, num_tracks),
+        ra_unc_min_deg=_segment_extreme(ra_unc_deg, obs_offsets, np.minimum, np.inf),
+        ra_unc_max_deg=_segment_extreme(ra_unc_deg, obs_offsets, np.maximum, -np.inf),
+        ra_unc_mean_deg=_nan_means(ra_unc_deg, track_index, num_tracks),
+        dec_unc_min_deg=_segment_extreme(dec_unc_deg, obs_offsets, np.minimum, np.inf),
+        dec_unc_max_deg=_segment_extreme(dec_unc_deg, obs_offsets, np.maximum, -np.inf),
+        dec_unc_mean_deg=_nan_means(dec_unc_deg, track_index, num_tracks),
+    )
+
+
+assert set(TRACK_STATS_COLUMNS) < {f.name for f in fields(TrackStats)}
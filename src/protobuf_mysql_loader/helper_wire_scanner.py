@@ -0,0 +1,128 @@
+from typing import Iterator, List, Optional, Tuple, Union
+
+# Just enough of the protobuf wire format to pull the repeated track sub-messages and the token out of a SomeClass response
+# without building the whole object tree. https://protobuf.dev/programming-guides/encoding/
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_LENGTH_DELIMITED = 2
+_WIRE_FIXED32 = 5
+_FIXED_WIDTHS = {_WIRE_FIXED64: 8, _WIRE_FIXED32: 4}
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+def _read_varint(data:BytesLike, offset:int, end:int) -> Optional[Tuple[int, int]]:
+    """ Returns (value, offset just past the varint), or None if the varint runs past end (i.e. we need more bytes). """
+    value = 0
+    shift = 0
+    while offset < end:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+        if shift >= 64:
+            raise ValueError("Malformed protobuf: varint longer than 10 bytes")
+    return None
+
+
+def _read_field(data:BytesLike, offset:int, end:int) -> Optional[Tuple[int, int, int, int, int]]:
+    """
+    Returns (field_number, wire_type, value_start, value_end, next_offset) for the field starting at offset,
+    or None if it isn't completely inside data[:end] yet. For varints value_start:value_end covers the encoded varint.
+    """
+    tag = _read_varint(data, offset, end)
+    if tag is None:
+        return None
+    tag_value, value_start = tag
+    field_number, wire_type = tag_value >> 3, tag_value & 0x7
+    if wire_type == _WIRE_LENGTH_DELIMITED:
+        length = _read_varint(data, value_start, end)
+        if length is None:
+            return None
+        num_bytes, value_start = length
+        value_end = value_start + num_bytes
+    elif wire_type == _WIRE_VARINT:
+        varint = _read_varint(data, value_start, end)
+        if varint is None:
+            return None
+        value_end = varint[1]
+    elif wire_type in _FIXED_WIDTHS:
+        value_end = value_start + _FIXED_WIDTHS[wire_type]
+    else:
+        raise ValueError(f"Malformed protobuf: unsupported wire type {wire_type} for field {field_number}")
+    if value_end > end:
+        return None
+    return field_number, wire_type, value_start, value_end, value_end
+
+
+def get_field_numbers(message_class, tracks_field_name:str="udl_observation_responses", token_field_name:str="token") -> Tuple[int, int]:
+    # Read from the generated descriptor so we never hard-code numbers that could drift from the .proto
+    fields_by_name = message_class.DESCRIPTOR.fields_by_name
+    return fields_by_name[tracks_field_name].number, fields_by_name[token_field_name].number
+
+
+def iter_track_views(body:BytesLike, tracks_field_number:int, token_field_number:int, token_holder:Optional[List[str]]=None) -> Iterator[memoryview]:
+    """
+    Zero-copy scan of a fully downloaded response: yields each track sub-message as a memoryview slice of body.
+    If token_holder is given, the token gets appended to it when the scan reaches that field.
+    """
+    view = memoryview(body)
+    offset, end = 0, len(view)
+    while offset < end:
+        field = _read_field(view, offset, end)
+        if field is None:
+            raise ValueError(f"Malformed protobuf: response truncated at byte {offset} of {end}")
+        field_number, wire_type, value_start, value_end, offset = field
+        if wire_type != _WIRE_LENGTH_DELIMITED:
+            continue
+        if field_number == tracks_field_number:
+            yield view[value_start:value_end]
+        elif field_number == token_field_number and token_holder is not None:
+            token_holder.append(bytes(view[value_start:value_end]).decode("utf-8"))
+
+
+class StreamingTrackScanner:
+    """
+    Incremental version of iter_track_views for a body that arrives in chunks (e.g. requests' iter_content).
+    Only the unfinished tail of the stream is buffered, so memory is bounded by the largest track rather than the whole
+    response, and tracks can be handed to the decoder before the download finishes.
+        scanner = StreamingTrackScanner(*get_field_numbers(SomeClass))
+        for chunk in response.iter_content(64*1024):
+            for track_view in scanner.feed(chunk):
+                ...
+        scanner.finish(); scanner.token
+    """
+    def __init__(self, tracks_field_number:int, token_field_number:int):
+        self.tracks_field_number = tracks_field_number
+        self.token_field_number = token_field_number
+        self.token:str = ""
+        self.num_bytes_scanned:int = 0
+        self.num_tracks:int = 0
+        self._buffer = bytearray()
+
+    def feed(self, chunk:BytesLike) -> List[memoryview]:
+        self._buffer += chunk
+        self.num_bytes_scanned += len(chunk)
+        track_views = []
+        offset, end = 0, len(self._buffer)
+        while offset < end:
+            field = _read_field(self._buffer, offset, end)
+            if field is None:
+                break # the rest of this field hasn't arrived yet
+            field_number, wire_type, value_start, value_end, next_offset = field
+            if wire_type == _WIRE_LENGTH_DELIMITED:
+                if field_number == self.tracks_field_number:
+                    # Copy the track out into its own bytes so the buffer can be trimmed. The view is zero-copy over that.
+                    track_views.append(memoryview(bytes(self._buffer[value_start:value_end])))
+                elif field_number == self.token_field_number:
+                    self.token = self._buffer[value_start:value_end].decode("utf-8")
+            offset = next_offset
+        del self._buffer[:offset]
+        self.num_tracks += len(track_views)
+        return track_views
+
+    def finish(self) -> None:
+        if self._buffer:
+            raise ValueError(f"Malformed protobuf: stream ended with {len(self._buffer)} bytes of an unfinished field")
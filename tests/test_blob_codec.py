@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from protobuf_mysql_loader.helper_blob_codec import (
+    BlobCodec, RAW_BLOB_CODEC, CODEC_RAW, CODEC_DELTA_VARINT, CODEC_QUANTIZED_DELTA_VARINT, COMPRESSION_ZLIB, COMPRESSION_LZ4,
+    encode_blob, decode_blob, decode_blobs_concatenated, is_encoded_blob, lz4_block,
+)
+
+_TIMESTAMPS_US = np.array([1_720_655_998_123_456 + 1_010_000*i + (i % 3) for i in range(40)], dtype="<u8")
+_RA_DEC_DEG = np.column_stack([np.linspace(359.5, 361.2, 40) % 360, np.linspace(-12.3, -11.9, 40)]).astype("<f8")
+_SEN_POS_KM = np.tile([4040.3, -3428.8658, -4479.3615], (40, 1)).astype("<f4")
+
+
+def test_raw_codec_writes_the_bare_legacy_layout():
+    blob = encode_blob(_TIMESTAMPS_US, "Q")
+    assert blob == _TIMESTAMPS_US.tobytes()
+    assert not is_encoded_blob(blob)
+    np.testing.assert_array_equal(decode_blob(blob, "Q"), _TIMESTAMPS_US)
+    np.testing.assert_array_equal(decode_blob(encode_blob(_RA_DEC_DEG, "d"), "d", 2), _RA_DEC_DEG)
+
+
+@pytest.mark.parametrize("num_rows", [0, 1, 40, 500]) # 500 takes the vectorized varint path
+def test_delta_varint_is_lossless(num_rows):
+    timestamps_us = (np.arange(num_rows, dtype=np.int64) * 997 + 1_720_655_998_123_456).astype("<u8")
+    blob = encode_blob(timestamps_us, "Q", BlobCodec(CODEC_DELTA_VARINT))
+    assert is_encoded_blob(blob)
+    decoded = decode_blob(blob, "Q")
+    assert decoded.dtype == np.dtype("<u8")
+    np.testing.assert_array_equal(decoded, timestamps_us)
+    if num_rows > 1:
+        assert len(blob) < timestamps_us.nbytes
+
+
+def test_delta_varint_handles_decreasing_values():
+    values = np.array([50, 10, 2**40, 3, 3, 0], dtype="<u8")
+    np.testing.assert_array_equal(decode_blob(encode_blob(values, "Q", BlobCodec(CODEC_DELTA_VARINT)), "Q"), values)
+
+
+def test_delta_varint_refuses_float_columns():
+    with pytest.raises(ValueError):
+        encode_blob(_RA_DEC_DEG, "d", BlobCodec(CODEC_DELTA_VARINT))
+
+
+@pytest.mark.parametrize("step", [1e-9, 1e-4])
+def test_quantized_multi_component_round_trip_is_within_half_a_step(step):
+    blob = encode_blob(_RA_DEC_DEG, "d", BlobCodec(CODEC_QUANTIZED_DELTA_VARINT, quantization_step=step))
+    decoded = decode_blob(blob, "d", 2)
+    assert decoded.shape == _RA_DEC_DEG.shape
+    assert np.abs(decoded - _RA_DEC_DEG).max() <= step/2 * (1 + 1e-6)
+
+
+@pytest.mark.parametrize("bad_value", [np.nan, np.inf, -np.inf, 1e30])
+def test_quantized_refuses_values_it_cant_represent(bad_value):
+    values = np.array([5.1, bad_value, 6.2], dtype="<f4")
+    with pytest.raises(ValueError):
+        encode_blob(values, "f", BlobCodec(CODEC_QUANTIZED_DELTA_VARINT, quantization_step=1e-3))
+
+
+def test_quantized_needs_a_step():
+    with pytest.raises(ValueError):
+        encode_blob(_SEN_POS_KM, "f", BlobCodec(CODEC_QUANTIZED_DELTA_VARINT))
+
+
+@pytest.mark.parametrize("blob_codec", [
+    BlobCodec(CODEC_RAW, COMPRESSION_ZLIB),
+    BlobCodec(CODEC_DELTA_VARINT, COMPRESSION_ZLIB),
+])
+def test_zlib_compressed_round_trip(blob_codec):
+    blob = encode_blob(_TIMESTAMPS_US, "Q", blob_codec)
+    assert is_encoded_blob(blob)
+    np.testing.assert_array_equal(decode_blob(blob, "Q"), _TIMESTAMPS_US)
+
+
+@pytest.mark.skipif(lz4_block is None, reason="lz4 isn't installed")
+def test_lz4_compressed_round_trip():
+    blob = encode_blob(_SEN_POS_KM, "f", BlobCodec(CODEC_RAW, COMPRESSION_LZ4))
+    np.testing.assert_array_equal(decode_blob(blob, "f", 3), _SEN_POS_KM)
+
+
+def test_bare_blob_starting_with_the_magic_is_still_read_as_raw():
+    # 'PMB' followed by bytes that don't make a valid header
+    values = np.frombuffer(b"PMB" + b"\xff" * 13, dtype="<u8")
+    blob = values.tobytes()
+    assert not is_encoded_blob(blob)
+    np.testing.assert_array_equal(decode_blob(blob, "Q"), values)
+
+
+def test_raw_blob_codec_is_the_default():
+    assert RAW_BLOB_CODEC == BlobCodec() and not RAW_BLOB_CODEC.writes_header
+
+
+def _concatenated_one_by_one(blobs, legacy_dtype_char, legacy_num_components=1):
+    decoded = [decode_blob(blob, legacy_dtype_char, legacy_num_components) for blob in blobs]
+    return np.concatenate(decoded), [len(values) for values in decoded]
+
+
+_TRACK_LENGTHS = [3, 0, 1, 40, 7]
+
+
+@pytest.mark.parametrize("blob_codec", [
+    RAW_BLOB_CODEC,
+    BlobCodec(CODEC_DELTA_VARINT),
+    BlobCodec(CODEC_DELTA_VARINT, COMPRESSION_ZLIB),
+])
+def test_concatenated_timestamps_match_decoding_one_by_one(blob_codec):
+    blobs = [encode_blob(_TIMESTAMPS_US[:n] + np.uint64(i), "Q", blob_codec) for i, n in enumerate(_TRACK_LENGTHS)]
+    values, num_rows = decode_blobs_concatenated(blobs, "Q")
+    expected_values, expected_num_rows = _concatenated_one_by_one(blobs, "Q")
+    np.testing.assert_array_equal(values, expected_values)
+    np.testing.assert_array_equal(num_rows, expected_num_rows)
+
+
+def test_concatenated_multi_component_quantized_blobs_keep_rows_together():
+    blob_codec = BlobCodec(CODEC_QUANTIZED_DELTA_VARINT, quantization_step=1e-9)
+    blobs = [encode_blob(_RA_DEC_DEG[:n] + i, "d", blob_codec) for i, n in enumerate(_TRACK_LENGTHS)]
+    values, num_rows = decode_blobs_concatenated(blobs, "d", 2)
+    expected_values, expected_num_rows = _concatenated_one_by_one(blobs, "d", 2)
+    assert values.shape == (sum(_TRACK_LENGTHS), 2)
+    np.testing.assert_array_equal(values, expected_values)
+    np.testing.assert_array_equal(num_rows, expected_num_rows)
+
+
+def test_concatenated_mix_of_headered_and_raw_blobs():
+    # e.g. rows written before and after a column's codec was switched
+    blobs = [
+        encode_blob(_TIMESTAMPS_US[:5], "Q"),
+        encode_blob(_TIMESTAMPS_US[5:9], "Q", BlobCodec(CODEC_DELTA_VARINT)),
+        encode_blob(_TIMESTAMPS_US[9:20], "Q", BlobCodec(CODEC_RAW, COMPRESSION_ZLIB)),
+        encode_blob(_TIMESTAMPS_US[20:], "Q"),
+    ]
+    values, num_rows = decode_blobs_concatenated(blobs, "Q")
+    np.testing.assert_array_equal(values, _TIMESTAMPS_US)
+    np.testing.assert_array_equal(num_rows, [5, 4, 11, 20])
+
+
+def test_concatenated_no_blobs():
+    values, num_rows = decode_blobs_concatenated([], "f", 3)
+    assert values.shape == (0, 3) and len(num_rows) == 0
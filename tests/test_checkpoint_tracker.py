@@ -0,0 +1,129 @@
+import threading
+
+from protobuf_mysql_loader.helper_pipeline import TokenCheckpointTracker
+
+
+def _tracker_with(*num_batches_per_response) -> TokenCheckpointTracker:
+    tracker = TokenCheckpointTracker()
+    for sequence_number, num_batches in enumerate(num_batches_per_response):
+        tracker.register_response(sequence_number, f"token-{sequence_number}", num_batches)
+    return tracker
+
+
+def _token(checkpoint):
+    return None if checkpoint is None else checkpoint.token
+
+
+def test_checkpoint_only_moves_once_every_batch_of_the_response_committed():
+    tracker = _tracker_with(3)
+    assert tracker.mark_batch_committed(0) is None
+    assert tracker.mark_batch_committed(0) is None
+    assert _token(tracker.mark_batch_committed(0)) == "token-0"
+    assert tracker.num_responses_in_flight == 0
+
+
+def test_out_of_order_commits_wait_for_older_responses():
+    tracker = _tracker_with(1, 1, 1)
+    assert tracker.mark_batch_committed(2) is None
+    assert tracker.mark_batch_committed(1) is None
+    assert tracker.num_responses_in_flight == 3
+    # Response 0 landing releases everything behind it at once, as the newest token
+    assert _token(tracker.mark_batch_committed(0)) == "token-2"
+    assert tracker.num_responses_in_flight == 0
+
+
+def test_response_split_across_concurrent_writers():
+    num_batches = 200
+    tracker = _tracker_with(num_batches, 1)
+    advanced = []
+    def commit_some(num_commits):
+        for _ in range(num_commits):
+            checkpoint = tracker.mark_batch_committed(0)
+            if checkpoint is not None:
+                advanced.append(checkpoint)
+    threads = [threading.Thread(target=commit_some, args=(num_batches // 4,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [checkpoint.token for checkpoint in advanced] == ["token-0"] # exactly one writer saw it move
+    assert _token(tracker.mark_batch_committed(1)) == "token-1"
+
+
+def test_on_advance_sees_checkpoints_in_order():
+    tracker = _tracker_with(1, 1, 1)
+    seen = []
+    tracker.mark_batch_committed(1, on_advance=seen.append)
+    tracker.mark_batch_committed(0, on_advance=seen.append)
+    tracker.mark_batch_committed(2, on_advance=seen.append)
+    assert [checkpoint.token for checkpoint in seen] == ["token-1", "token-2"]
+
+
+def test_ranks_strictly_increase_across_responses_and_trackers():
+    tracker = _tracker_with(1, 1)
+    first = tracker.mark_batch_committed(0)
+    second = tracker.mark_batch_committed(1)
+    assert second.rank > first.rank
+    # A tracker started later (i.e. after a restart) always outranks this one
+    restarted = TokenCheckpointTracker()
+    restarted._rank_base = tracker._rank_base + 1_000_000_000
+    restarted.register_response(0, "token-after-restart", 1)
+    assert restarted.mark_batch_committed(0).rank > second.rank
+
+
+def test_allocate_sequence_number_skips_registered_ones():
+    tracker = _tracker_with(1, 1)
+    assert tracker.allocate_sequence_number() == 2
+    assert tracker.allocate_sequence_number() == 3
+
+
+def test_checkpoint_if_committed_is_a_dry_run():
+    tracker = _tracker_with(2, 1)
+    assert tracker.checkpoint_if_committed(0) is None # one batch of response 0 still outstanding
+    tracker.mark_batch_committed(0)
+    assert _token(tracker.checkpoint_if_committed(0)) == "token-0"
+    assert _token(tracker.checkpoint_if_committed(0)) == "token-0" # asking again changes nothing
+    assert tracker.num_responses_in_flight == 2
+    assert _token(tracker.mark_batch_committed(0)) == "token-0"
+    assert _token(tracker.checkpoint_if_committed(1)) == "token-1"
+    assert tracker.num_responses_in_flight == 1
+
+
+def test_abandoned_response_never_becomes_the_checkpoint():
+    tracker = _tracker_with(2, 1)
+    tracker.mark_batch_committed(0)
+    tracker.abandon(0)
+    assert tracker.num_responses_in_flight == 1
+    assert tracker.mark_batch_committed(0) is None # its other batch landing late is ignored
+    assert _token(tracker.mark_batch_committed(1)) == "token-1"
+    assert tracker.num_responses_in_flight == 0
+
+
+def test_commit_after_abandon_moves_the_checkpoint_again():
+    # One failed write used to pin the checkpoint for the rest of the process
+    tracker = TokenCheckpointTracker()
+    for attempt in range(3):
+        sequence_number = tracker.allocate_sequence_number()
+        tracker.register_response(sequence_number, f"token-{attempt}", 2)
+        tracker.mark_batch_committed(sequence_number)
+        tracker.abandon(sequence_number)
+    sequence_number = tracker.allocate_sequence_number()
+    tracker.register_response(sequence_number, "token-retry", 1)
+    assert _token(tracker.mark_batch_committed(sequence_number)) == "token-retry"
+    assert tracker.num_responses_in_flight == 0
+
+
+def test_abandon_behind_an_older_pending_response():
+    tracker = _tracker_with(1, 1, 1)
+    tracker.abandon(1)
+    assert tracker.mark_batch_committed(2) is None # response 0 is still outstanding
+    assert _token(tracker.mark_batch_committed(0)) == "token-2" # 1 is stepped over, never checkpointed itself
+    assert tracker.num_responses_in_flight == 0
+
+
+def test_abandon_ahead_of_committed_responses_leaves_them_for_the_next_commit():
+    tracker = _tracker_with(1, 1, 1)
+    tracker.mark_batch_committed(1)
+    tracker.abandon(0)
+    assert _token(tracker.checkpoint_if_committed(2)) == "token-2"
+    assert _token(tracker.mark_batch_committed(2)) == "token-2"
@@ -0,0 +1,73 @@
+import math
+import struct
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from protobuf_mysql_loader.helper_api_2_mysql import Observation, ObDataType, columnize_track, datetime_to_us, mysqlify_track, pack_list_of_values_as_little_endian_bytes
+
+# The columnar encoder has to produce exactly the bytes the old per-Observation struct.pack code did, so rows written
+# before and after it read back the same. Tracks here are plain attribute trees shaped like the protobuf messages.
+
+_START_TIME = datetime(2024, 7, 10, 23, 59, 58, 123456)
+
+
+def _wrapped(value):
+    return SimpleNamespace(value=value)
+
+
+def _make_track(num_obs:int, mag_of_ob=lambda i: 7.25 + 0.1*i):
+    obs = []
+    for i in range(num_obs):
+        obs.append(SimpleNamespace(
+            ob_time=_wrapped((_START_TIME + timedelta(seconds=1.01*i)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")),
+            ra=_wrapped(359.9 + 0.07*i), declination=_wrapped(-12.3456789 + 0.01*i),
+            ra_unc=_wrapped(2.1e-4 + 1e-6*i), declination_unc=_wrapped(1.9e-4 - 1e-6*i),
+            senx=_wrapped(4040.3 + 0.001*i), seny=_wrapped(-3428.8658), senz=_wrapped(-4479.3615),
+            senvelx=_wrapped(0.25003), senvely=_wrapped(0.29463), senvelz=_wrapped(0.0),
+            mag=_wrapped(mag_of_ob(i)),
+            id_on_orbit=_wrapped(""), id_sensor=_wrapped(""), sat_no=_wrapped("44713"),
+            orig_object_id=_wrapped("satellite44713"), orig_sensor_id=_wrapped("sensor-11269-4"), uct=_wrapped(False),
+        ))
+    return SimpleNamespace(udl_observation_data=obs)
+
+
+def _blobs_the_old_way(sx_api_track) -> dict:
+    # The pre-columnar mysqlify_track, blob for blob
+    observations = [Observation.from_proto(ob) for ob in sx_api_track.udl_observation_data]
+    return {
+        "timestamp_us_blob":         pack_list_of_values_as_little_endian_bytes([datetime_to_us(o.obtime) for o in observations], ObDataType.U64),
+        "ra_and_dec_deg_blob":       pack_list_of_values_as_little_endian_bytes([value for o in observations for value in (o.ra, o.dec)], ObDataType.F64),
+        "ra_and_dec_unc_deg_blob":   pack_list_of_values_as_little_endian_bytes([value for o in observations for value in (o.ra_unc, o.dec_unc)], ObDataType.F32),
+        "sen_pos_xyz_itrf_km_blob":  pack_list_of_values_as_little_endian_bytes([coord for o in observations for coord in o.pitrf], ObDataType.F32),
+        "sen_vel_xyz_itrf_kms_blob": pack_list_of_values_as_little_endian_bytes([coord for o in observations for coord in o.vitrf], ObDataType.F32),
+        "mag_blob":                  pack_list_of_values_as_little_endian_bytes([o.mag for o in observations], ObDataType.F32),
+    }
+
+
+@pytest.mark.parametrize("num_obs", [1, 2, 7, 50])
+def test_mysqlify_track_blobs_match_struct_pack(num_obs):
+    track = _make_track(num_obs)
+    record = mysqlify_track(track)
+    for column, expected_blob in _blobs_the_old_way(track).items():
+        assert getattr(record, column) == expected_blob, column
+
+
+def test_nan_mag_matches_struct_pack():
+    track = _make_track(5, mag_of_ob=lambda i: math.nan if i % 2 else 8.5)
+    record = mysqlify_track(track)
+    assert record.mag_blob == _blobs_the_old_way(track)["mag_blob"]
+    assert np.isnan(np.frombuffer(record.mag_blob, dtype="<f4")[1::2]).all()
+
+
+def test_zero_obs_track_columnizes_to_empty_blobs():
+    columns = columnize_track(_make_track(0))
+    assert columns.n_obs == 0
+    assert columns.timestamps_us.tobytes() == struct.pack("<0Q")
+    assert columns.ra_dec_deg.tobytes() == struct.pack("<0d")
+    for values in (columns.ra_dec_unc_deg, columns.sen_pos_xyz_itrf_km, columns.sen_vel_xyz_itrf_kms, columns.mag):
+        assert values.tobytes() == struct.pack("<0f")
+    with pytest.raises(AssertionError):
+        mysqlify_track(_make_track(0)) # a track always has obs, and there's no median of nothing
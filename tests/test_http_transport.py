@@ -0,0 +1,81 @@
+import gzip
+import io
+import zlib
+
+import pytest
+import requests
+
+from protobuf_mysql_loader.helper_http_transport import BodyBuffer, TransportSettings, read_response_body, read_error_body
+
+
+class _FakeRaw:
+    def __init__(self, data:bytes):
+        self._stream = io.BytesIO(data)
+        self.calls = []
+
+    def read(self, num_bytes:int, decode_content:bool=False) -> bytes:
+        return self._stream.read(num_bytes)
+
+    def release_conn(self) -> None:
+        self.calls.append("release_conn")
+
+    def close(self) -> None:
+        self.calls.append("close")
+
+
+def _response(data:bytes, content_encoding=None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = _FakeRaw(data)
+    if content_encoding:
+        response.headers["Content-Encoding"] = content_encoding
+    response.headers["Content-Length"] = str(len(data))
+    return response
+
+
+BODY = bytes(range(256)) * 400 + b"tail"
+
+
+@pytest.mark.parametrize("content_encoding, encode", [
+    (None, lambda body: body),
+    ("gzip", gzip.compress),
+    ("deflate", zlib.compress),
+    ("deflate", lambda body: zlib.compress(body)[2:-4]), # raw deflate, no zlib wrapper
+])
+def test_decodes_and_counts_wire_bytes(content_encoding, encode):
+    wire = encode(BODY)
+    response = _response(wire, content_encoding)
+    body = read_response_body(response, TransportSettings(read_chunk_size=1000), BodyBuffer(16))
+    assert bytes(body.body) == BODY
+    assert body.num_bytes == len(BODY)
+    assert body.num_wire_bytes == len(wire)
+    assert response.raw.calls[0] == "release_conn" # back to the pool, fully read
+
+
+def test_refuses_bodies_over_the_limit():
+    response = _response(gzip.compress(b"\0" * 100_000), "gzip")
+    with pytest.raises(ValueError):
+        read_response_body(response, TransportSettings(max_body_bytes=50_000), BodyBuffer(16))
+    assert response.raw.calls[0] == "close" # a half-read connection is closed, not handed back to the pool
+
+
+def test_unsupported_encoding():
+    with pytest.raises(ValueError):
+        read_response_body(_response(b"x", "br"), TransportSettings(), BodyBuffer(16))
+
+
+def test_body_buffer_reuse_keeps_old_views_intact():
+    body_buffer = BodyBuffer(4)
+    body_buffer.append(b"abcd")
+    first_view = body_buffer.view()
+    body_buffer.append(b"efgh") # grows into a new bytearray, so first_view still reads the old one
+    assert bytes(first_view) == b"abcd" and bytes(body_buffer.view()) == b"abcdefgh"
+    first_view.release()
+    body_buffer.reset(size_hint=100)
+    assert len(body_buffer) == 0 and body_buffer.capacity >= 100
+
+
+def test_error_body_is_truncated():
+    assert read_error_body(_response(b"short"), TransportSettings()) == repr(b"short")
+    logged = read_error_body(_response(b"x" * 5000), TransportSettings(max_error_body_bytes=10))
+    assert logged.startswith(repr(b"x" * 10)) and "truncated to 10 bytes" in logged
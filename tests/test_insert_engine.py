@@ -0,0 +1,35 @@
+from protobuf_mysql_loader.db.mysql_insert_engine import MultiRowInsertEngine
+
+_COLUMNS = tuple(f"column_{i}" for i in range(40))
+
+
+def _rows(num_rows:int, blob_size:int=2000):
+    return [(b"x" * blob_size,) + (i,) * (len(_COLUMNS) - 1) for i in range(num_rows)]
+
+
+def test_chunks_are_powers_of_two_within_the_byte_budget():
+    engine = MultiRowInsertEngine("tracks", _COLUMNS)
+    rows = _rows(100)
+    chunks = engine.chunk_rows(rows, max_statement_bytes=50_000)
+    assert sum(len(chunk) for chunk in chunks) == len(rows)
+    assert [row for chunk in chunks for row in chunk] == rows
+    for chunk in chunks:
+        assert len(chunk) & (len(chunk) - 1) == 0
+        assert len(chunk) * 2000 <= 50_000
+
+
+def test_large_batch_is_split_under_the_placeholder_limit():
+    # 64 MB max_allowed_packet, ~3 KB rows: by bytes alone this would be 8192-row statements with ~327k placeholders
+    engine = MultiRowInsertEngine("tracks", _COLUMNS)
+    rows = _rows(10_000)
+    chunks = engine.chunk_rows(rows, max_statement_bytes=int(64 * 1024**2 * 0.8))
+    assert len(chunks) > 1
+    assert sum(len(chunk) for chunk in chunks) == len(rows)
+    assert all(len(chunk) * len(_COLUMNS) <= 65_535 for chunk in chunks)
+    assert max(len(chunk) for chunk in chunks) == 1024 # 65535 // 40 = 1638, rounded down to a power of two
+
+
+def test_oversized_row_still_goes_out_on_its_own():
+    engine = MultiRowInsertEngine("tracks", _COLUMNS)
+    chunks = engine.chunk_rows(_rows(3, blob_size=100_000), max_statement_bytes=50_000)
+    assert [len(chunk) for chunk in chunks] == [1, 1, 1]
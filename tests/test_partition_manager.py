@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from protobuf_mysql_loader.db.mysql_partition_manager import (
+    PartitionManager, PartitionInfo, GRANULARITY_DAILY, GRANULARITY_MONTHLY, RETENTION_ARCHIVE,
+    ARCHIVE_TABLE_PARTITIONED, ARCHIVE_TABLE_FILLED, ARCHIVE_TABLE_CONFLICT, period_start, partition_name_for,
+)
+
+NOW = datetime(2025, 7, 14, 15, 30, tzinfo=timezone.utc)
+
+
+def _bound(year:int, month:int, day:int=1) -> int:
+    return int(datetime(year, month, day, tzinfo=timezone.utc).timestamp())
+
+
+def _monthly_partitions(first_month:int, last_month:int, catch_all_name:str="p_max"):
+    """ 2025 monthly partitions first_month..last_month plus the MAXVALUE catch-all """
+    partitions = [PartitionInfo(f"p2025_{month:02}", _bound(2025, month + 1) if month < 12 else _bound(2026, 1), 100) for month in range(first_month, last_month + 1)]
+    return partitions + [PartitionInfo(catch_all_name, None, 0)]
+
+
+def _manager(**kwargs):
+    return PartitionManager("tracks", connection_factory=None, **kwargs)
+
+
+def test_period_start_and_names():
+    assert period_start(NOW, GRANULARITY_MONTHLY) == datetime(2025, 7, 1, tzinfo=timezone.utc)
+    assert period_start(datetime(2025, 7, 14, 23, 59), GRANULARITY_DAILY) == datetime(2025, 7, 14, tzinfo=timezone.utc)
+    assert partition_name_for(datetime(2025, 7, 14), GRANULARITY_MONTHLY) == "p2025_07"
+    assert partition_name_for(datetime(2025, 7, 14), GRANULARITY_DAILY) == "p2025_07_14"
+    with pytest.raises(ValueError):
+        period_start(NOW, "weekly")
+
+
+def test_splits_new_months_off_the_catch_all():
+    statements = _manager(periods_ahead=2).plan(_monthly_partitions(5, 7, catch_all_name="pmax"), now=NOW)
+    assert statements == [
+        "ALTER TABLE tracks REORGANIZE PARTITION pmax INTO ("
+        f"PARTITION p2025_08 VALUES LESS THAN ({_bound(2025, 9)}), "
+        f"PARTITION p2025_09 VALUES LESS THAN ({_bound(2025, 10)}), "
+        "PARTITION p_max VALUES LESS THAN (MAXVALUE));"
+    ]
+
+
+def test_up_to_date_plans_nothing():
+    assert _manager(periods_ahead=2).plan(_monthly_partitions(5, 9), now=NOW) == []
+    assert _manager().plan([], now=NOW) == []
+
+
+def test_adds_without_a_catch_all_and_starts_periods_behind_when_stale():
+    partitions = [PartitionInfo("p2024_01", _bound(2024, 2), 5)]
+    statements = _manager(granularity=GRANULARITY_DAILY, periods_ahead=1, periods_behind=1).plan(partitions, now=NOW)
+    assert statements == [
+        "ALTER TABLE tracks ADD PARTITION ("
+        f"PARTITION p2025_07_13 VALUES LESS THAN ({_bound(2025, 7, 14)}), "
+        f"PARTITION p2025_07_14 VALUES LESS THAN ({_bound(2025, 7, 15)}), "
+        f"PARTITION p2025_07_15 VALUES LESS THAN ({_bound(2025, 7, 16)}));"
+    ]
+
+
+def test_expired_partitions():
+    partitions = _monthly_partitions(1, 9)
+    assert _manager().expired_partitions(partitions, now=NOW) == [] # no retention configured
+    # Three whole months back from July is April, so January through March are entirely older
+    assert [p.name for p in _manager(retention_periods=3).expired_partitions(partitions, now=NOW)] == ["p2025_01", "p2025_02", "p2025_03"]
+    # Never the newest finite partition, even when everything is past retention
+    assert [p.name for p in _manager(retention_periods=1).expired_partitions(_monthly_partitions(1, 3), now=NOW)] == ["p2025_01", "p2025_02"]
+
+
+def test_retention_drop_follows_the_split():
+    statements = _manager(periods_ahead=2, retention_periods=5).plan(_monthly_partitions(1, 8), now=NOW)
+    assert statements[0].startswith("ALTER TABLE tracks REORGANIZE PARTITION p_max INTO (PARTITION p2025_09")
+    assert statements[1:] == ["ALTER TABLE tracks DROP PARTITION p2025_01;"]
+
+
+def test_retention_archive_resumes_from_each_state():
+    manager = _manager(periods_ahead=0, retention_periods=3, retention_action=RETENTION_ARCHIVE)
+    states = {"p2025_02": ARCHIVE_TABLE_PARTITIONED, "p2025_03": ARCHIVE_TABLE_FILLED, "p2025_04": ARCHIVE_TABLE_CONFLICT}
+    statements = manager.plan(_monthly_partitions(1, 7), now=NOW, archive_table_states=states)
+    assert statements == [
+        "CREATE TABLE tracks_archive_p2025_01 LIKE tracks;",
+        "ALTER TABLE tracks_archive_p2025_01 REMOVE PARTITIONING;",
+        "ALTER TABLE tracks EXCHANGE PARTITION p2025_01 WITH TABLE tracks_archive_p2025_01 WITHOUT VALIDATION;",
+        "ALTER TABLE tracks DROP PARTITION p2025_01;",
+        "ALTER TABLE tracks_archive_p2025_02 REMOVE PARTITIONING;",
+        "ALTER TABLE tracks EXCHANGE PARTITION p2025_02 WITH TABLE tracks_archive_p2025_02 WITHOUT VALIDATION;",
+        "ALTER TABLE tracks DROP PARTITION p2025_02;",
+        "ALTER TABLE tracks DROP PARTITION p2025_03;",
+    ]
+
+
+def test_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        _manager(granularity="weekly")
+    with pytest.raises(ValueError):
+        _manager(retention_action="truncate")
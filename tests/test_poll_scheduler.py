@@ -0,0 +1,117 @@
+import random
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from protobuf_mysql_loader.helper_poll_scheduler import (
+    AdaptivePollScheduler, BackoffPolicy, FakeClock, parse_retry_after_s,
+    ERROR_NETWORK, ERROR_RATE_LIMITED, ERROR_SERVER, ERROR_NO_TRACKS,
+)
+
+
+def _scheduler(**kwargs) -> AdaptivePollScheduler:
+    kwargs.setdefault("clock", FakeClock())
+    kwargs.setdefault("rng", random.Random(0))
+    return AdaptivePollScheduler(**kwargs)
+
+
+def _poll_steadily(scheduler:AdaptivePollScheduler, tracks_per_s:float, num_polls:int) -> float:
+    # Each poll returns whatever arrived while we waited since the last one
+    scheduler.record_response(int(tracks_per_s))
+    for _ in range(num_polls):
+        waited_s = max(scheduler.next_poll_delay_s, 0.5)
+        scheduler.clock.advance(waited_s)
+        scheduler.record_response(round(tracks_per_s * waited_s))
+    return scheduler.next_poll_delay_s
+
+
+def test_backoff_grows_per_error_class_within_the_jitter_band():
+    scheduler = _scheduler(backoff_policies={ERROR_SERVER: BackoffPolicy(base_s=10, max_s=80)})
+    for num_errors, capped_s in enumerate([10, 20, 40, 80, 80], start=1):
+        delay_s = scheduler.record_error(ERROR_SERVER)
+        assert capped_s / 2 <= delay_s <= capped_s
+        assert scheduler.num_consecutive_errors(ERROR_SERVER) == num_errors
+    # Another class keeps its own counter
+    assert scheduler.num_consecutive_errors(ERROR_NETWORK) == 0
+    assert scheduler.record_error(ERROR_NETWORK) <= 5
+
+
+def test_a_response_with_tracks_resets_every_backoff():
+    scheduler = _scheduler()
+    scheduler.record_error(ERROR_SERVER)
+    scheduler.record_error(ERROR_RATE_LIMITED)
+    scheduler.record_response(500)
+    assert scheduler.num_consecutive_errors(ERROR_SERVER) == 0
+    assert scheduler.num_consecutive_errors(ERROR_RATE_LIMITED) == 0
+
+
+def test_empty_responses_back_off_then_give_up():
+    scheduler = _scheduler(max_time_without_tracks_s=100, backoff_policies={ERROR_NO_TRACKS: BackoffPolicy(base_s=5, max_s=60)})
+    assert 2.5 <= scheduler.record_response(0) <= 5
+    assert 5 <= scheduler.record_response(0) <= 10
+    scheduler.clock.advance(101)
+    with pytest.raises(Exception, match="Haven't received any tracks"):
+        scheduler.record_response(0)
+
+
+def test_retry_after_overrides_the_backoff():
+    scheduler = _scheduler()
+    assert scheduler.record_error(ERROR_RATE_LIMITED, retry_after_s=42) == 42
+    assert scheduler.num_consecutive_errors(ERROR_RATE_LIMITED) == 1 # still counted
+    assert scheduler.record_error(ERROR_RATE_LIMITED, retry_after_s=0) == 0
+
+
+def test_retry_after_is_clamped():
+    scheduler = _scheduler(max_retry_after_s=300)
+    assert scheduler.record_error(ERROR_RATE_LIMITED, retry_after_s=365*86400) == 300
+    assert scheduler.record_error(ERROR_RATE_LIMITED, retry_after_s=-5) == 0
+
+
+def test_parse_retry_after():
+    now_utc = datetime(2024, 7, 10, 12, 0, 0, tzinfo=timezone.utc)
+    assert parse_retry_after_s("120") == 120
+    assert parse_retry_after_s(format_datetime(now_utc + timedelta(seconds=90), usegmt=True), now_utc=now_utc) == 90
+    assert parse_retry_after_s(format_datetime(now_utc - timedelta(seconds=90), usegmt=True), now_utc=now_utc) == 0
+    assert parse_retry_after_s(None) is None
+    assert parse_retry_after_s("soon") is None
+
+
+def test_interval_converges_on_the_time_to_fill_a_poll():
+    # 10 tracks/s and 100 wanted per poll -> about 10s between polls, under the 30s freshness target
+    scheduler = _scheduler(desired_tracks_per_poll=100, target_freshness_lag_s=30)
+    assert _poll_steadily(scheduler, tracks_per_s=10, num_polls=30) == pytest.approx(10, rel=0.05)
+    assert scheduler.arrival_rate_tracks_per_s == pytest.approx(10, rel=0.05)
+
+
+def test_interval_converges_on_the_freshness_target_when_tracks_trickle_in():
+    # 1 track/s would take 100s to fill a poll, but the freshness target caps the wait at 30s
+    scheduler = _scheduler(desired_tracks_per_poll=100, target_freshness_lag_s=30, max_poll_interval_s=60)
+    assert _poll_steadily(scheduler, tracks_per_s=1, num_polls=30) == pytest.approx(30)
+
+
+def test_interval_is_clamped_to_min_and_max():
+    fast = _scheduler(desired_tracks_per_poll=100, min_poll_interval_s=2, full_page_num_tracks=10**9)
+    assert _poll_steadily(fast, tracks_per_s=1000, num_polls=20) == 2
+    slow = _scheduler(desired_tracks_per_poll=100, target_freshness_lag_s=600, max_poll_interval_s=45)
+    assert _poll_steadily(slow, tracks_per_s=0.5, num_polls=20) == 45
+
+
+def test_full_page_or_falling_behind_polls_again_right_away():
+    scheduler = _scheduler(full_page_num_tracks=3000, desired_tracks_per_poll=100, target_freshness_lag_s=30)
+    scheduler.record_response(50)
+    scheduler.clock.advance(10)
+    assert scheduler.record_response(2900) == 0
+    scheduler.clock.advance(10)
+    assert scheduler.record_response(150, ingest_lag_s=45) == 0
+    scheduler.clock.advance(10)
+    assert scheduler.record_response(150, ingest_lag_s=5) > 0
+
+
+def test_waiting_goes_through_the_clock():
+    clock = FakeClock(start_s=100)
+    scheduler = _scheduler(clock=clock)
+    scheduler.record_error(ERROR_RATE_LIMITED, retry_after_s=7)
+    scheduler.wait_for_next_poll()
+    assert clock.sleeps == [7]
+    assert clock.now() == 107
@@ -0,0 +1,117 @@
+import pickle
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from protobuf_mysql_loader.helper_api_2_mysql import MYSQL_RECORD_INSERT_COLUMNS, track_insert_values, insert_values_to_mysql_record, mysql_record_to_insert_tuple
+from protobuf_mysql_loader.helper_record_batch import RecordBatch, RecordBatchBuilder
+
+
+def _wrapped(value):
+    return SimpleNamespace(value=value)
+
+
+def _make_track(track_number:int, num_obs:int):
+    start_time = datetime(2024, 7, 10, 12, 0, 0) + timedelta(minutes=track_number)
+    sensor_id = f"sensor-{11269 + track_number % 3}-4" # repeats, so the string columns share dictionary entries
+    obs = []
+    for i in range(num_obs):
+        obs.append(SimpleNamespace(
+            ob_time=_wrapped((start_time + timedelta(seconds=i)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")),
+            ra=_wrapped(10.0*track_number + 0.01*i), declination=_wrapped(-5.0 + 0.01*i),
+            ra_unc=_wrapped(2e-4), declination_unc=_wrapped(2e-4),
+            senx=_wrapped(4040.3), seny=_wrapped(-3428.9), senz=_wrapped(-4479.4),
+            senvelx=_wrapped(0.25), senvely=_wrapped(0.29), senvelz=_wrapped(0.0),
+            mag=_wrapped(float("nan") if track_number == 2 else 8.0 + 0.1*i),
+            id_on_orbit=_wrapped(""), id_sensor=_wrapped(""), sat_no=_wrapped(str(40000 + track_number)),
+            orig_object_id=_wrapped(f"satellite{40000 + track_number}"), orig_sensor_id=_wrapped(sensor_id), uct=_wrapped(track_number % 2 == 0),
+        ))
+    return SimpleNamespace(udl_observation_data=obs)
+
+
+def _insert_tuples(num_tracks:int, first_track_number:int=0):
+    # Datetime columns as naive UTC datetimes, i.e. what the writers get from a RecordBatch
+    return [mysql_record_to_insert_tuple(insert_values_to_mysql_record(track_insert_values(_make_track(n, 1 + n % 5), rx_time_utc="2024-07-10 12:00:00.000000")))
+            for n in range(first_track_number, first_track_number + num_tracks)]
+
+
+def _assert_same_rows(batch, tuples):
+    assert len(batch) == len(tuples)
+    for row, expected in zip(batch, tuples):
+        assert len(row) == len(MYSQL_RECORD_INSERT_COLUMNS)
+        for value, expected_value in zip(row, expected):
+            if isinstance(expected_value, float) and expected_value != expected_value:
+                assert value is None or value != value
+            else:
+                assert value == expected_value
+
+
+@pytest.fixture(scope="module")
+def tuples():
+    return _insert_tuples(9)
+
+
+def test_round_trip_through_insert_tuples(tuples):
+    batch = RecordBatch.from_insert_tuples(tuples)
+    _assert_same_rows(batch, tuples)
+    _assert_same_rows(batch.to_insert_tuples(), tuples)
+    assert batch[-1] == tuple(batch)[-1]
+    with pytest.raises(IndexError):
+        batch[len(tuples)]
+
+
+@pytest.mark.parametrize("start, stop", [(0, 9), (2, 5), (4, 4), (8, 9), (-3, None), (0, 100)])
+def test_slices_match_slicing_the_tuples(tuples, start, stop):
+    batch = RecordBatch.from_insert_tuples(tuples)
+    _assert_same_rows(batch[start:stop], tuples[start:stop])
+
+
+def test_stepped_slice_and_take(tuples):
+    batch = RecordBatch.from_insert_tuples(tuples)
+    _assert_same_rows(batch[::2], tuples[::2])
+    _assert_same_rows(batch.take([7, 0, 3]), [tuples[7], tuples[0], tuples[3]])
+    mask = np.array([i % 3 == 0 for i in range(len(tuples))])
+    _assert_same_rows(batch.take(mask), [t for t, keep in zip(tuples, mask) if keep])
+
+
+def test_slice_blobs_are_rebased(tuples):
+    blob_column = MYSQL_RECORD_INSERT_COLUMNS.index("mag_blob")
+    sliced = RecordBatch.from_insert_tuples(tuples)[3:6]
+    buffer, offsets = sliced.blob_buffer_and_offsets("mag_blob")
+    assert offsets[0] == 0 and offsets[-1] == len(buffer)
+    assert buffer == b"".join(t[blob_column] for t in tuples[3:6])
+
+
+def test_concatenate_merges_string_dictionaries():
+    first, second = _insert_tuples(4), _insert_tuples(5, first_track_number=20)
+    batches = [RecordBatch.from_insert_tuples(first), RecordBatch.from_insert_tuples([]), RecordBatch.from_insert_tuples(second)]
+    combined = RecordBatch.concatenate(batches)
+    _assert_same_rows(combined, first + second)
+    codes, categories = combined.string_codes_and_categories("orig_sensor_id")
+    assert len(categories) == len(set(categories)) == 3
+
+
+def test_concatenating_slices_gives_back_the_batch(tuples):
+    batch = RecordBatch.from_insert_tuples(tuples)
+    _assert_same_rows(RecordBatch.concatenate([batch[:3], batch[3:3], batch[3:7], batch[7:]]), tuples)
+    assert len(RecordBatch.concatenate([])) == 0
+
+
+def test_pickles(tuples):
+    batch = RecordBatch.from_insert_tuples(tuples)
+    _assert_same_rows(pickle.loads(pickle.dumps(batch)), tuples)
+
+
+def test_payload_bytes_counts_strings_and_blobs(tuples):
+    expected = sum(len(value) if isinstance(value, (str, bytes)) else 8 for t in tuples for value in t)
+    assert RecordBatch.from_insert_tuples(tuples).payload_bytes() == expected
+
+
+def test_builder_matches_from_insert_tuples(tuples):
+    builder = RecordBatchBuilder()
+    for n in range(9):
+        builder.append(track_insert_values(_make_track(n, 1 + n % 5), rx_time_utc="2024-07-10 12:00:00.000000"))
+    assert len(builder) == 9
+    _assert_same_rows(builder.build(), tuples)
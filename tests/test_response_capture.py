@@ -0,0 +1,70 @@
+import os
+from datetime import datetime, timezone
+
+from protobuf_mysql_loader.helper_response_capture import ResponseRecorder, iter_captured_responses, list_capture_segments, read_capture_index, CAPTURE_INDEX_SUFFIX
+
+T0_S = datetime(2025, 7, 7, 19, 0, tzinfo=timezone.utc).timestamp()
+
+
+def _record(capture_dir, num_responses:int, **kwargs):
+    recorder = ResponseRecorder(str(capture_dir), **kwargs)
+    for i in range(num_responses):
+        recorder.record(f"token{i}" if i else "", bytes([i]) * (100 + i), f"token{i+1}", received_s=T0_S + 60*i)
+    recorder.close()
+
+
+def _request_tokens(responses):
+    return [r.request_token for r in responses]
+
+
+def test_round_trip_across_segments(tmp_path):
+    _record(tmp_path, 10, max_segment_bytes=400)
+    assert len(list_capture_segments(str(tmp_path))) > 2
+    responses = list(iter_captured_responses(str(tmp_path)))
+    assert _request_tokens(responses) == [""] + [f"token{i}" for i in range(1, 10)]
+    assert [r.response_token for r in responses] == [f"token{i}" for i in range(1, 11)]
+    assert all(r.body == bytes([i]) * (100 + i) for i, r in enumerate(responses))
+    assert responses[3].received_utc == datetime(2025, 7, 7, 19, 3, tzinfo=timezone.utc)
+
+
+def test_start_token_and_time_bounds(tmp_path):
+    _record(tmp_path, 10, max_segment_bytes=400)
+    assert _request_tokens(iter_captured_responses(str(tmp_path), start_token="token6")) == ["token6", "token7", "token8", "token9"]
+    assert list(iter_captured_responses(str(tmp_path), start_token="no such token")) == []
+    since, until = datetime(2025, 7, 7, 19, 2, 30), datetime(2025, 7, 7, 19, 5) # naive means UTC
+    assert _request_tokens(iter_captured_responses(str(tmp_path), since_utc=since, until_utc=until)) == ["token3", "token4"]
+
+
+def test_records_missing_from_the_index_are_found_by_scanning(tmp_path):
+    _record(tmp_path, 4)
+    [segment_path] = list_capture_segments(str(tmp_path))
+    index_path = segment_path + CAPTURE_INDEX_SUFFIX
+    with open(index_path, "r") as index_file:
+        lines = index_file.readlines()
+    with open(index_path, "w") as index_file:
+        index_file.writelines(lines[:2] + [lines[2][:10]]) # a crash between the segment and index writes
+    assert [entry.request_token for entry in read_capture_index(segment_path)] == ["", "token1", "token2", "token3"]
+    assert len(list(iter_captured_responses(str(tmp_path)))) == 4
+
+
+def test_torn_last_record_is_skipped(tmp_path):
+    _record(tmp_path, 3)
+    [segment_path] = list_capture_segments(str(tmp_path))
+    os.remove(segment_path + CAPTURE_INDEX_SUFFIX)
+    with open(segment_path, "r+b") as segment_file:
+        segment_file.truncate(os.path.getsize(segment_path) - 5)
+    assert _request_tokens(iter_captured_responses(str(tmp_path))) == ["", "token1"]
+
+
+def test_oldest_segments_are_deleted_over_the_limit(tmp_path):
+    _record(tmp_path, 20, max_segment_bytes=300, max_total_bytes=2000)
+    total_bytes = sum(os.path.getsize(os.path.join(tmp_path, name)) for name in os.listdir(tmp_path))
+    assert total_bytes <= 2000
+    responses = list(iter_captured_responses(str(tmp_path)))
+    assert 0 < len(responses) < 20
+    assert responses[-1].request_token == "token19"
+    assert _request_tokens(responses) == [f"token{i}" for i in range(20 - len(responses), 20)]
+
+    # A new recorder carries on after the existing segments
+    _record(tmp_path, 1, max_segment_bytes=300, max_total_bytes=None)
+    assert list(iter_captured_responses(str(tmp_path)))[-1].request_token == ""
@@ -0,0 +1,89 @@
+import math
+
+import numpy as np
+import pytest
+
+from protobuf_mysql_loader.helper_sky_cells import SKY_CELL_LEVEL, SkyBox, SkyCone, cell_ranges_sql, sky_cell_id, sky_cell_ids, sky_cell_ranges
+
+_rng = np.random.default_rng(0)
+_RA_DEG = np.concatenate([_rng.uniform(0, 360, 2000), [0.0, 359.9999999, -1e-12, 180.0, 90.0]])
+_DEC_DEG = np.concatenate([np.degrees(np.arcsin(_rng.uniform(-1, 1, 2000))), [0.0, 89.9999, -90.0, 90.0, -45.0]])
+
+
+def _in_ranges(cells:np.ndarray, ranges) -> np.ndarray:
+    covered = np.zeros(len(cells), dtype=bool)
+    for lo, hi in ranges:
+        covered |= (cells >= lo) & (cells <= hi)
+    return covered
+
+
+def test_vectorized_ids_match_scalar_ones():
+    expected = [sky_cell_id(ra, dec) for ra, dec in zip(_RA_DEG, _DEC_DEG)]
+    np.testing.assert_array_equal(sky_cell_ids(_RA_DEG, _DEC_DEG), np.array(expected, dtype=np.uint64))
+
+
+def test_non_finite_coordinates_have_no_cell():
+    assert sky_cell_id(math.nan, 10.0) is None
+    assert sky_cell_id(10.0, math.inf) is None
+
+
+def test_ids_fit_the_level():
+    assert int(sky_cell_ids(_RA_DEG, _DEC_DEG).max()) < 1 << (2 * SKY_CELL_LEVEL)
+
+
+@pytest.mark.parametrize("levels_up", [1, 3, 10])
+def test_parent_cell_is_a_right_shift(levels_up):
+    # A cell's parent k levels up is id >> 2k, so every child of a coarse cell is one contiguous id range
+    coarse_level = SKY_CELL_LEVEL - levels_up
+    for ra, dec in zip(_RA_DEG[:200], _DEC_DEG[:200]):
+        assert sky_cell_id(ra, dec) >> (2 * levels_up) == sky_cell_id(ra, dec, level=coarse_level)
+    np.testing.assert_array_equal(sky_cell_ids(_RA_DEG, _DEC_DEG) >> np.uint64(2 * levels_up), sky_cell_ids(_RA_DEG, _DEC_DEG, level=coarse_level))
+
+
+def test_children_of_a_coarse_cell_fill_its_id_range():
+    coarse_level = SKY_CELL_LEVEL - 2
+    parent = sky_cell_id(123.4, 5.6, level=coarse_level)
+    ra_deg, dec_deg = 123.4 + _rng.uniform(-0.002, 0.002, 5000), 5.6 + _rng.uniform(-0.002, 0.002, 5000)
+    in_parent = sky_cell_ids(ra_deg, dec_deg, level=coarse_level) == parent
+    children = set(sky_cell_ids(ra_deg[in_parent], dec_deg[in_parent], level=coarse_level + 1).tolist())
+    assert children == set(range(parent << 2, (parent + 1) << 2)) # all four, and nothing outside the parent's range
+
+
+@pytest.mark.parametrize("region", [
+    SkyCone(ra_deg=10.0, dec_deg=20.0, radius_deg=2.0),
+    SkyCone(ra_deg=359.5, dec_deg=-5.0, radius_deg=3.0),   # wraps through RA 0
+    SkyCone(ra_deg=45.0, dec_deg=88.0, radius_deg=5.0),    # contains the pole
+    SkyCone(ra_deg=200.0, dec_deg=-30.0, radius_deg=40.0),
+    SkyBox(ra_min_deg=100.0, ra_max_deg=140.0, dec_min_deg=-10.0, dec_max_deg=25.0),
+    SkyBox(ra_min_deg=350.0, ra_max_deg=10.0, dec_min_deg=-60.0, dec_max_deg=-50.0),  # wraps through RA 0
+    SkyBox(ra_min_deg=0.0, ra_max_deg=360.0, dec_min_deg=80.0, dec_max_deg=90.0),
+])
+def test_cell_ranges_cover_every_point_in_the_region(region):
+    ra_deg = np.concatenate([_RA_DEG, _rng.uniform(0, 360, 20000)])
+    dec_deg = np.concatenate([_DEC_DEG, np.degrees(np.arcsin(_rng.uniform(-1, 1, 20000)))])
+    inside = region.contains(ra_deg, dec_deg)
+    assert inside.any()
+    ranges = sky_cell_ranges(region, max_ranges=8)
+    assert 1 <= len(ranges) <= 8
+    assert all(lo <= hi for lo, hi in ranges)
+    assert all(ranges[i][1] < ranges[i+1][0] for i in range(len(ranges) - 1)) # sorted, disjoint
+    assert _in_ranges(sky_cell_ids(ra_deg, dec_deg), ranges)[inside].all()
+
+
+def test_small_cone_is_a_small_fraction_of_the_sky():
+    ranges = sky_cell_ranges(SkyCone(ra_deg=10.0, dec_deg=20.0, radius_deg=0.5))
+    num_cells_covered = sum(hi - lo + 1 for lo, hi in ranges)
+    assert num_cells_covered < (1 << (2 * SKY_CELL_LEVEL)) / 1000
+
+
+def test_cone_contains_matches_great_circle_distance():
+    cone = SkyCone(ra_deg=30.0, dec_deg=40.0, radius_deg=5.0)
+    ra, dec = np.radians(_RA_DEG), np.radians(_DEC_DEG)
+    cos_distance = np.sin(dec) * math.sin(math.radians(40.0)) + np.cos(dec) * math.cos(math.radians(40.0)) * np.cos(ra - math.radians(30.0))
+    distance_deg = np.degrees(np.arccos(np.clip(cos_distance, -1, 1)))
+    np.testing.assert_array_equal(cone.contains(_RA_DEG, _DEC_DEG), distance_deg <= 5.0)
+
+
+def test_cell_ranges_sql():
+    assert cell_ranges_sql([(1, 5), (9, 9)]) == ("(sky_cell BETWEEN %s AND %s OR sky_cell BETWEEN %s AND %s)", (1, 5, 9, 9))
+    assert cell_ranges_sql([]) == ("FALSE", ())
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from protobuf_mysql_loader.db.mysql_spill_buffer import SpillBuffer, SpillSegmentReader, SpillBufferFull, ENTRY_BATCH, ENTRY_CHECKPOINT
+from protobuf_mysql_loader.helper_pipeline import Checkpoint
+
+COLUMNS = ("a", "b")
+
+
+def _rows(first:int, num_rows:int):
+    return [(i, f"row{i}") for i in range(first, first + num_rows)]
+
+
+def _spill_segment(spill_dir) -> str:
+    """ Three batches, the middle one completing a checkpoint. Returns the sealed segment's path. """
+    spill_buffer = SpillBuffer(str(spill_dir), "tracks", columns=COLUMNS)
+    spill_buffer.spill(_rows(0, 3))
+    spill_buffer.spill(_rows(3, 2), Checkpoint(7, "token7", 1_000))
+    spill_buffer.spill(_rows(5, 4))
+    spill_buffer.stop()
+    [path] = [os.path.join(spill_dir, name) for name in os.listdir(spill_dir)]
+    return path
+
+
+def _read(path:str):
+    reader = SpillSegmentReader(path)
+    return list(reader.entries()), reader.num_unreadable_bytes
+
+
+def test_reads_back_what_was_spilled(tmp_path):
+    entries, num_unreadable_bytes = _read(_spill_segment(tmp_path))
+    assert num_unreadable_bytes == 0
+    assert entries == [
+        (ENTRY_BATCH, (COLUMNS, _rows(0, 3))),
+        (ENTRY_BATCH, (COLUMNS, _rows(3, 2))),
+        (ENTRY_CHECKPOINT, Checkpoint(7, "token7", 1_000)),
+        (ENTRY_BATCH, (COLUMNS, _rows(5, 4))),
+    ]
+
+
+@pytest.mark.parametrize("num_bytes_cut", [1, 7, 12, 20])
+def test_torn_last_entry_is_dropped(tmp_path, num_bytes_cut):
+    path = _spill_segment(tmp_path)
+    full_entries, _ = _read(path)
+    with open(path, "r+b") as segment_file:
+        segment_file.truncate(os.path.getsize(path) - num_bytes_cut)
+    entries, num_unreadable_bytes = _read(path)
+    assert entries == full_entries[:-1]
+    assert 0 < num_unreadable_bytes < os.path.getsize(path)
+
+
+def test_nothing_after_a_bad_crc_is_trusted(tmp_path):
+    path = _spill_segment(tmp_path)
+    full_entries, _ = _read(path)
+    with open(path, "rb") as segment_file:
+        data = bytearray(segment_file.read())
+    second_payload = data.index(b"row3") # inside the second batch's pickle
+    data[second_payload] ^= 0xFF
+    with open(path, "wb") as segment_file:
+        segment_file.write(data)
+    entries, num_unreadable_bytes = _read(path)
+    assert entries == full_entries[:1]
+    assert num_unreadable_bytes > 0
+
+
+def test_header_only_and_empty_segments(tmp_path):
+    path = _spill_segment(tmp_path)
+    with open(path, "r+b") as segment_file:
+        segment_file.truncate(16)
+    assert _read(path) == ([], 0)
+    with open(path, "r+b") as segment_file:
+        segment_file.truncate(5)
+    assert _read(path) == ([], 5)
+
+
+def test_newest_checkpoint_and_size_limit(tmp_path):
+    spill_buffer = SpillBuffer(str(tmp_path), "tracks", columns=COLUMNS, max_total_bytes=4096)
+    assert spill_buffer.newest_checkpoint() is None and not spill_buffer.should_spill()
+    spill_buffer.spill(_rows(0, 1), Checkpoint(1, "token1", 20))
+    spill_buffer.spill_checkpoint(Checkpoint(0, "token0", 10))
+    assert spill_buffer.newest_checkpoint() == Checkpoint(1, "token1", 20)
+    assert spill_buffer.should_spill()
+    with pytest.raises(SpillBufferFull):
+        spill_buffer.spill(_rows(0, 1000))
+    spill_buffer.stop()
+
+    # Segments left behind are picked up by the next process, which starts out spilling
+    reopened = SpillBuffer(str(tmp_path), "tracks", columns=COLUMNS)
+    assert reopened.should_spill() and reopened.num_segments == 1
+    assert reopened.newest_checkpoint() == Checkpoint(1, "token1", 20)
@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+import pytest
+
+from protobuf_mysql_loader.helper_api_2_mysql import MySQLRecord, TRACK_TABLE_SCHEMA, MYSQL_RECORD_INSERT_COLUMNS
+from protobuf_mysql_loader.helper_table_schema import TableSchema, column, KIND_UINT64, KIND_STRING, KIND_DATETIME
+
+
+@dataclass
+class _Reading:
+    reading_id:int = column("BIGINT UNSIGNED", KIND_UINT64, auto_increment=True, default=None)
+    taken_utc:datetime = column("DATETIME(6)", KIND_DATETIME, default=None)
+    station:str = column("VARCHAR(16)", KIND_STRING, index_name="idx_station", default="")
+    serial:str = column("VARCHAR(32)", KIND_STRING, nullable=True, index_name="uq_serial", unique=True, default=None)
+
+
+def test_derived_sql():
+    schema = TableSchema(_Reading, partition_column="taken_utc")
+    assert schema.insert_columns == ("taken_utc", "station", "serial")
+    assert schema.primary_key == ("reading_id", "taken_utc")
+    assert schema.insert_sql("readings") == "INSERT INTO readings ( taken_utc,station,serial ) VALUES ( %s,%s,%s );"
+    assert schema.insert_sql("readings", ignore_duplicates=True).startswith("INSERT IGNORE INTO readings ")
+    assert schema.index_definitions_sql() == {
+        "idx_station": "KEY idx_station (station, taken_utc)",
+        "uq_serial": "UNIQUE KEY uq_serial (serial, taken_utc)",
+    }
+    create_sql = schema.create_table_sql("readings", first_partition_bound_s=1_720_569_600)
+    assert "reading_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT" in create_sql
+    assert "serial VARCHAR(32) NULL" in create_sql
+    assert "PRIMARY KEY (reading_id, taken_utc)" in create_sql
+    assert "PARTITION BY RANGE (FLOOR(UNIX_TIMESTAMP(taken_utc)))" in create_sql
+    assert "PARTITION p_init VALUES LESS THAN (1720569600)" in create_sql
+
+
+def test_record_to_insert_tuple_follows_insert_columns():
+    schema = TableSchema(_Reading, partition_column="taken_utc")
+    reading = _Reading(reading_id=7, taken_utc=datetime(2025, 7, 7), station="kitt-peak", serial="A1")
+    assert schema.record_to_insert_tuple(reading) == (datetime(2025, 7, 7), "kitt-peak", "A1")
+
+
+def test_rejects_bad_schemas():
+    @dataclass
+    class Untyped:
+        taken_utc:datetime = column("DATETIME(6)", KIND_DATETIME, default=None)
+        note:str = ""
+    with pytest.raises(TypeError):
+        TableSchema(Untyped, partition_column="taken_utc")
+    with pytest.raises(ValueError):
+        TableSchema(_Reading, partition_column="received_utc")
+
+
+def test_track_table_schema_matches_mysql_record():
+    assert TRACK_TABLE_SCHEMA.record_class is MySQLRecord
+    assert TRACK_TABLE_SCHEMA.insert_columns == tuple(MYSQL_RECORD_INSERT_COLUMNS)
+    assert set(TRACK_TABLE_SCHEMA.insert_column_kinds) == set(MYSQL_RECORD_INSERT_COLUMNS)
+    create_sql = TRACK_TABLE_SCHEMA.create_table_sql("tracks", 0)
+    for name in MYSQL_RECORD_INSERT_COLUMNS:
+        assert f"\n    {name} " in create_sql
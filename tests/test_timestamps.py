@@ -0,0 +1,76 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from protobuf_mysql_loader.helper_timestamps import zulu_iso8601_to_us, zulu_iso8601_batch_to_us, us_to_naive_utc_datetime, naive_utc_datetime_to_us
+
+
+def _strptime_us(zulutime:str) -> int:
+    parsed = datetime.strptime(zulutime, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+    return (parsed - datetime(1970, 1, 1, tzinfo=timezone.utc)) // (parsed.resolution)
+
+
+VALID = [
+    "2025-07-07T19:15:52.503105Z",
+    "2025-07-07T19:15:52.5Z",
+    "2025-07-07T00:00:00.000000Z",
+    "2024-02-29T23:59:59.999999Z",
+    "1970-01-01T00:00:00.000001Z",
+    "1970-01-01T00:00:00.0Z",
+    "9999-12-31T23:59:59.999999Z",
+]
+
+INVALID = [
+    "1969-12-31T23:59:59.5Z",        # before the epoch
+    "1969-12-31T23:59:59.999999Z",
+    "2025-07-07T+1:15:52.5Z",        # int() takes a sign
+    "2025-07-07T19:15:52. 5Z",       # and whitespace
+    "2025-07-07T19:15:5_.503105Z",   # and underscores
+    "2025-07-07T1٩:15:52.503105Z",   # and non-ASCII digits
+    "2025-07-07T24:00:00.000000Z",
+    "2025-07-07T19:60:52.503105Z",
+    "2025-07-07T19:15:60.503105Z",
+    "2025-02-30T19:15:52.503105Z",
+    "2025-07-07T19:15:52.Z",
+    "2025-07-07T19:15:52.5031050Z",
+    "2025-07-07 19:15:52.503105Z",
+    "2025-07-07T19:15:52.503105",
+]
+
+
+@pytest.mark.parametrize("zulutime", VALID)
+def test_scalar_matches_strptime(zulutime):
+    assert zulu_iso8601_to_us(zulutime) == _strptime_us(zulutime)
+
+
+@pytest.mark.parametrize("zulutime", INVALID)
+def test_scalar_rejects(zulutime):
+    with pytest.raises(ValueError):
+        zulu_iso8601_to_us(zulutime)
+
+
+@pytest.mark.parametrize("zulutime", INVALID)
+@pytest.mark.parametrize("num_good", [0, 1, 5])
+def test_batch_rejects_like_the_scalar(zulutime, num_good):
+    # Same length as the good ones goes down the vectorized path, a different length down the scalar fallback
+    num_fraction_digits = len(zulutime) - 21
+    good = "2025-07-07T19:15:52." + "5"*num_fraction_digits + "Z" if 1 <= num_fraction_digits <= 6 else "2025-07-07T19:15:52.503105Z"
+    zulu_iso8601_batch_to_us([good]*num_good)
+    with pytest.raises(ValueError):
+        zulu_iso8601_batch_to_us([good]*num_good + [zulutime])
+
+
+def test_batch_matches_scalar():
+    same_width = [f"2025-07-{day:02}T{hour:02}:15:52.{day*hour:06}Z" for day in (6, 7, 31) for hour in (0, 9, 23)]
+    for zulutimes in (same_width, VALID, same_width[:1], []):
+        decoded = zulu_iso8601_batch_to_us(zulutimes)
+        assert decoded.dtype == np.dtype("<u8")
+        assert decoded.tolist() == [zulu_iso8601_to_us(z) for z in zulutimes]
+
+
+def test_naive_datetime_round_trip():
+    for zulutime in VALID[:-1]:
+        micro_time = zulu_iso8601_to_us(zulutime)
+        assert naive_utc_datetime_to_us(us_to_naive_utc_datetime(micro_time)) == micro_time
+        assert us_to_naive_utc_datetime(micro_time) == datetime.strptime(zulutime, "%Y-%m-%dT%H:%M:%S.%fZ")
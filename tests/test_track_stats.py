@@ -0,0 +1,103 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from protobuf_mysql_loader.helper_track_stats import ARCSEC_PER_DEG, TRACK_STATS_COLUMNS, compute_track_stats
+
+
+def _reference_stats(timestamps_us, ra_dec_deg, ra_dec_unc_deg, mag):
+    """ One track at a time, the obvious way """
+    n_obs = len(timestamps_us)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # all-NaN slices
+        stats = {
+            "n_obs": n_obs,
+            "mag_min": np.nanmin(mag) if n_obs else np.nan, "mag_max": np.nanmax(mag) if n_obs else np.nan, "mag_mean": np.nanmean(mag) if n_obs else np.nan,
+            "median_mag": np.nanmedian(mag) if n_obs else np.nan,
+        }
+        for name, column in (("ra_unc", 0), ("dec_unc", 1)):
+            values = ra_dec_unc_deg[:, column]
+            stats[f"{name}_min_deg"] = np.nanmin(values) if n_obs else np.nan
+            stats[f"{name}_max_deg"] = np.nanmax(values) if n_obs else np.nan
+            stats[f"{name}_mean_deg"] = np.nanmean(values) if n_obs else np.nan
+    if n_obs == 0:
+        return {**stats, "duration_s": np.nan, "median_ra_deg": np.nan, "median_dec_deg": np.nan,
+                "ra_rate_deg_per_s": np.nan, "dec_rate_deg_per_s": np.nan, "angular_rate_deg_per_s": np.nan, "rate_fit_rms_arcsec": np.nan}
+
+    t_s = (timestamps_us.astype(np.int64) - int(timestamps_us[0])) / 1e6
+    ra_deg = np.unwrap(ra_dec_deg[:, 0], period=360.0)
+    ra_deg = ra_deg - 360.0 * np.round((ra_deg[0] - ra_dec_deg[0, 0]) / 360.0)
+    dec_deg = ra_dec_deg[:, 1]
+    median_dec_deg = np.median(dec_deg)
+    stats.update(duration_s=t_s[-1], median_ra_deg=np.median(ra_deg) % 360.0, median_dec_deg=median_dec_deg)
+    if n_obs < 2 or np.ptp(t_s) == 0:
+        stats.update(ra_rate_deg_per_s=np.nan, dec_rate_deg_per_s=np.nan, angular_rate_deg_per_s=np.nan, rate_fit_rms_arcsec=np.nan)
+        return stats
+    cos_dec = np.cos(np.radians(median_dec_deg))
+    ra_slope, ra_intercept = np.polyfit(t_s, ra_deg, 1)
+    dec_slope, dec_intercept = np.polyfit(t_s, dec_deg, 1)
+    residuals_sq = ((ra_deg - (ra_slope*t_s + ra_intercept)) * cos_dec)**2 + (dec_deg - (dec_slope*t_s + dec_intercept))**2
+    stats.update(
+        ra_rate_deg_per_s=ra_slope * cos_dec, dec_rate_deg_per_s=dec_slope,
+        angular_rate_deg_per_s=np.hypot(ra_slope * cos_dec, dec_slope),
+        rate_fit_rms_arcsec=np.sqrt(residuals_sq.mean()) * ARCSEC_PER_DEG,
+    )
+    return stats
+
+
+def _make_tracks(seed=0):
+    rng = np.random.default_rng(seed)
+    tracks = []
+    for n_obs in [5, 0, 1, 12, 2, 0, 30, 3]:
+        timestamps_us = (1_720_655_998_000_000 + np.cumsum(rng.integers(900_000, 1_100_000, n_obs))).astype("<u8")
+        ra0, dec0 = rng.uniform(0, 360), rng.uniform(-70, 70)
+        t_s = np.arange(n_obs, dtype=float)
+        ra_dec_deg = np.column_stack([(ra0 + rng.uniform(-0.3, 0.3)*t_s + rng.normal(0, 1e-4, n_obs)) % 360, dec0 + 0.05*t_s]).astype("<f8")
+        ra_dec_unc_deg = rng.uniform(1e-4, 3e-4, (n_obs, 2)).astype("<f4")
+        mag = rng.uniform(6, 12, n_obs).astype("<f4")
+        tracks.append([timestamps_us, ra_dec_deg, ra_dec_unc_deg, mag])
+    # A track across RA 0h, NaN mags and uncertainties, and a track whose mags are all NaN
+    tracks[3][1][:, 0] = (359.9 + 0.02*np.arange(12)) % 360
+    tracks[3][3][[1, 4]] = np.nan
+    tracks[3][2][2, 0] = np.nan
+    tracks[4][3][:] = np.nan
+    return tracks
+
+
+def _compute(tracks):
+    obs_offsets = np.concatenate([[0], np.cumsum([len(track[0]) for track in tracks])])
+    return compute_track_stats(*(np.concatenate([track[i] for track in tracks]) for i in range(4)), obs_offsets)
+
+
+@pytest.mark.parametrize("column", ("median_ra_deg", "median_dec_deg", "median_mag") + TRACK_STATS_COLUMNS)
+def test_batch_stats_match_a_per_track_reference(column):
+    tracks = _make_tracks()
+    stats = _compute(tracks)
+    assert len(stats) == len(tracks)
+    expected = np.array([_reference_stats(*track)[column] for track in tracks], dtype=float)
+    np.testing.assert_allclose(getattr(stats, column), expected, rtol=1e-6, atol=1e-9, equal_nan=True)
+
+
+def test_track_across_0h_has_a_sensible_median_and_rate():
+    stats = _compute(_make_tracks())
+    assert stats.median_ra_deg[3] == pytest.approx((359.9 + 0.02*5.5) % 360, abs=1e-9)
+    assert abs(stats.ra_rate_deg_per_s[3]) < 0.1
+
+
+def test_undefined_values_become_null_rows():
+    stats = _compute(_make_tracks())
+    rows = stats.rows(TRACK_STATS_COLUMNS)
+    empty_track, one_ob_track, all_nan_mags_track = rows[1], rows[2], rows[4]
+    assert empty_track[0] == 0 and all(value is None for value in empty_track[1:])
+    assert one_ob_track[TRACK_STATS_COLUMNS.index("duration_s")] == 0
+    assert one_ob_track[TRACK_STATS_COLUMNS.index("angular_rate_deg_per_s")] is None
+    assert all_nan_mags_track[TRACK_STATS_COLUMNS.index("mag_mean")] is None
+    assert all_nan_mags_track[TRACK_STATS_COLUMNS.index("ra_rate_deg_per_s")] is not None
+
+
+def test_no_obs_at_all():
+    stats = compute_track_stats(np.empty(0, dtype="<u8"), np.empty((0, 2)), np.empty((0, 2)), np.empty(0), np.zeros(3, dtype=np.int64))
+    assert len(stats) == 2
+    assert stats.n_obs.tolist() == [0, 0]
+    assert np.isnan(stats.mag_mean).all()
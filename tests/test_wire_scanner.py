@@ -0,0 +1,82 @@
+import pytest
+
+from protobuf_mysql_loader.helper_wire_scanner import StreamingTrackScanner, iter_track_views
+
+_TRACKS_FIELD = 3
+_TOKEN_FIELD = 1
+
+
+def _varint(value:int) -> bytes:
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _length_delimited(field_number:int, payload:bytes) -> bytes:
+    return _varint(field_number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _response(tracks, token:str="next-token-abc") -> bytes:
+    # A SomeClass-shaped message with some fields the scanner has to skip: a varint, a fixed64 and a fixed32
+    body = _varint(7 << 3 | 0) + _varint(300)
+    body += _length_delimited(_TOKEN_FIELD, token.encode("utf-8"))
+    for i, track in enumerate(tracks):
+        body += _length_delimited(_TRACKS_FIELD, track)
+        if i == 0:
+            body += _varint(8 << 3 | 1) + b"\x01" * 8 + _varint(9 << 3 | 5) + b"\x02" * 4
+    return body
+
+
+_TRACKS = [b"\x0a\x03abc", b"", b"x" * 300, bytes(range(256)) * 3]
+
+
+def test_iter_track_views_finds_every_track_and_the_token():
+    token_holder = []
+    track_views = list(iter_track_views(_response(_TRACKS), _TRACKS_FIELD, _TOKEN_FIELD, token_holder))
+    assert [bytes(view) for view in track_views] == _TRACKS
+    assert token_holder == ["next-token-abc"]
+
+
+def test_iter_track_views_rejects_a_truncated_body():
+    with pytest.raises(ValueError, match="truncated"):
+        list(iter_track_views(_response(_TRACKS)[:-5], _TRACKS_FIELD, _TOKEN_FIELD))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1000, 10**6])
+def test_streaming_scanner_resyncs_across_any_chunk_boundary(chunk_size):
+    body = _response(_TRACKS)
+    scanner = StreamingTrackScanner(_TRACKS_FIELD, _TOKEN_FIELD)
+    track_views = []
+    for start in range(0, len(body), chunk_size):
+        track_views += scanner.feed(body[start:start+chunk_size])
+    scanner.finish()
+    assert [bytes(view) for view in track_views] == _TRACKS
+    assert scanner.token == "next-token-abc"
+    assert scanner.num_tracks == len(_TRACKS)
+    assert scanner.num_bytes_scanned == len(body)
+
+
+def test_streaming_scanner_only_buffers_the_unfinished_field():
+    body = _response(_TRACKS)
+    scanner = StreamingTrackScanner(_TRACKS_FIELD, _TOKEN_FIELD)
+    split = body.index(_TRACKS[2]) + 10 # partway into the 300-byte track
+    first = scanner.feed(body[:split])
+    assert [bytes(view) for view in first] == _TRACKS[:2]
+    assert len(scanner._buffer) < 300 + 5
+    rest = scanner.feed(body[split:])
+    assert [bytes(view) for view in rest] == _TRACKS[2:]
+
+
+def test_streaming_scanner_finish_rejects_a_cut_off_stream():
+    scanner = StreamingTrackScanner(_TRACKS_FIELD, _TOKEN_FIELD)
+    scanner.feed(_response(_TRACKS)[:-1])
+    with pytest.raises(ValueError, match="unfinished field"):
+        scanner.finish()
+
+
+def test_unsupported_wire_type_is_an_error():
+    with pytest.raises(ValueError, match="wire type"):
+        list(iter_track_views(_varint(4 << 3 | 3), _TRACKS_FIELD, _TOKEN_FIELD))